@@ -1,6 +1,17 @@
+import ClientImageHandling
+import HydrusData
+import HydrusExceptions
+import HydrusThreading
+import Queue
 import imp
 import sys
 import os
+import threading
+
+# decoded images are shrunk to this before they are handed to a tagger that does not declare an input_size
+DEFAULT_MAX_INPUT_DIMENSION = 512
+
+NUM_DECODE_THREADS = 2
 
 class AutoTaggerException(Exception):
     pass
@@ -20,24 +31,170 @@ class Tagger( object ):
             self._TagImage = TagModule.tag_image
             self._TagImages = TagModule.tag_images
 
+            # optional ( x, y ) the model wants its images resized to
+            self._input_size = getattr(TagModule, 'input_size', None)
+
         except ZeroDivisionError:
             raise AutoTaggerException('Given path did not contain a directory or was packaged incorrectly')
         except NameError:
             raise AutoTaggerException('Given path did not contain a tagger')
 
+        self._lock = threading.Lock()
+        self._loaded = False
+
     def Load( self ):
-        old_dir = os.getcwd()
-        os.chdir(self._path)
-        self._Load()
-        os.chdir(old_dir)
+        with self._lock:
+            if self._loaded:
+                return
+
+            old_dir = os.getcwd()
+            os.chdir(self._path)
+            try:
+                self._Load()
+            finally:
+                os.chdir(old_dir)
+
+            self._loaded = True
 
     def GetTags( self ):
         return self._GetTags()
 
+    def PrepareImage( self, numpy_image ):
+        if self._input_size is not None:
+            return ClientImageHandling.EfficientlyResizeNumpyImage( numpy_image, tuple(self._input_size) )
+
+        return ClientImageHandling.EfficientlyThumbnailNumpyImage( numpy_image, ( DEFAULT_MAX_INPUT_DIMENSION, DEFAULT_MAX_INPUT_DIMENSION ) )
+
     def TagImage( self, numpy_image, threshold ):
-        return self._TagImage( numpy_image, threshold )
+        with self._lock:
+            return self._TagImage( numpy_image, threshold )
 
     def TagImages( self, keys, numpy_images, threshold ):
-        return self._TagImages( keys, numpy_images, threshold )
+        with self._lock:
+            return self._TagImages( keys, numpy_images, threshold )
+
+
+_taggers_lock = threading.Lock()
+_paths_to_taggers = {}
+
+def GetTagger( path ):
+    # taggers are expensive to load, so keep each one around for the life of the client
+    path = os.path.abspath(path)
+
+    with _taggers_lock:
+        if path not in _paths_to_taggers:
+            _paths_to_taggers[path] = Tagger(path)
+
+        tagger = _paths_to_taggers[path]
+
+    tagger.Load()
+
+    return tagger
+
+
+def TagFiles( tagger, hashes_paths_and_mimes, threshold, batch_size, batch_callback, stop_callback = None, num_decode_threads = NUM_DECODE_THREADS ):
+    # decodes files on a small pool of worker threads and feeds the tagger fixed-size batches as they fill
+    # the read-ahead queue is bounded, so no more than a couple of batches of decoded images are ever in memory
+    # batch_callback is called with ( proposed_tags, num_done ) after each batch
+
+    batch_size = max(1, batch_size)
+
+    jobs = Queue.Queue()
+
+    for row in hashes_paths_and_mimes:
+        jobs.put(row)
+
+    num_decode_threads = max(1, min(num_decode_threads, jobs.qsize()))
+
+    for i in range(num_decode_threads):
+        jobs.put(None)
+
+    decoded = Queue.Queue(maxsize = 2 * batch_size)
+
+    stop_event = threading.Event()
+
+    def ShouldStop():
+        return stop_event.is_set() or HydrusThreading.IsThreadShuttingDown() or (stop_callback is not None and stop_callback())
+
+    def PutResult(result):
+        while not stop_event.is_set():
+            try:
+                decoded.put(result, timeout = 0.5)
+                return
+            except Queue.Full:
+                continue
+
+    def Decode():
+        while True:
+            row = jobs.get()
+
+            if row is None or stop_event.is_set():
+                PutResult(None)
+                return
+
+            (hash, path, mime) = row
+
+            try:
+                numpy_image = ClientImageHandling.GenerateNumpyImage(path, mime)
+                numpy_image = tagger.PrepareImage(numpy_image)
+            except HydrusExceptions.FileMissingException as e:
+                HydrusData.Print('Auto Tag: missing file: {}'.format(e))
+                numpy_image = None
+            except Exception as e:
+                HydrusData.Print('Auto Tag: could not decode {}: {}'.format(hash.encode('hex'), e))
+                numpy_image = None
+
+            PutResult((hash, numpy_image))
+
+    threads = [threading.Thread(target = Decode) for i in range(num_decode_threads)]
+
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    num_decoders_running = num_decode_threads
+    num_done = 0
+
+    batch_hashes = []
+    batch_images = []
+
+    def FlushBatch():
+        if len(batch_hashes) > 0:
+            proposed_tags = tagger.TagImages(list(batch_hashes), list(batch_images), threshold)
+        else:
+            proposed_tags = {}
+
+        del batch_hashes[:]
+        del batch_images[:]
+
+        batch_callback(proposed_tags, num_done)
+
+    try:
+        while num_decoders_running > 0:
+            if ShouldStop():
+                return
+
+            try:
+                result = decoded.get(timeout = 0.5)
+            except Queue.Empty:
+                continue
+
+            if result is None:
+                num_decoders_running -= 1
+                continue
+
+            (hash, numpy_image) = result
+
+            num_done += 1
+
+            if numpy_image is not None:
+                batch_hashes.append(hash)
+                batch_images.append(numpy_image)
+
+            if len(batch_hashes) >= batch_size:
+                FlushBatch()
+
+        FlushBatch()
 
-    
+    finally:
+        stop_event.set()
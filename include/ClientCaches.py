@@ -13,6 +13,7 @@ import HydrusPaths
 import HydrusSerialisable
 import HydrusSessions
 import HydrusThreading
+import heapq
 import itertools
 import json
 import os
@@ -28,6 +29,7 @@ import ClientConstants as CC
 import HydrusGlobals as HG
 import collections
 import HydrusTags
+import Queue
 import traceback
 
 # important thing here, and reason why it is recursive, is because we want to preserve the parent-grandparent interleaving
@@ -220,6 +222,136 @@ class ClientFilesManager( object ):
         self._Reinit()
         
     
+    def _CheckFileIntegrityChunk( self, mode, chunk_of_info, move_location ):
+        
+        # each location is probably a different disk, so they are read at the same time
+        
+        locations_to_info = collections.defaultdict( list )
+        
+        for row in chunk_of_info:
+            
+            ( hash_id, hash, mime ) = row
+            
+            prefix = 'f' + hash.encode( 'hex' )[:2]
+            
+            locations_to_info[ self._prefixes_to_locations[ prefix ] ].append( row )
+            
+        
+        results_queue = Queue.Queue()
+        
+        def check_location( location_info ):
+            
+            missing_hash_ids = []
+            incorrect_hash_ids = []
+            
+            try:
+                
+                for ( hash_id, hash, mime ) in location_info:
+                    
+                    try:
+                        
+                        # lockless because the check holds the lock
+                        path = self.LocklessGetFilePath( hash, mime )
+                        
+                    except HydrusExceptions.FileMissingException:
+                        
+                        HydrusData.Print( 'Could not find the file for ' + hash.encode( 'hex' ) + '!' )
+                        
+                        missing_hash_ids.append( hash_id )
+                        
+                        continue
+                        
+                    
+                    if mode == 'thorough':
+                        
+                        actual_hash = HydrusFileHandling.GetHashFromPath( path )
+                        
+                        if actual_hash != hash:
+                            
+                            incorrect_hash_ids.append( hash_id )
+                            
+                            if move_location is not None:
+                                
+                                move_filename = 'believed ' + hash.encode( 'hex' ) + ' actually ' + actual_hash.encode( 'hex' ) + HC.mime_ext_lookup[ mime ]
+                                
+                                move_path = os.path.join( move_location, move_filename )
+                                
+                                HydrusPaths.MergeFile( path, move_path )
+                                
+                            
+                        
+                    
+                
+                results_queue.put( ( missing_hash_ids, incorrect_hash_ids ) )
+                
+            except Exception as e:
+                
+                results_queue.put( e )
+                
+            
+        
+        for location_info in locations_to_info.values():
+            
+            self._controller.CallToThread( check_location, location_info )
+            
+        
+        missing_hash_ids = []
+        incorrect_hash_ids = []
+        
+        for i in range( len( locations_to_info ) ):
+            
+            result = results_queue.get()
+            
+            if isinstance( result, Exception ):
+                
+                raise result
+                
+            
+            ( location_missing_hash_ids, location_incorrect_hash_ids ) = result
+            
+            missing_hash_ids.extend( location_missing_hash_ids )
+            incorrect_hash_ids.extend( location_incorrect_hash_ids )
+            
+        
+        return ( missing_hash_ids, incorrect_hash_ids )
+        
+    
+    def _FilterOrphanPaths( self, test_type, paths ):
+        
+        orphan_paths = []
+        
+        hashes_to_paths = collections.defaultdict( list )
+        
+        for path in paths:
+            
+            ( directory, filename ) = os.path.split( path )
+            
+            should_be_a_hex_hash = filename[:64]
+            
+            try:
+                
+                hash = should_be_a_hex_hash.decode( 'hex' )
+                
+            except:
+                
+                orphan_paths.append( path )
+                
+                continue
+                
+            
+            hashes_to_paths[ hash ].append( path )
+            
+        
+        orphan_hashes = self._controller.Read( 'orphan_hashes', test_type, hashes_to_paths.keys() )
+        
+        for hash in orphan_hashes:
+            
+            orphan_paths.extend( hashes_to_paths[ hash ] )
+            
+        
+        return orphan_paths
+        
+    
     def _GenerateExpectedFilePath( self, hash, mime ):
         
         hash_encoded = hash.encode( 'hex' )
@@ -543,21 +675,99 @@ class ClientFilesManager( object ):
             
         
     
-    def _IterateAllThumbnailPaths( self ):
+    def _IterateAllPathBatches( self, prefix_types ):
+        
+        # each location is probably a different disk, so list them all at once
+        
+        locations_to_prefixes = collections.defaultdict( list )
         
         for ( prefix, location ) in self._prefixes_to_locations.items():
             
-            if prefix.startswith( 't' ) or prefix.startswith( 'r' ):
+            if prefix[0] in prefix_types:
                 
-                dir = os.path.join( location, prefix )
+                locations_to_prefixes[ location ].append( prefix )
                 
-                filenames = os.listdir( dir )
+            
+        
+        # the listers only run a little ahead of the db checks, and they give up if the caller does
+        
+        results_queue = Queue.Queue( maxsize = 16 )
+        
+        stop_event = threading.Event()
+        
+        def put_result( result ):
+            
+            while not stop_event.is_set():
                 
-                for filename in filenames:
+                try:
                     
-                    yield os.path.join( dir, filename )
+                    results_queue.put( result, timeout = 1 )
+                    
+                    return
+                    
+                except Queue.Full:
+                    
+                    continue
+                    
+                
+            
+        
+        def list_location( location, prefixes ):
+            
+            try:
+                
+                for prefix in prefixes:
+                    
+                    dir = os.path.join( location, prefix )
                     
+                    filenames = os.listdir( dir )
+                    
+                    for chunk_of_filenames in HydrusData.SplitListIntoChunks( filenames, 4096 ):
+                        
+                        put_result( [ os.path.join( dir, filename ) for filename in chunk_of_filenames ] )
+                        
+                    
+                
+            except Exception as e:
                 
+                put_result( e )
+                
+            finally:
+                
+                put_result( None )
+                
+            
+        
+        for ( location, prefixes ) in locations_to_prefixes.items():
+            
+            self._controller.CallToThread( list_location, location, prefixes )
+            
+        
+        try:
+            
+            num_locations_done = 0
+            
+            while num_locations_done < len( locations_to_prefixes ):
+                
+                result = results_queue.get()
+                
+                if result is None:
+                    
+                    num_locations_done += 1
+                    
+                elif isinstance( result, Exception ):
+                    
+                    raise result
+                    
+                else:
+                    
+                    yield result
+                    
+                
+            
+        finally:
+            
+            stop_event.set()
             
         
     
@@ -720,6 +930,17 @@ class ClientFilesManager( object ):
             
         
     
+    def AddFullSizeThumbnails( self, hashes_and_thumbnails ):
+        
+        with self._lock:
+            
+            for ( hash, thumbnail ) in hashes_and_thumbnails:
+                
+                self.LocklessAddFullSizeThumbnail( hash, thumbnail )
+                
+            
+        
+    
     def LocklessAddFullSizeThumbnail( self, hash, thumbnail ):
         
         path = self._GenerateExpectedFullSizeThumbnailPath( hash )
@@ -742,11 +963,114 @@ class ClientFilesManager( object ):
         self._controller.pub( 'new_thumbnails', { hash } )
         
     
-    def CheckFileIntegrity( self, *args, **kwargs ):
+    def CheckFileIntegrity( self, mode, allowed_mimes = None, move_location = None ):
         
-        with self._lock:
+        prefix_string = 'checking file integrity: '
+        
+        job_key = ClientThreading.JobKey( cancellable = True )
+        
+        try:
+            
+            job_key.SetVariable( 'popup_text_1', prefix_string + 'preparing' )
+            
+            self._controller.pub( 'modal_message', job_key )
+            
+            if allowed_mimes is not None:
+                
+                allowed_mimes = sorted( allowed_mimes )
+                
+            
+            # a big check can be cancelled and picked up again later, as long as it is the same check
+            
+            checkpoint = self._controller.Read( 'serialisable_simple', 'file_integrity_checkpoint' )
+            
+            if checkpoint is not None and checkpoint[ 'mode' ] == mode and checkpoint[ 'allowed_mimes' ] == allowed_mimes:
+                
+                after_hash_id = checkpoint[ 'after_hash_id' ]
+                missing_count = checkpoint[ 'missing_count' ]
+                incorrect_count = checkpoint[ 'incorrect_count' ]
+                
+            else:
+                
+                after_hash_id = None
+                missing_count = 0
+                incorrect_count = 0
+                
+            
+            info = self._controller.Read( 'file_integrity_info', allowed_mimes = allowed_mimes, after_hash_id = after_hash_id )
+            
+            with self._lock:
+                
+                for ( i, chunk_of_info ) in enumerate( HydrusData.SplitListIntoChunks( info, 1024 ) ):
+                    
+                    ( i_paused, should_quit ) = job_key.WaitIfNeeded()
+                    
+                    if should_quit:
+                        
+                        return
+                        
+                    
+                    num_done = i * 1024
+                    
+                    job_key.SetVariable( 'popup_text_1', prefix_string + HydrusData.ConvertValueRangeToPrettyString( num_done, len( info ) ) )
+                    job_key.SetVariable( 'popup_gauge_1', ( num_done, len( info ) ) )
+                    
+                    ( missing_hash_ids, incorrect_hash_ids ) = self._CheckFileIntegrityChunk( mode, chunk_of_info, move_location )
+                    
+                    deletee_hash_ids = missing_hash_ids + incorrect_hash_ids
+                    
+                    if len( deletee_hash_ids ) > 0:
+                        
+                        self._controller.WriteSynchronous( 'file_integrity_failures', deletee_hash_ids )
+                        
+                    
+                    missing_count += len( missing_hash_ids )
+                    incorrect_count += len( incorrect_hash_ids )
+                    
+                    ( last_hash_id, last_hash, last_mime ) = chunk_of_info[-1]
+                    
+                    checkpoint = { 'mode' : mode, 'allowed_mimes' : allowed_mimes, 'after_hash_id' : last_hash_id, 'missing_count' : missing_count, 'incorrect_count' : incorrect_count }
+                    
+                    self._controller.WriteSynchronous( 'serialisable_simple', 'file_integrity_checkpoint', checkpoint )
+                    
+                
+            
+            self._controller.WriteSynchronous( 'serialisable_simple', 'file_integrity_checkpoint', None )
+            
+            job_key.DeleteVariable( 'popup_gauge_1' )
+            
+            final_text = 'done! '
+            
+            if missing_count + incorrect_count == 0:
+                
+                final_text += 'all files ok!'
+                
+            else:
+                
+                final_text += HydrusData.ConvertIntToPrettyString( missing_count ) + ' files were missing!'
+                
+                if mode == 'thorough':
+                    
+                    final_text += ' ' + HydrusData.ConvertIntToPrettyString( incorrect_count ) + ' files were incorrect and thus '
+                    
+                    if move_location is None:
+                        
+                        final_text += 'deleted!'
+                        
+                    else:
+                        
+                        final_text += 'moved!'
+                        
+                    
+                
+            
+            job_key.SetVariable( 'popup_text_1', prefix_string + final_text )
+            
+        finally:
+            
+            HydrusData.Print( job_key.ToString() )
             
-            self._controller.WriteSynchronous( 'file_integrity', *args, **kwargs )
+            job_key.Finish()
             
         
     
@@ -764,7 +1088,9 @@ class ClientFilesManager( object ):
             orphan_paths = []
             orphan_thumbnails = []
             
-            for ( i, path ) in enumerate( self._IterateAllFilePaths() ):
+            num_reviewed = 0
+            
+            for paths in self._IterateAllPathBatches( 'f' ):
                 
                 ( i_paused, should_quit ) = job_key.WaitIfNeeded()
                 
@@ -773,31 +1099,7 @@ class ClientFilesManager( object ):
                     return
                     
                 
-                if i % 100 == 0:
-                    
-                    status = 'reviewed ' + HydrusData.ConvertIntToPrettyString( i ) + ' files, found ' + HydrusData.ConvertIntToPrettyString( len( orphan_paths ) ) + ' orphans'
-                    
-                    job_key.SetVariable( 'popup_text_1', status )
-                    
-                
-                try:
-                    
-                    is_an_orphan = False
-                    
-                    ( directory, filename ) = os.path.split( path )
-                    
-                    should_be_a_hex_hash = filename[:64]
-                    
-                    hash = should_be_a_hex_hash.decode( 'hex' )
-                    
-                    is_an_orphan = HG.client_controller.Read( 'is_an_orphan', 'file', hash )
-                    
-                except:
-                    
-                    is_an_orphan = True
-                    
-                
-                if is_an_orphan:
+                for path in self._FilterOrphanPaths( 'file', paths ):
                     
                     if move_location is not None:
                         
@@ -815,10 +1117,18 @@ class ClientFilesManager( object ):
                     orphan_paths.append( path )
                     
                 
+                num_reviewed += len( paths )
+                
+                status = 'reviewed ' + HydrusData.ConvertIntToPrettyString( num_reviewed ) + ' files, found ' + HydrusData.ConvertIntToPrettyString( len( orphan_paths ) ) + ' orphans'
+                
+                job_key.SetVariable( 'popup_text_1', status )
+                
             
             time.sleep( 2 )
             
-            for ( i, path ) in enumerate( self._IterateAllThumbnailPaths() ):
+            num_reviewed = 0
+            
+            for paths in self._IterateAllPathBatches( 'tr' ):
                 
                 ( i_paused, should_quit ) = job_key.WaitIfNeeded()
                 
@@ -827,34 +1137,13 @@ class ClientFilesManager( object ):
                     return
                     
                 
-                if i % 100 == 0:
-                    
-                    status = 'reviewed ' + HydrusData.ConvertIntToPrettyString( i ) + ' thumbnails, found ' + HydrusData.ConvertIntToPrettyString( len( orphan_thumbnails ) ) + ' orphans'
-                    
-                    job_key.SetVariable( 'popup_text_1', status )
-                    
+                orphan_thumbnails.extend( self._FilterOrphanPaths( 'thumbnail', paths ) )
                 
-                try:
-                    
-                    is_an_orphan = False
-                    
-                    ( directory, filename ) = os.path.split( path )
-                    
-                    should_be_a_hex_hash = filename[:64]
-                    
-                    hash = should_be_a_hex_hash.decode( 'hex' )
-                    
-                    is_an_orphan = HG.client_controller.Read( 'is_an_orphan', 'thumbnail', hash )
-                    
-                except:
-                    
-                    is_an_orphan = True
-                    
+                num_reviewed += len( paths )
                 
-                if is_an_orphan:
-                    
-                    orphan_thumbnails.append( path )
-                    
+                status = 'reviewed ' + HydrusData.ConvertIntToPrettyString( num_reviewed ) + ' thumbnails, found ' + HydrusData.ConvertIntToPrettyString( len( orphan_thumbnails ) ) + ' orphans'
+                
+                job_key.SetVariable( 'popup_text_1', status )
                 
             
             time.sleep( 2 )
@@ -867,7 +1156,7 @@ class ClientFilesManager( object ):
                 
                 time.sleep( 5 )
                 
-                for path in orphan_paths:
+                for ( i, path ) in enumerate( orphan_paths ):
                     
                     ( i_paused, should_quit ) = job_key.WaitIfNeeded()
                     
@@ -1277,17 +1566,26 @@ class ClientFilesManager( object ):
     
 class DataCache( object ):
     
-    def __init__( self, controller, cache_size, timeout = 1200 ):
+    # how many of the least recently used items the size-aware policy considers when it picks the biggest to throw out
+    SIZE_AWARE_EVICTION_WINDOW = 8
+    
+    def __init__( self, controller, cache_size, timeout = 1200, eviction_policy = CC.CACHE_EVICTION_LRU ):
         
         self._controller = controller
         self._cache_size = cache_size
         self._timeout = timeout
+        self._eviction_policy = eviction_policy
         
         self._keys_to_data = {}
+        self._keys_to_memory_footprints = {}
         self._keys_fifo = collections.OrderedDict()
         
         self._total_estimated_memory_footprint = 0
         
+        self._num_hits = 0
+        self._num_misses = 0
+        self._num_evictions = 0
+        
         self._lock = threading.Lock()
         
         self._controller.sub( self, 'MaintainCache', 'memory_maintenance_pulse' )
@@ -1300,23 +1598,34 @@ class DataCache( object ):
             return
             
         
-        deletee_data = self._keys_to_data[ key ]
-        
         del self._keys_to_data[ key ]
         
-        self._RecalcMemoryUsage()
+        self._total_estimated_memory_footprint -= self._keys_to_memory_footprints[ key ]
+        
+        del self._keys_to_memory_footprints[ key ]
+        
+        if key in self._keys_fifo:
+            
+            del self._keys_fifo[ key ]
+            
         
     
     def _DeleteItem( self ):
         
-        ( deletee_key, last_access_time ) = self._keys_fifo.popitem( last = False )
+        if self._eviction_policy == CC.CACHE_EVICTION_SIZE_AWARE_LRU:
+            
+            candidate_keys = list( itertools.islice( self._keys_fifo.iterkeys(), self.SIZE_AWARE_EVICTION_WINDOW ) )
+            
+            deletee_key = max( candidate_keys, key = lambda key: self._keys_to_memory_footprints[ key ] )
+            
+        else:
+            
+            ( deletee_key, timestamp ) = self._keys_fifo.popitem( last = False )
+            
         
         self._Delete( deletee_key )
         
-    
-    def _RecalcMemoryUsage( self ):
-        
-        self._total_estimated_memory_footprint = sum( ( data.GetEstimatedMemoryFootprint() for data in self._keys_to_data.values() ) )
+        self._num_evictions += 1
         
     
     def _TouchKey( self, key ):
@@ -1335,6 +1644,7 @@ class DataCache( object ):
         with self._lock:
             
             self._keys_to_data = {}
+            self._keys_to_memory_footprints = {}
             self._keys_fifo = collections.OrderedDict()
             
             self._total_estimated_memory_footprint = 0
@@ -1347,16 +1657,19 @@ class DataCache( object ):
             
             if key not in self._keys_to_data:
                 
-                while self._total_estimated_memory_footprint > self._cache_size:
+                memory_footprint = data.GetEstimatedMemoryFootprint()
+                
+                while len( self._keys_fifo ) > 0 and self._total_estimated_memory_footprint + memory_footprint > self._cache_size:
                     
                     self._DeleteItem()
                     
                 
                 self._keys_to_data[ key ] = data
+                self._keys_to_memory_footprints[ key ] = memory_footprint
                 
-                self._TouchKey( key )
+                self._total_estimated_memory_footprint += memory_footprint
                 
-                self._RecalcMemoryUsage()
+                self._TouchKey( key )
                 
             
         
@@ -1375,9 +1688,13 @@ class DataCache( object ):
             
             if key not in self._keys_to_data:
                 
+                self._num_misses += 1
+                
                 raise Exception( 'Cache error! Looking for ' + HydrusData.ToUnicode( key ) + ', but it was missing.' )
                 
             
+            self._num_hits += 1
+            
             self._TouchKey( key )
             
             return self._keys_to_data[ key ]
@@ -1390,17 +1707,29 @@ class DataCache( object ):
             
             if key in self._keys_to_data:
                 
+                self._num_hits += 1
+                
                 self._TouchKey( key )
                 
                 return self._keys_to_data[ key ]
                 
             else:
                 
+                self._num_misses += 1
+                
                 return None
                 
             
         
     
+    def GetStatistics( self ):
+        
+        with self._lock:
+            
+            return ( len( self._keys_to_data ), self._total_estimated_memory_footprint, self._cache_size, self._num_hits, self._num_misses, self._num_evictions )
+            
+        
+    
     def HasData( self, key ):
         
         with self._lock:
@@ -1425,7 +1754,9 @@ class DataCache( object ):
                     
                     if HydrusData.TimeHasPassed( last_access_time + self._timeout ):
                         
-                        self._DeleteItem()
+                        self._Delete( key )
+                        
+                        self._num_evictions += 1
                         
                     else:
                         
@@ -1787,7 +2118,9 @@ class RenderedImageCache( object ):
         
         cache_size = self._controller.options[ 'fullscreen_cache_size' ]
         
-        self._data_cache = DataCache( self._controller, cache_size, timeout = 600 )
+        # rendered images vary a lot in size, so it is better to throw out one big old image than many small old ones
+        
+        self._data_cache = DataCache( self._controller, cache_size, timeout = 600, eviction_policy = CC.CACHE_EVICTION_SIZE_AWARE_LRU )
         
     
     def Clear( self ):
@@ -1795,6 +2128,11 @@ class RenderedImageCache( object ):
         self._data_cache.Clear()
         
     
+    def GetCacheStatistics( self ):
+        
+        return self._data_cache.GetStatistics()
+        
+    
     def GetImageRenderer( self, media ):
         
         hash = media.GetHash()
@@ -1826,6 +2164,9 @@ class RenderedImageCache( object ):
     
 class ThumbnailCache( object ):
     
+    # cv and pil release the GIL for most of a thumbnail load, so a few workers keep the disk and cores busy
+    NUM_WATERFALL_WORKERS = 3
+    
     def __init__( self, controller ):
         
         self._controller = controller
@@ -1836,16 +2177,29 @@ class ThumbnailCache( object ):
         
         self._lock = threading.Lock()
         
-        self._waterfall_queue_quick = set()
-        self._waterfall_queue_random = []
+        # the queue is a heap of ( sort_key, job_id ). a job_id that is no longer in _waterfall_job_ids_to_jobs has been cancelled or re-queued, and is skipped when it surfaces
+        
+        self._waterfall_heap = []
+        
+        self._waterfall_job_ids_to_jobs = {}
+        self._waterfall_jobs_to_job_ids = {}
+        
+        self._waterfall_job_id_counter = itertools.count()
+        self._waterfall_generation = 0
         
         self._waterfall_event = threading.Event()
         
+        # the waterfall workers and the gui can all ask for the same thumbnail at once, so only the first loads or regenerates it and the others wait on its result
+        self._hashes_to_loads_in_progress = {}
+        
         self._special_thumbs = {}
         
         self.Clear()
         
-        self._controller.CallToThreadLongRunning( self.DAEMONWaterfall )
+        for i in range( self.NUM_WATERFALL_WORKERS ):
+            
+            self._controller.CallToThreadLongRunning( self.DAEMONWaterfall )
+            
         
         self._controller.sub( self, 'Clear', 'thumbnail_resize' )
         self._controller.sub( self, 'ClearThumbnails', 'clear_thumbnails' )
@@ -1853,6 +2207,61 @@ class ThumbnailCache( object ):
     
     def _GetResizedHydrusBitmapFromHardDrive( self, display_media ):
         
+        hash = display_media.GetHash()
+        
+        with self._lock:
+            
+            if hash in self._hashes_to_loads_in_progress:
+                
+                load = self._hashes_to_loads_in_progress[ hash ]
+                
+                we_load = False
+                
+            else:
+                
+                load = { 'done' : threading.Event(), 'hydrus_bitmap' : None }
+                
+                self._hashes_to_loads_in_progress[ hash ] = load
+                
+                we_load = True
+                
+            
+        
+        if not we_load:
+            
+            load[ 'done' ].wait()
+            
+            if load[ 'hydrus_bitmap' ] is None:
+                
+                # the other load failed, so have a go ourselves and raise whatever it raised
+                
+                return self._GetResizedHydrusBitmapFromHardDrive( display_media )
+                
+            
+            return load[ 'hydrus_bitmap' ]
+            
+        
+        try:
+            
+            hydrus_bitmap = self._LoadResizedHydrusBitmapFromHardDrive( display_media )
+            
+            load[ 'hydrus_bitmap' ] = hydrus_bitmap
+            
+            return hydrus_bitmap
+            
+        finally:
+            
+            with self._lock:
+                
+                del self._hashes_to_loads_in_progress[ hash ]
+                
+            
+            load[ 'done' ].set()
+            
+        
+    
+    def _LoadResizedHydrusBitmapFromHardDrive( self, display_media ):
+        
         thumbnail_dimensions = self._controller.options[ 'thumbnail_dimensions' ]
         
         if tuple( thumbnail_dimensions ) == HC.UNSCALED_THUMBNAIL_DIMENSIONS:
@@ -1941,27 +2350,51 @@ class ThumbnailCache( object ):
         return hydrus_bitmap
         
     
-    def _RecalcWaterfallQueueRandom( self ):
+    def _CompactWaterfallHeap( self ):
+        
+        self._waterfall_heap = [ ( sort_key, job_id ) for ( sort_key, job_id ) in self._waterfall_heap if job_id in self._waterfall_job_ids_to_jobs ]
         
-        # here we sort by the hash since this is both breddy random and more likely to access faster on a well defragged hard drive!
+        heapq.heapify( self._waterfall_heap )
         
-        def sort_by_hash_key( ( page_key, media ) ):
+    
+    def _GetNextWaterfallJob( self ):
+        
+        while len( self._waterfall_heap ) > 0:
             
-            return media.GetDisplayMedia().GetHash()
+            ( sort_key, job_id ) = heapq.heappop( self._waterfall_heap )
+            
+            if job_id in self._waterfall_job_ids_to_jobs:
+                
+                job = self._waterfall_job_ids_to_jobs[ job_id ]
+                
+                del self._waterfall_job_ids_to_jobs[ job_id ]
+                del self._waterfall_jobs_to_job_ids[ job ]
+                
+                return job
+                
             
         
-        self._waterfall_queue_random = list( self._waterfall_queue_quick )
-        
-        self._waterfall_queue_random.sort( key = sort_by_hash_key )
+        return None
         
     
     def CancelWaterfall( self, page_key, medias ):
         
         with self._lock:
             
-            self._waterfall_queue_quick.difference_update( ( ( page_key, media ) for media in medias ) )
+            for media in medias:
+                
+                job_id = self._waterfall_jobs_to_job_ids.pop( ( page_key, media ), None )
+                
+                if job_id is not None:
+                    
+                    del self._waterfall_job_ids_to_jobs[ job_id ]
+                    
+                
             
-            self._RecalcWaterfallQueueRandom()
+            if len( self._waterfall_heap ) > 2 * len( self._waterfall_job_ids_to_jobs ) + 1024:
+                
+                self._CompactWaterfallHeap()
+                
             
         
     
@@ -2019,10 +2452,15 @@ class ThumbnailCache( object ):
         
         with self._lock:
             
-            return len( self._waterfall_queue_random ) > 0
+            return len( self._waterfall_job_ids_to_jobs ) > 0
             
         
     
+    def GetCacheStatistics( self ):
+        
+        return self._data_cache.GetStatistics()
+        
+    
     def GetThumbnail( self, media ):
         
         try:
@@ -2110,13 +2548,49 @@ class ThumbnailCache( object ):
             
         
     
-    def Waterfall( self, page_key, medias ):
+    def Waterfall( self, page_key, medias, visible = True ):
+        
+        # visible thumbs go first, then the most recent request, which is what the user is looking at now
+        # within a request we go by hash, which is both breddy random and more likely to access faster on a well defragged hard drive!
         
         with self._lock:
             
-            self._waterfall_queue_quick.update( ( ( page_key, media ) for media in medias ) )
+            self._waterfall_generation += 1
+            
+            visibility_priority = 0 if visible else 1
+            
+            for media in medias:
+                
+                job = ( page_key, media )
+                
+                old_job_id = self._waterfall_jobs_to_job_ids.get( job, None )
+                
+                if old_job_id is not None:
+                    
+                    del self._waterfall_job_ids_to_jobs[ old_job_id ]
+                    
+                
+                try:
+                    
+                    hash = media.GetDisplayMedia().GetHash()
+                    
+                except:
+                    
+                    hash = ''
+                    
+                
+                job_id = next( self._waterfall_job_id_counter )
+                
+                self._waterfall_job_ids_to_jobs[ job_id ] = job
+                self._waterfall_jobs_to_job_ids[ job ] = job_id
+                
+                heapq.heappush( self._waterfall_heap, ( ( visibility_priority, - self._waterfall_generation, hash ), job_id ) )
+                
             
-            self._RecalcWaterfallQueueRandom()
+            if len( self._waterfall_heap ) > 2 * len( self._waterfall_job_ids_to_jobs ) + 1024:
+                
+                self._CompactWaterfallHeap()
+                
             
         
         self._waterfall_event.set()
@@ -2130,7 +2604,7 @@ class ThumbnailCache( object ):
             
             with self._lock:
                 
-                do_wait = len( self._waterfall_queue_random ) == 0
+                do_wait = len( self._waterfall_job_ids_to_jobs ) == 0
                 
             
             if do_wait:
@@ -2151,14 +2625,12 @@ class ThumbnailCache( object ):
                 
                 with self._lock:
                     
-                    if len( self._waterfall_queue_random ) == 0:
-                        
-                        break
-                        
+                    result = self._GetNextWaterfallJob()
                     
-                    result = self._waterfall_queue_random.pop( 0 )
+                
+                if result is None:
                     
-                    self._waterfall_queue_quick.discard( result )
+                    break
                     
                 
                 ( page_key, media ) = result
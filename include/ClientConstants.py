@@ -16,6 +16,9 @@ APPLICATION_COMMAND_TYPE_CONTENT = 1
 
 BLANK_PHASH = '\x80\x00\x00\x00\x00\x00\x00\x00' # first bit 1 but everything else 0 means only significant part of dct was [0,0], which represents flat colour
 
+CACHE_EVICTION_LRU = 0
+CACHE_EVICTION_SIZE_AWARE_LRU = 1
+
 CAN_HIDE_MOUSE = True
 
 FILTER_WHITELIST = 0
@@ -1,6 +1,6 @@
-import ClientAutoTagging
 import ClientData
 import ClientDefaults
+import ClientDuplicates
 import ClientGUIShortcuts
 import ClientImageHandling
 import ClientMedia
@@ -18,6 +18,7 @@ import gc
 import hashlib
 import itertools
 import json
+import multiprocessing.pool
 import HydrusConstants as HC
 import HydrusData
 import HydrusDB
@@ -52,10 +53,19 @@ YAML_DUMP_ID_EXPORT_FOLDER = 6
 YAML_DUMP_ID_SUBSCRIPTION = 7
 YAML_DUMP_ID_LOCAL_BOORU = 8
 
+# below this many uncached definitions, one lookup each is quicker than setting up a temp table to do them all at once
+BULK_ID_LOOKUP_THRESHOLD = 32
+
 # Sqlite can handle -( 2 ** 63 ) -> ( 2 ** 63 ) - 1, but the user won't be searching that distance, so np
 MIN_CACHED_INTEGER = -99999999
 MAX_CACHED_INTEGER = 99999999
 
+# how many files phash regeneration decodes at once--the decoding is spread over a thread pool and the dcts are done together
+SIMILAR_FILES_PHASH_BATCH_SIZE = 64
+
+# how many files duplicate pair discovery searches for at once--they share their tree walk and are committed together
+SIMILAR_FILES_SEARCH_BATCH_SIZE = 256
+
 def CanCacheInteger( num ):
     
     return MIN_CACHED_INTEGER <= num and num <= MAX_CACHED_INTEGER
@@ -150,13 +160,32 @@ def report_speed_to_log( precise_timestamp, num_rows, row_name ):
 class DB( HydrusDB.HydrusDB ):
     
     READ_WRITE_ACTIONS = [ 'service_info', 'system_predicates', 'missing_thumbnail_hashes' ]
+    READ_CONCURRENT_ACTIONS = [ 'autocomplete_predicates', 'file_query_ids', 'local_booru_share', 'local_booru_share_keys', 'local_booru_shares', 'media_results', 'media_results_from_ids', 'orphan_hashes', 'related_tags', 'url_statuses' ]
+    COALESCABLE_WRITE_ACTIONS = [ 'content_updates' ]
     
     def __init__( self, controller, db_dir, db_name, no_wal = False ):
         
         self._initial_messages = []
         
+        # shared with the read pool, so it lives for the whole life of the db and locks itself
+        self._file_search_cache = ClientSearch.FileSearchResultsCache()
+        self._subtag_search_cache = ClientSearch.SubtagSearchCache()
+        
+        # also shared with the read pool, but only touched by the writer or under _read_cache_lock
+        self._tag_posting_lists = ClientSearch.TagPostingLists()
+        
+        # master definitions never change once committed, so read connections may add to these freely
+        # a writer id that is not committed yet just finds nothing in a read connection's snapshot, and rollback clears them
+        self._hash_id_cache = HydrusDB.IdCache( 65536 )
+        self._namespace_id_cache = HydrusDB.IdCache( 1024 )
+        self._subtag_id_cache = HydrusDB.IdCache( 65536 )
+        self._tag_id_cache = HydrusDB.IdCache( 65536 )
+        self._url_id_cache = HydrusDB.IdCache( 16384 )
+        
         HydrusDB.HydrusDB.__init__( self, controller, db_dir, db_name, no_wal = no_wal )
         
+        self._controller.sub( self, 'NotifyNewSiblings', 'new_siblings_gui' )
+        
         self._controller.pub( 'splash_set_title_text', u'booting db\u2026' )
         
     
@@ -174,9 +203,13 @@ class DB( HydrusDB.HydrusDB ):
         # hash_id, size, mime, width, height, duration, num_frames, num_words
         self._c.executemany( insert_phrase + ' files_info VALUES ( ?, ?, ?, ?, ?, ?, ?, ? );', rows )
         
+        self._file_search_cache.Clear()
+        
     
     def _AddFiles( self, service_id, rows ):
         
+        self._file_search_cache.Clear()
+        
         hash_ids = { row[0] for row in rows }
         
         existing_hash_ids = { hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM current_files WHERE service_id = ? AND hash_id IN ' + HydrusData.SplayListForDB( hash_ids ) + ';', ( service_id, ) ) }
@@ -439,6 +472,8 @@ class DB( HydrusDB.HydrusDB ):
     
     def _ArchiveFiles( self, hash_ids ):
         
+        self._file_search_cache.Clear()
+        
         valid_hash_ids = [ hash_id for hash_id in hash_ids if hash_id in self._inbox_hash_ids ]
         
         if len( valid_hash_ids ) > 0:
@@ -476,46 +511,8 @@ class DB( HydrusDB.HydrusDB ):
         repository_updates_table_name = GenerateRepositoryRepositoryUpdatesTableName( service_id )
         
         self._c.executemany( 'INSERT OR IGNORE INTO ' + repository_updates_table_name + ' ( update_index, hash_id, processed ) VALUES ( ?, ?, ? );', inserts )
-
-
-
-    def _AutoTagImages( self, hashes, tagger_path, threshold ):
-
-        client_files_manager = self._controller.client_files_manager
-
-        tagger = ClientAutoTagging.Tagger(tagger_path)
-    
-        tagger.Load()
-
-        hash_ids = self._GetHashIds( hashes )
-
-        numpy_images = []
-
-        hashes_found = []
-
-        for hash, hash_id in zip( hashes, hash_ids ) :
-            try:
-                mime = self._GetMime( hash_id )
-
-                if mime not in HC.IMAGES:
-                    continue
-
-                path = client_files_manager.GetFilePath( hash, mime )
-
-                numpy_image = ClientImageHandling.GenerateNumpyImage( path, mime )
-                numpy_images.append( numpy_image )
-                hashes_found.append( hash )
-
-            except HydrusExceptions.FileMissingException as e:
-                print('Auto Tag: db err: {}'.format(e))
-                continue
-
-        proposed_tags = tagger.TagImages( hashes_found, numpy_images, threshold )
-
-        return proposed_tags
-
-
         
+    
     def _Backup( self, path ):
         
         client_files_locations = self._GetClientFilesLocations()
@@ -588,6 +585,59 @@ class DB( HydrusDB.HydrusDB ):
             
         
     
+    def _BenchmarkJSONDumps( self, num_dumps = 10 ):
+        
+        # times loading and saving the biggest dumps in both formats, so we can see what the binary format is buying us
+        
+        rows = self._c.execute( 'SELECT dump_type, NULL, LENGTH( dump ) FROM json_dumps UNION ALL SELECT dump_type, dump_name, LENGTH( dump ) FROM json_dumps_named ORDER BY 3 DESC LIMIT ?;', ( num_dumps, ) ).fetchall()
+        
+        results = []
+        
+        for ( dump_type, dump_name, stored_size ) in rows:
+            
+            if dump_name is None:
+                
+                ( dump, ) = self._c.execute( 'SELECT dump FROM json_dumps WHERE dump_type = ?;', ( dump_type, ) ).fetchone()
+                
+            else:
+                
+                ( dump, ) = self._c.execute( 'SELECT dump FROM json_dumps_named WHERE dump_type = ? AND dump_name = ?;', ( dump_type, dump_name ) ).fetchone()
+                
+            
+            serialisable_info = HydrusSerialisable.LoadSerialisableInfo( dump )
+            
+            timings = []
+            
+            for ( save_func, load_func ) in ( ( json.dumps, json.loads ), ( HydrusSerialisable.DumpSerialisableInfo, HydrusSerialisable.LoadSerialisableInfo ) ):
+                
+                time_started = HydrusData.GetNowPrecise()
+                
+                format_dump = save_func( serialisable_info )
+                
+                time_saved = HydrusData.GetNowPrecise()
+                
+                load_func( format_dump )
+                
+                time_loaded = HydrusData.GetNowPrecise()
+                
+                timings.append( ( len( format_dump ), time_saved - time_started, time_loaded - time_saved ) )
+                
+            
+            ( ( json_size, json_save_time, json_load_time ), ( binary_size, binary_save_time, binary_load_time ) ) = timings
+            
+            name = HydrusSerialisable.SERIALISABLE_TYPES_TO_OBJECT_TYPES[ dump_type ].SERIALISABLE_NAME
+            
+            if dump_name is not None:
+                
+                name += ' "' + dump_name + '"'
+                
+            
+            results.append( ( name, json_size, json_save_time, json_load_time, binary_size, binary_save_time, binary_load_time ) )
+            
+        
+        return results
+        
+    
     def _CacheCombinedFilesMappingsDrop( self, service_id ):
         
         ac_cache_table_name = GenerateCombinedFilesMappingsCacheTableName( service_id )
@@ -683,14 +733,9 @@ class DB( HydrusDB.HydrusDB ):
         
         ( hash_id_map_table_name, tag_id_map_table_name ) = GenerateRepositoryMasterCacheTableNames( service_id )
         
-        inserts = []
+        hashes_to_hash_ids = self._GetHashesToHashIds( service_hash_ids_to_hashes.values() )
         
-        for ( service_hash_id, hash ) in service_hash_ids_to_hashes.items():
-            
-            hash_id = self._GetHashId( hash )
-            
-            inserts.append( ( service_hash_id, hash_id ) )
-            
+        inserts = [ ( service_hash_id, hashes_to_hash_ids[ hash ] ) for ( service_hash_id, hash ) in service_hash_ids_to_hashes.items() ]
         
         self._c.executemany( 'INSERT OR IGNORE INTO ' + hash_id_map_table_name + ' ( service_hash_id, hash_id ) VALUES ( ?, ? );', inserts )
         
@@ -699,14 +744,9 @@ class DB( HydrusDB.HydrusDB ):
         
         ( hash_id_map_table_name, tag_id_map_table_name ) = GenerateRepositoryMasterCacheTableNames( service_id )
         
-        inserts = []
+        tags_to_tag_ids = self._GetTagsToTagIds( service_tag_ids_to_tags.values() )
         
-        for ( service_tag_id, tag ) in service_tag_ids_to_tags.items():
-            
-            tag_id = self._GetTagId( tag )
-            
-            inserts.append( ( service_tag_id, tag_id ) )
-            
+        inserts = [ ( service_tag_id, tags_to_tag_ids[ tag ] ) for ( service_tag_id, tag ) in service_tag_ids_to_tags.items() ]
         
         self._c.executemany( 'INSERT OR IGNORE INTO ' + tag_id_map_table_name + ' ( service_tag_id, tag_id ) VALUES ( ?, ? );', inserts )
         
@@ -874,6 +914,11 @@ class DB( HydrusDB.HydrusDB ):
             
             phash_ids.add( phash_id )
             
+            if self._phash_index is not None:
+                
+                self._phash_index.AddPHashes( [ ( phash_id, phash ) ] )
+                
+            
         
         self._c.executemany( 'INSERT OR IGNORE INTO shape_perceptual_hash_map ( phash_id, hash_id ) VALUES ( ?, ? );', ( ( phash_id, hash_id ) for phash_id in phash_ids ) )
         
@@ -920,6 +965,11 @@ class DB( HydrusDB.HydrusDB ):
         
         self._c.executemany( 'INSERT OR IGNORE INTO shape_maintenance_branch_regen ( phash_id ) VALUES ( ? );', ( ( phash_id, ) for phash_id in useless_phash_ids ) )
         
+        if self._phash_index is not None:
+            
+            self._phash_index.RemovePHashIds( useless_phash_ids )
+            
+        
     
     def _CacheSimilarFilesGenerateBranch( self, job_key, parent_id, phash_id, phash, children ):
         
@@ -1260,6 +1310,36 @@ class DB( HydrusDB.HydrusDB ):
         return ( num_phashes_to_regen, num_branches_to_regen, searched_distances_to_count, duplicate_types_to_count )
         
     
+    def _CacheSimilarFilesGetPHashIndex( self ):
+        
+        if not self._controller.new_options.GetBoolean( 'use_resident_similar_files_index' ):
+            
+            self._phash_index = None
+            
+            return None
+            
+        
+        if self._phash_index is None:
+            
+            self._controller.pub( 'splash_set_status_subtext', 'loading similar files index' )
+            
+            phash_index = ClientDuplicates.PHashIndex()
+            
+            # we only want the phashes that are actually in use, just as the tree would give
+            
+            phash_index.AddPHashes( self._c.execute( 'SELECT phash_id, phash FROM shape_perceptual_hashes WHERE phash_id IN ( SELECT phash_id FROM shape_perceptual_hash_map );' ) )
+            
+            self._phash_index = phash_index
+            
+            if HG.db_report_mode:
+                
+                HydrusData.ShowText( 'Similar files index loaded with ' + HydrusData.ConvertIntToPrettyString( len( phash_index ) ) + ' phashes.' )
+                
+            
+        
+        return self._phash_index
+        
+    
     def _CacheSimilarFilesGetPHashId( self, phash ):
         
         result = self._c.execute( 'SELECT phash_id FROM shape_perceptual_hashes WHERE phash = ?;', ( sqlite3.Binary( phash ), ) ).fetchone()
@@ -1411,7 +1491,9 @@ class DB( HydrusDB.HydrusDB ):
             
             total_done_previously = total_num_hash_ids_in_cache - len( hash_ids )
             
-            for ( i, hash_id ) in enumerate( hash_ids ):
+            num_done = 0
+            
+            for batch_of_hash_ids in HydrusData.SplitListIntoChunks( hash_ids, SIMILAR_FILES_SEARCH_BATCH_SIZE ):
                 
                 job_key.SetVariable( 'popup_title', 'similar files duplicate pair discovery' )
                 
@@ -1431,25 +1513,31 @@ class DB( HydrusDB.HydrusDB ):
                     return
                     
                 
-                if i % 25 == 0:
-                    
-                    text = 'searched ' + HydrusData.ConvertValueRangeToPrettyString( total_done_previously + i, total_num_hash_ids_in_cache ) + ' files'
-                    
-                    job_key.SetVariable( 'popup_text_1', text )
-                    job_key.SetVariable( 'popup_gauge_1', ( total_done_previously + i, total_num_hash_ids_in_cache ) )
-                    
-                    HG.client_controller.pub( 'splash_set_status_subtext', text )
-                    
+                text = 'searched ' + HydrusData.ConvertValueRangeToPrettyString( total_done_previously + num_done, total_num_hash_ids_in_cache ) + ' files'
+                
+                job_key.SetVariable( 'popup_text_1', text )
+                job_key.SetVariable( 'popup_gauge_1', ( total_done_previously + num_done, total_num_hash_ids_in_cache ) )
                 
-                duplicate_hash_ids = [ duplicate_hash_id for duplicate_hash_id in self._CacheSimilarFilesSearch( hash_id, search_distance ) if duplicate_hash_id != hash_id ]
+                HG.client_controller.pub( 'splash_set_status_subtext', text )
+                
+                hash_ids_to_duplicate_hash_ids = self._CacheSimilarFilesSearchMany( batch_of_hash_ids, search_distance )
                 
                 # double-check the files exist in shape_search_cache, as I think stale branches are producing deleted file pairs here
                 
-                self._c.executemany( 'INSERT OR IGNORE INTO duplicate_pairs ( smaller_hash_id, larger_hash_id, duplicate_type ) VALUES ( ?, ?, ? );', ( ( min( hash_id, duplicate_hash_id ), max( hash_id, duplicate_hash_id ), HC.DUPLICATE_UNKNOWN ) for duplicate_hash_id in duplicate_hash_ids ) )
+                pair_rows = set()
+                
+                for ( hash_id, duplicate_hash_ids ) in hash_ids_to_duplicate_hash_ids.items():
+                    
+                    pair_rows.update( ( ( min( hash_id, duplicate_hash_id ), max( hash_id, duplicate_hash_id ), HC.DUPLICATE_UNKNOWN ) for duplicate_hash_id in duplicate_hash_ids if duplicate_hash_id != hash_id ) )
+                    
+                
+                self._c.executemany( 'INSERT OR IGNORE INTO duplicate_pairs ( smaller_hash_id, larger_hash_id, duplicate_type ) VALUES ( ?, ?, ? );', pair_rows )
                 
                 pairs_found += self._GetRowCount()
                 
-                self._c.execute( 'UPDATE shape_search_cache SET searched_distance = ? WHERE hash_id = ?;', ( search_distance, hash_id ) )
+                self._c.executemany( 'UPDATE shape_search_cache SET searched_distance = ? WHERE hash_id = ?;', ( ( search_distance, hash_id ) for hash_id in batch_of_hash_ids ) )
+                
+                num_done += len( batch_of_hash_ids )
                 
             
         finally:
@@ -1486,87 +1574,113 @@ class DB( HydrusDB.HydrusDB ):
             
             total_done_previously = total_num_hash_ids_in_cache - len( hash_ids )
             
-            for ( i, hash_id ) in enumerate( hash_ids ):
+            time_started_precise = HydrusData.GetNowPrecise()
+            
+            num_threads = max( 1, min( 8, psutil.cpu_count() or 1 ) )
+            
+            pool = multiprocessing.pool.ThreadPool( num_threads )
+            
+            try:
                 
-                job_key.SetVariable( 'popup_title', 'similar files metadata maintenance' )
+                num_done = 0
                 
-                if pub_job_key and not job_key_pubbed and HydrusData.TimeHasPassed( time_started + 5 ):
+                for batch_of_hash_ids in HydrusData.SplitListIntoChunks( hash_ids, SIMILAR_FILES_PHASH_BATCH_SIZE ):
                     
-                    self._controller.pub( 'modal_message', job_key )
+                    job_key.SetVariable( 'popup_title', 'similar files metadata maintenance' )
                     
-                    job_key_pubbed = True
+                    if pub_job_key and not job_key_pubbed and HydrusData.TimeHasPassed( time_started + 5 ):
+                        
+                        self._controller.pub( 'modal_message', job_key )
+                        
+                        job_key_pubbed = True
+                        
                     
-                
-                ( i_paused, should_quit ) = job_key.WaitIfNeeded()
-                
-                should_stop = stop_time is not None and HydrusData.TimeHasPassed( stop_time )
-                
-                if should_quit or should_stop:
+                    ( i_paused, should_quit ) = job_key.WaitIfNeeded()
                     
-                    return
+                    should_stop = stop_time is not None and HydrusData.TimeHasPassed( stop_time )
                     
-                
-                if i % 50 == 0:
+                    if should_quit or should_stop:
+                        
+                        return
+                        
                     
                     gc.collect()
                     
-                
-                if i % 10 == 0:
+                    text = 'regenerating similar file metadata - ' + HydrusData.ConvertValueRangeToPrettyString( total_done_previously + num_done, total_num_hash_ids_in_cache )
+                    
+                    time_running = HydrusData.GetNowPrecise() - time_started_precise
                     
-                    text = 'regenerating similar file metadata - ' + HydrusData.ConvertValueRangeToPrettyString( total_done_previously + i, total_num_hash_ids_in_cache )
+                    if num_done > 0 and time_running > 0:
+                        
+                        text += ' - ' + HydrusData.ConvertIntToPrettyString( int( num_done / time_running ) ) + ' files/s'
+                        
                     
                     HG.client_controller.pub( 'splash_set_status_subtext', text )
                     job_key.SetVariable( 'popup_text_1', text )
-                    job_key.SetVariable( 'popup_gauge_1', ( total_done_previously + i, total_num_hash_ids_in_cache ) )
+                    job_key.SetVariable( 'popup_gauge_1', ( total_done_previously + num_done, total_num_hash_ids_in_cache ) )
                     
-                
-                try:
+                    hash_ids_to_phashes = { hash_id : [] for hash_id in batch_of_hash_ids }
                     
-                    hash = self._GetHash( hash_id )
-                    mime = self._GetMime( hash_id )
+                    hash_ids_and_paths = []
                     
-                    if mime in HC.MIMES_WE_CAN_PHASH:
+                    for hash_id in batch_of_hash_ids:
                         
-                        path = client_files_manager.GetFilePath( hash, mime )
+                        hash = self._GetHash( hash_id )
+                        mime = self._GetMime( hash_id )
                         
                         if mime in HC.MIMES_WE_CAN_PHASH:
                             
                             try:
                                 
-                                phashes = ClientImageHandling.GenerateShapePerceptualHashes( path, mime )
-                                
-                            except Exception as e:
+                                path = client_files_manager.GetFilePath( hash, mime )
                                 
-                                HydrusData.Print( 'Could not generate phashes for ' + path )
+                            except HydrusExceptions.FileMissingException:
                                 
-                                HydrusData.PrintException( e )
-                                
-                                phashes = []
+                                continue
                                 
                             
+                            hash_ids_and_paths.append( ( hash_id, path, mime ) )
+                            
                         
-                    else:
+                    
+                    results = ClientImageHandling.GenerateShapePerceptualHashesForPaths( [ ( path, mime ) for ( hash_id, path, mime ) in hash_ids_and_paths ], pool )
+                    
+                    for ( ( hash_id, path, mime ), ( phashes, e ) ) in zip( hash_ids_and_paths, results ):
                         
-                        phashes = []
+                        if e is None:
+                            
+                            hash_ids_to_phashes[ hash_id ] = phashes
+                            
+                        else:
+                            
+                            HydrusData.Print( 'Could not generate phashes for ' + path )
+                            
+                            HydrusData.PrintException( e )
+                            
                         
                     
-                except HydrusExceptions.FileMissingException:
-                    
-                    phashes = []
+                    for ( hash_id, phashes ) in hash_ids_to_phashes.items():
+                        
+                        existing_phash_ids = { phash_id for ( phash_id, ) in self._c.execute( 'SELECT phash_id FROM shape_perceptual_hash_map WHERE hash_id = ?;', ( hash_id, ) ) }
+                        
+                        correct_phash_ids = self._CacheSimilarFilesAssociatePHashes( hash_id, phashes )
+                        
+                        incorrect_phash_ids = existing_phash_ids.difference( correct_phash_ids )
+                        
+                        if len( incorrect_phash_ids ) > 0:
+                            
+                            self._CacheSimilarFilesDisassociatePHashes( hash_id, incorrect_phash_ids )
+                            
+                        
                     
-                
-                existing_phash_ids = { phash_id for ( phash_id, ) in self._c.execute( 'SELECT phash_id FROM shape_perceptual_hash_map WHERE hash_id = ?;', ( hash_id, ) ) }
-                
-                correct_phash_ids = self._CacheSimilarFilesAssociatePHashes( hash_id, phashes )
-                
-                incorrect_phash_ids = existing_phash_ids.difference( correct_phash_ids )
-                
-                if len( incorrect_phash_ids ) > 0:
+                    self._c.executemany( 'DELETE FROM shape_maintenance_phash_regen WHERE hash_id = ?;', ( ( hash_id, ) for hash_id in batch_of_hash_ids ) )
                     
-                    self._CacheSimilarFilesDisassociatePHashes( hash_id, incorrect_phash_ids )
+                    num_done += len( batch_of_hash_ids )
                     
                 
-                self._c.execute( 'DELETE FROM shape_maintenance_phash_regen WHERE hash_id = ?;', ( hash_id, ) )
+            finally:
+                
+                pool.close()
                 
             
         finally:
@@ -1811,6 +1925,11 @@ class DB( HydrusDB.HydrusDB ):
         
         self._c.executemany( 'DELETE FROM shape_perceptual_hashes WHERE phash_id = ?;', ( ( p_id, ) for p_id in orphan_phash_ids ) )
         
+        if self._phash_index is not None:
+            
+            self._phash_index.RemovePHashIds( orphan_phash_ids )
+            
+        
         useful_nodes = [ row for row in unbalanced_nodes if row[0] in useful_phash_ids ]
         
         useful_population = len( useful_nodes )
@@ -1897,112 +2016,169 @@ class DB( HydrusDB.HydrusDB ):
     
     def _CacheSimilarFilesSearch( self, hash_id, max_hamming_distance ):
         
+        hash_ids_to_similar_hash_ids = self._CacheSimilarFilesSearchMany( ( hash_id, ), max_hamming_distance )
+        
+        return list( hash_ids_to_similar_hash_ids[ hash_id ] )
+        
+    
+    def _CacheSimilarFilesSearchMany( self, hash_ids, max_hamming_distance ):
+        
+        # this does one search for a whole batch of files, sharing node fetches and distance calcs between files with the same phashes
+        
+        hash_ids_to_similar_hash_ids = { hash_id : set() for hash_id in hash_ids }
+        
         if max_hamming_distance == 0:
             
-            similar_hash_ids = [ hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM shape_perceptual_hash_map WHERE phash_id IN ( SELECT phash_id FROM shape_perceptual_hash_map WHERE hash_id = ? );', ( hash_id, ) ) ]
+            select_statement = 'SELECT search_map.hash_id, similar_map.hash_id FROM shape_perceptual_hash_map AS search_map, shape_perceptual_hash_map AS similar_map ON ( search_map.phash_id = similar_map.phash_id ) WHERE search_map.hash_id IN %s;'
+            
+            for ( hash_id, similar_hash_id ) in self._SelectFromList( select_statement, hash_ids_to_similar_hash_ids.keys() ):
+                
+                hash_ids_to_similar_hash_ids[ hash_id ].add( similar_hash_id )
+                
+            
+            return hash_ids_to_similar_hash_ids
+            
+        
+        select_statement = 'SELECT hash_id, phash FROM shape_perceptual_hashes NATURAL JOIN shape_perceptual_hash_map WHERE hash_id IN %s;'
+        
+        search_phashes_to_hash_ids = HydrusData.BuildKeyToSetDict( ( ( str( phash ), hash_id ) for ( hash_id, phash ) in self._SelectFromList( select_statement, hash_ids_to_similar_hash_ids.keys() ) ) )
+        
+        if len( search_phashes_to_hash_ids ) == 0:
+            
+            return hash_ids_to_similar_hash_ids
+            
+        
+        if self._CacheSimilarFilesGetPHashIndex() is not None:
+            
+            search_phashes_to_similar_phash_ids = self._phash_index.SearchMany( search_phashes_to_hash_ids.keys(), max_hamming_distance )
             
         else:
             
-            search_radius = max_hamming_distance
+            search_phashes_to_similar_phash_ids = self._CacheSimilarFilesSearchTree( search_phashes_to_hash_ids.keys(), max_hamming_distance )
             
-            result = self._c.execute( 'SELECT phash_id FROM shape_vptree WHERE parent_id IS NULL;' ).fetchone()
+        
+        all_similar_phash_ids = set()
+        
+        for similar_phash_ids in search_phashes_to_similar_phash_ids.values():
             
-            if result is None:
-                
-                return []
-                
+            all_similar_phash_ids.update( similar_phash_ids )
             
-            ( root_node_phash_id, ) = result
+        
+        select_statement = 'SELECT phash_id, hash_id FROM shape_perceptual_hash_map WHERE phash_id IN %s;'
+        
+        similar_phash_ids_to_hash_ids = HydrusData.BuildKeyToListDict( self._SelectFromList( select_statement, all_similar_phash_ids ) )
+        
+        for ( search_phash, similar_phash_ids ) in search_phashes_to_similar_phash_ids.items():
+            
+            similar_hash_ids = set()
             
-            search_phashes = [ phash for ( phash, ) in self._c.execute( 'SELECT phash FROM shape_perceptual_hashes NATURAL JOIN shape_perceptual_hash_map WHERE hash_id = ?;', ( hash_id, ) ) ]
+            for similar_phash_id in similar_phash_ids:
+                
+                similar_hash_ids.update( similar_phash_ids_to_hash_ids[ similar_phash_id ] )
+                
             
-            if len( search_phashes ) == 0:
+            for hash_id in search_phashes_to_hash_ids[ search_phash ]:
                 
-                return []
+                hash_ids_to_similar_hash_ids[ hash_id ].update( similar_hash_ids )
                 
             
-            next_potentials = { root_node_phash_id : tuple( search_phashes ) }
-            similar_phash_ids = set()
+        
+        return hash_ids_to_similar_hash_ids
+        
+    
+    def _CacheSimilarFilesSearchTree( self, search_phashes, max_hamming_distance ):
+        
+        search_phashes_to_similar_phash_ids = { search_phash : set() for search_phash in search_phashes }
+        
+        search_radius = max_hamming_distance
+        
+        result = self._c.execute( 'SELECT phash_id FROM shape_vptree WHERE parent_id IS NULL;' ).fetchone()
+        
+        if result is None:
+            
+            return search_phashes_to_similar_phash_ids
             
-            num_cycles = 0
+        
+        ( root_node_phash_id, ) = result
+        
+        # every query walks the tree together, so each node is only fetched once per cycle no matter how many queries want it
+        
+        next_potentials = { root_node_phash_id : tuple( search_phashes_to_similar_phash_ids.keys() ) }
+        
+        num_cycles = 0
+        
+        while len( next_potentials ) > 0:
             
-            while len( next_potentials ) > 0:
-                
-                current_potentials = next_potentials
-                next_potentials = {}
+            current_potentials = next_potentials
+            next_potentials = {}
+            
+            num_cycles += 1
+            
+            select_statement = 'SELECT phash_id, phash, radius, inner_id, outer_id FROM shape_perceptual_hashes NATURAL JOIN shape_vptree WHERE phash_id IN %s;'
+            
+            for ( node_phash_id, node_phash, node_radius, inner_phash_id, outer_phash_id ) in self._SelectFromList( select_statement, current_potentials.keys() ):
                 
-                num_cycles += 1
+                search_phashes = current_potentials[ node_phash_id ]
                 
-                select_statement = 'SELECT phash_id, phash, radius, inner_id, outer_id FROM shape_perceptual_hashes NATURAL JOIN shape_vptree WHERE phash_id IN %s;'
+                inner_search_phashes = []
+                outer_search_phashes = []
                 
-                for ( node_phash_id, node_phash, node_radius, inner_phash_id, outer_phash_id ) in self._SelectFromList( select_statement, current_potentials.keys() ):
+                for search_phash in search_phashes:
                     
-                    search_phashes = current_potentials[ node_phash_id ]
+                    # first check the node--is it similar?
                     
-                    inner_search_phashes = []
-                    outer_search_phashes = []
+                    node_hamming_distance = HydrusData.Get64BitHammingDistance( search_phash, node_phash )
                     
-                    for search_phash in search_phashes:
+                    if node_hamming_distance <= search_radius:
                         
-                        # first check the node--is it similar?
+                        search_phashes_to_similar_phash_ids[ search_phash ].add( node_phash_id )
                         
-                        node_hamming_distance = HydrusData.Get64BitHammingDistance( search_phash, node_phash )
+                    
+                    # now how about its children?
+                    
+                    if node_radius is not None:
                         
-                        if node_hamming_distance <= search_radius:
-                            
-                            similar_phash_ids.add( node_phash_id )
-                            
+                        # we have two spheres--node and search--their centers separated by node_hamming_distance
+                        # we want to search inside/outside the node_sphere if the search_sphere intersects with those spaces
+                        # there are four possibles:
+                        # (----N----)-(--S--)    intersects with outer only - distance between N and S > their radii
+                        # (----N---(-)-S--)      intersects with both
+                        # (----N-(--S-)-)        intersects with both
+                        # (---(-N-S--)-)         intersects with inner only - distance between N and S + radius_S does not exceed radius_N
                         
-                        # now how about its children?
+                        spheres_disjoint = node_hamming_distance > ( node_radius + search_radius )
+                        search_sphere_subset_of_node_sphere = ( node_hamming_distance + search_radius ) <= node_radius
                         
-                        if node_radius is not None:
-                            
-                            # we have two spheres--node and search--their centers separated by node_hamming_distance
-                            # we want to search inside/outside the node_sphere if the search_sphere intersects with those spaces
-                            # there are four possibles:
-                            # (----N----)-(--S--)    intersects with outer only - distance between N and S > their radii
-                            # (----N---(-)-S--)      intersects with both
-                            # (----N-(--S-)-)        intersects with both
-                            # (---(-N-S--)-)         intersects with inner only - distance between N and S + radius_S does not exceed radius_N
+                        if not spheres_disjoint: # i.e. they intersect at some point
                             
-                            spheres_disjoint = node_hamming_distance > ( node_radius + search_radius )
-                            search_sphere_subset_of_node_sphere = ( node_hamming_distance + search_radius ) <= node_radius
+                            inner_search_phashes.append( search_phash )
                             
-                            if not spheres_disjoint: # i.e. they intersect at some point
-                                
-                                inner_search_phashes.append( search_phash )
-                                
+                        
+                        if not search_sphere_subset_of_node_sphere: # i.e. search sphere intersects with non-node sphere space at some point
                             
-                            if not search_sphere_subset_of_node_sphere: # i.e. search sphere intersects with non-node sphere space at some point
-                                
-                                outer_search_phashes.append( search_phash )
-                                
+                            outer_search_phashes.append( search_phash )
                             
                         
                     
-                    if inner_phash_id is not None and len( inner_search_phashes ) > 0:
-                        
-                        next_potentials[ inner_phash_id ] = tuple( inner_search_phashes )
-                        
+                
+                if inner_phash_id is not None and len( inner_search_phashes ) > 0:
                     
-                    if outer_phash_id is not None and len( outer_search_phashes ) > 0:
-                        
-                        next_potentials[ outer_phash_id ] = tuple( outer_search_phashes )
-                        
+                    next_potentials[ inner_phash_id ] = tuple( inner_search_phashes )
                     
                 
-            
-            if HG.db_report_mode:
-                
-                HydrusData.ShowText( 'Similar file search completed in ' + HydrusData.ConvertIntToPrettyString( num_cycles ) + ' cycles.' )
+                if outer_phash_id is not None and len( outer_search_phashes ) > 0:
+                    
+                    next_potentials[ outer_phash_id ] = tuple( outer_search_phashes )
+                    
                 
             
-            select_statement = 'SELECT hash_id FROM shape_perceptual_hash_map WHERE phash_id IN %s;'
+        
+        if HG.db_report_mode:
             
-            similar_hash_ids = [ hash_id for ( hash_id, ) in self._SelectFromList( select_statement, similar_phash_ids ) ]
+            HydrusData.ShowText( 'Similar file search for ' + HydrusData.ConvertIntToPrettyString( len( search_phashes_to_similar_phash_ids ) ) + ' phashes completed in ' + HydrusData.ConvertIntToPrettyString( num_cycles ) + ' cycles.' )
             
         
-        return similar_hash_ids
+        return search_phashes_to_similar_phash_ids
         
     
     def _CacheSimilarFilesSetDuplicatePairStatus( self, pair_info ):
@@ -2221,6 +2397,9 @@ class DB( HydrusDB.HydrusDB ):
         
         ac_cache_changes = []
         
+        posting_list_current_mappings_ids = []
+        posting_list_pending_mappings_ids = []
+        
         for group_of_hash_ids in HydrusData.SplitListIntoChunks( hash_ids, 100 ):
             
             splayed_group_of_hash_ids = HydrusData.SplayListForDB( group_of_hash_ids )
@@ -2251,6 +2430,8 @@ class DB( HydrusDB.HydrusDB ):
                     
                     self._c.executemany( 'INSERT OR IGNORE INTO ' + cache_current_mappings_table_name + ' ( hash_id, tag_id ) VALUES ( ?, ? );', ( ( hash_id, tag_id ) for hash_id in current_hash_ids ) )
                     
+                    posting_list_current_mappings_ids.append( ( tag_id, current_hash_ids ) )
+                    
                 
                 #
                 
@@ -2273,6 +2454,8 @@ class DB( HydrusDB.HydrusDB ):
                     
                     self._c.executemany( 'INSERT OR IGNORE INTO ' + cache_pending_mappings_table_name + ' ( hash_id, tag_id ) VALUES ( ?, ? );', ( ( hash_id, tag_id ) for hash_id in pending_hash_ids ) )
                     
+                    posting_list_pending_mappings_ids.append( ( tag_id, pending_hash_ids ) )
+                    
                 
                 if num_current > 0 or num_pending > 0:
                     
@@ -2288,6 +2471,9 @@ class DB( HydrusDB.HydrusDB ):
             self._c.executemany( 'UPDATE ' + ac_cache_table_name + ' SET current_count = current_count + ?, pending_count = pending_count + ? WHERE tag_id = ?;', ( ( num_current, num_pending, tag_id ) for ( tag_id, num_current, num_pending ) in ac_cache_changes ) )
             
         
+        self._UpdateTagPostingLists( file_service_id, tag_service_id, HC.CONTENT_STATUS_CURRENT, posting_list_current_mappings_ids, True )
+        self._UpdateTagPostingLists( file_service_id, tag_service_id, HC.CONTENT_STATUS_PENDING, posting_list_pending_mappings_ids, True )
+        
     
     def _CacheSpecificMappingsAddMappings( self, file_service_id, tag_service_id, mappings_ids ):
         
@@ -2324,6 +2510,9 @@ class DB( HydrusDB.HydrusDB ):
                 
                 self._c.executemany( 'DELETE FROM ' + cache_deleted_mappings_table_name + ' WHERE hash_id = ? AND tag_id = ?;', ( ( hash_id, tag_id ) for hash_id in hash_ids ) )
                 
+                self._UpdateTagPostingLists( file_service_id, tag_service_id, HC.CONTENT_STATUS_PENDING, ( ( tag_id, hash_ids ), ), False )
+                self._UpdateTagPostingLists( file_service_id, tag_service_id, HC.CONTENT_STATUS_CURRENT, ( ( tag_id, hash_ids ), ), True )
+                
             
         
     
@@ -2341,6 +2530,8 @@ class DB( HydrusDB.HydrusDB ):
         
         self._c.execute( 'DROP TABLE IF EXISTS ' + ac_cache_table_name + ';' )
         
+        self._tag_posting_lists.ClearServicePair( file_service_id, tag_service_id )
+        
     
     def _CacheSpecificMappingsDeleteFiles( self, file_service_id, tag_service_id, hash_ids ):
         
@@ -2350,6 +2541,9 @@ class DB( HydrusDB.HydrusDB ):
         
         ac_cache_changes = []
         
+        posting_list_current_mappings_ids = []
+        posting_list_pending_mappings_ids = []
+        
         for group_of_hash_ids in HydrusData.SplitListIntoChunks( hash_ids, 100 ):
             
             splayed_group_of_hash_ids = HydrusData.SplayListForDB( group_of_hash_ids )
@@ -2380,6 +2574,8 @@ class DB( HydrusDB.HydrusDB ):
                     
                     self._c.executemany( 'DELETE FROM ' + cache_current_mappings_table_name + ' WHERE tag_id = ? AND hash_id = ?;', ( ( tag_id, hash_id ) for hash_id in current_hash_ids ) )
                     
+                    posting_list_current_mappings_ids.append( ( tag_id, current_hash_ids ) )
+                    
                 
                 #
                 
@@ -2402,6 +2598,8 @@ class DB( HydrusDB.HydrusDB ):
                     
                     self._c.executemany( 'DELETE FROM ' + cache_pending_mappings_table_name + ' WHERE tag_id = ? AND hash_id = ?;', ( ( tag_id, hash_id ) for hash_id in pending_hash_ids ) )
                     
+                    posting_list_pending_mappings_ids.append( ( tag_id, pending_hash_ids ) )
+                    
                 
                 ac_cache_changes.append( ( tag_id, num_current, num_pending ) )
                 
@@ -2414,6 +2612,9 @@ class DB( HydrusDB.HydrusDB ):
             self._c.executemany( 'DELETE FROM ' + ac_cache_table_name + ' WHERE tag_id = ? AND current_count = ? AND pending_count = ?;', ( ( tag_id, 0, 0 ) for ( tag_id, num_current, num_pending ) in ac_cache_changes ) )
             
         
+        self._UpdateTagPostingLists( file_service_id, tag_service_id, HC.CONTENT_STATUS_CURRENT, posting_list_current_mappings_ids, False )
+        self._UpdateTagPostingLists( file_service_id, tag_service_id, HC.CONTENT_STATUS_PENDING, posting_list_pending_mappings_ids, False )
+        
     
     def _CacheSpecificMappingsDeleteMappings( self, file_service_id, tag_service_id, mappings_ids ):
         
@@ -2440,6 +2641,8 @@ class DB( HydrusDB.HydrusDB ):
                 
                 self._c.executemany( 'INSERT OR IGNORE INTO ' + cache_deleted_mappings_table_name + ' ( hash_id, tag_id ) VALUES ( ?, ? );', ( ( hash_id, tag_id ) for hash_id in hash_ids ) )
                 
+                self._UpdateTagPostingLists( file_service_id, tag_service_id, HC.CONTENT_STATUS_CURRENT, ( ( tag_id, hash_ids ), ), False )
+                
             
         
     
@@ -2506,6 +2709,7 @@ class DB( HydrusDB.HydrusDB ):
                     self._c.execute( 'UPDATE ' + ac_cache_table_name + ' SET pending_count = pending_count + ? WHERE tag_id = ?;', ( num_added, tag_id ) )
                     
                 
+                self._UpdateTagPostingLists( file_service_id, tag_service_id, HC.CONTENT_STATUS_PENDING, ( ( tag_id, hash_ids ), ), True )
                 
             
         
@@ -2531,6 +2735,8 @@ class DB( HydrusDB.HydrusDB ):
                     self._c.execute( 'DELETE FROM ' + ac_cache_table_name + ' WHERE tag_id = ? AND current_count = ? AND pending_count = ?;', ( tag_id, 0, 0 ) )
                     
                 
+                self._UpdateTagPostingLists( file_service_id, tag_service_id, HC.CONTENT_STATUS_PENDING, ( ( tag_id, hash_ids ), ), False )
+                
             
         
     
@@ -2594,130 +2800,28 @@ class DB( HydrusDB.HydrusDB ):
             
         
     
-    def _CheckFileIntegrity( self, mode, allowed_mimes = None, move_location = None ):
+    def _CleanUpCaches( self ):
         
-        prefix_string = 'checking file integrity: '
+        self._subscriptions_cache = {}
+        self._service_cache = {}
         
-        job_key = ClientThreading.JobKey( cancellable = True )
+        self._phash_index = None
         
-        try:
-            
-            job_key.SetVariable( 'popup_text_1', prefix_string + 'preparing' )
-            
-            self._controller.pub( 'modal_message', job_key )
-            
-            if allowed_mimes is None:
-                
-                select = 'SELECT hash_id, mime FROM current_files NATURAL JOIN files_info WHERE service_id = ?;'
-                
-            else:
-                
-                select = 'SELECT hash_id, mime FROM current_files NATURAL JOIN files_info WHERE service_id = ? AND mime IN ' + HydrusData.SplayListForDB( allowed_mimes ) + ';'
-                
-            
-            info = self._c.execute( select, ( self._combined_local_file_service_id, ) ).fetchall()
-            
-            missing_count = 0
-            deletee_hash_ids = []
-            
-            client_files_manager = self._controller.client_files_manager
-            
-            for ( i, ( hash_id, mime ) ) in enumerate( info ):
-                
-                ( i_paused, should_quit ) = job_key.WaitIfNeeded()
-                
-                if should_quit:
-                    
-                    return
-                    
-                
-                job_key.SetVariable( 'popup_text_1', prefix_string + HydrusData.ConvertValueRangeToPrettyString( i, len( info ) ) )
-                job_key.SetVariable( 'popup_gauge_1', ( i, len( info ) ) )
-                
-                hash = self._GetHash( hash_id )
-                
-                try:
-                    
-                    # lockless because this db call is made by the locked client files manager
-                    path = client_files_manager.LocklessGetFilePath( hash, mime )
-                    
-                except HydrusExceptions.FileMissingException:
-                    
-                    HydrusData.Print( 'Could not find the file for ' + hash.encode( 'hex' ) + '!' )
-                    
-                    deletee_hash_ids.append( hash_id )
-                    
-                    missing_count += 1
-                    
-                    continue
-                    
-                
-                if mode == 'thorough':
-                    
-                    actual_hash = HydrusFileHandling.GetHashFromPath( path )
-                    
-                    if actual_hash != hash:
-                        
-                        deletee_hash_ids.append( hash_id )
-                        
-                        if move_location is not None:
-                            
-                            move_filename = 'believed ' + hash.encode( 'hex' ) + ' actually ' + actual_hash.encode( 'hex' ) + HC.mime_ext_lookup[ mime ]
-                            
-                            move_path = os.path.join( move_location, move_filename )
-                            
-                            HydrusPaths.MergeFile( path, move_path )
-                            
-                        
-                    
-                
-            
-            job_key.DeleteVariable( 'popup_gauge_1' )
-            job_key.SetVariable( 'popup_text_1', prefix_string + 'deleting the incorrect records' )
-            
-            self._DeleteFiles( self._local_file_service_id, deletee_hash_ids )
-            self._DeleteFiles( self._trash_service_id, deletee_hash_ids )
-            self._DeleteFiles( self._combined_local_file_service_id, deletee_hash_ids )
-            
-            final_text = 'done! '
-            
-            if len( deletee_hash_ids ) == 0:
-                
-                final_text += 'all files ok!'
-                
-            else:
-                
-                final_text += HydrusData.ConvertIntToPrettyString( missing_count ) + ' files were missing!'
-                
-                if mode == 'thorough':
-                    
-                    final_text += ' ' + HydrusData.ConvertIntToPrettyString( len( deletee_hash_ids ) - missing_count ) + ' files were incorrect and thus '
-                    
-                    if move_location is None:
-                        
-                        final_text += 'deleted!'
-                        
-                    else:
-                        
-                        final_text += 'moved!'
-                        
-                    
-                
-            
-            job_key.SetVariable( 'popup_text_1', prefix_string + final_text )
-            
-        finally:
-            
-            HydrusData.Print( job_key.ToString() )
-            
-            job_key.Finish()
-            
+        self._tag_posting_lists.Clear()
+        
+        self._file_search_cache.Clear()
+        self._subtag_search_cache.Clear()
+        
+        self._ClearIdCaches()
         
     
-    def _CleanUpCaches( self ):
+    def _ClearIdCaches( self ):
         
-        self._subscriptions_cache = {}
-        self._service_cache = {}
+        self._hash_id_cache.Clear()
+        self._namespace_id_cache.Clear()
+        self._subtag_id_cache.Clear()
+        self._tag_id_cache.Clear()
+        self._url_id_cache.Clear()
         
     
     def _ClearOrphanFileRecords( self ):
@@ -2800,6 +2904,31 @@ class DB( HydrusDB.HydrusDB ):
             
         
     
+    def _CoalesceWriteArgs( self, action, list_of_args ):
+        
+        if action == 'content_updates':
+            
+            merged_service_keys_to_content_updates = {}
+            
+            for ( service_keys_to_content_updates, ) in list_of_args:
+                
+                for ( service_key, content_updates ) in service_keys_to_content_updates.items():
+                    
+                    if service_key not in merged_service_keys_to_content_updates:
+                        
+                        merged_service_keys_to_content_updates[ service_key ] = []
+                        
+                    
+                    merged_service_keys_to_content_updates[ service_key ].extend( content_updates )
+                    
+                
+            
+            return ( merged_service_keys_to_content_updates, )
+            
+        
+        raise Exception( 'db received an unknown coalesce command: ' + action )
+        
+    
     def _CreateDB( self ):
         
         client_files_default = os.path.join( self._db_dir, 'client_files' )
@@ -3006,6 +3135,8 @@ class DB( HydrusDB.HydrusDB ):
     
     def _DeleteFiles( self, service_id, hash_ids ):
         
+        self._file_search_cache.Clear()
+        
         # the gui sometimes gets out of sync and sends a DELETE FROM TRASH call before the SEND TO TRASH call
         # in this case, let's make sure the local file domains are clear before deleting from the umbrella domain
         
@@ -3091,6 +3222,13 @@ class DB( HydrusDB.HydrusDB ):
                     
                 
             
+            # sidecars are parsed copies of update files, so they go when the update files do
+            
+            if service_id == self._local_update_service_id:
+                
+                self._DeleteRepositoryUpdateSidecars( existing_hash_ids )
+                
+            
             # if the files are being fully deleted, then physically delete them
             
             if service_id == self._combined_local_file_service_id:
@@ -3119,6 +3257,13 @@ class DB( HydrusDB.HydrusDB ):
         self._c.executemany( 'UPDATE service_info SET info = info + ? WHERE service_id = ? AND info_type = ?;', service_info_updates )
         
     
+    def _DeleteFileIntegrityFailures( self, hash_ids ):
+        
+        self._DeleteFiles( self._local_file_service_id, hash_ids )
+        self._DeleteFiles( self._trash_service_id, hash_ids )
+        self._DeleteFiles( self._combined_local_file_service_id, hash_ids )
+        
+    
     def _DeleteHydrusSessionKey( self, service_key ):
         
         try:
@@ -3203,6 +3348,8 @@ class DB( HydrusDB.HydrusDB ):
             
             self._controller.CallToThread( client_files_manager.DelayedDeleteFiles, file_hashes, time_to_delete )
             
+            self._DeleteRepositoryUpdateSidecars( deletable_file_hash_ids )
+            
         
         useful_thumbnail_hash_ids = { hash_id for ( hash_id, ) in self._c.execute( 'SELECT hash_id FROM current_files WHERE hash_id IN ' + HydrusData.SplayListForDB( hash_ids ) + ';' ) }
         
@@ -3223,8 +3370,18 @@ class DB( HydrusDB.HydrusDB ):
             
         
     
+    def _DeleteRepositoryUpdateSidecars( self, hash_ids ):
+        
+        for update_hash in self._GetHashes( hash_ids ):
+            
+            HydrusPaths.DeletePath( self._GetRepositoryUpdateSidecarPath( update_hash ) )
+            
+        
+    
     def _DeleteService( self, service_id ):
         
+        self._file_search_cache.Clear()
+        
         service = self._GetService( service_id )
         
         service_key = service.GetServiceKey()
@@ -3247,6 +3404,8 @@ class DB( HydrusDB.HydrusDB ):
             
             self._CacheCombinedFilesMappingsDrop( service_id )
             
+            self._tag_posting_lists.ClearServicePair( self._combined_file_service_id, service_id )
+            
             file_service_ids = self._GetServiceIds( HC.AUTOCOMPLETE_CACHE_SPECIFIC_FILE_SERVICES )
             
             for file_service_id in file_service_ids:
@@ -3679,6 +3838,8 @@ class DB( HydrusDB.HydrusDB ):
             
             predicates_phrase = ' OR '.join( predicates )
             
+            tag_ids = self._STS( self._c.execute( 'SELECT tag_id FROM tags WHERE ' + predicates_phrase + ';' ) )
+            
         else:
             
             def GetPossibleSubtagIds( half_complete_subtag ):
@@ -3691,11 +3852,33 @@ class DB( HydrusDB.HydrusDB ):
                     
                     return self._STL( self._c.execute( 'SELECT subtag_id FROM subtags WHERE subtag LIKE ?;', ( like_param, ) ) )
                     
-                else:
+                
+                prefix = ClientSearch.GetSubtagSearchPrefix( half_complete_subtag )
+                
+                if prefix is not None:
+                    
+                    return self._GetSubtagIdsFromSearchPrefix( prefix )
                     
-                    subtags_fts4_param = '"' + half_complete_subtag + '"'
+                
+                subtags_fts4_param = '"' + half_complete_subtag + '"'
+                
+                return self._STL( self._c.execute( 'SELECT docid FROM subtags_fts4 WHERE subtag MATCH ?;', ( subtags_fts4_param, ) ) )
+                
+            
+            def GetTagIdsFromSubtagIds( subtag_ids, namespace_ids = None ):
+                
+                # a join on a temp table uses the ( subtag_id, namespace_id ) index, where a giant IN list for a short search would not
+                
+                with HydrusDB.TemporaryIntegerTable( self._c, subtag_ids, 'subtag_id' ) as temp_table_name:
                     
-                    return self._STL( self._c.execute( 'SELECT docid FROM subtags_fts4 WHERE subtag MATCH ?;', ( subtags_fts4_param, ) ) )
+                    if namespace_ids is None:
+                        
+                        return self._STS( self._c.execute( 'SELECT tag_id FROM ' + temp_table_name + ' CROSS JOIN tags USING ( subtag_id );' ) )
+                        
+                    else:
+                        
+                        return self._STS( self._c.execute( 'SELECT tag_id FROM ' + temp_table_name + ' CROSS JOIN tags USING ( subtag_id ) WHERE namespace_id IN ' + HydrusData.SplayListForDB( namespace_ids ) + ';' ) )
+                        
                     
                 
             
@@ -3703,16 +3886,12 @@ class DB( HydrusDB.HydrusDB ):
             
             if namespace != '':
                 
-                predicates = []
-                
                 if '*' in namespace:
                     
                     like_param = ConvertWildcardToSQLiteLikeParameter( namespace )
                     
                     possible_namespace_ids = self._STL( self._c.execute( 'SELECT namespace_id FROM namespaces WHERE namespace LIKE ?;', ( like_param, ) ) )
                     
-                    predicates.append( 'namespace_id IN ' + HydrusData.SplayListForDB( possible_namespace_ids ) )
-                    
                 else:
                     
                     result = self._c.execute( 'SELECT namespace_id FROM namespaces WHERE namespace = ?;', ( namespace, ) ).fetchone()
@@ -3725,7 +3904,7 @@ class DB( HydrusDB.HydrusDB ):
                         
                         ( namespace_id, ) = result
                         
-                        predicates.append( 'namespace_id = ' + str( namespace_id ) )
+                        possible_namespace_ids = [ namespace_id ]
                         
                     
                 
@@ -3733,10 +3912,12 @@ class DB( HydrusDB.HydrusDB ):
                     
                     possible_subtag_ids = GetPossibleSubtagIds( half_complete_subtag )
                     
-                    predicates.append( 'subtag_id IN ' + HydrusData.SplayListForDB( possible_subtag_ids ) )
+                    tag_ids = GetTagIdsFromSubtagIds( possible_subtag_ids, namespace_ids = possible_namespace_ids )
+                    
+                else:
+                    
+                    tag_ids = self._STS( self._c.execute( 'SELECT tag_id FROM tags WHERE namespace_id IN ' + HydrusData.SplayListForDB( possible_namespace_ids ) + ';' ) )
                     
-                
-                predicates_phrase = ' AND '.join( predicates )
                 
             else:
                 
@@ -3751,24 +3932,24 @@ class DB( HydrusDB.HydrusDB ):
                 
                 possible_subtag_ids = GetPossibleSubtagIds( half_complete_subtag )
                 
-                predicates_phrase = 'namespace_id IN ' + HydrusData.SplayListForDB( possible_namespace_ids ) + ' OR subtag_id IN ' + HydrusData.SplayListForDB( possible_subtag_ids )
+                tag_ids = GetTagIdsFromSubtagIds( possible_subtag_ids )
+                
+                # there is no index on namespace_id, so only scan for namespaced tags when the text actually matches a namespace
+                
+                if len( possible_namespace_ids ) > 0:
+                    
+                    tag_ids.update( self._STI( self._c.execute( 'SELECT tag_id FROM tags WHERE namespace_id IN ' + HydrusData.SplayListForDB( possible_namespace_ids ) + ';' ) ) )
+                    
                 
             
         
-        tag_ids = self._STS( self._c.execute( 'SELECT tag_id FROM tags WHERE ' + predicates_phrase + ';' ) )
-        
         # now fetch siblings, add to set
         
         siblings_manager = self._controller.GetManager( 'tag_siblings' )
         
         all_associated_sibling_tags = siblings_manager.GetAutocompleteSiblings( service_key, search_text, exact_match )
         
-        for sibling_tag in all_associated_sibling_tags:
-            
-            tag_id = self._GetTagId( sibling_tag )
-            
-            tag_ids.add( tag_id )
-            
+        tag_ids.update( self._GetTagsToTagIds( all_associated_sibling_tags ).values() )
         
         return tag_ids
         
@@ -3969,171 +4150,390 @@ class DB( HydrusDB.HydrusDB ):
             
         
     
-    def _GetFileSystemPredicates( self, service_key ):
-        
-        service_id = self._GetServiceId( service_key )
+    def _GetFileSearchCacheDependencies( self, search_context ):
         
-        service = self._GetService( service_id )
-        
-        service_type = service.GetServiceType()
+        tag_service_key = search_context.GetTagServiceKey()
         
-        have_ratings = len( self._GetServiceIds( HC.RATINGS_SERVICES ) ) > 0
+        siblings_manager = self._controller.GetManager( 'tag_siblings' )
         
-        predicates = []
+        subtags = set()
         
-        if service_type in ( HC.COMBINED_FILE, HC.COMBINED_TAG ):
+        for tag in search_context.GetTagsToInclude() + search_context.GetTagsToExclude():
             
-            predicates.extend( [ ClientSearch.Predicate( predicate_type, None ) for predicate_type in [ HC.PREDICATE_TYPE_SYSTEM_EVERYTHING, HC.PREDICATE_TYPE_SYSTEM_UNTAGGED, HC.PREDICATE_TYPE_SYSTEM_NUM_TAGS, HC.PREDICATE_TYPE_SYSTEM_LIMIT, HC.PREDICATE_TYPE_SYSTEM_KNOWN_URLS, HC.PREDICATE_TYPE_SYSTEM_HASH, HC.PREDICATE_TYPE_SYSTEM_FILE_SERVICE, HC.PREDICATE_TYPE_SYSTEM_DUPLICATE_RELATIONSHIPS ] ] )
+            for sibling_tag in siblings_manager.GetAllSiblings( tag_service_key, tag ):
+                
+                ( namespace, subtag ) = HydrusTags.SplitTag( sibling_tag )
+                
+                subtags.add( subtag )
+                
             
-        elif service_type in HC.TAG_SERVICES:
+        
+        # these depend on more than the tags we can name, so any mappings change in the tag domain has to clear them
+        
+        any_tag_predicate_types = ( HC.PREDICATE_TYPE_NAMESPACE, HC.PREDICATE_TYPE_WILDCARD, HC.PREDICATE_TYPE_SYSTEM_UNTAGGED, HC.PREDICATE_TYPE_SYSTEM_NUM_TAGS, HC.PREDICATE_TYPE_SYSTEM_TAG_AS_NUMBER )
+        
+        any_tag = search_context.GetFileServiceKey() == CC.COMBINED_FILE_SERVICE_KEY or True in ( predicate.GetType() in any_tag_predicate_types for predicate in search_context.GetPredicates() )
+        
+        rating_service_keys = { service_key for ( operator, value, service_key ) in search_context.GetSystemPredicates().GetRatingsPredicates() }
+        
+        return ( subtags, any_tag, rating_service_keys )
+        
+    
+    def _GetFileSearchPlan( self, file_service_key, tag_service_key, tags_to_include, namespaces_to_include, wildcards_to_include, files_info_predicates, include_current_tags, include_pending_tags, use_tag_posting_lists ):
+        
+        # we want to run the most selective predicate first so every later one has only a few candidates to check
+        # tags have real counts in the autocomplete caches. everything else is estimated from the stats analyze leaves in sqlite_stat1
+        
+        file_service_id = self._GetServiceId( file_service_key )
+        tag_service_id = self._GetServiceId( tag_service_key )
+        
+        if tag_service_key == CC.COMBINED_TAG_SERVICE_KEY:
             
-            service_info = self._GetServiceInfoSpecific( service_id, service_type, { HC.SERVICE_INFO_NUM_FILES } )
+            search_tag_service_ids = self._GetServiceIds( HC.TAG_SERVICES )
             
-            num_everything = service_info[ HC.SERVICE_INFO_NUM_FILES ]
+        else:
             
-            predicates.append( ClientSearch.Predicate( HC.PREDICATE_TYPE_SYSTEM_EVERYTHING, min_current_count = num_everything ) )
+            search_tag_service_ids = [ tag_service_id ]
             
-            predicates.extend( [ ClientSearch.Predicate( predicate_type, None ) for predicate_type in [ HC.PREDICATE_TYPE_SYSTEM_NUM_TAGS, HC.PREDICATE_TYPE_SYSTEM_LIMIT, HC.PREDICATE_TYPE_SYSTEM_KNOWN_URLS, HC.PREDICATE_TYPE_SYSTEM_HASH ] ] )
+        
+        mappings_table_names = []
+        files_table_name = None
+        
+        for search_tag_service_id in search_tag_service_ids:
             
-            if have_ratings:
+            if file_service_key == CC.COMBINED_FILE_SERVICE_KEY:
                 
-                predicates.append( ClientSearch.Predicate( HC.PREDICATE_TYPE_SYSTEM_RATING ) )
+                ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( search_tag_service_id )
+                
+            else:
+                
+                ( files_table_name, current_mappings_table_name, cache_deleted_mappings_table_name, pending_mappings_table_name, ac_cache_table_name ) = GenerateSpecificMappingsCacheTableNames( file_service_id, search_tag_service_id )
                 
             
-            predicates.extend( [ ClientSearch.Predicate( predicate_type, None ) for predicate_type in [ HC.PREDICATE_TYPE_SYSTEM_FILE_SERVICE, HC.PREDICATE_TYPE_SYSTEM_TAG_AS_NUMBER, HC.PREDICATE_TYPE_SYSTEM_DUPLICATE_RELATIONSHIPS ] ] )
+            if include_current_tags:
+                
+                mappings_table_names.append( current_mappings_table_name )
+                
             
-        elif service_type in HC.FILE_SERVICES:
+            if include_pending_tags:
+                
+                mappings_table_names.append( pending_mappings_table_name )
+                
             
-            service_info = self._GetServiceInfoSpecific( service_id, service_type, { HC.SERVICE_INFO_NUM_VIEWABLE_FILES, HC.SERVICE_INFO_NUM_INBOX } )
+        
+        num_mappings = 0
+        
+        for mappings_table_name in mappings_table_names:
             
-            num_everything = service_info[ HC.SERVICE_INFO_NUM_VIEWABLE_FILES ]
-            num_inbox = service_info[ HC.SERVICE_INFO_NUM_INBOX ]
-            num_archive = num_everything - num_inbox
+            statistics = self._GetTableStatistics( mappings_table_name )
             
-            if service_type == HC.FILE_REPOSITORY:
+            if statistics is None:
                 
-                ( num_local, ) = self._c.execute( 'SELECT COUNT( * ) FROM current_files AS remote_current_files, current_files ON ( remote_current_files.hash_id = current_files.hash_id ) WHERE remote_current_files.service_id = ? AND current_files.service_id = ?;', ( service_id, self._combined_local_file_service_id ) ).fetchone()
-                
-                num_not_local = num_everything - num_local
+                num_mappings = None
                 
-                num_archive = num_local - num_inbox
+                break
                 
             
-            predicates.append( ClientSearch.Predicate( HC.PREDICATE_TYPE_SYSTEM_EVERYTHING, min_current_count = num_everything ) )
+            num_mappings += statistics[0]
             
-            show_inbox_and_archive = True
+        
+        num_files = None
+        
+        if files_table_name is not None:
             
-            if self._controller.new_options.GetBoolean( 'filter_inbox_and_archive_predicates' ) and ( num_inbox == 0 or num_archive == 0 ):
+            statistics = self._GetTableStatistics( files_table_name )
+            
+            if statistics is not None:
                 
-                show_inbox_and_archive = False
+                num_files = statistics[0]
                 
             
-            if show_inbox_and_archive:
+        
+        if num_mappings is None:
+            
+            namespace_estimate = None
+            
+        else:
+            
+            ( num_namespaces, ) = self._c.execute( 'SELECT COUNT( * ) FROM namespaces;' ).fetchone()
+            
+            # don't count the null namespace
+            
+            namespace_estimate = num_mappings // max( num_namespaces - 1, 1 )
+            
+            if num_files is not None:
                 
-                predicates.append( ClientSearch.Predicate( HC.PREDICATE_TYPE_SYSTEM_INBOX, min_current_count = num_inbox ) )
-                predicates.append( ClientSearch.Predicate( HC.PREDICATE_TYPE_SYSTEM_ARCHIVE, min_current_count = num_archive ) )
+                namespace_estimate = min( namespace_estimate, num_files )
                 
             
-            if service_type == HC.FILE_REPOSITORY:
+        
+        tags_and_estimates = []
+        
+        for tag in tags_to_include:
+            
+            if file_service_key == CC.COMBINED_FILE_SERVICE_KEY and tag_service_key == CC.COMBINED_TAG_SERVICE_KEY:
                 
-                predicates.append( ClientSearch.Predicate( HC.PREDICATE_TYPE_SYSTEM_LOCAL, min_current_count = num_local ) )
-                predicates.append( ClientSearch.Predicate( HC.PREDICATE_TYPE_SYSTEM_NOT_LOCAL, min_current_count = num_not_local ) )
+                # there is no autocomplete cache for this domain
+                
+                tags_and_estimates.append( ( tag, None ) )
+                
+                continue
                 
             
-            predicates.extend( [ ClientSearch.Predicate( predicate_type ) for predicate_type in [ HC.PREDICATE_TYPE_SYSTEM_UNTAGGED, HC.PREDICATE_TYPE_SYSTEM_NUM_TAGS, HC.PREDICATE_TYPE_SYSTEM_LIMIT, HC.PREDICATE_TYPE_SYSTEM_SIZE, HC.PREDICATE_TYPE_SYSTEM_AGE, HC.PREDICATE_TYPE_SYSTEM_KNOWN_URLS, HC.PREDICATE_TYPE_SYSTEM_HASH, HC.PREDICATE_TYPE_SYSTEM_DIMENSIONS, HC.PREDICATE_TYPE_SYSTEM_DURATION, HC.PREDICATE_TYPE_SYSTEM_NUM_WORDS, HC.PREDICATE_TYPE_SYSTEM_MIME ] ] )
+            tag_ids = self._GetTagIdsForSearch( tag_service_key, tag )
             
-            if have_ratings:
+            ids_to_count = self._GetAutocompleteCounts( tag_service_id, file_service_id, tag_ids, include_current_tags, include_pending_tags )
+            
+            estimate = 0
+            
+            for ( current_min, current_max, pending_min, pending_max ) in ids_to_count.values():
                 
-                predicates.append( ClientSearch.Predicate( HC.PREDICATE_TYPE_SYSTEM_RATING ) )
+                estimate += current_min if current_max is None else current_max
+                estimate += pending_min if pending_max is None else pending_max
                 
             
-            predicates.extend( [ ClientSearch.Predicate( predicate_type ) for predicate_type in [ HC.PREDICATE_TYPE_SYSTEM_SIMILAR_TO, HC.PREDICATE_TYPE_SYSTEM_FILE_SERVICE, HC.PREDICATE_TYPE_SYSTEM_TAG_AS_NUMBER, HC.PREDICATE_TYPE_SYSTEM_DUPLICATE_RELATIONSHIPS ] ] )
+            tags_and_estimates.append( ( tag, estimate ) )
             
         
-        return predicates
-        
-    
-    def _GetHash( self, hash_id ):
-        
-        result = self._c.execute( 'SELECT hash FROM hashes WHERE hash_id = ?;', ( hash_id, ) ).fetchone()
+        search_plan = []
         
-        if result is None:
-            
-            HydrusData.ShowText( 'Database hash error: hash_id ' + str( hash_id ) + ' was missing! This is a serious error that likely needs a repository reset to fix! Think about contacting hydrus dev!' )
+        if use_tag_posting_lists and len( tags_and_estimates ) > 0:
             
-            return 'aaaaaaaaaaaaaaaa'.decode( 'hex' ) + os.urandom( 16 )
+            estimates = [ estimate for ( tag, estimate ) in tags_and_estimates if estimate is not None ]
+            
+            if len( estimates ) > 0:
+                
+                estimate = min( estimates )
+                
+            else:
+                
+                estimate = None
+                
+            
+            search_plan.append( ( estimate, 'tag_posting_lists', list( tags_to_include ) ) )
+            
+        else:
+            
+            search_plan.extend( ( ( estimate, 'tag', tag ) for ( tag, estimate ) in tags_and_estimates ) )
             
         
-        ( hash, ) = result
+        search_plan.extend( ( ( namespace_estimate, 'namespace', namespace ) for namespace in namespaces_to_include ) )
         
-        return hash
+        for wildcard in wildcards_to_include:
+            
+            ( namespace_wildcard, subtag_wildcard ) = HydrusTags.SplitTag( wildcard )
+            
+            if namespace_wildcard != '' and '*' not in namespace_wildcard:
+                
+                estimate = namespace_estimate
+                
+            else:
+                
+                estimate = num_mappings
+                
+            
+            search_plan.append( ( estimate, 'wildcard', wildcard ) )
+            
         
-    
-    def _GetHashes( self, hash_ids ):
+        if len( files_info_predicates ) > 0:
+            
+            search_plan.append( ( num_files, 'files_info', list( files_info_predicates ) ) )
+            
         
-        return [ hash for ( hash, ) in self._c.execute( 'SELECT hash FROM hashes WHERE hash_id IN ' + HydrusData.SplayListForDB( hash_ids ) + ';' ) ]
+        def sort_key( step ):
+            
+            ( estimate, step_type, step_value ) = step
+            
+            if estimate is None:
+                
+                return float( 'inf' )
+                
+            
+            return estimate
+            
+        
+        # sort is stable, so steps we could not estimate stay in the old tags, namespaces, wildcards, file info order
+        
+        search_plan.sort( key = sort_key )
+        
+        return search_plan
         
     
-    def _GetHashId( self, hash ):
+    def _GetFileSystemPredicates( self, service_key ):
         
-        result = self._c.execute( 'SELECT hash_id FROM hashes WHERE hash = ?;', ( sqlite3.Binary( hash ), ) ).fetchone()
+        service_id = self._GetServiceId( service_key )
         
-        if result is None:
+        service = self._GetService( service_id )
+        
+        service_type = service.GetServiceType()
+        
+        have_ratings = len( self._GetServiceIds( HC.RATINGS_SERVICES ) ) > 0
+        
+        predicates = []
+        
+        if service_type in ( HC.COMBINED_FILE, HC.COMBINED_TAG ):
             
-            self._c.execute( 'INSERT INTO hashes ( hash ) VALUES ( ? );', ( sqlite3.Binary( hash ), ) )
+            predicates.extend( [ ClientSearch.Predicate( predicate_type, None ) for predicate_type in [ HC.PREDICATE_TYPE_SYSTEM_EVERYTHING, HC.PREDICATE_TYPE_SYSTEM_UNTAGGED, HC.PREDICATE_TYPE_SYSTEM_NUM_TAGS, HC.PREDICATE_TYPE_SYSTEM_LIMIT, HC.PREDICATE_TYPE_SYSTEM_KNOWN_URLS, HC.PREDICATE_TYPE_SYSTEM_HASH, HC.PREDICATE_TYPE_SYSTEM_FILE_SERVICE, HC.PREDICATE_TYPE_SYSTEM_DUPLICATE_RELATIONSHIPS ] ] )
             
-            hash_id = self._c.lastrowid
+        elif service_type in HC.TAG_SERVICES:
             
-        else:
+            service_info = self._GetServiceInfoSpecific( service_id, service_type, { HC.SERVICE_INFO_NUM_FILES } )
             
-            ( hash_id, ) = result
+            num_everything = service_info[ HC.SERVICE_INFO_NUM_FILES ]
+            
+            predicates.append( ClientSearch.Predicate( HC.PREDICATE_TYPE_SYSTEM_EVERYTHING, min_current_count = num_everything ) )
+            
+            predicates.extend( [ ClientSearch.Predicate( predicate_type, None ) for predicate_type in [ HC.PREDICATE_TYPE_SYSTEM_NUM_TAGS, HC.PREDICATE_TYPE_SYSTEM_LIMIT, HC.PREDICATE_TYPE_SYSTEM_KNOWN_URLS, HC.PREDICATE_TYPE_SYSTEM_HASH ] ] )
+            
+            if have_ratings:
+                
+                predicates.append( ClientSearch.Predicate( HC.PREDICATE_TYPE_SYSTEM_RATING ) )
+                
+            
+            predicates.extend( [ ClientSearch.Predicate( predicate_type, None ) for predicate_type in [ HC.PREDICATE_TYPE_SYSTEM_FILE_SERVICE, HC.PREDICATE_TYPE_SYSTEM_TAG_AS_NUMBER, HC.PREDICATE_TYPE_SYSTEM_DUPLICATE_RELATIONSHIPS ] ] )
+            
+        elif service_type in HC.FILE_SERVICES:
+            
+            service_info = self._GetServiceInfoSpecific( service_id, service_type, { HC.SERVICE_INFO_NUM_VIEWABLE_FILES, HC.SERVICE_INFO_NUM_INBOX } )
+            
+            num_everything = service_info[ HC.SERVICE_INFO_NUM_VIEWABLE_FILES ]
+            num_inbox = service_info[ HC.SERVICE_INFO_NUM_INBOX ]
+            num_archive = num_everything - num_inbox
+            
+            if service_type == HC.FILE_REPOSITORY:
+                
+                ( num_local, ) = self._c.execute( 'SELECT COUNT( * ) FROM current_files AS remote_current_files, current_files ON ( remote_current_files.hash_id = current_files.hash_id ) WHERE remote_current_files.service_id = ? AND current_files.service_id = ?;', ( service_id, self._combined_local_file_service_id ) ).fetchone()
+                
+                num_not_local = num_everything - num_local
+                
+                num_archive = num_local - num_inbox
+                
+            
+            predicates.append( ClientSearch.Predicate( HC.PREDICATE_TYPE_SYSTEM_EVERYTHING, min_current_count = num_everything ) )
+            
+            show_inbox_and_archive = True
+            
+            if self._controller.new_options.GetBoolean( 'filter_inbox_and_archive_predicates' ) and ( num_inbox == 0 or num_archive == 0 ):
+                
+                show_inbox_and_archive = False
+                
+            
+            if show_inbox_and_archive:
+                
+                predicates.append( ClientSearch.Predicate( HC.PREDICATE_TYPE_SYSTEM_INBOX, min_current_count = num_inbox ) )
+                predicates.append( ClientSearch.Predicate( HC.PREDICATE_TYPE_SYSTEM_ARCHIVE, min_current_count = num_archive ) )
+                
+            
+            if service_type == HC.FILE_REPOSITORY:
+                
+                predicates.append( ClientSearch.Predicate( HC.PREDICATE_TYPE_SYSTEM_LOCAL, min_current_count = num_local ) )
+                predicates.append( ClientSearch.Predicate( HC.PREDICATE_TYPE_SYSTEM_NOT_LOCAL, min_current_count = num_not_local ) )
+                
+            
+            predicates.extend( [ ClientSearch.Predicate( predicate_type ) for predicate_type in [ HC.PREDICATE_TYPE_SYSTEM_UNTAGGED, HC.PREDICATE_TYPE_SYSTEM_NUM_TAGS, HC.PREDICATE_TYPE_SYSTEM_LIMIT, HC.PREDICATE_TYPE_SYSTEM_SIZE, HC.PREDICATE_TYPE_SYSTEM_AGE, HC.PREDICATE_TYPE_SYSTEM_KNOWN_URLS, HC.PREDICATE_TYPE_SYSTEM_HASH, HC.PREDICATE_TYPE_SYSTEM_DIMENSIONS, HC.PREDICATE_TYPE_SYSTEM_DURATION, HC.PREDICATE_TYPE_SYSTEM_NUM_WORDS, HC.PREDICATE_TYPE_SYSTEM_MIME ] ] )
+            
+            if have_ratings:
+                
+                predicates.append( ClientSearch.Predicate( HC.PREDICATE_TYPE_SYSTEM_RATING ) )
+                
+            
+            predicates.extend( [ ClientSearch.Predicate( predicate_type ) for predicate_type in [ HC.PREDICATE_TYPE_SYSTEM_SIMILAR_TO, HC.PREDICATE_TYPE_SYSTEM_FILE_SERVICE, HC.PREDICATE_TYPE_SYSTEM_TAG_AS_NUMBER, HC.PREDICATE_TYPE_SYSTEM_DUPLICATE_RELATIONSHIPS ] ] )
             
         
-        return hash_id
+        return predicates
         
     
-    def _GetHashIds( self, hashes ):
+    def _GetHash( self, hash_id ):
         
-        hash_ids = set()
-        hashes_not_in_db = set()
+        result = self._c.execute( 'SELECT hash FROM hashes WHERE hash_id = ?;', ( hash_id, ) ).fetchone()
         
-        for hash in hashes:
+        if result is None:
+            
+            HydrusData.ShowText( 'Database hash error: hash_id ' + str( hash_id ) + ' was missing! This is a serious error that likely needs a repository reset to fix! Think about contacting hydrus dev!' )
+            
+            return 'aaaaaaaaaaaaaaaa'.decode( 'hex' ) + os.urandom( 16 )
+            
+        
+        ( hash, ) = result
+        
+        return hash
+        
+    
+    def _GetHashes( self, hash_ids ):
+        
+        return [ hash for ( hash, ) in self._c.execute( 'SELECT hash FROM hashes WHERE hash_id IN ' + HydrusData.SplayListForDB( hash_ids ) + ';' ) ]
+        
+    
+    def _GetHashesToHashIds( self, hashes ):
+        
+        hashes = { hash for hash in hashes if hash is not None }
+        
+        ( hashes_to_hash_ids, uncached_hashes ) = self._hash_id_cache.GetIds( hashes )
+        
+        if len( uncached_hashes ) < BULK_ID_LOOKUP_THRESHOLD:
             
-            if hash is None:
+            for hash in uncached_hashes:
                 
-                continue
+                hashes_to_hash_ids[ hash ] = self._GetHashId( hash )
                 
             
-            result = self._c.execute( 'SELECT hash_id FROM hashes WHERE hash = ?;', ( sqlite3.Binary( hash ), ) ).fetchone()
+        else:
             
-            if result is None:
+            with HydrusDB.TemporaryBlobTable( self._c, uncached_hashes, 'hash' ) as temp_table_name:
                 
-                hashes_not_in_db.add( hash )
+                select = 'SELECT hash, hash_id FROM ' + temp_table_name + ' CROSS JOIN hashes USING ( hash );'
                 
-            else:
+                uncached_hashes_to_hash_ids = dict( self._c.execute( select ) )
                 
-                ( hash_id, ) = result
-                
-                hash_ids.add( hash_id )
+                if len( uncached_hashes_to_hash_ids ) < len( uncached_hashes ):
+                    
+                    self._c.execute( 'INSERT INTO hashes ( hash ) SELECT hash FROM ' + temp_table_name + ' AS temp_hashes WHERE NOT EXISTS ( SELECT 1 FROM hashes WHERE hashes.hash = temp_hashes.hash );' )
+                    
+                    uncached_hashes_to_hash_ids = dict( self._c.execute( select ) )
+                    
                 
             
+            self._hash_id_cache.AddIds( uncached_hashes_to_hash_ids )
+            
+            hashes_to_hash_ids.update( uncached_hashes_to_hash_ids )
+            
+        
+        return hashes_to_hash_ids
+        
+    
+    def _GetHashId( self, hash ):
         
-        if len( hashes_not_in_db ) > 0:
+        hash_id = self._hash_id_cache.GetId( hash )
+        
+        if hash_id is not None:
             
-            self._c.executemany( 'INSERT INTO hashes ( hash ) VALUES ( ? );', ( ( sqlite3.Binary( hash ), ) for hash in hashes_not_in_db ) )
+            return hash_id
             
-            for hash in hashes_not_in_db:
-                
-                ( hash_id, ) = self._c.execute( 'SELECT hash_id FROM hashes WHERE hash = ?;', ( sqlite3.Binary( hash ), ) ).fetchone()
-                
-                hash_ids.add( hash_id )
-                
+        
+        result = self._c.execute( 'SELECT hash_id FROM hashes WHERE hash = ?;', ( sqlite3.Binary( hash ), ) ).fetchone()
+        
+        if result is None:
+            
+            self._c.execute( 'INSERT INTO hashes ( hash ) VALUES ( ? );', ( sqlite3.Binary( hash ), ) )
+            
+            hash_id = self._c.lastrowid
+            
+        else:
+            
+            ( hash_id, ) = result
             
         
-        return hash_ids
+        self._hash_id_cache.AddIds( { hash : hash_id } )
+        
+        return hash_id
         
     
-    def _GetHashIdsFromNamespace( self, file_service_key, tag_service_key, namespace, include_current_tags, include_pending_tags ):
+    def _GetHashIds( self, hashes ):
+        
+        return set( self._GetHashesToHashIds( hashes ).values() )
+        
+    
+    def _GetHashIdsFromNamespace( self, file_service_key, tag_service_key, namespace, include_current_tags, include_pending_tags, allowed_hash_ids = None ):
         
         if not self._NamespaceExists( namespace ):
             
@@ -4174,28 +4574,22 @@ class DB( HydrusDB.HydrusDB ):
                 
             
         
-        hash_ids = set()
+        selects = []
         
         if include_current_tags:
             
-            for current_select in current_selects:
-                
-                hash_ids.update( ( id for ( id, ) in self._c.execute( current_select ) ) )
-                
+            selects.extend( current_selects )
             
         
         if include_pending_tags:
             
-            for pending_select in pending_selects:
-                
-                hash_ids.update( ( id for ( id, ) in self._c.execute( pending_select ) ) )
-                
+            selects.extend( pending_selects )
             
         
-        return hash_ids
+        return self._GetHashIdsFromSelects( selects, allowed_hash_ids = allowed_hash_ids )
         
     
-    def _GetHashIdsFromNamespaceIdsSubtagIds( self, file_service_key, tag_service_key, namespace_ids, subtag_ids, include_current_tags, include_pending_tags ):
+    def _GetHashIdsFromNamespaceIdsSubtagIds( self, file_service_key, tag_service_key, namespace_ids, subtag_ids, include_current_tags, include_pending_tags, allowed_hash_ids = None ):
         
         file_service_id = self._GetServiceId( file_service_key )
         
@@ -4229,25 +4623,19 @@ class DB( HydrusDB.HydrusDB ):
                 
             
         
-        hash_ids = set()
+        selects = []
         
         if include_current_tags:
             
-            for current_select in current_selects:
-                
-                hash_ids.update( ( id for ( id, ) in self._c.execute( current_select ) ) )
-                
+            selects.extend( current_selects )
             
         
         if include_pending_tags:
             
-            for pending_select in pending_selects:
-                
-                hash_ids.update( ( id for ( id, ) in self._c.execute( pending_select ) ) )
-                
+            selects.extend( pending_selects )
             
         
-        return hash_ids
+        return self._GetHashIdsFromSelects( selects, allowed_hash_ids = allowed_hash_ids )
         
     
     def _GetHashIdsFromQuery( self, search_context, job_key = None ):
@@ -4261,6 +4649,113 @@ class DB( HydrusDB.HydrusDB ):
         
         system_predicates = search_context.GetSystemPredicates()
         
+        self._file_search_cache.SetMaxSize( self._controller.new_options.GetInteger( 'file_search_cache_size_mb' ) * 1048576 )
+        
+        # relative ages and duplicate and similar files status can change without a content update, so these searches always run fresh
+        
+        uncacheable_predicate_types = ( HC.PREDICATE_TYPE_SYSTEM_AGE, HC.PREDICATE_TYPE_SYSTEM_SIMILAR_TO, HC.PREDICATE_TYPE_SYSTEM_DUPLICATE_RELATIONSHIPS )
+        
+        can_cache = self._file_search_cache.IsEnabled() and True not in ( predicate.GetType() in uncacheable_predicate_types for predicate in search_context.GetPredicates() )
+        
+        cached_posting_list = None
+        narrowed = False
+        
+        if can_cache:
+            
+            cache_key = search_context.GetCacheKey()
+            
+            # the writer invalidates the cache before it commits, so a read connection only touches it while its snapshot matches what the cache has seen
+            
+            with self._read_cache_lock:
+                
+                if self._ReadCachesAreCurrent():
+                    
+                    # grab this before we read anything, so a change made while we search will stop us storing a stale result
+                    
+                    generation = self._file_search_cache.GetGeneration()
+                    
+                    ( cached_posting_list, narrowed ) = self._file_search_cache.GetResult( cache_key )
+                    
+                else:
+                    
+                    can_cache = False
+                    
+                
+            
+        
+        if cached_posting_list is not None and not narrowed:
+            
+            query_hash_ids = set( cached_posting_list.tolist() )
+            
+        else:
+            
+            if cached_posting_list is None:
+                
+                initial_hash_ids = None
+                
+            else:
+                
+                initial_hash_ids = set( cached_posting_list.tolist() )
+                
+            
+            query_hash_ids = self._GetHashIdsFromQueryUncached( search_context, job_key, initial_hash_ids = initial_hash_ids )
+            
+            if job_key.IsCancelled():
+                
+                return set()
+                
+            
+            if can_cache:
+                
+                ( subtags, any_tag, rating_service_keys ) = self._GetFileSearchCacheDependencies( search_context )
+                
+                with self._read_cache_lock:
+                    
+                    if self._ReadCachesAreCurrent():
+                        
+                        self._file_search_cache.AddResult( generation, cache_key, query_hash_ids, subtags, any_tag, rating_service_keys )
+                        
+                    
+                
+                
+            
+        
+        if HG.db_report_mode and can_cache:
+            
+            if cached_posting_list is None:
+                
+                result_text = 'miss'
+                
+            elif narrowed:
+                
+                result_text = 'narrowed a cached search'
+                
+            else:
+                
+                result_text = 'hit'
+                
+            
+            HydrusData.ShowText( 'File search cache ' + result_text + ': ' + self._file_search_cache.GetReport() )
+            
+        
+        limit = system_predicates.GetLimit()
+        
+        if limit is not None and limit <= len( query_hash_ids ):
+            
+            query_hash_ids = random.sample( query_hash_ids, limit )
+            
+        else:
+            
+            query_hash_ids = list( query_hash_ids )
+            
+        
+        return query_hash_ids
+        
+    
+    def _GetHashIdsFromQueryUncached( self, search_context, job_key, initial_hash_ids = None ):
+        
+        system_predicates = search_context.GetSystemPredicates()
+        
         file_service_key = search_context.GetFileServiceKey()
         tag_service_key = search_context.GetTagServiceKey()
         
@@ -4284,6 +4779,8 @@ class DB( HydrusDB.HydrusDB ):
         include_current_tags = search_context.IncludeCurrentTags()
         include_pending_tags = search_context.IncludePendingTags()
         
+        use_tag_posting_lists = self._controller.new_options.GetBoolean( 'use_resident_tag_posting_lists' )
+        
         #
         
         files_info_predicates = []
@@ -4345,7 +4842,9 @@ class DB( HydrusDB.HydrusDB ):
                 
             
         
-        query_hash_ids = None
+        # a cached search with fewer predicates may already have narrowed things down for us
+        
+        query_hash_ids = initial_hash_ids
         
         if system_predicates.HasSimilarTo():
             
@@ -4451,55 +4950,121 @@ class DB( HydrusDB.HydrusDB ):
         
         if len( tags_to_include ) > 0 or len( namespaces_to_include ) > 0 or len( wildcards_to_include ) > 0:
             
-            def sort_longest_first_key( s ):
-                
-                return -len( s )
-                
-            
-            tags_to_include = list( tags_to_include )
+            search_plan = self._GetFileSearchPlan( file_service_key, tag_service_key, tags_to_include, namespaces_to_include, wildcards_to_include, files_info_predicates, include_current_tags, include_pending_tags, use_tag_posting_lists )
             
-            tags_to_include.sort( key = sort_longest_first_key )
+            plan_report_lines = []
             
-            for tag in tags_to_include:
+            for ( estimate, step_type, step_value ) in search_plan:
                 
-                tag_query_hash_ids = self._GetHashIdsFromTag( file_service_key, tag_service_key, tag, include_current_tags, include_pending_tags, allowed_hash_ids = query_hash_ids )
+                # once we have fewer candidates than a step is expected to match, it is cheaper to check just those candidates than to fetch the step's whole result
                 
-                query_hash_ids = update_qhi( query_hash_ids, tag_query_hash_ids )
+                if query_hash_ids is not None and ( estimate is None or len( query_hash_ids ) < estimate ):
+                    
+                    allowed_hash_ids = query_hash_ids
+                    
+                    num_candidates = len( allowed_hash_ids )
+                    
+                else:
+                    
+                    allowed_hash_ids = None
+                    
                 
-                if query_hash_ids == set():
+                if step_type == 'tag':
+                    
+                    step_hash_ids = self._GetHashIdsFromTag( file_service_key, tag_service_key, step_value, include_current_tags, include_pending_tags, allowed_hash_ids = allowed_hash_ids )
                     
-                    return query_hash_ids
+                    step_description = 'tag "' + step_value + '"'
+                    
+                elif step_type == 'tag_posting_lists':
+                    
+                    # the posting lists are intersected in numpy, and we only make python ints for what survives
+                    
+                    tag_posting_lists = [ self._GetHashIdsPostingListFromTag( file_service_key, tag_service_key, tag, include_current_tags, include_pending_tags ) for tag in step_value ]
+                    
+                    step_hash_ids = ClientSearch.IntersectPostingLists( tag_posting_lists ).tolist()
+                    
+                    step_description = 'tags "' + '", "'.join( step_value ) + '" from memory'
+                    
+                elif step_type == 'namespace':
+                    
+                    step_hash_ids = self._GetHashIdsFromNamespace( file_service_key, tag_service_key, step_value, include_current_tags, include_pending_tags, allowed_hash_ids = allowed_hash_ids )
+                    
+                    step_description = 'namespace "' + step_value + '"'
+                    
+                elif step_type == 'wildcard':
+                    
+                    step_hash_ids = self._GetHashIdsFromWildcard( file_service_key, tag_service_key, step_value, include_current_tags, include_pending_tags, allowed_hash_ids = allowed_hash_ids )
+                    
+                    step_description = 'wildcard "' + step_value + '"'
+                    
+                elif step_type == 'files_info':
+                    
+                    predicates = list( step_value )
+                    
+                    if file_service_key == CC.COMBINED_FILE_SERVICE_KEY:
+                        
+                        table_join = 'files_info'
+                        
+                    else:
+                        
+                        table_join = 'current_files NATURAL JOIN files_info'
+                        
+                        predicates.insert( 0, 'service_id = ' + str( file_service_id ) )
+                        
+                    
+                    if allowed_hash_ids is None:
+                        
+                        step_hash_ids = self._STL( self._c.execute( 'SELECT hash_id FROM ' + table_join + ' WHERE ' + ' AND '.join( predicates ) + ';' ) )
+                        
+                    else:
+                        
+                        predicates.append( 'hash_id IN %s' )
+                        
+                        step_hash_ids = self._STL( self._SelectFromList( 'SELECT hash_id FROM ' + table_join + ' WHERE ' + ' AND '.join( predicates ) + ';', allowed_hash_ids ) )
+                        
+                    
+                    step_description = 'file info ' + ' AND '.join( step_value )
                     
                 
-            
-            if len( namespaces_to_include ) > 0:
+                query_hash_ids = update_qhi( query_hash_ids, step_hash_ids )
                 
-                namespace_query_hash_ids = HydrusData.IntelligentMassIntersect( ( self._GetHashIdsFromNamespace( file_service_key, tag_service_key, namespace, include_current_tags, include_pending_tags ) for namespace in namespaces_to_include ) )
+                if HG.db_report_mode:
+                    
+                    if estimate is None:
+                        
+                        estimate_text = 'unknown'
+                        
+                    else:
+                        
+                        estimate_text = HydrusData.ConvertIntToPrettyString( estimate )
+                        
+                    
+                    if allowed_hash_ids is None:
+                        
+                        method_text = 'fetched in full'
+                        
+                    else:
+                        
+                        method_text = 'checked against ' + HydrusData.ConvertIntToPrettyString( num_candidates ) + ' candidates'
+                        
+                    
+                    plan_report_lines.append( step_description + ': estimated ' + estimate_text + ' files, ' + method_text + ', ' + HydrusData.ConvertIntToPrettyString( len( query_hash_ids ) ) + ' files left' )
+                    
                 
-                query_hash_ids = update_qhi( query_hash_ids, namespace_query_hash_ids )
+                if len( query_hash_ids ) == 0:
+                    
+                    break
+                    
                 
             
-            if len( wildcards_to_include ) > 0:
-                
-                wildcard_query_hash_ids = HydrusData.IntelligentMassIntersect( ( self._GetHashIdsFromWildcard( file_service_key, tag_service_key, wildcard, include_current_tags, include_pending_tags ) for wildcard in wildcards_to_include ) )
+            if HG.db_report_mode:
                 
-                query_hash_ids = update_qhi( query_hash_ids, wildcard_query_hash_ids )
+                HydrusData.ShowText( 'File search plan:' + os.linesep + os.linesep.join( plan_report_lines ) )
                 
             
-            if len( files_info_predicates ) > 0:
+            if query_hash_ids == set():
                 
-                files_info_predicates.append( 'hash_id IN %s' )
-                
-                if file_service_key == CC.COMBINED_FILE_SERVICE_KEY:
-                    
-                    query_hash_ids.intersection_update( self._STI( self._SelectFromList( 'SELECT hash_id FROM files_info WHERE ' + ' AND '.join( files_info_predicates ) + ';', query_hash_ids ) ) )
-                    
-                else:
-                    
-                    files_info_predicates.insert( 0, 'service_id = ' + str( file_service_id ) )
-                    
-                    query_hash_ids.intersection_update( self._STI( self._SelectFromList( 'SELECT hash_id FROM current_files NATURAL JOIN files_info WHERE ' + ' AND '.join( files_info_predicates ) + ';', query_hash_ids ) ) )
-                    
+                return query_hash_ids
                 
             
         else:
@@ -4569,7 +5134,9 @@ class DB( HydrusDB.HydrusDB ):
                     
                     files_info_predicates.insert( 0, 'service_id = ' + str( file_service_id ) )
                     
-                    domain_query_hash_ids = self._STS( self._c.execute( 'SELECT hash_id FROM current_files NATURAL JOIN files_info WHERE ' + ' AND '.join( files_info_predicates ) + ';' ) )
+                    select = 'SELECT hash_id FROM current_files NATURAL JOIN files_info WHERE ' + ' AND '.join( files_info_predicates ) + ';'
+                    
+                    domain_query_hash_ids = self._GetHashIdsFromSelects( [ select ], allowed_hash_ids = query_hash_ids )
                     
                 
             
@@ -4596,6 +5163,17 @@ class DB( HydrusDB.HydrusDB ):
         
         exclude_query_hash_ids = set()
         
+        if use_tag_posting_lists and len( tags_to_exclude ) > 0:
+            
+            exclude_posting_list = ClientSearch.UnionPostingLists( [ self._GetHashIdsPostingListFromTag( file_service_key, tag_service_key, tag, include_current_tags, include_pending_tags ) for tag in tags_to_exclude ] )
+            
+            query_posting_list = ClientSearch.ConvertHashIdsToPostingList( query_hash_ids )
+            
+            exclude_query_hash_ids.update( ClientSearch.IntersectPostingLists( ( query_posting_list, exclude_posting_list ) ).tolist() )
+            
+            tags_to_exclude = []
+            
+        
         for tag in tags_to_exclude:
             
             exclude_query_hash_ids.update( self._GetHashIdsFromTag( file_service_key, tag_service_key, tag, include_current_tags, include_pending_tags, allowed_hash_ids = query_hash_ids ) )
@@ -4893,23 +5471,34 @@ class DB( HydrusDB.HydrusDB ):
             return set()
             
         
-        #
+        return query_hash_ids
         
-        limit = system_predicates.GetLimit()
+    
+    def _GetHashIdsFromSelects( self, selects, allowed_hash_ids = None ):
         
-        if limit is not None and limit <= len( query_hash_ids ):
+        hash_ids = set()
+        
+        if allowed_hash_ids is None:
             
-            query_hash_ids = random.sample( query_hash_ids, limit )
+            for select in selects:
+                
+                hash_ids.update( self._STI( self._c.execute( select ) ) )
+                
             
         else:
             
-            query_hash_ids = list( query_hash_ids )
+            selects = [ select.replace( ';', ' AND hash_id IN %s;' ) for select in selects ]
+            
+            for select in selects:
+                
+                hash_ids.update( self._STI( self._SelectFromList( select, allowed_hash_ids ) ) )
+                
             
         
-        return query_hash_ids
+        return hash_ids
         
     
-    def _GetHashIdsFromSubtagIds( self, file_service_key, tag_service_key, subtag_ids, include_current_tags, include_pending_tags ):
+    def _GetHashIdsFromSubtagIds( self, file_service_key, tag_service_key, subtag_ids, include_current_tags, include_pending_tags, allowed_hash_ids = None ):
         
         file_service_id = self._GetServiceId( file_service_key )
         
@@ -4943,25 +5532,19 @@ class DB( HydrusDB.HydrusDB ):
                 
             
         
-        hash_ids = set()
+        selects = []
         
         if include_current_tags:
             
-            for current_select in current_selects:
-                
-                hash_ids.update( ( id for ( id, ) in self._c.execute( current_select ) ) )
-                
+            selects.extend( current_selects )
             
         
         if include_pending_tags:
             
-            for pending_select in pending_selects:
-                
-                hash_ids.update( ( id for ( id, ) in self._c.execute( pending_select ) ) )
-                
+            selects.extend( pending_selects )
             
         
-        return hash_ids
+        return self._GetHashIdsFromSelects( selects, allowed_hash_ids = allowed_hash_ids )
         
     
     def _GetHashIdsFromTag( self, file_service_key, tag_service_key, tag, include_current_tags, include_pending_tags, allowed_hash_ids = None ):
@@ -5045,8 +5628,6 @@ class DB( HydrusDB.HydrusDB ):
                 
             
         
-        hash_ids = set()
-        
         selects = []
         
         if include_current_tags:
@@ -5059,24 +5640,7 @@ class DB( HydrusDB.HydrusDB ):
             selects.extend( pending_selects )
             
         
-        if allowed_hash_ids is None:
-            
-            for select in selects:
-                
-                hash_ids.update( self._STI( self._c.execute( select ) ) )
-                
-            
-        else:
-            
-            selects = [ select.replace( ';', ' AND hash_id IN %s;' ) for select in selects ]
-            
-            for select in selects:
-                
-                hash_ids.update( self._STI( self._SelectFromList( select, allowed_hash_ids ) ) )
-                
-            
-        
-        return hash_ids
+        return self._GetHashIdsFromSelects( selects, allowed_hash_ids = allowed_hash_ids )
         
     
     def _GetHashIdsFromURLRule( self, rule_type, rule, hash_ids = None ):
@@ -5113,7 +5677,7 @@ class DB( HydrusDB.HydrusDB ):
         return result_hash_ids
         
     
-    def _GetHashIdsFromWildcard( self, file_service_key, tag_service_key, wildcard, include_current_tags, include_pending_tags ):
+    def _GetHashIdsFromWildcard( self, file_service_key, tag_service_key, wildcard, include_current_tags, include_pending_tags, allowed_hash_ids = None ):
         
         def GetNamespaceIdsFromWildcard( w ):
             
@@ -5169,13 +5733,93 @@ class DB( HydrusDB.HydrusDB ):
             
             possible_namespace_ids = GetNamespaceIdsFromWildcard( namespace_wildcard )
             
-            return self._GetHashIdsFromNamespaceIdsSubtagIds( file_service_key, tag_service_key, possible_namespace_ids, possible_subtag_ids, include_current_tags, include_pending_tags )
+            return self._GetHashIdsFromNamespaceIdsSubtagIds( file_service_key, tag_service_key, possible_namespace_ids, possible_subtag_ids, include_current_tags, include_pending_tags, allowed_hash_ids = allowed_hash_ids )
             
         else:
             
-            return self._GetHashIdsFromSubtagIds( file_service_key, tag_service_key, possible_subtag_ids, include_current_tags, include_pending_tags )
+            return self._GetHashIdsFromSubtagIds( file_service_key, tag_service_key, possible_subtag_ids, include_current_tags, include_pending_tags, allowed_hash_ids = allowed_hash_ids )
+            
+        
+    
+    def _GetHashIdsPostingListFromTag( self, file_service_key, tag_service_key, tag, include_current_tags, include_pending_tags ):
+        
+        file_service_id = self._GetServiceId( file_service_key )
+        
+        if tag_service_key == CC.COMBINED_TAG_SERVICE_KEY:
+            
+            search_tag_service_ids = self._GetServiceIds( HC.TAG_SERVICES )
+            
+        else:
+            
+            search_tag_service_ids = [ self._GetServiceId( tag_service_key ) ]
+            
+        
+        tag_ids = self._GetTagIdsForSearch( tag_service_key, tag )
+        
+        statuses = []
+        
+        if include_current_tags:
+            
+            statuses.append( HC.CONTENT_STATUS_CURRENT )
+            
+        
+        if include_pending_tags:
+            
+            statuses.append( HC.CONTENT_STATUS_PENDING )
             
         
+        posting_lists = []
+        
+        for search_tag_service_id in search_tag_service_ids:
+            
+            if file_service_key == CC.COMBINED_FILE_SERVICE_KEY:
+                
+                ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( search_tag_service_id )
+                
+            else:
+                
+                ( cache_files_table_name, current_mappings_table_name, cache_deleted_mappings_table_name, pending_mappings_table_name, ac_cache_table_name ) = GenerateSpecificMappingsCacheTableNames( file_service_id, search_tag_service_id )
+                
+            
+            statuses_to_table_names = { HC.CONTENT_STATUS_CURRENT : current_mappings_table_name, HC.CONTENT_STATUS_PENDING : pending_mappings_table_name }
+            
+            for tag_id in tag_ids:
+                
+                for status in statuses:
+                    
+                    key = ( file_service_id, search_tag_service_id, tag_id, status )
+                    
+                    # a read connection's snapshot may be behind the lists, or ahead of them while the writer is busy, so it only uses or installs them when they match
+                    
+                    with self._read_cache_lock:
+                        
+                        posting_list = self._tag_posting_lists.GetPostingList( key ) if self._ReadCachesAreCurrent() else None
+                        
+                    
+                    if posting_list is None:
+                        
+                        hash_ids = self._STI( self._c.execute( 'SELECT hash_id FROM ' + statuses_to_table_names[ status ] + ' WHERE tag_id = ?;', ( tag_id, ) ) )
+                        
+                        posting_list = ClientSearch.ConvertHashIdsToPostingList( hash_ids )
+                        
+                        with self._read_cache_lock:
+                            
+                            if self._ReadCachesAreCurrent():
+                                
+                                self._tag_posting_lists.SetMaxSize( self._controller.new_options.GetInteger( 'tag_posting_lists_cache_size_mb' ) * 1048576 )
+                                
+                                self._tag_posting_lists.SetPostingList( key, posting_list )
+                                
+                            
+                        
+                    
+                    posting_lists.append( posting_list )
+                    
+                
+            
+        
+        return ClientSearch.UnionPostingLists( posting_lists )
+        
     
     def _GetHashIdsTagCounts( self, tag_service_key, include_current, include_pending, hash_ids = None ):
         
@@ -5320,17 +5964,23 @@ class DB( HydrusDB.HydrusDB ):
     
     def _GetHashIdsToHashes( self, hash_ids ):
         
+        ( results, uncached_hash_ids ) = self._hash_id_cache.GetKeys( hash_ids )
+        
         # this is actually a bit faster than saying "hash_id IN ( bigass_list )"
         
-        results = {}
+        uncached_hashes_to_hash_ids = {}
         
-        for hash_id in hash_ids:
+        for hash_id in uncached_hash_ids:
             
             ( hash, ) = self._c.execute( 'SELECT hash FROM hashes WHERE hash_id = ?;', ( hash_id, ) ).fetchone()
             
-            results[ hash_id ] = hash
+            uncached_hashes_to_hash_ids[ hash ] = hash_id
             
         
+        self._hash_id_cache.AddIds( uncached_hashes_to_hash_ids )
+        
+        results.update( { hash_id : hash for ( hash, hash_id ) in uncached_hashes_to_hash_ids.items() } )
+        
         return results
         
     
@@ -5461,9 +6111,7 @@ class DB( HydrusDB.HydrusDB ):
             
             ( version, dump ) = result
             
-            serialisable_info = json.loads( dump )
-            
-            return HydrusSerialisable.CreateFromSerialisableTuple( ( dump_type, version, serialisable_info ) )
+            return HydrusSerialisable.CreateFromSerialisableInfoDump( ( dump_type, version ), dump )
             
         
     
@@ -5477,22 +6125,39 @@ class DB( HydrusDB.HydrusDB ):
             
             for ( dump_name, version, dump ) in results:
                 
-                serialisable_info = json.loads( dump )
-                
-                objs.append( HydrusSerialisable.CreateFromSerialisableTuple( ( dump_type, dump_name, version, serialisable_info ) ) )
+                objs.append( HydrusSerialisable.CreateFromSerialisableInfoDump( ( dump_type, dump_name, version ), dump ) )
                 
             
-            return objs
+            return objs
+            
+        else:
+            
+            ( version, dump ) = self._c.execute( 'SELECT version, dump FROM json_dumps_named WHERE dump_type = ? AND dump_name = ?;', ( dump_type, dump_name ) ).fetchone()
+            
+            return HydrusSerialisable.CreateFromSerialisableInfoDump( ( dump_type, dump_name, version ), dump )
+            
+        
+    
+    def _GetFileIntegrityInfo( self, allowed_mimes = None, after_hash_id = None ):
+        
+        if after_hash_id is None:
+            
+            after_hash_id = -1
             
-        else:
+        
+        if allowed_mimes is None:
             
-            ( version, dump ) = self._c.execute( 'SELECT version, dump FROM json_dumps_named WHERE dump_type = ? AND dump_name = ?;', ( dump_type, dump_name ) ).fetchone()
+            select = 'SELECT hash_id, hash, mime FROM current_files NATURAL JOIN files_info NATURAL JOIN hashes WHERE service_id = ? AND hash_id > ? ORDER BY hash_id ASC;'
             
-            serialisable_info = json.loads( dump )
+        else:
             
-            return HydrusSerialisable.CreateFromSerialisableTuple( ( dump_type, dump_name, version, serialisable_info ) )
+            select = 'SELECT hash_id, hash, mime FROM current_files NATURAL JOIN files_info NATURAL JOIN hashes WHERE service_id = ? AND hash_id > ? AND mime IN ' + HydrusData.SplayListForDB( allowed_mimes ) + ' ORDER BY hash_id ASC;'
             
         
+        info = self._c.execute( select, ( self._combined_local_file_service_id, after_hash_id ) ).fetchall()
+        
+        return info
+        
     
     def _GetJSONDumpNames( self, dump_type ):
         
@@ -5705,6 +6370,13 @@ class DB( HydrusDB.HydrusDB ):
             return self._null_namespace_id
             
         
+        namespace_id = self._namespace_id_cache.GetId( namespace )
+        
+        if namespace_id is not None:
+            
+            return namespace_id
+            
+        
         result = self._c.execute( 'SELECT namespace_id FROM namespaces WHERE namespace = ?;', ( namespace, ) ).fetchone()
         
         if result is None:
@@ -5718,6 +6390,8 @@ class DB( HydrusDB.HydrusDB ):
             ( namespace_id, ) = result
             
         
+        self._namespace_id_cache.AddIds( { namespace : namespace_id } )
+        
         return namespace_id
         
     
@@ -5749,6 +6423,13 @@ class DB( HydrusDB.HydrusDB ):
         return pendings
         
     
+    def _GetNumReadConnections( self ):
+        
+        new_options = self._GetJSONDump( HydrusSerialisable.SERIALISABLE_TYPE_CLIENT_OPTIONS )
+        
+        return new_options.GetInteger( 'db_read_connections' )
+        
+    
     def _GetOptions( self ):
         
         result = self._c.execute( 'SELECT options FROM options;' ).fetchone()
@@ -5774,6 +6455,29 @@ class DB( HydrusDB.HydrusDB ):
         return options
         
     
+    def _GetOrphanHashes( self, test_type, possible_hashes ):
+        
+        possible_hashes = set( possible_hashes )
+        
+        if test_type == 'file':
+            
+            predicate_string = 'service_id = ' + str( self._combined_local_file_service_id ) + ' AND '
+            
+        elif test_type == 'thumbnail':
+            
+            predicate_string = ''
+            
+        
+        with HydrusDB.TemporaryBlobTable( self._c, possible_hashes, 'hash' ) as temp_table_name:
+            
+            select = 'SELECT hash FROM ' + temp_table_name + ' NATURAL JOIN hashes WHERE EXISTS ( SELECT 1 FROM current_files WHERE ' + predicate_string + 'current_files.hash_id = hashes.hash_id );'
+            
+            non_orphan_hashes = { hash for ( hash, ) in self._c.execute( select ) }
+            
+        
+        return possible_hashes.difference( non_orphan_hashes )
+        
+    
     def _GetPending( self, service_key ):
         
         service_id = self._GetServiceId( service_key )
@@ -5984,77 +6688,90 @@ class DB( HydrusDB.HydrusDB ):
         
         siblings_manager = HG.client_controller.GetManager( 'tag_siblings' )
         
-        stop_time_for_finding_files = HydrusData.GetNowPrecise() + ( max_time_to_take / 2 )
-        stop_time_for_finding_tags = HydrusData.GetNowPrecise() + ( max_time_to_take / 2 )
-        
         search_tags = siblings_manager.CollapseTags( service_key, search_tags )
         
         service_id = self._GetServiceId( service_key )
         
-        skip_hash_id = self._GetHashId( skip_hash )
-        
         ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateMappingsTableNames( service_id )
         
-        tag_ids = [ self._GetTagId( tag ) for tag in search_tags ]
+        # this can run on a read connection, so don't create any tags or hashes
+        
+        tag_ids = [ self._GetTagId( tag ) for tag in search_tags if self._TagExists( tag ) ]
+        
+        if len( tag_ids ) == 0:
+            
+            return []
+            
+        
+        if self._HashExists( skip_hash ):
+            
+            skip_hash_id = self._GetHashId( skip_hash )
+            
+        else:
+            
+            skip_hash_id = None
+            
+        
+        # the rarest search tags say the most about this file, so we fill our sample from them first
+        # a longer time budget buys a bigger sample, and the sample is always the same for the same tags, so repeat searches agree
         
-        random.shuffle( tag_ids )
+        tag_ids_to_counts = { tag_id : current_count for ( tag_id, current_count, pending_count ) in self._CacheCombinedFilesMappingsGetAutocompleteCounts( service_id, tag_ids ) }
         
-        hash_ids_counter = collections.Counter()
+        tag_ids.sort( key = lambda tag_id: ( tag_ids_to_counts.get( tag_id, 0 ), tag_id ) )
         
-        query = self._c.execute( 'SELECT hash_id FROM ' + current_mappings_table_name + ' WHERE tag_id IN ' + HydrusData.SplayListForDB( tag_ids ) + ';' )
+        num_files_to_sample = max( 100, int( max_time_to_take * 4000 ) )
         
-        results = query.fetchmany( 100 )
+        sample_hash_ids = set()
         
-        while len( results ) > 0:
+        for tag_id in tag_ids:
             
-            for ( hash_id, ) in results:
-                
-                hash_ids_counter[ hash_id ] += 1
-                
+            num_files_wanted = num_files_to_sample - len( sample_hash_ids )
             
-            if HydrusData.TimeHasPassedPrecise( stop_time_for_finding_files ):
+            if num_files_wanted <= 0:
                 
                 break
                 
             
-            results = query.fetchmany( 100 )
+            sample_hash_ids.update( self._STI( self._c.execute( 'SELECT hash_id FROM ' + current_mappings_table_name + ' WHERE tag_id = ? LIMIT ?;', ( tag_id, num_files_wanted + 1 ) ) ) )
             
         
-        if skip_hash_id in hash_ids_counter:
+        sample_hash_ids.discard( skip_hash_id )
+        
+        if len( sample_hash_ids ) == 0:
             
-            del hash_ids_counter[ skip_hash_id ]
+            return []
             
         
-        #
+        # now fetch all the tags of the whole sample in one go
         
-        if len( hash_ids_counter ) == 0:
+        hash_ids_to_tag_ids = collections.defaultdict( list )
+        
+        with HydrusDB.TemporaryIntegerTable( self._c, sample_hash_ids, 'hash_id' ) as temp_table_name:
             
-            return []
+            for ( hash_id, tag_id ) in self._c.execute( 'SELECT hash_id, tag_id FROM ' + temp_table_name + ' NATURAL JOIN ' + current_mappings_table_name + ';' ):
+                
+                hash_ids_to_tag_ids[ hash_id ].append( tag_id )
+                
             
         
+        search_tag_ids = set( tag_ids )
+        
+        hash_ids_to_num_search_tags = { hash_id : len( search_tag_ids.intersection( file_tag_ids ) ) for ( hash_id, file_tag_ids ) in hash_ids_to_tag_ids.items() }
+        
         # this stuff is often 2, 2, 2, 2, 2, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1.....
         # the 1 stuff often produces large quantities of the same very popular tag, so your search for [ 'eva', 'female' ] will produce 'touhou' because so many 2hu images have 'female'
         # so we want to do a 'soft' intersect, only picking the files that have the greatest number of shared search_tags
         # this filters to only the '2' results, which gives us eva females and their hair colour and a few choice other popular tags for that particular domain
         
-        [ ( gumpf, largest_count ) ] = hash_ids_counter.most_common( 1 )
-        
-        hash_ids = [ hash_id for ( hash_id, count ) in hash_ids_counter.items() if count > largest_count * 0.8 ]
+        largest_count = max( hash_ids_to_num_search_tags.values() )
         
         counter = collections.Counter()
         
-        random.shuffle( hash_ids )
-        
-        for hash_id in hash_ids:
-            
-            for ( tag_id, ) in self._c.execute( 'SELECT tag_id FROM ' + current_mappings_table_name + ' WHERE hash_id = ?;', ( hash_id, ) ):
-                
-                counter[ tag_id ] += 1
-                
+        for ( hash_id, file_tag_ids ) in hash_ids_to_tag_ids.items():
             
-            if HydrusData.TimeHasPassedPrecise( stop_time_for_finding_tags ):
+            if hash_ids_to_num_search_tags[ hash_id ] > largest_count * 0.8:
                 
-                break
+                counter.update( file_tag_ids )
                 
             
         
@@ -6068,7 +6785,9 @@ class DB( HydrusDB.HydrusDB ):
                 
             
         
-        results = counter.most_common( max_results )
+        # break ties on tag_id so the same search always gives the same suggestions
+        
+        results = sorted( counter.items(), key = lambda item: ( - item[1], item[0] ) )[ : max_results ]
         
         tags_to_counts = { self._GetTag( tag_id ) : count for ( tag_id, count ) in results }
         
@@ -6154,13 +6873,21 @@ class DB( HydrusDB.HydrusDB ):
         return needed_hashes
         
     
+    def _GetRepositoryUpdateSidecarPath( self, update_hash ):
+        
+        hash_encoded = update_hash.encode( 'hex' )
+        
+        return os.path.join( self._db_dir, 'client_update_sidecars', hash_encoded[:2], hash_encoded + '.sidecar' )
+        
+    
     def _GetService( self, service_id ):
         
-        if service_id in self._service_cache:
+        with self._read_cache_lock:
             
-            service = self._service_cache[ service_id ]
+            service = self._service_cache.get( service_id, None ) if self._ReadCachesAreCurrent() else None
             
-        else:
+        
+        if service is None:
             
             result = self._c.execute( 'SELECT service_key, service_type, name, dictionary_string FROM services WHERE service_id = ?;', ( service_id, ) ).fetchone()
             
@@ -6175,7 +6902,13 @@ class DB( HydrusDB.HydrusDB ):
             
             service = ClientServices.GenerateService( service_key, service_type, name, dictionary )
             
-            self._service_cache[ service_id ] = service
+            with self._read_cache_lock:
+                
+                if self._ReadCachesAreCurrent():
+                    
+                    self._service_cache[ service_id ] = service
+                    
+                
             
         
         return service
@@ -6423,6 +7156,13 @@ class DB( HydrusDB.HydrusDB ):
     
     def _GetSubtagId( self, subtag ):
         
+        subtag_id = self._subtag_id_cache.GetId( subtag )
+        
+        if subtag_id is not None:
+            
+            return subtag_id
+            
+        
         result = self._c.execute( 'SELECT subtag_id FROM subtags WHERE subtag = ?;', ( subtag, ) ).fetchone()
         
         if result is None:
@@ -6435,6 +7175,8 @@ class DB( HydrusDB.HydrusDB ):
             
             self._c.execute( 'REPLACE INTO subtags_fts4 ( docid, subtag ) VALUES ( ?, ? );', ( subtag_id, subtag_searchable ) )
             
+            self._subtag_search_cache.AddSubtag( subtag_id, subtag_searchable )
+            
             try:
                 
                 integer_subtag = int( subtag )
@@ -6454,9 +7196,135 @@ class DB( HydrusDB.HydrusDB ):
             ( subtag_id, ) = result
             
         
+        self._subtag_id_cache.AddIds( { subtag : subtag_id } )
+        
         return subtag_id
         
     
+    def _GetSubtagIdsFromSearchPrefix( self, prefix ):
+        
+        if self._controller.new_options.GetBoolean( 'use_resident_autocomplete_index' ):
+            
+            if not self._subtag_search_cache.IndexIsLoaded():
+                
+                self._LoadSubtagSearchIndex()
+                
+            
+        else:
+            
+            self._subtag_search_cache.ClearIndex()
+            
+        
+        # the writer adds new subtags to the cache before it commits, so a read connection only uses it, or takes a generation to store its results under, while its snapshot is current
+        
+        with self._read_cache_lock:
+            
+            if self._ReadCachesAreCurrent():
+                
+                subtag_ids = self._subtag_search_cache.GetSubtagIds( prefix )
+                
+                generation = self._subtag_search_cache.GetGeneration()
+                
+            else:
+                
+                subtag_ids = None
+                
+                generation = None
+                
+            
+        
+        if subtag_ids is not None:
+            
+            return subtag_ids
+            
+        
+        subtags_fts4_param = '"' + prefix + '*"'
+        
+        rows = []
+        
+        for ( subtag_id, subtag_searchable ) in self._c.execute( 'SELECT docid, subtag FROM subtags_fts4 WHERE subtag MATCH ?;', ( subtags_fts4_param, ) ):
+            
+            rows.extend( ( ( token, subtag_id ) for token in ClientSearch.ConvertSearchableSubtagToTokens( subtag_searchable ) if token.startswith( prefix ) ) )
+            
+        
+        if generation is not None:
+            
+            self._subtag_search_cache.AddRows( generation, prefix, rows )
+            
+        
+        return { subtag_id for ( token, subtag_id ) in rows }
+        
+    
+    def _GetSubtagsToSubtagIds( self, subtags ):
+        
+        ( subtags_to_subtag_ids, uncached_subtags ) = self._subtag_id_cache.GetIds( subtags )
+        
+        if len( uncached_subtags ) < BULK_ID_LOOKUP_THRESHOLD:
+            
+            for subtag in uncached_subtags:
+                
+                subtags_to_subtag_ids[ subtag ] = self._GetSubtagId( subtag )
+                
+            
+        else:
+            
+            with HydrusDB.TemporaryTextTable( self._c, uncached_subtags, 'subtag' ) as temp_table_name:
+                
+                uncached_subtags_to_subtag_ids = dict( self._c.execute( 'SELECT subtag, subtag_id FROM ' + temp_table_name + ' CROSS JOIN subtags USING ( subtag );' ) )
+                
+            
+            self._subtag_id_cache.AddIds( uncached_subtags_to_subtag_ids )
+            
+            subtags_to_subtag_ids.update( uncached_subtags_to_subtag_ids )
+            
+            # new subtags also need their search rows, so they go through the normal path
+            
+            for subtag in uncached_subtags:
+                
+                if subtag not in subtags_to_subtag_ids:
+                    
+                    subtags_to_subtag_ids[ subtag ] = self._GetSubtagId( subtag )
+                    
+                
+            
+        
+        return subtags_to_subtag_ids
+        
+    
+    def _GetTableStatistics( self, table_name ):
+        
+        # sqlite_stat1 only exists once analyze has been run on that db file, and a table only gets a row once it has been analyzed itself
+        
+        if '.' in table_name:
+            
+            ( schema_name, table_name ) = table_name.split( '.', 1 )
+            
+            schema_prefix = schema_name + '.'
+            
+        else:
+            
+            schema_prefix = ''
+            
+        
+        if self._c.execute( 'SELECT 1 FROM ' + schema_prefix + 'sqlite_master WHERE name = ?;', ( 'sqlite_stat1', ) ).fetchone() is None:
+            
+            return None
+            
+        
+        # the table's own row, or its primary key if it is WITHOUT ROWID, starts with the total number of rows
+        
+        result = self._c.execute( 'SELECT stat FROM ' + schema_prefix + 'sqlite_stat1 WHERE tbl = ? AND ( idx IS NULL OR idx = ? );', ( table_name, table_name ) ).fetchone()
+        
+        if result is None:
+            
+            return None
+            
+        
+        ( stat, ) = result
+        
+        return [ int( value ) for value in stat.split( ' ' ) if value.isdigit() ]
+        
+    
     def _GetTag( self, tag_id ):
         
         result = self._c.execute( 'SELECT namespace, subtag FROM tags NATURAL JOIN namespaces NATURAL JOIN subtags WHERE tag_id = ?;', ( tag_id, ) ).fetchone()
@@ -6526,54 +7394,173 @@ class DB( HydrusDB.HydrusDB ):
         
         HydrusTags.CheckTagNotEmpty( tag )
         
+        tag_id = self._tag_id_cache.GetId( tag )
+        
+        if tag_id is not None:
+            
+            return tag_id
+            
+        
         ( namespace, subtag ) = HydrusTags.SplitTag( tag )
         
-        result = self._c.execute( 'SELECT tag_id FROM tags NATURAL JOIN namespaces NATURAL JOIN subtags WHERE namespace = ? AND subtag = ?;', ( namespace, subtag ) ).fetchone()
+        result = self._c.execute( 'SELECT tag_id FROM tags NATURAL JOIN namespaces NATURAL JOIN subtags WHERE namespace = ? AND subtag = ?;', ( namespace, subtag ) ).fetchone()
+        
+        if result is None:
+            
+            namespace_id = self._GetNamespaceId( namespace )
+            subtag_id = self._GetSubtagId( subtag )
+            
+            self._c.execute( 'INSERT INTO tags ( namespace_id, subtag_id ) VALUES ( ?, ? );', ( namespace_id, subtag_id ) )
+            
+            tag_id = self._c.lastrowid
+            
+        else:
+            
+            ( tag_id, ) = result
+            
+        
+        self._tag_id_cache.AddIds( { tag : tag_id } )
+        
+        return tag_id
+        
+    
+    def _GetTagIdsForSearch( self, tag_service_key, tag ):
+        
+        siblings_manager = self._controller.GetManager( 'tag_siblings' )
+        
+        tags = siblings_manager.GetAllSiblings( tag_service_key, tag )
+        
+        tag_ids = set()
+        
+        for tag in tags:
+            
+            ( namespace, subtag ) = HydrusTags.SplitTag( tag )
+            
+            if namespace != '':
+                
+                if not self._TagExists( tag ):
+                    
+                    continue
+                    
+                
+                tag_ids.add( self._GetTagId( tag ) )
+                
+            else:
+                
+                if not self._SubtagExists( subtag ):
+                    
+                    continue
+                    
+                
+                subtag_id = self._GetSubtagId( subtag )
+                
+                tag_ids.update( self._STI( self._c.execute( 'SELECT tag_id FROM tags WHERE subtag_id = ?;', ( subtag_id, ) ) ) )
+                
+            
+        
+        return tag_ids
+        
+    
+    def _GetTagIdsToTags( self, tag_ids ):
+        
+        ( tag_ids_to_tags, uncached_tag_ids ) = self._tag_id_cache.GetKeys( tag_ids )
+        
+        select_statement = 'SELECT tag_id, namespace, subtag FROM tags NATURAL JOIN namespaces NATURAL JOIN subtags WHERE tag_id IN %s;'
+        
+        uncached_tag_ids_to_tags = { tag_id : HydrusTags.CombineTag( namespace, subtag ) for ( tag_id, namespace, subtag ) in self._SelectFromList( select_statement, uncached_tag_ids ) }
+        
+        self._tag_id_cache.AddIds( { tag : tag_id for ( tag_id, tag ) in uncached_tag_ids_to_tags.items() } )
+        
+        tag_ids_to_tags.update( uncached_tag_ids_to_tags )
+        
+        if len( tag_ids_to_tags ) < len( tag_ids ):
+            
+            for tag_id in tag_ids:
+                
+                if tag_id not in tag_ids_to_tags:
+                    
+                    tag = 'unknown tag:' + HydrusData.GenerateKey().encode( 'hex' )
+                    
+                    ( namespace, subtag ) = HydrusTags.SplitTag( tag )
+                    
+                    namespace_id = self._GetNamespaceId( namespace )
+                    subtag_id = self._GetSubtagId( subtag )
+                    
+                    self._c.execute( 'REPLACE INTO tags ( tag_id, namespace_id, subtag_id ) VALUES ( ?, ?, ? );', ( tag_id, namespace_id, subtag_id ) )
+                    
+                    tag_ids_to_tags[ tag_id ] = tag
+                    
+                
+            
+        
+        return tag_ids_to_tags
+        
+    
+    def _GetTagsToTagIds( self, tags ):
+        
+        tags_to_clean_tags = {}
+        
+        for tag in tags:
+            
+            clean_tag = HydrusTags.CleanTag( tag )
+            
+            HydrusTags.CheckTagNotEmpty( clean_tag )
+            
+            tags_to_clean_tags[ tag ] = clean_tag
+            
+        
+        ( clean_tags_to_tag_ids, uncached_clean_tags ) = self._tag_id_cache.GetIds( set( tags_to_clean_tags.values() ) )
         
-        if result is None:
+        if len( uncached_clean_tags ) < BULK_ID_LOOKUP_THRESHOLD:
             
-            namespace_id = self._GetNamespaceId( namespace )
-            subtag_id = self._GetSubtagId( subtag )
+            for clean_tag in uncached_clean_tags:
+                
+                clean_tags_to_tag_ids[ clean_tag ] = self._GetTagId( clean_tag )
+                
             
-            self._c.execute( 'INSERT INTO tags ( namespace_id, subtag_id ) VALUES ( ?, ? );', ( namespace_id, subtag_id ) )
+        else:
             
-            tag_id = self._c.lastrowid
+            clean_tags_to_pairs = { clean_tag : HydrusTags.SplitTag( clean_tag ) for clean_tag in uncached_clean_tags }
             
-        else:
+            namespaces_to_namespace_ids = { namespace : self._GetNamespaceId( namespace ) for namespace in { namespace for ( namespace, subtag ) in clean_tags_to_pairs.values() } }
             
-            ( tag_id, ) = result
+            subtags_to_subtag_ids = self._GetSubtagsToSubtagIds( { subtag for ( namespace, subtag ) in clean_tags_to_pairs.values() } )
             
-        
-        return tag_id
-        
-    
-    def _GetTagIdsToTags( self, tag_ids ):
-        
-        select_statement = 'SELECT tag_id, namespace, subtag FROM tags NATURAL JOIN namespaces NATURAL JOIN subtags WHERE tag_id IN %s;'
-        
-        tag_ids_to_tags = { tag_id : HydrusTags.CombineTag( namespace, subtag ) for ( tag_id, namespace, subtag ) in self._SelectFromList( select_statement, tag_ids ) }
-        
-        if len( tag_ids_to_tags ) < tag_ids:
+            id_pairs_to_clean_tags = { ( namespaces_to_namespace_ids[ namespace ], subtags_to_subtag_ids[ subtag ] ) : clean_tag for ( clean_tag, ( namespace, subtag ) ) in clean_tags_to_pairs.items() }
             
-            for tag_id in tag_ids:
+            uncached_clean_tags_to_tag_ids = {}
+            
+            with HydrusDB.TemporaryIntegerTable( self._c, subtags_to_subtag_ids.values(), 'subtag_id' ) as temp_table_name:
                 
-                if tag_id not in tag_ids_to_tags:
+                select = 'SELECT tag_id, namespace_id, subtag_id FROM ' + temp_table_name + ' CROSS JOIN tags USING ( subtag_id ) WHERE namespace_id IN ' + HydrusData.SplayListForDB( namespaces_to_namespace_ids.values() ) + ';'
+                
+                for ( tag_id, namespace_id, subtag_id ) in self._c.execute( select ):
                     
-                    tag = 'unknown tag:' + HydrusData.GenerateKey().encode( 'hex' )
+                    id_pair = ( namespace_id, subtag_id )
                     
-                    ( namespace, subtag ) = HydrusTags.SplitTag( tag )
+                    if id_pair in id_pairs_to_clean_tags:
+                        
+                        uncached_clean_tags_to_tag_ids[ id_pairs_to_clean_tags[ id_pair ] ] = tag_id
+                        
                     
-                    namespace_id = self._GetNamespaceId( namespace )
-                    subtag_id = self._GetSubtagId( subtag )
+                
+            
+            for ( ( namespace_id, subtag_id ), clean_tag ) in id_pairs_to_clean_tags.items():
+                
+                if clean_tag not in uncached_clean_tags_to_tag_ids:
                     
-                    self._c.execute( 'REPLACE INTO tags ( tag_id, namespace_id, subtag_id ) VALUES ( ?, ?, ? );', ( tag_id, namespace_id, subtag_id ) )
+                    self._c.execute( 'INSERT INTO tags ( namespace_id, subtag_id ) VALUES ( ?, ? );', ( namespace_id, subtag_id ) )
                     
-                    tag_ids_to_tags[ tag_id ] = tag
+                    uncached_clean_tags_to_tag_ids[ clean_tag ] = self._c.lastrowid
                     
                 
             
+            self._tag_id_cache.AddIds( uncached_clean_tags_to_tag_ids )
+            
+            clean_tags_to_tag_ids.update( uncached_clean_tags_to_tag_ids )
+            
         
-        return tag_ids_to_tags
+        return { tag : clean_tags_to_tag_ids[ clean_tag ] for ( tag, clean_tag ) in tags_to_clean_tags.items() }
         
     
     def _GetTagParents( self, service_key = None ):
@@ -6794,6 +7781,13 @@ class DB( HydrusDB.HydrusDB ):
     
     def _GetURLId( self, url ):
         
+        url_id = self._url_id_cache.GetId( url )
+        
+        if url_id is not None:
+            
+            return url_id
+            
+        
         result = self._c.execute( 'SELECT url_id FROM urls WHERE url = ?;', ( url, ) ).fetchone()
         
         if result is None:
@@ -6816,6 +7810,8 @@ class DB( HydrusDB.HydrusDB ):
             ( url_id, ) = result
             
         
+        self._url_id_cache.AddIds( { url : url_id } )
+        
         return url_id
         
     
@@ -6837,6 +7833,78 @@ class DB( HydrusDB.HydrusDB ):
         return results
         
     
+    def _GetWriteCoalesceKey( self, action, args ):
+        
+        if action == 'content_updates':
+            
+            if len( args ) != 1:
+                
+                return None
+                
+            
+            ( service_keys_to_content_updates, ) = args
+            
+            # one job processes its services in no fixed order, so merging jobs that touch different services could reorder their updates
+            
+            if len( service_keys_to_content_updates ) != 1:
+                
+                return None
+                
+            
+            ( service_key, ) = service_keys_to_content_updates.keys()
+            
+            return ( action, service_key )
+            
+        
+        return HydrusDB.HydrusDB._GetWriteCoalesceKey( self, action, args )
+        
+    
+    def _GetWriteCoalesceRows( self, action, args ):
+        
+        if action == 'content_updates':
+            
+            ( service_keys_to_content_updates, ) = args
+            
+            rows = set()
+            
+            for content_updates in service_keys_to_content_updates.values():
+                
+                for content_update in content_updates:
+                    
+                    ( data_type, content_update_action, row ) = content_update.ToTuple()
+                    
+                    if content_update_action == HC.CONTENT_UPDATE_ADVANCED:
+                        
+                        return None
+                        
+                    
+                    hashes = content_update.GetHashes()
+                    
+                    if data_type == HC.CONTENT_TYPE_MAPPINGS:
+                        
+                        tag = row[0]
+                        
+                        rows.update( ( ( data_type, tag, hash ) for hash in hashes ) )
+                        
+                    elif len( hashes ) > 0:
+                        
+                        rows.update( ( ( data_type, hash ) for hash in hashes ) )
+                        
+                    else:
+                        
+                        # siblings, parents and so on do not say which files they touch, so they only merge with other kinds of update
+                        
+                        rows.add( ( data_type, ) )
+                        
+                    
+                
+            
+            return rows
+            
+        
+        return HydrusDB.HydrusDB._GetWriteCoalesceRows( self, action, args )
+        
+    
     def _GetYAMLDump( self, dump_type, dump_name = None ):
         
         if dump_name is None:
@@ -7016,9 +8084,16 @@ class DB( HydrusDB.HydrusDB ):
         
         self._AddFiles( self._local_update_service_id, [ ( hash_id, now ) ] )
         
+        if isinstance( update, HydrusNetwork.ContentUpdate ):
+            
+            self._WriteRepositoryUpdateSidecar( update_hash, update )
+            
+        
     
     def _InboxFiles( self, hash_ids ):
         
+        self._file_search_cache.Clear()
+        
         self._c.executemany( 'INSERT OR IGNORE INTO file_inbox VALUES ( ? );', ( ( hash_id, ) for hash_id in hash_ids ) )
         
         num_added = self._GetRowCount()
@@ -7052,6 +8127,14 @@ class DB( HydrusDB.HydrusDB ):
         self._subscriptions_cache = {}
         self._service_cache = {}
         
+        self._phash_index = None
+        
+        self._tag_posting_lists.Clear()
+        
+        # the update code may have rebuilt master tables
+        
+        self._ClearIdCaches()
+        
         ( self._null_namespace_id, ) = self._c.execute( 'SELECT namespace_id FROM namespaces WHERE namespace = ?;', ( '', ) ).fetchone()
         
         HG.client_controller.pub( 'splash_set_status_subtext', 'inbox' )
@@ -7089,49 +8172,6 @@ class DB( HydrusDB.HydrusDB ):
         return hash_id in self._inbox_hash_ids
         
     
-    def _IsAnOrphan( self, test_type, possible_hash ):
-        
-        if self._HashExists( possible_hash ):
-            
-            hash = possible_hash
-            
-            if test_type == 'file':
-                
-                hash_id = self._GetHashId( hash )
-                
-                result = self._c.execute( 'SELECT 1 FROM current_files WHERE service_id = ? AND hash_id = ?;', ( self._combined_local_file_service_id, hash_id ) ).fetchone()
-                
-                if result is None:
-                    
-                    return True
-                    
-                else:
-                    
-                    return False
-                    
-                
-            elif test_type == 'thumbnail':
-                
-                hash_id = self._GetHashId( hash )
-                
-                result = self._c.execute( 'SELECT 1 FROM current_files WHERE hash_id = ?;', ( hash_id, ) ).fetchone()
-                
-                if result is None:
-                    
-                    return True
-                    
-                else:
-                    
-                    return False
-                    
-                
-            
-        else:
-            
-            return True
-            
-        
-    
     def _LoadIntoDiskCache( self, stop_time = None, caller_limit = None ):
         
         self._CloseDBCursor()
@@ -7201,6 +8241,83 @@ class DB( HydrusDB.HydrusDB ):
         return True
         
     
+    def _LoadRepositoryContentUpdate( self, update_hash ):
+        
+        sidecar_path = self._GetRepositoryUpdateSidecarPath( update_hash )
+        
+        if not self._controller.new_options.GetBoolean( 'use_repository_update_sidecars' ):
+            
+            HydrusPaths.DeletePath( sidecar_path )
+            
+        elif os.path.exists( sidecar_path ):
+            
+            try:
+                
+                return HydrusNetwork.ContentUpdateSidecar( sidecar_path )
+                
+            except Exception as e:
+                
+                HydrusData.Print( 'Could not load the sidecar for update ' + update_hash.encode( 'hex' ) + ', so it will be rebuilt:' )
+                HydrusData.PrintException( e, do_wait = False )
+                
+            
+        
+        client_files_manager = self._controller.client_files_manager
+        
+        update_path = client_files_manager.LocklessGetFilePath( update_hash, HC.APPLICATION_HYDRUS_UPDATE_CONTENT )
+        
+        with open( update_path, 'rb' ) as f:
+            
+            update_network_string = f.read()
+            
+        
+        content_update = HydrusSerialisable.CreateFromNetworkString( update_network_string )
+        
+        self._WriteRepositoryUpdateSidecar( update_hash, content_update )
+        
+        return content_update
+        
+    
+    def _LoadSubtagSearchIndex( self ):
+        
+        # if our snapshot is current as we start, every subtag added while we read arrives in the cache's pending rows, so the finished index is complete
+        
+        with self._read_cache_lock:
+            
+            if self._ReadCachesAreCurrent():
+                
+                index_generation = self._subtag_search_cache.StartIndexLoad()
+                
+            else:
+                
+                index_generation = None
+                
+            
+        
+        if index_generation is None:
+            
+            return
+            
+        
+        try:
+            
+            rows = []
+            
+            for ( subtag_id, subtag_searchable ) in self._c.execute( 'SELECT docid, subtag FROM subtags_fts4;' ):
+                
+                rows.extend( ( ( token, subtag_id ) for token in ClientSearch.ConvertSearchableSubtagToTokens( subtag_searchable ) ) )
+                
+            
+        except:
+            
+            self._subtag_search_cache.ClearIndex()
+            
+            raise
+            
+        
+        self._subtag_search_cache.SetIndex( index_generation, rows )
+        
+    
     def _MaintenanceDue( self, stop_time ):
         
         # vacuum
@@ -7349,6 +8466,17 @@ class DB( HydrusDB.HydrusDB ):
                 
                 ( data_type, action, row ) = content_update.ToTuple()
                 
+                # mappings invalidate by tag in _UpdateMappings
+                
+                if data_type == HC.CONTENT_TYPE_RATINGS:
+                    
+                    self._file_search_cache.InvalidateRatings( service_key )
+                    
+                elif data_type != HC.CONTENT_TYPE_MAPPINGS:
+                    
+                    self._file_search_cache.Clear()
+                    
+                
                 if service_type in HC.FILE_SERVICES:
                     
                     if data_type == HC.CONTENT_TYPE_FILES:
@@ -8457,16 +9585,21 @@ class DB( HydrusDB.HydrusDB ):
                             
                             update_hash = self._GetHash( hash_id )
                             
-                            update_path = client_files_manager.LocklessGetFilePath( update_hash, HC.APPLICATION_HYDRUS_UPDATE_DEFINITIONS )
+                            content_update = self._LoadRepositoryContentUpdate( update_hash )
                             
-                            with open( update_path, 'rb' ) as f:
+                            try:
                                 
-                                update_network_string = f.read()
+                                did_whole_update = self._ProcessRepositoryContentUpdate( job_key, service_id, content_update )
+                                
+                                num_rows = content_update.GetNumRows()
+                                
+                            finally:
+                                
+                                if isinstance( content_update, HydrusNetwork.ContentUpdateSidecar ):
+                                    
+                                    content_update.Close()
+                                    
                                 
-                            
-                            content_update = HydrusSerialisable.CreateFromNetworkString( update_network_string )
-                            
-                            did_whole_update = self._ProcessRepositoryContentUpdate( job_key, service_id, content_update )
                             
                             ( i_paused, should_quit ) = job_key.WaitIfNeeded()
                             
@@ -8479,8 +9612,6 @@ class DB( HydrusDB.HydrusDB ):
                             
                             num_updates_done += 1
                             
-                            num_rows = content_update.GetNumRows()
-                            
                             total_content_rows += num_rows
                             
                         
@@ -8533,6 +9664,7 @@ class DB( HydrusDB.HydrusDB ):
     def _Read( self, action, *args, **kwargs ):
         
         if action == 'autocomplete_predicates': result = self._GetAutocompletePredicates( *args, **kwargs )
+        elif action == 'benchmark_json_dumps': result = self._BenchmarkJSONDumps( *args, **kwargs )
         elif action == 'client_files_locations': result = self._GetClientFilesLocations( *args, **kwargs )
         elif action == 'downloads': result = self._GetDownloads( *args, **kwargs )
         elif action == 'duplicate_hashes': result = self._CacheSimilarFilesGetDuplicateHashes( *args, **kwargs )
@@ -8540,6 +9672,7 @@ class DB( HydrusDB.HydrusDB ):
         elif action == 'unique_duplicate_pairs': result = self._CacheSimilarFilesGetUniqueDuplicatePairs( *args, **kwargs )
         elif action == 'file_hashes': result = self._GetFileHashes( *args, **kwargs )
         elif action == 'file_notes': result = self._GetFileNotes( *args, **kwargs )
+        elif action == 'file_integrity_info': result = self._GetFileIntegrityInfo( *args, **kwargs )
         elif action == 'file_query_ids': result = self._GetHashIdsFromQuery( *args, **kwargs )
         elif action == 'file_system_predicates': result = self._GetFileSystemPredicates( *args, **kwargs )
         elif action == 'filter_hashes': result = self._FilterHashes( *args, **kwargs )
@@ -8547,7 +9680,6 @@ class DB( HydrusDB.HydrusDB ):
         elif action == 'hydrus_sessions': result = self._GetHydrusSessions( *args, **kwargs )
         elif action == 'imageboards': result = self._GetYAMLDump( YAML_DUMP_ID_IMAGEBOARD, *args, **kwargs )
         elif action == 'in_inbox': result = self._InInbox( *args, **kwargs )
-        elif action == 'is_an_orphan': result = self._IsAnOrphan( *args, **kwargs )
         elif action == 'load_into_disk_cache': result = self._LoadIntoDiskCache( *args, **kwargs )
         elif action == 'local_booru_share_keys': result = self._GetYAMLDumpNames( YAML_DUMP_ID_LOCAL_BOORU )
         elif action == 'local_booru_share': result = self._GetYAMLDump( YAML_DUMP_ID_LOCAL_BOORU, *args, **kwargs )
@@ -8560,6 +9692,7 @@ class DB( HydrusDB.HydrusDB ):
         elif action == 'nums_pending': result = self._GetNumsPending( *args, **kwargs )
         elif action == 'trash_hashes': result = self._GetTrashHashes( *args, **kwargs )
         elif action == 'options': result = self._GetOptions( *args, **kwargs )
+        elif action == 'orphan_hashes': result = self._GetOrphanHashes( *args, **kwargs )
         elif action == 'pending': result = self._GetPending( *args, **kwargs )
         elif action == 'recent_tags': result = self._GetRecentTags( *args, **kwargs )
         elif action == 'remote_booru': result = self._GetYAMLDump( YAML_DUMP_ID_REMOTE_BOORU, *args, **kwargs )
@@ -8946,6 +10079,24 @@ class DB( HydrusDB.HydrusDB ):
             
         
     
+    def _Rollback( self ):
+        
+        # this job may have made new definitions, and if the rollback itself fails the whole transaction is lost, so clear these first
+        
+        self._ClearIdCaches()
+        
+        HydrusDB.HydrusDB._Rollback( self )
+        
+        # resident caches may now hold rows that no longer exist, so they will be reloaded on next use
+        
+        self._phash_index = None
+        
+        self._tag_posting_lists.Clear()
+        
+        self._file_search_cache.Clear()
+        self._subtag_search_cache.Clear()
+        
+    
     def _SaveDirtyServices( self, dirty_services ):
         
         # if allowed to save objects
@@ -8995,7 +10146,7 @@ class DB( HydrusDB.HydrusDB ):
             
             try:
                 
-                dump = json.dumps( serialisable_info )
+                dump = HydrusSerialisable.DumpSerialisableInfo( serialisable_info )
                 
             except Exception as e:
                 
@@ -9016,7 +10167,7 @@ class DB( HydrusDB.HydrusDB ):
             
             try:
                 
-                dump = json.dumps( serialisable_info )
+                dump = HydrusSerialisable.DumpSerialisableInfo( serialisable_info )
                 
             except Exception as e:
                 
@@ -9031,6 +10182,11 @@ class DB( HydrusDB.HydrusDB ):
             
             self._c.execute( 'INSERT INTO json_dumps ( dump_type, version, dump ) VALUES ( ?, ?, ? );', ( dump_type, version, sqlite3.Binary( dump ) ) )
             
+            if dump_type == HydrusSerialisable.SERIALISABLE_TYPE_CLIENT_OPTIONS and not obj.GetBoolean( 'use_repository_update_sidecars' ):
+                
+                HydrusPaths.DeletePath( os.path.join( self._db_dir, 'client_update_sidecars' ) )
+                
+            
         
     
     def _SetJSONSimple( self, name, value ):
@@ -10456,6 +11612,17 @@ class DB( HydrusDB.HydrusDB ):
         tag_ids_to_search_for = tag_ids_being_added.union( tag_ids_being_removed )
         hash_ids_to_search_for = hash_ids_being_added.union( hash_ids_being_removed )
         
+        if self._file_search_cache.IsEnabled():
+            
+            changed_subtags = self._STS( self._SelectFromList( 'SELECT subtag FROM tags NATURAL JOIN subtags WHERE tag_id IN %s;', tag_ids_to_search_for ) )
+            
+        else:
+            
+            changed_subtags = set()
+            
+        
+        self._file_search_cache.InvalidateTags( self._GetService( tag_service_id ).GetServiceKey(), changed_subtags )
+        
         self._c.execute( 'CREATE TABLE mem.temp_tag_ids ( tag_id INTEGER );' )
         self._c.execute( 'CREATE TABLE mem.temp_hash_ids ( hash_id INTEGER );' )
         
@@ -10498,6 +11665,9 @@ class DB( HydrusDB.HydrusDB ):
                 combined_files_current_counter[ tag_id ] += num_current_inserted
                 
             
+            self._UpdateTagPostingLists( self._combined_file_service_id, tag_service_id, HC.CONTENT_STATUS_PENDING, mappings_ids, False )
+            self._UpdateTagPostingLists( self._combined_file_service_id, tag_service_id, HC.CONTENT_STATUS_CURRENT, mappings_ids, True )
+            
             for file_service_id in file_service_ids:
                 
                 self._CacheSpecificMappingsAddMappings( file_service_id, tag_service_id, mappings_ids )
@@ -10527,6 +11697,8 @@ class DB( HydrusDB.HydrusDB ):
                 combined_files_current_counter[ tag_id ] -= num_current_deleted
                 
             
+            self._UpdateTagPostingLists( self._combined_file_service_id, tag_service_id, HC.CONTENT_STATUS_CURRENT, deleted_mappings_ids, False )
+            
             for file_service_id in file_service_ids:
                 
                 self._CacheSpecificMappingsDeleteMappings( file_service_id, tag_service_id, deleted_mappings_ids )
@@ -10561,6 +11733,8 @@ class DB( HydrusDB.HydrusDB ):
                 combined_files_pending_counter[ tag_id ] += num_pending_inserted
                 
             
+            self._UpdateTagPostingLists( self._combined_file_service_id, tag_service_id, HC.CONTENT_STATUS_PENDING, pending_mappings_ids, True )
+            
             for file_service_id in file_service_ids:
                 
                 self._CacheSpecificMappingsPendMappings( file_service_id, tag_service_id, pending_mappings_ids )
@@ -10580,6 +11754,8 @@ class DB( HydrusDB.HydrusDB ):
                 combined_files_pending_counter[ tag_id ] -= num_pending_deleted
                 
             
+            self._UpdateTagPostingLists( self._combined_file_service_id, tag_service_id, HC.CONTENT_STATUS_PENDING, pending_rescinded_mappings_ids, False )
+            
             for file_service_id in file_service_ids:
                 
                 self._CacheSpecificMappingsRescindPendingMappings( file_service_id, tag_service_id, pending_rescinded_mappings_ids )
@@ -10859,6 +12035,33 @@ class DB( HydrusDB.HydrusDB ):
         self._InitDBCursor()
         
     
+    def _UpdateTagPostingLists( self, file_service_id, tag_service_id, status, mappings_ids, adding ):
+        
+        # only lists that have been loaded need to be kept in sync--anything else will be read from the db as and when it is searched
+        # the changes are merged into a list when it is next searched, so a big list is not rebuilt on every little update
+        
+        if not self._controller.new_options.GetBoolean( 'use_resident_tag_posting_lists' ):
+            
+            self._tag_posting_lists.Clear()
+            
+            return
+            
+        
+        for ( tag_id, hash_ids ) in mappings_ids:
+            
+            key = ( file_service_id, tag_service_id, tag_id, status )
+            
+            if adding:
+                
+                self._tag_posting_lists.AddHashIds( key, hash_ids )
+                
+            else:
+                
+                self._tag_posting_lists.DeleteHashIds( key, hash_ids )
+                
+            
+        
+    
     def _Vacuum( self, stop_time = None, force_vacuum = False ):
         
         new_options = self._controller.new_options
@@ -10977,7 +12180,6 @@ class DB( HydrusDB.HydrusDB ):
         
         if action == 'analyze': result = self._AnalyzeStaleBigTables( *args, **kwargs )
         elif action == 'associate_repository_update_hashes': result = self._AssociateRepositoryUpdateHashes( *args, **kwargs )
-        elif action == 'auto_tag_images': result = self._AutoTagImages( *args, **kwargs )
         elif action == 'backup': result = self._Backup( *args, **kwargs )
         elif action == 'clear_orphan_file_records': result = self._ClearOrphanFileRecords( *args, **kwargs )
         elif action == 'content_updates': result = self._ProcessContentUpdates( *args, **kwargs )
@@ -10993,7 +12195,7 @@ class DB( HydrusDB.HydrusDB ):
         elif action == 'dirty_services': result = self._SaveDirtyServices( *args, **kwargs )
         elif action == 'duplicate_pair_status': result = self._CacheSimilarFilesSetDuplicatePairStatus( *args, **kwargs )
         elif action == 'export_mappings': result = self._ExportToTagArchive( *args, **kwargs )
-        elif action == 'file_integrity': result = self._CheckFileIntegrity( *args, **kwargs )
+        elif action == 'file_integrity_failures': result = self._DeleteFileIntegrityFailures( *args, **kwargs )
         elif action == 'hydrus_session': result = self._AddHydrusSession( *args, **kwargs )
         elif action == 'imageboard': result = self._SetYAMLDump( YAML_DUMP_ID_IMAGEBOARD, *args, **kwargs )
         elif action == 'import_file': result = self._ImportFile( *args, **kwargs )
@@ -11027,6 +12229,30 @@ class DB( HydrusDB.HydrusDB ):
         return result
         
     
+    def _WriteRepositoryUpdateSidecar( self, update_hash, content_update ):
+        
+        # the sidecar is only a cache, so if it cannot be written, processing just parses the update again
+        
+        if not self._controller.new_options.GetBoolean( 'use_repository_update_sidecars' ):
+            
+            return
+            
+        
+        sidecar_path = self._GetRepositoryUpdateSidecarPath( update_hash )
+        
+        try:
+            
+            HydrusPaths.MakeSureDirectoryExists( os.path.dirname( sidecar_path ) )
+            
+            HydrusNetwork.WriteContentUpdateSidecar( sidecar_path, content_update )
+            
+        except Exception as e:
+            
+            HydrusData.Print( 'Could not write a sidecar for update ' + update_hash.encode( 'hex' ) + ':' )
+            HydrusData.PrintException( e, do_wait = False )
+            
+        
+    
     def pub_content_updates_after_commit( self, service_keys_to_content_updates ):
         
         self.pub_after_job( 'content_updates_data', service_keys_to_content_updates )
@@ -11054,6 +12280,13 @@ class DB( HydrusDB.HydrusDB ):
         return self._initial_messages
         
     
+    def NotifyNewSiblings( self ):
+        
+        # the siblings manager has just changed what a tag search will expand to
+        
+        self._file_search_cache.Clear()
+        
+    
     def RestoreBackup( self, path ):
         
         for filename in self._db_filenames.values():
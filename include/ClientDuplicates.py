@@ -4,6 +4,11 @@ import HydrusData
 import HydrusExceptions
 import HydrusGlobals as HG
 import HydrusSerialisable
+import numpy
+import struct
+
+# number of set bits in each possible byte, for vectorised popcount
+BYTE_POPCOUNTS = numpy.array( [ bin( i ).count( '1' ) for i in range( 256 ) ], dtype = numpy.uint8 )
 
 class DuplicateActionOptions( HydrusSerialisable.SerialisableBase ):
     
@@ -391,3 +396,132 @@ class DuplicateActionOptions( HydrusSerialisable.SerialisableBase ):
         
     
 HydrusSerialisable.SERIALISABLE_TYPES_TO_OBJECT_TYPES[ HydrusSerialisable.SERIALISABLE_TYPE_DUPLICATE_ACTION_OPTIONS ] = DuplicateActionOptions
+
+class PHashIndex( object ):
+    
+    def __init__( self ):
+        
+        self._phash_ids_to_phashes = {}
+        
+        self._packed_phash_ids = numpy.zeros( 0, dtype = numpy.int64 )
+        self._packed_phashes = numpy.zeros( 0, dtype = numpy.uint64 )
+        
+        self._dirty = False
+        
+    
+    def __len__( self ):
+        
+        return len( self._phash_ids_to_phashes )
+        
+    
+    def _GetDistances( self, search_phash ):
+        
+        ( search_phash_int, ) = struct.unpack( '!Q', search_phash )
+        
+        xors = numpy.bitwise_xor( self._packed_phashes, numpy.uint64( search_phash_int ) )
+        
+        # the xor'd array is viewed as bytes, so each row of eight byte popcounts sums to the hamming distance
+        
+        distances = BYTE_POPCOUNTS[ xors.view( numpy.uint8 ) ].reshape( ( -1, 8 ) ).sum( axis = 1 )
+        
+        return distances
+        
+    
+    def _PackIfNeeded( self ):
+        
+        if self._dirty:
+            
+            phash_ids = self._phash_ids_to_phashes.keys()
+            
+            self._packed_phash_ids = numpy.array( phash_ids, dtype = numpy.int64 )
+            
+            # phashes are stored as big-endian unsigned 64-bit blobs, so we can read them straight in
+            
+            packed_phashes = ''.join( ( self._phash_ids_to_phashes[ phash_id ] for phash_id in phash_ids ) )
+            
+            self._packed_phashes = numpy.frombuffer( packed_phashes, dtype = '>u8' ).astype( numpy.uint64 )
+            
+            self._dirty = False
+            
+        
+    
+    def AddPHashes( self, rows ):
+        
+        for ( phash_id, phash ) in rows:
+            
+            phash = str( phash )
+            
+            if self._phash_ids_to_phashes.get( phash_id, None ) != phash:
+                
+                self._phash_ids_to_phashes[ phash_id ] = phash
+                
+                self._dirty = True
+                
+            
+        
+    
+    def GetPHash( self, phash_id ):
+        
+        return self._phash_ids_to_phashes[ phash_id ]
+        
+    
+    def HasPHashId( self, phash_id ):
+        
+        return phash_id in self._phash_ids_to_phashes
+        
+    
+    def RemovePHashIds( self, phash_ids ):
+        
+        for phash_id in phash_ids:
+            
+            if phash_id in self._phash_ids_to_phashes:
+                
+                del self._phash_ids_to_phashes[ phash_id ]
+                
+                self._dirty = True
+                
+            
+        
+    
+    def Search( self, search_phashes, max_hamming_distance ):
+        
+        similar_phash_ids = set()
+        
+        for phash_ids in self.SearchMany( search_phashes, max_hamming_distance ).values():
+            
+            similar_phash_ids.update( phash_ids )
+            
+        
+        return similar_phash_ids
+        
+    
+    def SearchMany( self, search_phashes, max_hamming_distance ):
+        
+        self._PackIfNeeded()
+        
+        search_phashes_to_similar_phash_ids = {}
+        
+        for search_phash in search_phashes:
+            
+            if search_phash in search_phashes_to_similar_phash_ids:
+                
+                continue
+                
+            
+            if len( self._packed_phash_ids ) == 0:
+                
+                similar_phash_ids = set()
+                
+            else:
+                
+                distances = self._GetDistances( search_phash )
+                
+                similar_phash_ids = set( self._packed_phash_ids[ distances <= max_hamming_distance ].tolist() )
+                
+            
+            search_phashes_to_similar_phash_ids[ search_phash ] = similar_phash_ids
+            
+        
+        return search_phashes_to_similar_phash_ids
+        
+    
@@ -772,6 +772,32 @@ class FrameGUI( ClientGUITopLevelWindows.FrameThatResizes ):
             
         
     
+    def _DebugBenchmarkJSONDumps( self ):
+        
+        def do_it():
+            
+            results = self._controller.Read( 'benchmark_json_dumps' )
+            
+            lines = []
+            
+            for ( name, json_size, json_save_time, json_load_time, binary_size, binary_save_time, binary_load_time ) in results:
+                
+                lines.append( name + ':' )
+                lines.append( '    json: ' + HydrusData.ConvertIntToBytes( json_size ) + ', save ' + HydrusData.ConvertTimeDeltaToPrettyString( json_save_time ) + ', load ' + HydrusData.ConvertTimeDeltaToPrettyString( json_load_time ) )
+                lines.append( '    binary: ' + HydrusData.ConvertIntToBytes( binary_size ) + ', save ' + HydrusData.ConvertTimeDeltaToPrettyString( binary_save_time ) + ', load ' + HydrusData.ConvertTimeDeltaToPrettyString( binary_load_time ) )
+                
+            
+            if len( lines ) == 0:
+                
+                lines.append( 'No dumps to benchmark!' )
+                
+            
+            HydrusData.ShowText( os.linesep.join( lines ) )
+            
+        
+        self._controller.CallToThread( do_it )
+        
+    
     def _DebugMakeDelayedModalPopup( self ):
         
         def do_it( controller ):
@@ -924,6 +950,30 @@ class FrameGUI( ClientGUITopLevelWindows.FrameThatResizes ):
         HydrusData.DebugPrint( 'garbage printing finished' )
         
     
+    def _DebugShowCacheStatistics( self ):
+        
+        for ( name, pretty_name ) in ( ( 'thumbnail', 'thumbnail cache' ), ( 'images', 'image rendering cache' ) ):
+            
+            ( num_items, memory_footprint, cache_size, num_hits, num_misses, num_evictions ) = self._controller.GetCache( name ).GetCacheStatistics()
+            
+            num_lookups = num_hits + num_misses
+            
+            if num_lookups == 0:
+                
+                hit_rate = 'no lookups yet'
+                
+            else:
+                
+                hit_rate = HydrusData.ConvertFloatToPercentage( float( num_hits ) / num_lookups ) + ' hit rate'
+                
+            
+            text = pretty_name + ': ' + HydrusData.ConvertIntToPrettyString( num_items ) + ' items, ' + HydrusData.ConvertValueRangeToBytes( memory_footprint, cache_size ) + ', '
+            text += HydrusData.ConvertIntToPrettyString( num_hits ) + ' hits, ' + HydrusData.ConvertIntToPrettyString( num_misses ) + ' misses (' + hit_rate + '), ' + HydrusData.ConvertIntToPrettyString( num_evictions ) + ' evictions'
+            
+            HydrusData.ShowText( text )
+            
+        
+    
     def _DebugShowScheduledJobs( self ):
         
         self._controller.DebugShowScheduledJobs()
@@ -1841,7 +1891,9 @@ class FrameGUI( ClientGUITopLevelWindows.FrameThatResizes ):
             ClientGUIMenus.AppendMenuItem( self, data_actions, 'run fast memory maintenance', 'Tell all the fast caches to maintain themselves.', self._controller.MaintainMemoryFast )
             ClientGUIMenus.AppendMenuItem( self, data_actions, 'run slow memory maintenance', 'Tell all the slow caches to maintain themselves.', self._controller.MaintainMemorySlow )
             ClientGUIMenus.AppendMenuItem( self, data_actions, 'flush log', 'Command the log to write any buffered contents to hard drive.', HydrusData.DebugPrint, 'Flushing log' )
+            ClientGUIMenus.AppendMenuItem( self, data_actions, 'benchmark json dumps', 'Time saving and loading the biggest stored objects in json and binary formats and print the results.', self._DebugBenchmarkJSONDumps )
             ClientGUIMenus.AppendMenuItem( self, data_actions, 'print garbage', 'Print some information about the python garbage to the log.', self._DebugPrintGarbage )
+            ClientGUIMenus.AppendMenuItem( self, data_actions, 'show cache statistics', 'Show how full the thumbnail and image caches are and how often they have been hit.', self._DebugShowCacheStatistics )
             ClientGUIMenus.AppendMenuItem( self, data_actions, 'show scheduled jobs', 'Print some information about the currently scheduled jobs log.', self._DebugShowScheduledJobs )
             ClientGUIMenus.AppendMenuItem( self, data_actions, 'clear image rendering cache', 'Tell the image rendering system to forget all current images. This will often free up a bunch of memory immediately.', self._controller.ClearCaches )
             ClientGUIMenus.AppendMenuItem( self, data_actions, 'clear db service info cache', 'Delete all cached service info like total number of mappings or files, in case it has become desynchronised. Some parts of the gui may be laggy immediately after this as these numbers are recalculated.', self._DeleteServiceInfo )
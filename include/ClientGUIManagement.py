@@ -1,4 +1,5 @@
 import HydrusConstants as HC
+import ClientAutoTagging
 import ClientDownloading
 import HydrusExceptions
 import HydrusPaths
@@ -1081,17 +1082,71 @@ class ManagementPanelAutoTag( ManagementPanel ):
 
 
     def _RunTagging( self ):
-        hashes = self._page.GetHashes()
+        if self._tagger_path is None:
+            wx.MessageBox( 'Please choose a tagger first!' )
+            return
 
-        proposed_tags = self._management_controller.GetVariable('proposed_tags')
+        client_files_manager = self._controller.client_files_manager
+
+        hashes_paths_and_mimes = []
+
+        for m in self._page.GetMedia():
+            flat_media = m.GetFlatMedia() if m.IsCollection() else [m]
+
+            for media in flat_media:
+                mime = media.GetMime()
+
+                if mime not in HC.IMAGES:
+                    continue
+
+                hash = media.GetHash()
+
+                try:
+                    path = client_files_manager.GetFilePath( hash, mime )
+                except HydrusExceptions.FileMissingException as e:
+                    HydrusData.Print('Auto Tag: missing file: {}'.format(e))
+                    continue
+
+                hashes_paths_and_mimes.append( ( hash, path, mime ) )
+
+        self._run_button.Disable()
+        self._run_gauge.SetRange( max( 1, len( hashes_paths_and_mimes ) ) )
+        self._run_gauge.SetValue( 0 )
+
+        self._controller.CallToThread( self._THREADRunTagging, self._tagger_path, hashes_paths_and_mimes, self._threshold, self._batch_size )
+
+
+    def _THREADRunTagging( self, tagger_path, hashes_paths_and_mimes, threshold, batch_size ):
+
+        def wx_update( proposed_tags, num_done ):
+            if not self:
+                return
+
+            self._management_controller.GetVariable('proposed_tags').update(proposed_tags)
+            self._run_gauge.SetValue(num_done)
+
+        def wx_done():
+            if not self:
+                return
 
-        for x in range(0, len(hashes), self._batch_size):
-            hash_batch = hashes[x:min(x + self._batch_size, len(hashes))]
-            # Should this be a Read?
-            tag_batch = self._controller.WriteSynchronous('auto_tag_images', hash_batch, self._tagger_path, self._threshold)
-            proposed_tags.update(tag_batch)
+            self._run_button.Enable()
 
-        self._management_controller.SetVariable('proposed_tags', proposed_tags)
+        def batch_callback( proposed_tags, num_done ):
+            wx.CallAfter( wx_update, proposed_tags, num_done )
+
+        def stop_callback():
+            return not self
+
+        try:
+            tagger = ClientAutoTagging.GetTagger( tagger_path )
+
+            ClientAutoTagging.TagFiles( tagger, hashes_paths_and_mimes, threshold, batch_size, batch_callback, stop_callback = stop_callback )
+
+        except Exception as e:
+            HydrusData.ShowException( e )
+
+        finally:
+            wx.CallAfter( wx_done )
 
 
     def _CommitSelected( self ):
@@ -1147,6 +1202,10 @@ class ManagementPanelDuplicateFilter( ManagementPanel ):
         
         menu_items.append( ( 'check', 'search for duplicate pairs at the current distance during normal db maintenance', 'Tell the client to find duplicate pairs in its normal db maintenance cycles, whether you have that set to idle or shutdown time.', check_manager ) )
         
+        check_manager = ClientGUICommon.CheckboxManagerOptions( 'use_resident_similar_files_index' )
+        
+        menu_items.append( ( 'check', 'keep similar files search data in memory', 'Load all the perceptual hashes into memory and search them directly rather than walking the tree in the database. This is much faster for large clients but uses roughly 100 bytes of memory per perceptual hash, and most files have one.', check_manager ) )
+        
         self._cog_button = ClientGUICommon.MenuBitmapButton( self, CC.GlobalBMPs.cog, menu_items )
         
         menu_items = []
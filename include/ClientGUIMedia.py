@@ -2631,7 +2631,7 @@ class MediaPanelThumbnails( MediaPanel ):
             
             self._RecalculateVirtualSize()
             
-            HG.client_controller.GetCache( 'thumbnail' ).Waterfall( self._page_key, thumbnails )
+            HG.client_controller.GetCache( 'thumbnail' ).Waterfall( self._page_key, thumbnails, visible = False )
             
             if len( self._selected_media ) == 0:
                 
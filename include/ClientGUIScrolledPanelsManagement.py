@@ -1549,6 +1549,9 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             self._network_timeout = wx.SpinCtrl( self, min = 3, max = 300 )
             self._network_timeout.SetToolTip( 'If a network connection experiences any uninterrupted inactivity for this duration, it will throw an error.' )
             
+            self._repository_update_download_concurrency = wx.SpinCtrl( self, min = 1, max = 16 )
+            self._repository_update_download_concurrency.SetToolTip( 'How many repository updates to download at once while syncing. More hides the wait between requests on a big sync. Each download still obeys the repository\'s bandwidth rules.' )
+            
             proxy_panel = ClientGUICommon.StaticBox( self, 'proxy settings' )
             
             self._proxy_type = ClientGUICommon.BetterChoice( proxy_panel )
@@ -1572,6 +1575,8 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             
             self._network_timeout.SetValue( self._new_options.GetInteger( 'network_timeout' ) )
             
+            self._repository_update_download_concurrency.SetValue( self._new_options.GetInteger( 'repository_update_download_concurrency' ) )
+            
             self._proxy_type.Append( 'http', 'http' )
             self._proxy_type.Append( 'socks4', 'socks4' )
             self._proxy_type.Append( 'socks5', 'socks5' )
@@ -1638,6 +1643,7 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             
             rows.append( ( 'external ip/host override: ', self._external_host ) )
             rows.append( ( 'network timeout (seconds): ', self._network_timeout ) )
+            rows.append( ( 'simultaneous repository update downloads: ', self._repository_update_download_concurrency ) )
             
             gridbox = ClientGUICommon.WrapInGrid( self, rows )
             
@@ -1682,6 +1688,7 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             HC.options[ 'external_host' ] = external_host
             
             self._new_options.SetInteger( 'network_timeout', self._network_timeout.GetValue() )
+            self._new_options.SetInteger( 'repository_update_download_concurrency', self._repository_update_download_concurrency.GetValue() )
             
         
     
@@ -3187,6 +3194,9 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             self._disk_cache_maintenance = ClientGUIControls.NoneableBytesControl( disk_panel, initial_value = 256 * 1024 * 1024, none_label = 'do not keep db cached' )
             self._disk_cache_maintenance.SetToolTip( 'The client can regularly ensure the front of its database is cached in your OS\'s disk cache. This represents how many megabytes it will ensure are cached in memory.' )
             
+            self._db_read_connections = wx.SpinCtrl( disk_panel, min = 0, max = 8 )
+            self._db_read_connections.SetToolTip( 'Simple searches, autocomplete and thumbnail info can be fetched on extra read-only db connections while other db work is going on. Set to 0 to do everything one job at a time. This takes effect when the client restarts.' )
+            
             #
             
             media_panel = ClientGUICommon.StaticBox( self, 'thumbnail size and media cache' )
@@ -3241,6 +3251,21 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             
             self._forced_search_limit = ClientGUICommon.NoneableSpinCtrl( misc_panel, '', min = 1, max = 100000 )
             
+            self._use_resident_tag_posting_lists = wx.CheckBox( misc_panel )
+            self._use_resident_tag_posting_lists.SetToolTip( 'Keep the files for each tag you search in memory as compact sorted lists, so searches that include or exclude big tags do not have to go back to the db. Uses a few bytes of memory per file per tag searched.' )
+            
+            self._tag_posting_lists_cache_size_mb = wx.SpinCtrl( misc_panel, min = 1, max = 4096 )
+            self._tag_posting_lists_cache_size_mb.SetToolTip( 'The most memory the searched tags\' file lists may use. When it is full, the lists searched longest ago are dropped, and will be read from the db again if they are searched.' )
+            
+            self._use_resident_autocomplete_index = wx.CheckBox( misc_panel )
+            self._use_resident_autocomplete_index.SetToolTip( 'Keep every word of every tag in memory as a sorted list, so tag autocomplete can find what you type without asking the db. Loads on the first autocomplete search and uses roughly a hundred bytes per tag.' )
+            
+            self._use_repository_update_sidecars = wx.CheckBox( misc_panel )
+            self._use_repository_update_sidecars.SetToolTip( 'Keep a small pre-parsed copy of each downloaded repository update next to the db, so processing does not have to parse the update again. Turning this off deletes all of those copies.' )
+            
+            self._file_search_cache_size_mb = wx.SpinCtrl( misc_panel, min = 0, max = 4096 )
+            self._file_search_cache_size_mb.SetToolTip( 'Remember the results of recent file searches, so refreshing the same search, or adding a predicate to it, can return without redoing the whole search. Results are dropped as soon as tags, ratings or files they might depend on change. Set to 0 to turn it off.' )
+            
             #
             
             self._disk_cache_init_period.SetValue( self._new_options.GetNoneableInteger( 'disk_cache_init_period' ) )
@@ -3258,6 +3283,8 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             
             self._disk_cache_maintenance.SetValue( disk_cache_maintenance )
             
+            self._db_read_connections.SetValue( self._new_options.GetInteger( 'db_read_connections' ) )
+            
             ( thumbnail_width, thumbnail_height ) = HC.options[ 'thumbnail_dimensions' ]
             
             self._thumbnail_width.SetValue( thumbnail_width )
@@ -3284,12 +3311,20 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             
             self._forced_search_limit.SetValue( self._new_options.GetNoneableInteger( 'forced_search_limit' ) )
             
+            self._use_resident_tag_posting_lists.SetValue( self._new_options.GetBoolean( 'use_resident_tag_posting_lists' ) )
+            self._use_resident_autocomplete_index.SetValue( self._new_options.GetBoolean( 'use_resident_autocomplete_index' ) )
+            self._use_repository_update_sidecars.SetValue( self._new_options.GetBoolean( 'use_repository_update_sidecars' ) )
+            
+            self._tag_posting_lists_cache_size_mb.SetValue( self._new_options.GetInteger( 'tag_posting_lists_cache_size_mb' ) )
+            self._file_search_cache_size_mb.SetValue( self._new_options.GetInteger( 'file_search_cache_size_mb' ) )
+            
             #
             
             rows = []
             
             rows.append( ( 'run disk cache on boot for this long: ', self._disk_cache_init_period ) )
             rows.append( ( 'regularly ensure this much of the db is in OS\'s disk cache: ', self._disk_cache_maintenance ) )
+            rows.append( ( 'number of parallel db read connections: ', self._db_read_connections ) )
             
             gridbox = ClientGUICommon.WrapInGrid( disk_panel, rows )
             
@@ -3377,6 +3412,11 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             rows = []
             
             rows.append( ( 'Forced system:limit for all searches: ', self._forced_search_limit ) )
+            rows.append( ( 'Keep searched tags\' file lists in memory: ', self._use_resident_tag_posting_lists ) )
+            rows.append( ( 'Searched tags\' file lists memory limit (MB): ', self._tag_posting_lists_cache_size_mb ) )
+            rows.append( ( 'Keep a tag autocomplete index in memory: ', self._use_resident_autocomplete_index ) )
+            rows.append( ( 'Keep pre-parsed copies of repository updates: ', self._use_repository_update_sidecars ) )
+            rows.append( ( 'File search results cache size (MB): ', self._file_search_cache_size_mb ) )
             
             gridbox = ClientGUICommon.WrapInGrid( misc_panel, rows )
             
@@ -3471,6 +3511,8 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             
             self._new_options.SetNoneableInteger( 'disk_cache_maintenance_mb', disk_cache_maintenance_mb )
             
+            self._new_options.SetInteger( 'db_read_connections', self._db_read_connections.GetValue() )
+            
             new_thumbnail_dimensions = [ self._thumbnail_width.GetValue(), self._thumbnail_height.GetValue() ]
             
             HC.options[ 'thumbnail_dimensions' ] = new_thumbnail_dimensions
@@ -3482,6 +3524,13 @@ class ManageOptionsPanel( ClientGUIScrolledPanels.ManagePanel ):
             
             self._new_options.SetNoneableInteger( 'forced_search_limit', self._forced_search_limit.GetValue() )
             
+            self._new_options.SetBoolean( 'use_resident_tag_posting_lists', self._use_resident_tag_posting_lists.GetValue() )
+            self._new_options.SetBoolean( 'use_resident_autocomplete_index', self._use_resident_autocomplete_index.GetValue() )
+            self._new_options.SetBoolean( 'use_repository_update_sidecars', self._use_repository_update_sidecars.GetValue() )
+            
+            self._new_options.SetInteger( 'tag_posting_lists_cache_size_mb', self._tag_posting_lists_cache_size_mb.GetValue() )
+            self._new_options.SetInteger( 'file_search_cache_size_mb', self._file_search_cache_size_mb.GetValue() )
+            
             HC.options[ 'num_autocomplete_chars' ] = self._num_autocomplete_chars.GetValue()
             
             HC.options[ 'fetch_ac_results_automatically' ] = self._fetch_ac_results_automatically.GetValue()
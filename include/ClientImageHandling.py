@@ -140,112 +140,122 @@ def GenerateShapePerceptualHashes( path, mime ):
     
     numpy_image = GenerateNumpyImage( path, mime )
     
-    ( y, x, depth ) = numpy_image.shape
+    ( phashes, ) = GenerateShapePerceptualHashesFromNumpyImages( ( numpy_image, ) )
     
-    if depth == 4:
-        
-        # doing this on 10000x10000 pngs eats ram like mad
-        numpy_image = EfficientlyThumbnailNumpyImage( numpy_image, ( 1024, 1024 ) )
-        
-        ( y, x, depth ) = numpy_image.shape
-        
-        # create weight and transform numpy_image to greyscale
-        
-        numpy_alpha = numpy_image[ :, :, 3 ]
-        
-        numpy_alpha_float = numpy_alpha / 255.0
-        
-        numpy_image_bgr = numpy_image[ :, :, :3 ]
-        
-        numpy_image_gray_bare = cv2.cvtColor( numpy_image_bgr, cv2.COLOR_RGB2GRAY )
-        
-        # create a white greyscale canvas
-        
-        white = numpy.ones( ( y, x ) ) * 255.0
-        
-        # paste the grayscale image onto the white canvas using: pixel * alpha + white * ( 1 - alpha )
-        
-        numpy_image_gray = numpy.uint8( ( numpy_image_gray_bare * numpy_alpha_float ) + ( white * ( numpy.ones( ( y, x ) ) - numpy_alpha_float ) ) )
+    return phashes
+    
+def GenerateShapePerceptualHashesForPaths( paths_and_mimes, pool ):
+    
+    # decoding, flattening and shrinking are per-file and mostly happen in cv, which releases the GIL, so they go to the pool
+    # the dct and median work is then done for the whole batch at once
+    # returns a list of ( phashes, exception ) in the same order as paths_and_mimes
+    
+    tiles_and_exceptions = pool.map( GenerateShapePerceptualHashTileOrException, paths_and_mimes )
+    
+    good_indices = [ i for ( i, ( tile, e ) ) in enumerate( tiles_and_exceptions ) if e is None ]
+    
+    results = [ ( set(), e ) for ( tile, e ) in tiles_and_exceptions ]
+    
+    if len( good_indices ) > 0:
         
-    else:
+        tiles = numpy.stack( [ tiles_and_exceptions[ i ][0] for i in good_indices ] )
         
-        numpy_image_gray = cv2.cvtColor( numpy_image, cv2.COLOR_RGB2GRAY )
+        for ( i, phashes ) in zip( good_indices, GenerateShapePerceptualHashesFromTiles( tiles ) ):
+            
+            results[ i ] = ( phashes, None )
+            
         
     
-    numpy_image_tiny = cv2.resize( numpy_image_gray, ( 32, 32 ), interpolation = cv2.INTER_AREA )
+    return results
+    
+def GenerateShapePerceptualHashesFromNumpyImages( numpy_images ):
+    
+    tiles = numpy.stack( [ GenerateShapePerceptualHashTile( numpy_image ) for numpy_image in numpy_images ] )
     
-    # convert to float and calc dct
+    return GenerateShapePerceptualHashesFromTiles( tiles )
     
-    numpy_image_tiny_float = numpy.float32( numpy_image_tiny )
+def GenerateShapePerceptualHashesFromTiles( tiles ):
     
-    dct = cv2.dct( numpy_image_tiny_float )
+    # tiles is an ( n, 32, 32 ) float32 array
+    # each dct is still cv2's float32 one, so the phashes match those already in the db bit for bit, and only the median and packing are done for the whole batch
     
-    # take top left 8x8 of dct
+    dct_88s = numpy.stack( [ cv2.dct( tile )[ :8, :8 ] for tile in tiles ] )
     
-    dct_88 = dct[:8,:8]
+    dct_88s = dct_88s.reshape( ( len( tiles ), 64 ) )
     
     # get median of dct
     # exclude [0,0], which represents flat colour
     # this [0,0] exclusion is apparently important for mean, but maybe it ain't so important for median--w/e
     
-    # old mean code
-    # mask = numpy.ones( ( 8, 8 ) )
-    # mask[0,0] = 0
-    # average = numpy.average( dct_88, weights = mask )
-    
-    median = numpy.median( dct_88.reshape( 64 )[1:] )
+    medians = numpy.median( dct_88s[ :, 1: ], axis = 1 )
     
     # make a monochromatic, 64-bit hash of whether the entry is above or below the median
+    # packbits goes most significant bit first, so row i of the 8x8 becomes byte i
     
-    dct_88_boolean = dct_88 > median
+    dct_88s_boolean = dct_88s > medians[ :, None ]
     
-    # convert TTTFTFTF to 11101010 by repeatedly shifting answer and adding 0 or 1
-    # you can even go ( a << 1 ) + b and leave out the initial param on the reduce call as bools act like ints for this
-    # but let's not go crazy for another two nanoseconds
-    def collapse_bools_to_binary_uint( a, b ):
-        
-        return ( a << 1 ) + int( b )
-        
+    packed = numpy.packbits( dct_88s_boolean, axis = 1 )
     
-    bytes = []
+    list_of_phashes = []
     
-    for i in range( 8 ):
+    for row in packed:
         
-        '''
-        # old way of doing it, which compared value to median every time
-        byte = 0
+        phash = row.tostring()
         
-        for j in range( 8 ):
-            
-            byte <<= 1 # shift byte one left
-            
-            value = dct_88[i,j]
-            
-            if value > median:
-                
-                byte |= 1
-                
-            
-        '''
+        # now discard the blank hash, which is 1000000... and not useful
+        
+        phashes = set()
         
-        byte = reduce( collapse_bools_to_binary_uint, dct_88_boolean[i], 0 )
+        phashes.add( phash )
         
-        bytes.append( byte )
+        phashes.discard( CC.BLANK_PHASH )
         
+        list_of_phashes.append( phashes )
+        
+    
+    # we good
+    
+    return list_of_phashes
     
-    phash = str( bytearray( bytes ) )
+def GenerateShapePerceptualHashTile( numpy_image ):
     
-    # now discard the blank hash, which is 1000000... and not useful
+    ( y, x, depth ) = numpy_image.shape
     
-    phashes = set()
+    if depth == 4:
+        
+        # doing this on 10000x10000 pngs eats ram like mad
+        numpy_image = EfficientlyThumbnailNumpyImage( numpy_image, ( 1024, 1024 ) )
+        
+        # paste the greyscale image onto a white canvas using: pixel * alpha + white * ( 1 - alpha )
+        # this is float64 in the same order as ever, so truncating to uint8 gives the same pixels, but white is a scalar rather than two full size canvases
+        
+        numpy_alpha_float = numpy_image[ :, :, 3 ] / 255.0
+        
+        numpy_image_gray_bare = cv2.cvtColor( numpy_image[ :, :, :3 ], cv2.COLOR_RGB2GRAY )
+        
+        numpy_image_gray = numpy.uint8( ( numpy_image_gray_bare * numpy_alpha_float ) + ( 255.0 * ( 1.0 - numpy_alpha_float ) ) )
+        
+    else:
+        
+        numpy_image_gray = cv2.cvtColor( numpy_image, cv2.COLOR_RGB2GRAY )
+        
     
-    phashes.add( phash )
+    numpy_image_tiny = cv2.resize( numpy_image_gray, ( 32, 32 ), interpolation = cv2.INTER_AREA )
     
-    phashes.discard( CC.BLANK_PHASH )
+    return numpy.float32( numpy_image_tiny )
     
-    # we good
+def GenerateShapePerceptualHashTileOrException( ( path, mime ) ):
     
-    return phashes
+    try:
+        
+        numpy_image = GenerateNumpyImage( path, mime )
+        
+        return ( GenerateShapePerceptualHashTile( numpy_image ), None )
+        
+    except Exception as e:
+        
+        return ( None, e )
+        
     
 def GenerateThumbnailFromStaticImageCV( path, dimensions = HC.UNSCALED_THUMBNAIL_DIMENSIONS, mime = None ):
     
@@ -4,6 +4,7 @@ import ClientNetworkingDomain
 import ClientParsing
 import ClientPaths
 import collections
+import heapq
 import HydrusConstants as HC
 import HydrusData
 import HydrusExceptions
@@ -18,6 +19,7 @@ import threading
 import time
 import traceback
 import urlparse
+import weakref
 
 def GenerateSeedCacheStatus( statuses_to_counts ):
     
@@ -251,6 +253,9 @@ class Seed( HydrusSerialisable.SerialisableBase ):
         self.seed_type = seed_type
         self.seed_data = seed_data
         
+        # the seed cache holding this seed, so a status change can update its index as it happens
+        self._seed_cache_ref = None
+        
         self.created = HydrusData.GetNow()
         self.modified = self.created
         self.source_time = None
@@ -311,6 +316,23 @@ class Seed( HydrusSerialisable.SerialisableBase ):
         return associable_urls
         
     
+    def _GetStatus( self ):
+        
+        return self._status
+        
+    
+    def _SetStatus( self, status ):
+        
+        self._status = status
+        
+        seed_cache = None if self._seed_cache_ref is None else self._seed_cache_ref()
+        
+        if seed_cache is not None:
+            
+            seed_cache.NotifySeedStatusChanged( self )
+            
+        
+    
     def _UpdateModified( self ):
         
         self.modified = HydrusData.GetNow()
@@ -646,6 +668,11 @@ class Seed( HydrusSerialisable.SerialisableBase ):
         self._referral_url = referral_url
         
     
+    def SetSeedCache( self, seed_cache ):
+        
+        self._seed_cache_ref = weakref.ref( seed_cache )
+        
+    
     def SetStatus( self, status, note = '', exception = None ):
         
         if exception is not None:
@@ -1020,6 +1047,8 @@ class Seed( HydrusSerialisable.SerialisableBase ):
         return did_work
         
     
+    status = property( _GetStatus, _SetStatus )
+    
 HydrusSerialisable.SERIALISABLE_TYPES_TO_OBJECT_TYPES[ HydrusSerialisable.SERIALISABLE_TYPE_SEED ] = Seed
 
 class SeedCache( HydrusSerialisable.SerialisableBase ):
@@ -1034,8 +1063,20 @@ class SeedCache( HydrusSerialisable.SerialisableBase ):
         
         self._seeds = HydrusSerialisable.SerialisableList()
         
+        # a loaded seed cache keeps its seed serialisable info here and only creates the seeds when something needs them
+        self._unloaded_serialisable_info = None
+        
         self._seeds_to_indices = {}
         
+        self._seeds_to_indexed_statuses = {}
+        self._statuses_to_indexed_seeds = collections.defaultdict( set )
+        
+        # heaps of ( index, seed ) for the statuses GetNextSeed has been asked about. stale entries are discarded as they surface
+        self._statuses_to_next_seed_heaps = {}
+        
+        # seeds in file order for the statuses GetSeeds has been asked about, dropped whenever a seed moves in or out
+        self._statuses_to_sorted_seeds = {}
+        
         self._seed_cache_key = HydrusData.GenerateKey()
         
         self._status_cache = None
@@ -1043,12 +1084,16 @@ class SeedCache( HydrusSerialisable.SerialisableBase ):
         
         self._status_dirty = True
         
-        self._lock = threading.Lock()
+        # seeds tell us about their status changes, and that can happen while we hold this
+        self._lock = threading.RLock()
         
     
     def __len__( self ):
         
-        return len( self._seeds )
+        with self._lock:
+            
+            return self._GetSeedCount()
+            
         
     
     def _GenerateStatus( self ):
@@ -1061,13 +1106,58 @@ class SeedCache( HydrusSerialisable.SerialisableBase ):
         self._status_dirty = False
         
     
+    def _GetSeedCount( self, status = None ):
+        
+        if status is None:
+            
+            if self._seeds is None:
+                
+                ( serialisable_type, version, serialisable_seeds ) = self._unloaded_serialisable_info
+                
+                return len( serialisable_seeds )
+                
+            else:
+                
+                return len( self._seeds )
+                
+            
+        else:
+            
+            return self._GetStatusesToCounts()[ status ]
+            
+        
+    
     def _GetStatusesToCounts( self ):
         
         statuses_to_counts = collections.Counter()
         
-        for seed in self._seeds:
+        if self._seeds is None:
+            
+            # we can count straight from the serialisable info, as long as none of it needs updating
             
-            statuses_to_counts[ seed.status ] += 1
+            ( serialisable_type, version, serialisable_seeds ) = self._unloaded_serialisable_info
+            
+            for ( seed_serialisable_type, seed_version, seed_serialisable_info ) in serialisable_seeds:
+                
+                if seed_version != Seed.SERIALISABLE_VERSION:
+                    
+                    self._LoadSeeds()
+                    
+                    return self._GetStatusesToCounts()
+                    
+                
+                statuses_to_counts[ seed_serialisable_info[5] ] += 1
+                
+            
+        else:
+            
+            for ( status, seeds ) in self._statuses_to_indexed_seeds.items():
+                
+                if len( seeds ) > 0:
+                    
+                    statuses_to_counts[ status ] = len( seeds )
+                    
+                
             
         
         return statuses_to_counts
@@ -1075,13 +1165,20 @@ class SeedCache( HydrusSerialisable.SerialisableBase ):
     
     def _GetSeeds( self, status = None ):
         
+        self._LoadSeeds()
+        
         if status is None:
             
             return list( self._seeds )
             
         else:
             
-            return [ seed for seed in self._seeds if seed.status == status ]
+            if status not in self._statuses_to_sorted_seeds:
+                
+                self._statuses_to_sorted_seeds[ status ] = sorted( self._statuses_to_indexed_seeds[ status ], key = lambda seed: self._seeds_to_indices[ seed ] )
+                
+            
+            return list( self._statuses_to_sorted_seeds[ status ] )
             
         
     
@@ -1089,6 +1186,11 @@ class SeedCache( HydrusSerialisable.SerialisableBase ):
         
         with self._lock:
             
+            if self._seeds is None:
+                
+                return self._unloaded_serialisable_info
+                
+            
             return self._seeds.GetSerialisableTuple()
             
         
@@ -1110,6 +1212,8 @@ class SeedCache( HydrusSerialisable.SerialisableBase ):
     
     def _HasSeed( self, seed ):
         
+        self._LoadSeeds()
+        
         search_seeds = seed.GetSearchSeeds()
         
         has_seed = True in ( search_seed in self._seeds_to_indices for search_seed in search_seeds )
@@ -1117,13 +1221,74 @@ class SeedCache( HydrusSerialisable.SerialisableBase ):
         return has_seed
         
     
+    def _IndexSeedStatus( self, seed ):
+        
+        status = seed.status
+        
+        old_status = self._seeds_to_indexed_statuses.get( seed, None )
+        
+        if old_status == status:
+            
+            return
+            
+        
+        if old_status is None:
+            
+            seed.SetSeedCache( self )
+            
+        else:
+            
+            self._statuses_to_indexed_seeds[ old_status ].discard( seed )
+            
+            self._statuses_to_sorted_seeds.pop( old_status, None )
+            
+        
+        self._seeds_to_indexed_statuses[ seed ] = status
+        self._statuses_to_indexed_seeds[ status ].add( seed )
+        
+        self._statuses_to_sorted_seeds.pop( status, None )
+        
+        if status in self._statuses_to_next_seed_heaps:
+            
+            heapq.heappush( self._statuses_to_next_seed_heaps[ status ], ( self._seeds_to_indices[ seed ], seed ) )
+            
+        
+    
     def _InitialiseFromSerialisableInfo( self, serialisable_info ):
         
         with self._lock:
             
-            self._seeds = HydrusSerialisable.CreateFromSerialisableTuple( serialisable_info )
+            self._seeds = None
             
-            self._seeds_to_indices = { seed : index for ( index, seed ) in enumerate( self._seeds ) }
+            self._unloaded_serialisable_info = serialisable_info
+            
+        
+    
+    def _LoadSeeds( self ):
+        
+        if self._seeds is None:
+            
+            self._seeds = HydrusSerialisable.CreateFromSerialisableTuple( self._unloaded_serialisable_info )
+            
+            self._unloaded_serialisable_info = None
+            
+            self._ReindexSeeds()
+            
+        
+    
+    def _ReindexSeeds( self ):
+        
+        self._seeds_to_indices = { seed : index for ( index, seed ) in enumerate( self._seeds ) }
+        
+        self._seeds_to_indexed_statuses = {}
+        self._statuses_to_indexed_seeds = collections.defaultdict( set )
+        
+        self._statuses_to_next_seed_heaps = {}
+        self._statuses_to_sorted_seeds = {}
+        
+        for seed in self._seeds:
+            
+            self._IndexSeedStatus( seed )
             
         
     
@@ -1364,6 +1529,8 @@ class SeedCache( HydrusSerialisable.SerialisableBase ):
                 
                 self._seeds_to_indices[ seed ] = len( self._seeds ) - 1
                 
+                self._IndexSeedStatus( seed )
+                
             
             self._SetStatusDirty()
             
@@ -1377,6 +1544,8 @@ class SeedCache( HydrusSerialisable.SerialisableBase ):
         
         with self._lock:
             
+            self._LoadSeeds()
+            
             if seed in self._seeds_to_indices:
                 
                 index = self._seeds_to_indices[ seed ]
@@ -1388,7 +1557,7 @@ class SeedCache( HydrusSerialisable.SerialisableBase ):
                     self._seeds.insert( index - 1, seed )
                     
                 
-                self._seeds_to_indices = { seed : index for ( index, seed ) in enumerate( self._seeds ) }
+                self._ReindexSeeds()
                 
             
         
@@ -1399,6 +1568,8 @@ class SeedCache( HydrusSerialisable.SerialisableBase ):
         
         with self._lock:
             
+            self._LoadSeeds()
+            
             if len( self._seeds ) <= 100:
                 
                 return False
@@ -1425,6 +1596,8 @@ class SeedCache( HydrusSerialisable.SerialisableBase ):
         
         with self._lock:
             
+            self._LoadSeeds()
+            
             if len( self._seeds ) <= 100:
                 
                 return
@@ -1446,7 +1619,7 @@ class SeedCache( HydrusSerialisable.SerialisableBase ):
             new_seeds.extend( self._seeds[-100:] )
             
             self._seeds = new_seeds
-            self._seeds_to_indices = { seed : index for ( index, seed ) in enumerate( self._seeds ) }
+            self._ReindexSeeds()
             
             self._SetStatusDirty()
             
@@ -1456,6 +1629,8 @@ class SeedCache( HydrusSerialisable.SerialisableBase ):
         
         with self._lock:
             
+            self._LoadSeeds()
+            
             if seed in self._seeds_to_indices:
                 
                 index = self._seeds_to_indices[ seed ]
@@ -1467,7 +1642,7 @@ class SeedCache( HydrusSerialisable.SerialisableBase ):
                     self._seeds.insert( index + 1, seed )
                     
                 
-                self._seeds_to_indices = { seed : index for ( index, seed ) in enumerate( self._seeds ) }
+                self._ReindexSeeds()
                 
             
         
@@ -1478,6 +1653,8 @@ class SeedCache( HydrusSerialisable.SerialisableBase ):
         
         with self._lock:
             
+            self._LoadSeeds()
+            
             if len( self._seeds ) == 0:
                 
                 return None
@@ -1493,6 +1670,8 @@ class SeedCache( HydrusSerialisable.SerialisableBase ):
         
         with self._lock:
             
+            self._LoadSeeds()
+            
             if len( self._seeds ) == 0:
                 
                 return 0
@@ -1508,6 +1687,8 @@ class SeedCache( HydrusSerialisable.SerialisableBase ):
         
         with self._lock:
             
+            self._LoadSeeds()
+            
             if len( self._seeds ) == 0:
                 
                 return 0
@@ -1523,16 +1704,33 @@ class SeedCache( HydrusSerialisable.SerialisableBase ):
         
         with self._lock:
             
-            for seed in self._seeds:
+            self._LoadSeeds()
+            
+            if status not in self._statuses_to_next_seed_heaps:
+                
+                heap = [ ( self._seeds_to_indices[ seed ], seed ) for seed in self._statuses_to_indexed_seeds[ status ] ]
+                
+                heapq.heapify( heap )
+                
+                self._statuses_to_next_seed_heaps[ status ] = heap
+                
+            
+            heap = self._statuses_to_next_seed_heaps[ status ]
+            
+            while len( heap ) > 0:
+                
+                ( index, seed ) = heap[0]
                 
-                if seed.status == status:
+                if self._seeds_to_indices.get( seed, None ) == index and self._seeds_to_indexed_statuses.get( seed, None ) == status:
                     
                     return seed
                     
                 
+                heapq.heappop( heap )
+                
+            
+            return None
             
-        
-        return None
         
     
     def GetNumNewFilesSince( self, since ):
@@ -1541,6 +1739,8 @@ class SeedCache( HydrusSerialisable.SerialisableBase ):
         
         with self._lock:
             
+            self._LoadSeeds()
+            
             for seed in self._seeds:
                 
                 source_timestamp = self._GetSourceTimestamp( seed )
@@ -1559,6 +1759,8 @@ class SeedCache( HydrusSerialisable.SerialisableBase ):
         
         with self._lock:
             
+            self._LoadSeeds()
+            
             hashes = []
             
             for seed in self._seeds:
@@ -1580,27 +1782,9 @@ class SeedCache( HydrusSerialisable.SerialisableBase ):
     
     def GetSeedCount( self, status = None ):
         
-        result = 0
-        
         with self._lock:
             
-            if status is None:
-                
-                result = len( self._seeds )
-                
-            else:
-                
-                for seed in self._seeds:
-                    
-                    if seed.status == status:
-                        
-                        result += 1
-                        
-                    
-                
-            
-        
-        return result
+            return self._GetSeedCount( status )
         
     
     def GetSeeds( self, status = None ):
@@ -1615,6 +1799,8 @@ class SeedCache( HydrusSerialisable.SerialisableBase ):
         
         with self._lock:
             
+            self._LoadSeeds()
+            
             return self._seeds_to_indices[ seed ]
             
         
@@ -1687,6 +1873,8 @@ class SeedCache( HydrusSerialisable.SerialisableBase ):
         
         with self._lock:
             
+            self._LoadSeeds()
+            
             index = min( index, len( self._seeds ) )
             
             for seed in seeds:
@@ -1705,7 +1893,7 @@ class SeedCache( HydrusSerialisable.SerialisableBase ):
                 index += 1
                 
             
-            self._seeds_to_indices = { seed : index for ( index, seed ) in enumerate( self._seeds ) }
+            self._ReindexSeeds()
             
             self._SetStatusDirty()
             
@@ -1715,10 +1903,43 @@ class SeedCache( HydrusSerialisable.SerialisableBase ):
         return len( new_seeds )
         
     
+    def NotifySeedStatusChanged( self, seed ):
+        
+        with self._lock:
+            
+            if self._seeds is None:
+                
+                return
+                
+            
+            index = self._seeds_to_indices.get( seed, None )
+            
+            # a seed we have since dropped may still report to us, so only take it if it is the very one we hold
+            
+            if index is not None and self._seeds[ index ] is seed:
+                
+                self._IndexSeedStatus( seed )
+                
+                self._SetStatusDirty()
+                
+            
+        
+    
     def NotifySeedsUpdated( self, seeds ):
         
         with self._lock:
             
+            if self._seeds is not None:
+                
+                for seed in seeds:
+                    
+                    if seed in self._seeds_to_indices:
+                        
+                        self._IndexSeedStatus( self._seeds[ self._seeds_to_indices[ seed ] ] )
+                        
+                    
+                
+            
             self._SetStatusDirty()
             
         
@@ -1729,11 +1950,13 @@ class SeedCache( HydrusSerialisable.SerialisableBase ):
         
         with self._lock:
             
+            self._LoadSeeds()
+            
             seeds_to_delete = set( seeds )
             
             self._seeds = HydrusSerialisable.SerialisableList( [ seed for seed in self._seeds if seed not in seeds_to_delete ] )
             
-            self._seeds_to_indices = { seed : index for ( index, seed ) in enumerate( self._seeds ) }
+            self._ReindexSeeds()
             
             self._SetStatusDirty()
             
@@ -1745,7 +1968,14 @@ class SeedCache( HydrusSerialisable.SerialisableBase ):
         
         with self._lock:
             
-            seeds_to_delete = [ seed for seed in self._seeds if seed.status in statuses_to_remove ]
+            self._LoadSeeds()
+            
+            seeds_to_delete = set()
+            
+            for status in statuses_to_remove:
+                
+                seeds_to_delete.update( self._statuses_to_indexed_seeds[ status ] )
+                
             
         
         self.RemoveSeeds( seeds_to_delete )
@@ -1755,7 +1985,9 @@ class SeedCache( HydrusSerialisable.SerialisableBase ):
         
         with self._lock:
             
-            seeds_to_delete = [ seed for seed in self._seeds if seed.status != CC.STATUS_UNKNOWN ]
+            self._LoadSeeds()
+            
+            seeds_to_delete = set( self._seeds ).difference( self._statuses_to_indexed_seeds[ CC.STATUS_UNKNOWN ] )
             
         
         self.RemoveSeeds( seeds_to_delete )
@@ -49,7 +49,9 @@ class HydrusResourceBooruFile( HydrusResourceBooru ):
         
         path = client_files_manager.GetFilePath( hash, mime )
         
-        response_context = HydrusServerResources.ResponseContext( 200, mime = mime, path = path )
+        etag = HydrusServerResources.GenerateETag( hash )
+        
+        response_context = HydrusServerResources.ResponseContext( 200, mime = mime, path = path, etag = etag )
         
         return response_context
         
@@ -265,7 +267,9 @@ class HydrusResourceBooruThumbnail( HydrusResourceBooru ):
             path = os.path.join( HC.STATIC_DIR, 'hydrus.png' )
             
         
-        response_context = HydrusServerResources.ResponseContext( 200, mime = response_context_mime, path = path )
+        etag = HydrusServerResources.GenerateETag( hash, path )
+        
+        response_context = HydrusServerResources.ResponseContext( 200, mime = response_context_mime, path = path, etag = etag )
         
         return response_context
         
@@ -280,7 +284,9 @@ class HydrusResourceLocalFile( HydrusServerResources.HydrusResource ):
         
         path = client_files_manager.GetFilePath( hash )
         
-        response_context = HydrusServerResources.ResponseContext( 200, mime = HC.APPLICATION_UNKNOWN, path = path )
+        etag = HydrusServerResources.GenerateETag( hash )
+        
+        response_context = HydrusServerResources.ResponseContext( 200, mime = HC.APPLICATION_UNKNOWN, path = path, etag = etag )
         
         return response_context
         
@@ -295,7 +301,9 @@ class HydrusResourceLocalThumbnail( HydrusServerResources.HydrusResource ):
         
         path = client_files_manager.GetFullSizeThumbnailPath( hash )
         
-        response_context = HydrusServerResources.ResponseContext( 200, mime = HC.APPLICATION_UNKNOWN, path = path )
+        etag = HydrusServerResources.GenerateETag( hash, path )
+        
+        response_context = HydrusServerResources.ResponseContext( 200, mime = HC.APPLICATION_UNKNOWN, path = path, etag = etag )
         
         return response_context
         
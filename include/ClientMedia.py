@@ -6,7 +6,6 @@ import ClientRatings
 import ClientSearch
 import ClientTags
 import HydrusConstants as HC
-import HydrusTags
 import os
 import random
 import time
@@ -17,7 +16,6 @@ import HydrusFileHandling
 import HydrusExceptions
 import HydrusGlobals as HG
 import HydrusSerialisable
-import itertools
 
 def FlattenMedia( media_list ):
     
@@ -183,45 +181,29 @@ def GetDuplicateComparisonStatements( shown_media, comparison_media ):
     
 def MergeTagsManagers( tags_managers ):
     
-    def CurrentAndPendingFilter( items ):
+    # merge the ids, so no tag strings are built just to be interned again
+    
+    merged_service_keys_to_statuses_to_tag_ids = collections.defaultdict( lambda: collections.defaultdict( set ) )
+    
+    for tags_manager in tags_managers:
         
-        for ( service_key, statuses_to_tags ) in items:
-            
-            filtered = { status : tags for ( status, tags ) in statuses_to_tags.items() if status in ( HC.CONTENT_STATUS_CURRENT, HC.CONTENT_STATUS_PENDING ) }
+        for ( service_key, statuses_to_tag_ids ) in tags_manager.GetServiceKeysToStatusesToTagIds().items():
             
-            yield ( service_key, filtered )
+            for status in ( HC.CONTENT_STATUS_CURRENT, HC.CONTENT_STATUS_PENDING ):
+                
+                if status in statuses_to_tag_ids:
+                    
+                    merged_service_keys_to_statuses_to_tag_ids[ service_key ][ status ].update( statuses_to_tag_ids[ status ] )
+                    
+                
             
         
     
-    # [[( service_key, statuses_to_tags )]]
-    s_k_s_t_t_tupled = ( CurrentAndPendingFilter( tags_manager.GetServiceKeysToStatusesToTags().items() ) for tags_manager in tags_managers )
-    
-    # [(service_key, statuses_to_tags)]
-    flattened_s_k_s_t_t = itertools.chain.from_iterable( s_k_s_t_t_tupled )
+    merged_tags_manager = TagsManager( {} )
     
-    # service_key : [ statuses_to_tags ]
-    s_k_s_t_t_dict = HydrusData.BuildKeyToListDict( flattened_s_k_s_t_t )
+    merged_tags_manager.SetServiceKeysToStatusesToTagIds( merged_service_keys_to_statuses_to_tag_ids )
     
-    # now let's merge so we have service_key : statuses_to_tags
-    
-    merged_service_keys_to_statuses_to_tags = collections.defaultdict( HydrusData.default_dict_set )
-    
-    for ( service_key, several_statuses_to_tags ) in s_k_s_t_t_dict.items():
-        
-        # [[( status, tags )]]
-        s_t_t_tupled = ( s_t_t.items() for s_t_t in several_statuses_to_tags )
-        
-        # [( status, tags )]
-        flattened_s_t_t = itertools.chain.from_iterable( s_t_t_tupled )
-        
-        statuses_to_tags = HydrusData.default_dict_set()
-        
-        for ( status, tags ) in flattened_s_t_t: statuses_to_tags[ status ].update( tags )
-        
-        merged_service_keys_to_statuses_to_tags[ service_key ] = statuses_to_tags
-        
-    
-    return TagsManager( merged_service_keys_to_statuses_to_tags )
+    return merged_tags_manager
     
 class DuplicatesManager( object ):
     
@@ -589,6 +571,9 @@ class MediaList( object ):
         self._collect_map_singletons = {}
         self._collect_map_collected = {}
         
+        self._hashes_to_collection_keys = {}
+        self._hashes_to_collection_keys_collect_by = None
+        
         self._sorted_media = SortedList( [ self._GenerateMediaSingleton( media_result ) for media_result in media_results ] )
         
         self._singleton_media = set( self._sorted_media )
@@ -609,10 +594,25 @@ class MediaList( object ):
         namespaces_to_collect_by = [ data for ( collect_by_type, data ) in collect_by if collect_by_type == 'namespace' ]
         ratings_to_collect_by = [ data for ( collect_by_type, data ) in collect_by if collect_by_type == 'rating' ]
         
-        services_manager = HG.client_controller.services_manager
+        # keys are cached by hash, so a recollect only has to slice the files whose tags or ratings changed since the last one
+        
+        if collect_by != self._hashes_to_collection_keys_collect_by:
+            
+            self._hashes_to_collection_keys = {}
+            self._hashes_to_collection_keys_collect_by = list( collect_by )
+            
         
         for media in medias:
             
+            hash = media.GetHash()
+            
+            if hash in self._hashes_to_collection_keys:
+                
+                keys_to_medias[ self._hashes_to_collection_keys[ hash ] ].append( media )
+                
+                continue
+                
+            
             if len( namespaces_to_collect_by ) > 0:
                 
                 namespace_key = media.GetTagsManager().GetNamespaceSlice( namespaces_to_collect_by )
@@ -631,7 +631,11 @@ class MediaList( object ):
                 rating_key = None
                 
             
-            keys_to_medias[ ( namespace_key, rating_key ) ].append( media )
+            key = ( namespace_key, rating_key )
+            
+            self._hashes_to_collection_keys[ hash ] = key
+            
+            keys_to_medias[ key ].append( media )
             
         
         return keys_to_medias
@@ -721,6 +725,33 @@ class MediaList( object ):
         return False
         
     
+    def _InvalidateCachedKeys( self, hashes = None ):
+        
+        if hashes is None:
+            
+            self._sorted_media.invalidate_sort_keys()
+            
+            self._hashes_to_collection_keys = {}
+            
+        else:
+            
+            self._sorted_media.invalidate_sort_keys( self._GetMedia( hashes ) )
+            
+            self._PruneCollectionKeys( hashes )
+            
+        
+    
+    def _PruneCollectionKeys( self, hashes ):
+        
+        for hash in hashes:
+            
+            if hash in self._hashes_to_collection_keys:
+                
+                del self._hashes_to_collection_keys[ hash ]
+                
+            
+        
+    
     def _RecalcHashes( self ):
         
         self._hashes = set()
@@ -764,6 +795,8 @@ class MediaList( object ):
             media._RemoveMediaByHashes( hashes )
             
         
+        self._PruneCollectionKeys( hashes )
+        
         affected_collected_media = [ media for media in self._collected_media if media.HasNoMedia() ]
         
         self._RemoveMediaDirectly( affected_singleton_media, affected_collected_media )
@@ -784,14 +817,19 @@ class MediaList( object ):
         self._singleton_media.difference_update( singleton_media )
         self._collected_media.difference_update( collected_media )
         
-        keys_to_remove = [ key for ( key, media ) in self._collect_map_singletons if media in singleton_media ]
+        for media in singleton_media.union( collected_media ):
+            
+            self._PruneCollectionKeys( media.GetHashes() )
+            
+        
+        keys_to_remove = [ key for ( key, media ) in self._collect_map_singletons.items() if media in singleton_media ]
         
         for key in keys_to_remove:
             
             del self._collect_map_singletons[ key ]
             
         
-        keys_to_remove = [ key for ( key, media ) in self._collect_map_collected if media in collected_media ]
+        keys_to_remove = [ key for ( key, media ) in self._collect_map_collected.items() if media in collected_media ]
         
         for key in keys_to_remove:
             
@@ -821,7 +859,7 @@ class MediaList( object ):
             
         else:
             
-            if self._collect_by is not None:
+            if self._collect_by is not None and len( self._collect_by ) > 0:
                 
                 keys_to_medias = self._CalculateCollectionKeysToMedias( self._collect_by, new_media )
                 
@@ -833,7 +871,7 @@ class MediaList( object ):
                         
                         singleton_media = self._collect_map_singletons[ key ]
                         
-                        self._sorted_media.remove_items( singleton_media )
+                        self._sorted_media.remove_items( ( singleton_media, ) )
                         self._singleton_media.discard( singleton_media )
                         del self._collect_map_singletons[ key ]
                         
@@ -852,7 +890,7 @@ class MediaList( object ):
                         
                         collected_media = self._collect_map_collected[ key ]
                         
-                        self._sorted_media.remove_items( collected_media )
+                        self._sorted_media.remove_items( ( collected_media, ) )
                         
                         collected_media.AddMedia( medias )
                         
@@ -867,6 +905,8 @@ class MediaList( object ):
                         self._singleton_media.add( singleton_media )
                         self._collect_map_singletons[ key ] = singleton_media
                         
+                        new_media.append( singleton_media )
+                        
                     else:
                         
                         collected_media = self._GenerateMediaCollection( [ media.GetMediaResult() for media in medias ] )
@@ -928,6 +968,8 @@ class MediaList( object ):
         
         for media in self._collected_media: media.DeletePending( service_key )
         
+        self._InvalidateCachedKeys()
+        
     
     def GenerateMediaResults( self, has_location = None, discriminant = None, selected_media = None, unrated = None, for_media_viewer = False ):
         
@@ -1143,6 +1185,13 @@ class MediaList( object ):
     
     def HasNoMedia( self ): return len( self._sorted_media ) == 0
     
+    def NotifyNewTagDisplay( self ):
+        
+        # siblings or display options may have changed what every file's tags look like, so collection and sort keys are recalculated next time
+        
+        self._InvalidateCachedKeys()
+        
+    
     def ProcessContentUpdate( self, service_key, content_update ):
         
         ( data_type, action, row ) = content_update.ToTuple()
@@ -1154,6 +1203,8 @@ class MediaList( object ):
             media.ProcessContentUpdate( service_key, content_update )
             
         
+        self._InvalidateCachedKeys( hashes )
+        
         if data_type == HC.CONTENT_TYPE_FILES:
             
             if action == HC.CONTENT_UPDATE_DELETE:
@@ -1219,6 +1270,8 @@ class MediaList( object ):
             
             for media in self._collected_media: media.ResetService( service_key )
             
+            self._InvalidateCachedKeys()
+            
         
     
     def Sort( self, media_sort = None ):
@@ -1258,6 +1311,8 @@ class ListeningMediaList( MediaList ):
         
         HG.client_controller.sub( self, 'ProcessContentUpdates', 'content_updates_gui' )
         HG.client_controller.sub( self, 'ProcessServiceUpdates', 'service_updates_gui' )
+        HG.client_controller.sub( self, 'NotifyNewTagDisplay', 'notify_new_siblings_gui' )
+        HG.client_controller.sub( self, 'NotifyNewTagDisplay', 'notify_new_options' )
         
     
     def AddMediaResults( self, media_results, append = True ):
@@ -2184,13 +2239,17 @@ class SortedList( object ):
         
         self._sorted_list = list( initial_items )
         
+        self._items_to_sort_keys = {}
+        self._is_sorted = False
+        
+        # every index below this is known to be correct in _items_to_indices
         self._items_to_indices = {}
-        self._indices_dirty = True
+        self._first_dirty_index = 0
         
     
     def __contains__( self, item ):
         
-        if self._indices_dirty:
+        if self._first_dirty_index < len( self._sorted_list ):
             
             self._RecalcIndices()
             
@@ -2213,36 +2272,108 @@ class SortedList( object ):
         return len( self._sorted_list )
         
     
-    def _DirtyIndices( self ):
+    def _DirtyIndices( self, index = 0 ):
+        
+        self._first_dirty_index = min( self._first_dirty_index, index )
+        
+    
+    def _GetInsertionIndex( self, sort_key ):
+        
+        # bisect_right, so an insert lands after equal items just as append-then-stable-sort would put it
+        
+        items_to_sort_keys = self._items_to_sort_keys
+        
+        lo = 0
+        hi = len( self._sorted_list )
+        
+        while lo < hi:
+            
+            mid = ( lo + hi ) // 2
+            
+            mid_sort_key = items_to_sort_keys[ self._sorted_list[ mid ] ]
+            
+            if self._sort_reverse:
+                
+                goes_after = mid_sort_key >= sort_key
+                
+            else:
+                
+                goes_after = mid_sort_key <= sort_key
+                
+            
+            if goes_after:
+                
+                lo = mid + 1
+                
+            else:
+                
+                hi = mid
+                
+            
+        
+        return lo
+        
+    
+    def _GetSortKey( self, item ):
         
-        self._indices_dirty = True
+        if item not in self._items_to_sort_keys:
+            
+            self._items_to_sort_keys[ item ] = self._sort_key( item )
+            
+        
+        return self._items_to_sort_keys[ item ]
         
     
     def _RecalcIndices( self ):
         
-        self._items_to_indices = { item : index for ( index, item ) in enumerate( self._sorted_list ) }
+        if self._first_dirty_index == 0:
+            
+            self._items_to_indices = { item : index for ( index, item ) in enumerate( self._sorted_list ) }
+            
+        else:
+            
+            start = self._first_dirty_index
+            
+            self._items_to_indices.update( ( ( item, index ) for ( index, item ) in enumerate( self._sorted_list[ start : ], start = start ) ) )
+            
         
-        self._indices_dirty = False
+        self._first_dirty_index = len( self._sorted_list )
         
     
-    def append_items( self, items ):
+    def _SortByCachedKeys( self ):
         
-        if self._indices_dirty is None:
+        for item in self._sorted_list:
             
-            self._RecalcIndices()
+            self._GetSortKey( item )
             
         
-        for ( i, item ) in enumerate( items, start = len( self._sorted_list ) ):
+        self._sorted_list.sort( key = self._items_to_sort_keys.__getitem__, reverse = self._sort_reverse )
+        
+        self._is_sorted = True
+        
+        self._DirtyIndices()
+        
+    
+    def append_items( self, items ):
+        
+        if self._first_dirty_index == len( self._sorted_list ):
             
-            self._items_to_indices[ item ] = i
+            for ( i, item ) in enumerate( items, start = len( self._sorted_list ) ):
+                
+                self._items_to_indices[ item ] = i
+                
+            
+            self._first_dirty_index += len( items )
             
         
         self._sorted_list.extend( items )
         
+        self._is_sorted = False
+        
     
     def index( self, item ):
         
-        if self._indices_dirty:
+        if self._first_dirty_index < len( self._sorted_list ):
             
             self._RecalcIndices()
             
@@ -2261,23 +2392,82 @@ class SortedList( object ):
     
     def insert_items( self, items ):
         
-        self.append_items( items )
+        if self._sort_key is None:
+            
+            self.append_items( items )
+            
+            return
+            
+        
+        # each bisect insert is a memmove of the list, so a big batch is cheaper as one stable sort of the nearly sorted list
+        
+        if self._is_sorted and len( items ) * 32 <= len( self._sorted_list ):
+            
+            for item in items:
+                
+                index = self._GetInsertionIndex( self._GetSortKey( item ) )
+                
+                self._sorted_list.insert( index, item )
+                
+                self._DirtyIndices( index )
+                
+            
+        else:
+            
+            self._sorted_list.extend( items )
+            
+            self._SortByCachedKeys()
+            
+        
+    
+    def invalidate_sort_keys( self, items = None ):
+        
+        if items is None:
+            
+            self._items_to_sort_keys = {}
+            
+        else:
+            
+            for item in items:
+                
+                if item in self._items_to_sort_keys:
+                    
+                    del self._items_to_sort_keys[ item ]
+                    
+                
+            
         
-        self.sort()
+        # the items may now be out of place, so the next insert will resort
+        
+        self._is_sorted = False
         
     
     def remove_items( self, items ):
         
         deletee_indices = [ self.index( item ) for item in items ]
         
+        if len( deletee_indices ) == 0:
+            
+            return
+            
+        
         deletee_indices.sort( reverse = True )
         
         for index in deletee_indices:
             
+            item = self._sorted_list[ index ]
+            
             del self._sorted_list[ index ]
             
+            del self._items_to_indices[ item ]
+            
+            if item in self._items_to_sort_keys:
+                
+                del self._items_to_sort_keys[ item ]
+                
+            
         
-        self._DirtyIndices()
+        self._DirtyIndices( deletee_indices[-1] )
         
     
     def sort( self, sort_key = None, reverse = False ):
@@ -2293,85 +2483,188 @@ class SortedList( object ):
             self._sort_reverse = reverse
             
         
-        self._sorted_list.sort( key = sort_key, reverse = reverse )
-        
-        self._DirtyIndices()
+        if sort_key is None:
+            
+            self._sorted_list.sort( reverse = reverse )
+            
+            self._DirtyIndices()
+            
+        else:
+            
+            # an explicit sort is the point where all the cached keys are brought up to date
+            
+            self._items_to_sort_keys = {}
+            
+            self._SortByCachedKeys()
+            
         
     
 class TagsManagerSimple( object ):
     
     def __init__( self, service_keys_to_statuses_to_tags ):
         
-        self._service_keys_to_statuses_to_tags = service_keys_to_statuses_to_tags
+        # service_key : status : sorted tuple of ClientTags.tag_id_table ids, with empty statuses not stored
+        self._service_keys_to_statuses_to_tag_ids = {}
+        
+        # the tag sets the getters hand out, built when first asked for and dropped when that service's tags change
+        # as with the sets this class used to store, they are shared, so callers must not change them
+        self._service_keys_to_statuses_to_tags_cache = {}
+        
+        for ( service_key, statuses_to_tags ) in service_keys_to_statuses_to_tags.items():
+            
+            statuses_to_tag_ids = { status : ClientTags.tag_id_table.GetTagIds( tags ) for ( status, tags ) in statuses_to_tags.items() }
+            
+            self._SetStatusesToTagIds( service_key, statuses_to_tag_ids )
+            
         
         self._combined_namespaces_cache = None
         
     
-    def _RecalcCombinedIfNeeded( self ):
+    def _GetCombinedNamespacesToTagIds( self ):
         
-        pass
+        self._RecalcCombinedIfNeeded()
+        
+        if self._combined_namespaces_cache is None:
+            
+            tag_id_table = ClientTags.tag_id_table
+            
+            combined_tag_ids = set( self._GetTagIds( CC.COMBINED_TAG_SERVICE_KEY, HC.CONTENT_STATUS_CURRENT ) )
+            combined_tag_ids.update( self._GetTagIds( CC.COMBINED_TAG_SERVICE_KEY, HC.CONTENT_STATUS_PENDING ) )
+            
+            self._combined_namespaces_cache = HydrusData.BuildKeyToListDict( ( ( tag_id_table.GetNamespace( tag_id ), tag_id ) for tag_id in combined_tag_ids ) )
+            
+        
+        return self._combined_namespaces_cache
         
     
-    def Duplicate( self ):
+    def _GenerateStatusesToTags( self, service_key ):
         
-        dupe_service_keys_to_statuses_to_tags = collections.defaultdict( HydrusData.default_dict_set )
+        statuses_to_tags = HydrusData.default_dict_set()
         
-        for ( service_key, statuses_to_tags ) in self._service_keys_to_statuses_to_tags.items():
+        if service_key in self._service_keys_to_statuses_to_tag_ids:
+            
+            for ( status, tag_ids ) in self._service_keys_to_statuses_to_tag_ids[ service_key ].items():
+                
+                statuses_to_tags[ status ] = set( ClientTags.tag_id_table.GetTags( tag_ids ) )
+                
             
-            dupe_statuses_to_tags = HydrusData.default_dict_set()
+        
+        return statuses_to_tags
+        
+    
+    def _GetStatusesToTags( self, service_key ):
+        
+        if service_key not in self._service_keys_to_statuses_to_tags_cache:
             
-            for ( status, tags ) in statuses_to_tags.items():
+            self._service_keys_to_statuses_to_tags_cache[ service_key ] = self._GenerateStatusesToTags( service_key )
+            
+        
+        return self._service_keys_to_statuses_to_tags_cache[ service_key ]
+        
+    
+    def _GetTagIds( self, service_key, status ):
+        
+        if service_key in self._service_keys_to_statuses_to_tag_ids:
+            
+            statuses_to_tag_ids = self._service_keys_to_statuses_to_tag_ids[ service_key ]
+            
+            if status in statuses_to_tag_ids:
                 
-                dupe_statuses_to_tags[ status ] = set( tags )
+                return statuses_to_tag_ids[ status ]
                 
             
-            dupe_service_keys_to_statuses_to_tags[ service_key ] = dupe_statuses_to_tags
+        
+        return ()
+        
+    
+    def _GetTags( self, service_key, status ):
+        
+        if service_key == CC.COMBINED_TAG_SERVICE_KEY:
+            
+            self._RecalcCombinedIfNeeded()
             
         
-        return TagsManagerSimple( dupe_service_keys_to_statuses_to_tags )
+        return self._GetStatusesToTags( service_key )[ status ]
         
     
-    def GetCombinedNamespaces( self, namespaces ):
+    def _RecalcCombinedIfNeeded( self ):
         
-        self._RecalcCombinedIfNeeded()
+        pass
         
-        if self._combined_namespaces_cache is None:
     
-            combined_statuses_to_tags = self._service_keys_to_statuses_to_tags[ CC.COMBINED_TAG_SERVICE_KEY ]
+    def _SetStatusesToTagIds( self, service_key, statuses_to_tag_ids ):
+        
+        if service_key in self._service_keys_to_statuses_to_tags_cache:
+            
+            del self._service_keys_to_statuses_to_tags_cache[ service_key ]
+            
+        
+        statuses_to_tag_ids = { status : tuple( sorted( tag_ids ) ) for ( status, tag_ids ) in statuses_to_tag_ids.items() if len( tag_ids ) > 0 }
+        
+        if len( statuses_to_tag_ids ) > 0:
             
-            combined_current = combined_statuses_to_tags[ HC.CONTENT_STATUS_CURRENT ]
-            combined_pending = combined_statuses_to_tags[ HC.CONTENT_STATUS_PENDING ]
+            self._service_keys_to_statuses_to_tag_ids[ service_key ] = statuses_to_tag_ids
             
-            pairs = ( HydrusTags.SplitTag( tag ) for tag in combined_current.union( combined_pending ) )
+        elif service_key in self._service_keys_to_statuses_to_tag_ids:
             
-            self._combined_namespaces_cache = HydrusData.BuildKeyToSetDict( ( namespace, subtag ) for ( namespace, subtag ) in pairs if namespace != '' )
+            del self._service_keys_to_statuses_to_tag_ids[ service_key ]
             
         
-        result = { namespace : self._combined_namespaces_cache[ namespace ] for namespace in namespaces }
+    
+    def Duplicate( self ):
         
-        return result
+        dupe = TagsManagerSimple( {} )
+        
+        # the tuples are immutable, so they can be shared
+        
+        dupe._service_keys_to_statuses_to_tag_ids = { service_key : dict( statuses_to_tag_ids ) for ( service_key, statuses_to_tag_ids ) in self._service_keys_to_statuses_to_tag_ids.items() }
+        
+        return dupe
         
     
-    def GetComparableNamespaceSlice( self, namespaces ):
+    def GetCombinedNamespaces( self, namespaces ):
         
-        self._RecalcCombinedIfNeeded()
+        tag_id_table = ClientTags.tag_id_table
         
-        combined_statuses_to_tags = self._service_keys_to_statuses_to_tags[ CC.COMBINED_TAG_SERVICE_KEY ]
+        namespaces_to_tag_ids = self._GetCombinedNamespacesToTagIds()
         
-        combined_current = combined_statuses_to_tags[ HC.CONTENT_STATUS_CURRENT ]
-        combined_pending = combined_statuses_to_tags[ HC.CONTENT_STATUS_PENDING ]
+        result = {}
         
-        combined = combined_current.union( combined_pending )
+        for namespace in namespaces:
+            
+            if namespace != '' and namespace in namespaces_to_tag_ids:
+                
+                result[ namespace ] = { tag_id_table.GetSubtag( tag_id ) for tag_id in namespaces_to_tag_ids[ namespace ] }
+                
+            else:
+                
+                result[ namespace ] = set()
+                
+            
         
-        pairs = [ HydrusTags.SplitTag( tag ) for tag in combined ]
+        return result
+        
+    
+    def GetComparableNamespaceSlice( self, namespaces ):
+        
+        tag_id_table = ClientTags.tag_id_table
+        
+        namespaces_to_tag_ids = self._GetCombinedNamespacesToTagIds()
         
         slice = []
         
         for desired_namespace in namespaces:
             
-            subtags = [ HydrusTags.ConvertTagToSortable( subtag ) for ( namespace, subtag ) in pairs if namespace == desired_namespace ]
-            
-            subtags.sort()
+            if desired_namespace in namespaces_to_tag_ids:
+                
+                subtags = [ tag_id_table.GetSortableSubtag( tag_id ) for tag_id in namespaces_to_tag_ids[ desired_namespace ] ]
+                
+                subtags.sort()
+                
+            else:
+                
+                subtags = []
+                
             
             slice.append( tuple( subtags ) )
             
@@ -2381,40 +2674,29 @@ class TagsManagerSimple( object ):
     
     def GetCurrent( self, service_key = CC.COMBINED_TAG_SERVICE_KEY ):
         
-        if service_key == CC.COMBINED_TAG_SERVICE_KEY:
-            
-            self._RecalcCombinedIfNeeded()
-            
-        
-        statuses_to_tags = self._service_keys_to_statuses_to_tags[ service_key ]
-        
-        return statuses_to_tags[ HC.CONTENT_STATUS_CURRENT ]
+        return self._GetTags( service_key, HC.CONTENT_STATUS_CURRENT )
         
     
     def GetDeleted( self, service_key = CC.COMBINED_TAG_SERVICE_KEY ):
         
-        if service_key == CC.COMBINED_TAG_SERVICE_KEY:
-            
-            self._RecalcCombinedIfNeeded()
-            
-        
-        statuses_to_tags = self._service_keys_to_statuses_to_tags[ service_key ]
-        
-        return statuses_to_tags[ HC.CONTENT_STATUS_DELETED ]
+        return self._GetTags( service_key, HC.CONTENT_STATUS_DELETED )
         
     
     def GetNamespaceSlice( self, namespaces ):
         
-        self._RecalcCombinedIfNeeded()
-        
-        combined_statuses_to_tags = self._service_keys_to_statuses_to_tags[ CC.COMBINED_TAG_SERVICE_KEY ]
+        tag_id_table = ClientTags.tag_id_table
         
-        combined_current = combined_statuses_to_tags[ HC.CONTENT_STATUS_CURRENT ]
-        combined_pending = combined_statuses_to_tags[ HC.CONTENT_STATUS_PENDING ]
+        namespaces_to_tag_ids = self._GetCombinedNamespacesToTagIds()
         
-        combined = combined_current.union( combined_pending )
+        slice = set()
         
-        slice = { tag for tag in combined if True in ( tag.startswith( namespace + ':' ) for namespace in namespaces ) }
+        for namespace in namespaces:
+            
+            if namespace != '' and namespace in namespaces_to_tag_ids:
+                
+                slice.update( tag_id_table.GetTags( namespaces_to_tag_ids[ namespace ] ) )
+                
+            
         
         slice = frozenset( slice )
         
@@ -2423,26 +2705,12 @@ class TagsManagerSimple( object ):
     
     def GetPending( self, service_key = CC.COMBINED_TAG_SERVICE_KEY ):
         
-        if service_key == CC.COMBINED_TAG_SERVICE_KEY:
-            
-            self._RecalcCombinedIfNeeded()
-            
-        
-        statuses_to_tags = self._service_keys_to_statuses_to_tags[ service_key ]
-        
-        return statuses_to_tags[ HC.CONTENT_STATUS_PENDING ]
+        return self._GetTags( service_key, HC.CONTENT_STATUS_PENDING )
         
     
     def GetPetitioned( self, service_key = CC.COMBINED_TAG_SERVICE_KEY ):
         
-        if service_key == CC.COMBINED_TAG_SERVICE_KEY:
-            
-            self._RecalcCombinedIfNeeded()
-            
-        
-        statuses_to_tags = self._service_keys_to_statuses_to_tags[ service_key ]
-        
-        return statuses_to_tags[ HC.CONTENT_STATUS_PETITIONED ]
+        return self._GetTags( service_key, HC.CONTENT_STATUS_PETITIONED )
         
     
 class TagsManager( TagsManagerSimple ):
@@ -2466,14 +2734,16 @@ class TagsManager( TagsManagerSimple ):
             
             combined_statuses_to_tags = collections.defaultdict( set )
             
-            for ( service_key, statuses_to_tags ) in self._service_keys_to_statuses_to_tags.items():
+            for service_key in self._service_keys_to_statuses_to_tag_ids.keys():
                 
                 if service_key == CC.COMBINED_TAG_SERVICE_KEY:
                     
                     continue
                     
                 
-                statuses_to_tags = siblings_manager.CollapseStatusesToTags( service_key, statuses_to_tags )
+                # these are thrown away once collapsed, so only the services someone actually asks about keep their tag sets
+                
+                statuses_to_tags = siblings_manager.CollapseStatusesToTags( service_key, self._GenerateStatusesToTags( service_key ) )
                 
                 combined_statuses_to_tags[ HC.CONTENT_STATUS_CURRENT ].update( statuses_to_tags[ HC.CONTENT_STATUS_CURRENT ] )
                 combined_statuses_to_tags[ HC.CONTENT_STATUS_PENDING ].update( statuses_to_tags[ HC.CONTENT_STATUS_PENDING ] )
@@ -2481,7 +2751,9 @@ class TagsManager( TagsManagerSimple ):
                 combined_statuses_to_tags[ HC.CONTENT_STATUS_DELETED ].update( statuses_to_tags[ HC.CONTENT_STATUS_DELETED ] )
                 
             
-            self._service_keys_to_statuses_to_tags[ CC.COMBINED_TAG_SERVICE_KEY ] = combined_statuses_to_tags
+            combined_statuses_to_tag_ids = { status : ClientTags.tag_id_table.GetTagIds( tags ) for ( status, tags ) in combined_statuses_to_tags.items() }
+            
+            self._SetStatusesToTagIds( CC.COMBINED_TAG_SERVICE_KEY, combined_statuses_to_tag_ids )
             
             self._combined_namespaces_cache = None
             
@@ -2491,12 +2763,14 @@ class TagsManager( TagsManagerSimple ):
     
     def DeletePending( self, service_key ):
         
-        statuses_to_tags = self._service_keys_to_statuses_to_tags[ service_key ]
-        
-        if len( statuses_to_tags[ HC.CONTENT_STATUS_PENDING ] ) + len( statuses_to_tags[ HC.CONTENT_STATUS_PETITIONED ] ) > 0:
+        if len( self._GetTagIds( service_key, HC.CONTENT_STATUS_PENDING ) ) + len( self._GetTagIds( service_key, HC.CONTENT_STATUS_PETITIONED ) ) > 0:
+            
+            statuses_to_tag_ids = dict( self._service_keys_to_statuses_to_tag_ids[ service_key ] )
+            
+            statuses_to_tag_ids[ HC.CONTENT_STATUS_PENDING ] = ()
+            statuses_to_tag_ids[ HC.CONTENT_STATUS_PETITIONED ] = ()
             
-            statuses_to_tags[ HC.CONTENT_STATUS_PENDING ] = set()
-            statuses_to_tags[ HC.CONTENT_STATUS_PETITIONED ] = set()
+            self._SetStatusesToTagIds( service_key, statuses_to_tag_ids )
             
             self._combined_is_calculated = False
             
@@ -2504,21 +2778,11 @@ class TagsManager( TagsManagerSimple ):
     
     def Duplicate( self ):
         
-        dupe_service_keys_to_statuses_to_tags = collections.defaultdict( HydrusData.default_dict_set )
+        dupe = TagsManager( {} )
         
-        for ( service_key, statuses_to_tags ) in self._service_keys_to_statuses_to_tags.items():
-            
-            dupe_statuses_to_tags = HydrusData.default_dict_set()
-            
-            for ( status, tags ) in statuses_to_tags.items():
-                
-                dupe_statuses_to_tags[ status ] = set( tags )
-                
-            
-            dupe_service_keys_to_statuses_to_tags[ service_key ] = dupe_statuses_to_tags
-            
+        dupe._service_keys_to_statuses_to_tag_ids = { service_key : dict( statuses_to_tag_ids ) for ( service_key, statuses_to_tag_ids ) in self._service_keys_to_statuses_to_tag_ids.items() }
         
-        return TagsManager( dupe_service_keys_to_statuses_to_tags )
+        return dupe
         
     
     def GetNumTags( self, service_key, include_current_tags = True, include_pending_tags = False ):
@@ -2530,19 +2794,33 @@ class TagsManager( TagsManagerSimple ):
         
         num_tags = 0
         
-        statuses_to_tags = self.GetStatusesToTags( service_key )
-        
-        if include_current_tags: num_tags += len( statuses_to_tags[ HC.CONTENT_STATUS_CURRENT ] )
-        if include_pending_tags: num_tags += len( statuses_to_tags[ HC.CONTENT_STATUS_PENDING ] )
+        if include_current_tags: num_tags += len( self._GetTagIds( service_key, HC.CONTENT_STATUS_CURRENT ) )
+        if include_pending_tags: num_tags += len( self._GetTagIds( service_key, HC.CONTENT_STATUS_PENDING ) )
         
         return num_tags
         
     
+    def GetServiceKeysToStatusesToTagIds( self ):
+        
+        self._RecalcCombinedIfNeeded()
+        
+        # the tuples are immutable, so they can be shared
+        
+        return { service_key : dict( statuses_to_tag_ids ) for ( service_key, statuses_to_tag_ids ) in self._service_keys_to_statuses_to_tag_ids.items() }
+        
+    
     def GetServiceKeysToStatusesToTags( self ):
         
         self._RecalcCombinedIfNeeded()
         
-        return self._service_keys_to_statuses_to_tags
+        service_keys_to_statuses_to_tags = collections.defaultdict( HydrusData.default_dict_set )
+        
+        for service_key in self._service_keys_to_statuses_to_tag_ids.keys():
+            
+            service_keys_to_statuses_to_tags[ service_key ] = self._GetStatusesToTags( service_key )
+            
+        
+        return service_keys_to_statuses_to_tags
         
     
     def GetStatusesToTags( self, service_key ):
@@ -2552,16 +2830,21 @@ class TagsManager( TagsManagerSimple ):
             self._RecalcCombinedIfNeeded()
             
         
-        return self._service_keys_to_statuses_to_tags[ service_key ]
+        return self._GetStatusesToTags( service_key )
         
     
     def HasTag( self, tag ):
         
         self._RecalcCombinedIfNeeded()
         
-        combined_statuses_to_tags = self._service_keys_to_statuses_to_tags[ CC.COMBINED_TAG_SERVICE_KEY ]
+        tag_id = ClientTags.tag_id_table.GetExistingTagId( tag )
+        
+        if tag_id is None:
+            
+            return False
+            
         
-        return tag in combined_statuses_to_tags[ HC.CONTENT_STATUS_CURRENT ] or tag in combined_statuses_to_tags[ HC.CONTENT_STATUS_PENDING ]
+        return tag_id in self._GetTagIds( CC.COMBINED_TAG_SERVICE_KEY, HC.CONTENT_STATUS_CURRENT ) or tag_id in self._GetTagIds( CC.COMBINED_TAG_SERVICE_KEY, HC.CONTENT_STATUS_PENDING )
         
     
     def NewSiblings( self ):
@@ -2571,8 +2854,6 @@ class TagsManager( TagsManagerSimple ):
     
     def ProcessContentUpdate( self, service_key, content_update ):
         
-        statuses_to_tags = self._service_keys_to_statuses_to_tags[ service_key ]
-        
         ( data_type, action, row ) = content_update.ToTuple()
         
         if action == HC.CONTENT_UPDATE_PETITION:
@@ -2584,50 +2865,71 @@ class TagsManager( TagsManagerSimple ):
             ( tag, hashes ) = row
             
         
+        ( tag_id, ) = ClientTags.tag_id_table.GetTagIds( ( tag, ) )
+        
+        statuses_to_tag_ids = { status : set( self._GetTagIds( service_key, status ) ) for status in ( HC.CONTENT_STATUS_CURRENT, HC.CONTENT_STATUS_DELETED, HC.CONTENT_STATUS_PENDING, HC.CONTENT_STATUS_PETITIONED ) }
+        
         if action == HC.CONTENT_UPDATE_ADD:
             
-            statuses_to_tags[ HC.CONTENT_STATUS_CURRENT ].add( tag )
+            statuses_to_tag_ids[ HC.CONTENT_STATUS_CURRENT ].add( tag_id )
             
-            statuses_to_tags[ HC.CONTENT_STATUS_DELETED ].discard( tag )
-            statuses_to_tags[ HC.CONTENT_STATUS_PENDING ].discard( tag )
+            statuses_to_tag_ids[ HC.CONTENT_STATUS_DELETED ].discard( tag_id )
+            statuses_to_tag_ids[ HC.CONTENT_STATUS_PENDING ].discard( tag_id )
             
         elif action == HC.CONTENT_UPDATE_DELETE:
             
-            statuses_to_tags[ HC.CONTENT_STATUS_DELETED ].add( tag )
+            statuses_to_tag_ids[ HC.CONTENT_STATUS_DELETED ].add( tag_id )
             
-            statuses_to_tags[ HC.CONTENT_STATUS_CURRENT ].discard( tag )
-            statuses_to_tags[ HC.CONTENT_STATUS_PETITIONED ].discard( tag )
+            statuses_to_tag_ids[ HC.CONTENT_STATUS_CURRENT ].discard( tag_id )
+            statuses_to_tag_ids[ HC.CONTENT_STATUS_PETITIONED ].discard( tag_id )
             
         elif action == HC.CONTENT_UPDATE_PEND:
             
-            if tag not in statuses_to_tags[ HC.CONTENT_STATUS_CURRENT ]:
+            if tag_id not in statuses_to_tag_ids[ HC.CONTENT_STATUS_CURRENT ]:
                 
-                statuses_to_tags[ HC.CONTENT_STATUS_PENDING ].add( tag )
+                statuses_to_tag_ids[ HC.CONTENT_STATUS_PENDING ].add( tag_id )
                 
             
         elif action == HC.CONTENT_UPDATE_RESCIND_PEND:
             
-            statuses_to_tags[ HC.CONTENT_STATUS_PENDING ].discard( tag )
+            statuses_to_tag_ids[ HC.CONTENT_STATUS_PENDING ].discard( tag_id )
             
         elif action == HC.CONTENT_UPDATE_PETITION:
             
-            if tag in statuses_to_tags[ HC.CONTENT_STATUS_CURRENT ]:
+            if tag_id in statuses_to_tag_ids[ HC.CONTENT_STATUS_CURRENT ]:
                 
-                statuses_to_tags[ HC.CONTENT_STATUS_PETITIONED ].add( tag )
+                statuses_to_tag_ids[ HC.CONTENT_STATUS_PETITIONED ].add( tag_id )
                 
             
-        elif action == HC.CONTENT_UPDATE_RESCIND_PETITION: statuses_to_tags[ HC.CONTENT_STATUS_PETITIONED ].discard( tag )
+        elif action == HC.CONTENT_UPDATE_RESCIND_PETITION: statuses_to_tag_ids[ HC.CONTENT_STATUS_PETITIONED ].discard( tag_id )
+        
+        self._SetStatusesToTagIds( service_key, statuses_to_tag_ids )
         
         self._combined_is_calculated = False
         
     
     def ResetService( self, service_key ):
         
-        if service_key in self._service_keys_to_statuses_to_tags:
+        if service_key in self._service_keys_to_statuses_to_tag_ids:
             
-            del self._service_keys_to_statuses_to_tags[ service_key ]
+            self._SetStatusesToTagIds( service_key, {} )
             
             self._combined_is_calculated = False
             
         
     
+    def SetServiceKeysToStatusesToTagIds( self, service_keys_to_statuses_to_tag_ids ):
+        
+        for service_key in list( self._service_keys_to_statuses_to_tag_ids.keys() ):
+            
+            self._SetStatusesToTagIds( service_key, {} )
+            
+        
+        for ( service_key, statuses_to_tag_ids ) in service_keys_to_statuses_to_tag_ids.items():
+            
+            self._SetStatusesToTagIds( service_key, statuses_to_tag_ids )
+            
+        
+        self._combined_is_calculated = False
+        
+    
@@ -75,6 +75,10 @@ class ClientOptions( HydrusSerialisable.SerialisableBase ):
         self._dictionary[ 'booleans' ][ 'use_system_ffmpeg' ] = False
         
         self._dictionary[ 'booleans' ][ 'maintain_similar_files_duplicate_pairs_during_idle' ] = False
+        self._dictionary[ 'booleans' ][ 'use_resident_similar_files_index' ] = False
+        self._dictionary[ 'booleans' ][ 'use_resident_tag_posting_lists' ] = False
+        self._dictionary[ 'booleans' ][ 'use_resident_autocomplete_index' ] = False
+        self._dictionary[ 'booleans' ][ 'use_repository_update_sidecars' ] = True
         
         self._dictionary[ 'booleans' ][ 'show_namespaces' ] = True
         
@@ -153,6 +157,11 @@ class ClientOptions( HydrusSerialisable.SerialisableBase ):
         
         self._dictionary[ 'integers' ][ 'video_buffer_size_mb' ] = 96
         
+        self._dictionary[ 'integers' ][ 'db_read_connections' ] = 2
+        
+        self._dictionary[ 'integers' ][ 'file_search_cache_size_mb' ] = 16
+        self._dictionary[ 'integers' ][ 'tag_posting_lists_cache_size_mb' ] = 64
+        
         self._dictionary[ 'integers' ][ 'related_tags_search_1_duration_ms' ] = 250
         self._dictionary[ 'integers' ][ 'related_tags_search_2_duration_ms' ] = 2000
         self._dictionary[ 'integers' ][ 'related_tags_search_3_duration_ms' ] = 6000
@@ -168,6 +177,8 @@ class ClientOptions( HydrusSerialisable.SerialisableBase ):
         
         self._dictionary[ 'integers' ][ 'network_timeout' ] = 10
         
+        self._dictionary[ 'integers' ][ 'repository_update_download_concurrency' ] = 4
+        
         self._dictionary[ 'integers' ][ 'thumbnail_visibility_scroll_percent' ] = 75
         
         self._dictionary[ 'integers' ][ 'total_pages_warning' ] = 165
@@ -1,7 +1,9 @@
+import bisect
 import calendar
 import ClientConstants as CC
 import ClientData
 import ClientTags
+import collections
 import datetime
 import HydrusConstants as HC
 import HydrusData
@@ -9,13 +11,20 @@ import HydrusExceptions
 import HydrusGlobals as HG
 import HydrusSerialisable
 import HydrusTags
+import json
+import numpy
 import re
+import threading
 import time
 import wx
 
 IGNORED_TAG_SEARCH_CHARACTERS = u'[](){}"\''
 IGNORED_TAG_SEARCH_CHARACTERS_UNICODE_TRANSLATE = { ord( char ) : None for char in IGNORED_TAG_SEARCH_CHARACTERS }
 
+# sqlite's fts4 'simple' tokenizer splits on ascii punctuation and whitespace, keeps everything from 0x80 up as token text, and only folds ascii case
+FTS4_TOKEN_RE = re.compile( u'[^\\x00-\\x2f\\x3a-\\x40\\x5b-\\x60\\x7b-\\x7f]+' )
+FTS4_CASE_FOLD_UNICODE_TRANSLATE = { ord( char ) : ord( char.lower() ) for char in u'ABCDEFGHIJKLMNOPQRSTUVWXYZ' }
+
 def ConvertTagToSearchable( tag ):
     
     if tag == '':
@@ -50,6 +59,30 @@ def ConvertEntryTextToSearchText( entry_text ):
     
     return entry_text
     
+def ConvertHashIdsToPostingList( hash_ids ):
+    
+    # a posting list is a sorted uint32 array of unique hash_ids, which numpy can intersect and merge without making python ints
+    
+    return numpy.unique( numpy.fromiter( hash_ids, dtype = numpy.uint32 ) )
+    
+def ConvertSearchableSubtagToTokens( searchable_subtag ):
+    
+    if not isinstance( searchable_subtag, unicode ):
+        
+        searchable_subtag = HydrusData.ToUnicode( searchable_subtag )
+        
+    
+    return FTS4_TOKEN_RE.findall( searchable_subtag.translate( FTS4_CASE_FOLD_UNICODE_TRANSLATE ) )
+    
+def DifferencePostingLists( posting_list, posting_list_to_remove ):
+    
+    if len( posting_list ) == 0 or len( posting_list_to_remove ) == 0:
+        
+        return posting_list
+        
+    
+    return numpy.setdiff1d( posting_list, posting_list_to_remove, assume_unique = True )
+    
 def FilterPredicatesBySearchText( service_key, search_text, predicates ):
     
     tags_to_predicates = {}
@@ -137,6 +170,34 @@ def FilterTagsBySearchText( service_key, search_text, tags, search_siblings = Tr
     
     return result
     
+def GetSubtagSearchPrefix( half_complete_subtag ):
+    
+    # 'sam*' matches every subtag with a token starting 'sam', which we can work out in memory, so these searches can be cached and narrowed
+    # anything with punctuation or spaces becomes an fts4 phrase query, which we leave to the db
+    
+    if not half_complete_subtag.endswith( '*' ) or IsComplexWildcard( half_complete_subtag ):
+        
+        return None
+        
+    
+    prefix = half_complete_subtag[:-1]
+    
+    if not isinstance( prefix, unicode ):
+        
+        prefix = HydrusData.ToUnicode( prefix )
+        
+    
+    prefix = prefix.translate( FTS4_CASE_FOLD_UNICODE_TRANSLATE )
+    
+    match = FTS4_TOKEN_RE.match( prefix )
+    
+    if match is None or match.end() != len( prefix ):
+        
+        return None
+        
+    
+    return prefix
+    
 def IsComplexWildcard( search_text ):
     
     num_stars = search_text.count( '*' )
@@ -153,6 +214,33 @@ def IsComplexWildcard( search_text ):
     
     return False
     
+def IntersectPostingLists( posting_lists ):
+    
+    posting_lists = list( posting_lists )
+    
+    if len( posting_lists ) == 0:
+        
+        return numpy.zeros( 0, dtype = numpy.uint32 )
+        
+    
+    # smallest first keeps every intermediate result as small as possible
+    
+    posting_lists.sort( key = len )
+    
+    result = posting_lists[0]
+    
+    for posting_list in posting_lists[1:]:
+        
+        if len( result ) == 0:
+            
+            break
+            
+        
+        result = numpy.intersect1d( result, posting_list, assume_unique = True )
+        
+    
+    return result
+    
 def SortPredicates( predicates ):
     
     def cmp_func( x, y ): return cmp( x.GetCount(), y.GetCount() )
@@ -161,6 +249,21 @@ def SortPredicates( predicates ):
     
     return predicates
 
+def UnionPostingLists( posting_lists ):
+    
+    posting_lists = [ posting_list for posting_list in posting_lists if len( posting_list ) > 0 ]
+    
+    if len( posting_lists ) == 0:
+        
+        return numpy.zeros( 0, dtype = numpy.uint32 )
+        
+    elif len( posting_lists ) == 1:
+        
+        return posting_lists[0]
+        
+    
+    return numpy.unique( numpy.concatenate( posting_lists ) )
+    
 class FileQueryResult( object ):
     
     def __init__( self, media_results ):
@@ -364,6 +467,15 @@ class FileSearchContext( HydrusSerialisable.SerialisableBase ):
             
         
     
+    def GetCacheKey( self ):
+        
+        # system:limit is applied after the cache, so limited and unlimited searches share their results
+        
+        predicate_keys = frozenset( ( json.dumps( predicate.GetSerialisableTuple() ) for predicate in self._predicates if predicate.GetType() != HC.PREDICATE_TYPE_SYSTEM_LIMIT ) )
+        
+        return ( self._file_service_key, self._tag_service_key, self._include_current_tags, self._include_pending_tags, predicate_keys )
+        
+    
     def GetFileServiceKey( self ): return self._file_service_key
     def GetNamespacesToExclude( self ): return self._namespaces_to_exclude
     def GetNamespacesToInclude( self ): return self._namespaces_to_include
@@ -408,6 +520,235 @@ class FileSearchContext( HydrusSerialisable.SerialisableBase ):
     
 HydrusSerialisable.SERIALISABLE_TYPES_TO_OBJECT_TYPES[ HydrusSerialisable.SERIALISABLE_TYPE_FILE_SEARCH_CONTEXT ] = FileSearchContext
 
+class FileSearchResultsCache( object ):
+    
+    # a rough allowance for the key and bookkeeping of each entry, so many tiny results still count against the size
+    ENTRY_OVERHEAD = 1024
+    
+    def __init__( self, max_size = 0 ):
+        
+        self._max_size = max_size
+        
+        self._lock = threading.Lock()
+        
+        self._cache_keys_to_entries = collections.OrderedDict()
+        
+        self._total_size = 0
+        
+        # bumped on every invalidation, so a search that was running while its data changed does not get stored
+        self._generation = 0
+        
+        self._num_hits = 0
+        self._num_narrowed_hits = 0
+        self._num_misses = 0
+        
+    
+    def __len__( self ):
+        
+        with self._lock:
+            
+            return len( self._cache_keys_to_entries )
+            
+        
+    
+    def _Delete( self, cache_key ):
+        
+        ( posting_list, subtags, any_tag, rating_service_keys ) = self._cache_keys_to_entries[ cache_key ]
+        
+        del self._cache_keys_to_entries[ cache_key ]
+        
+        self._total_size -= posting_list.nbytes + self.ENTRY_OVERHEAD
+        
+    
+    def _DeleteMatching( self, match ):
+        
+        self._generation += 1
+        
+        cache_keys = [ cache_key for ( cache_key, entry ) in self._cache_keys_to_entries.items() if match( cache_key, entry ) ]
+        
+        for cache_key in cache_keys:
+            
+            self._Delete( cache_key )
+            
+        
+    
+    def _MaintainSize( self ):
+        
+        while self._total_size > self._max_size and len( self._cache_keys_to_entries ) > 0:
+            
+            cache_key = next( iter( self._cache_keys_to_entries ) )
+            
+            self._Delete( cache_key )
+            
+        
+    
+    def AddResult( self, generation, cache_key, hash_ids, subtags, any_tag, rating_service_keys ):
+        
+        with self._lock:
+            
+            if generation != self._generation:
+                
+                return
+                
+            
+            posting_list = ConvertHashIdsToPostingList( hash_ids )
+            
+            if posting_list.nbytes + self.ENTRY_OVERHEAD > self._max_size:
+                
+                return
+                
+            
+            if cache_key in self._cache_keys_to_entries:
+                
+                self._Delete( cache_key )
+                
+            
+            self._cache_keys_to_entries[ cache_key ] = ( posting_list, frozenset( subtags ), any_tag, frozenset( rating_service_keys ) )
+            
+            self._total_size += posting_list.nbytes + self.ENTRY_OVERHEAD
+            
+            self._MaintainSize()
+            
+        
+    
+    def Clear( self ):
+        
+        with self._lock:
+            
+            self._DeleteMatching( lambda cache_key, entry: True )
+            
+        
+    
+    def GetGeneration( self ):
+        
+        with self._lock:
+            
+            return self._generation
+            
+        
+    
+    def GetReport( self ):
+        
+        with self._lock:
+            
+            num_lookups = self._num_hits + self._num_narrowed_hits + self._num_misses
+            
+            if num_lookups == 0:
+                
+                hit_percent = '0%'
+                narrowed_percent = '0%'
+                
+            else:
+                
+                hit_percent = HydrusData.ConvertFloatToPercentage( float( self._num_hits ) / num_lookups )
+                narrowed_percent = HydrusData.ConvertFloatToPercentage( float( self._num_narrowed_hits ) / num_lookups )
+                
+            
+            return HydrusData.ConvertIntToPrettyString( len( self._cache_keys_to_entries ) ) + ' searches cached in ' + HydrusData.ConvertIntToBytes( self._total_size ) + ', ' + hit_percent + ' of ' + HydrusData.ConvertIntToPrettyString( num_lookups ) + ' lookups hit, ' + narrowed_percent + ' narrowed a cached search'
+            
+        
+    
+    def GetResult( self, cache_key ):
+        
+        with self._lock:
+            
+            if cache_key in self._cache_keys_to_entries:
+                
+                entry = self._cache_keys_to_entries.pop( cache_key )
+                
+                self._cache_keys_to_entries[ cache_key ] = entry
+                
+                self._num_hits += 1
+                
+                return ( entry[0], False )
+                
+            
+            # a cached search whose predicates are a subset of ours holds every file we could possibly find
+            
+            ( file_service_key, tag_service_key, include_current_tags, include_pending_tags, predicate_keys ) = cache_key
+            
+            best_posting_list = None
+            
+            for ( ( other_file_service_key, other_tag_service_key, other_include_current_tags, other_include_pending_tags, other_predicate_keys ), entry ) in self._cache_keys_to_entries.items():
+                
+                if ( other_file_service_key, other_tag_service_key, other_include_current_tags, other_include_pending_tags ) != ( file_service_key, tag_service_key, include_current_tags, include_pending_tags ):
+                    
+                    continue
+                    
+                
+                if other_predicate_keys.issubset( predicate_keys ):
+                    
+                    posting_list = entry[0]
+                    
+                    if best_posting_list is None or len( posting_list ) < len( best_posting_list ):
+                        
+                        best_posting_list = posting_list
+                        
+                    
+                
+            
+            if best_posting_list is None:
+                
+                self._num_misses += 1
+                
+                return ( None, False )
+                
+            else:
+                
+                self._num_narrowed_hits += 1
+                
+                return ( best_posting_list, True )
+                
+            
+        
+    
+    def InvalidateRatings( self, rating_service_key ):
+        
+        with self._lock:
+            
+            self._DeleteMatching( lambda cache_key, entry: rating_service_key in entry[3] )
+            
+        
+    
+    def InvalidateTags( self, tag_service_key, subtags ):
+        
+        def match( cache_key, entry ):
+            
+            if cache_key[1] not in ( tag_service_key, CC.COMBINED_TAG_SERVICE_KEY ):
+                
+                return False
+                
+            
+            ( posting_list, entry_subtags, any_tag, rating_service_keys ) = entry
+            
+            return any_tag or not entry_subtags.isdisjoint( subtags )
+            
+        
+        with self._lock:
+            
+            self._DeleteMatching( match )
+            
+        
+    
+    def IsEnabled( self ):
+        
+        with self._lock:
+            
+            return self._max_size > 0
+            
+        
+    
+    def SetMaxSize( self, max_size ):
+        
+        with self._lock:
+            
+            self._max_size = max_size
+            
+            self._MaintainSize()
+            
+        
+    
+
 class FileSystemPredicates( object ):
     
     def __init__( self, system_predicates ):
@@ -1543,3 +1884,491 @@ SYSTEM_PREDICATE_ARCHIVE = Predicate( HC.PREDICATE_TYPE_SYSTEM_ARCHIVE, None )
 SYSTEM_PREDICATE_LOCAL = Predicate( HC.PREDICATE_TYPE_SYSTEM_LOCAL, None )
 
 SYSTEM_PREDICATE_NOT_LOCAL = Predicate( HC.PREDICATE_TYPE_SYSTEM_NOT_LOCAL, None )
+
+class SubtagSearchCache( object ):
+    
+    # results are lists of ( token, subtag_id ) rows, so a longer prefix can be filtered out of a shorter one without going back to the db
+    MAX_CACHED_PREFIXES = 256
+    MAX_CACHED_ROWS = 500000
+    
+    def __init__( self ):
+        
+        self._lock = threading.Lock()
+        
+        self._prefixes_to_rows = collections.OrderedDict()
+        
+        self._total_rows = 0
+        
+        # bumped on every change, so a lookup that was running while a subtag was added does not get stored
+        self._generation = 0
+        
+        # the optional resident index is every ( token, subtag_id ) row, sorted by token so a prefix is a bisect and a slice
+        self._index_tokens = None
+        self._index_subtag_ids = None
+        self._index_pending_rows = []
+        self._index_loading = False
+        self._index_generation = 0
+        
+    
+    def __len__( self ):
+        
+        with self._lock:
+            
+            return len( self._prefixes_to_rows )
+            
+        
+    
+    def _AddRows( self, prefix, rows ):
+        
+        if prefix in self._prefixes_to_rows:
+            
+            self._Delete( prefix )
+            
+        
+        if len( rows ) > self.MAX_CACHED_ROWS:
+            
+            return
+            
+        
+        self._prefixes_to_rows[ prefix ] = rows
+        
+        self._total_rows += len( rows )
+        
+        self._MaintainSize()
+        
+    
+    def _Delete( self, prefix ):
+        
+        rows = self._prefixes_to_rows.pop( prefix )
+        
+        self._total_rows -= len( rows )
+        
+    
+    def _GetIndexRows( self, prefix ):
+        
+        self._MergePendingIndexRows()
+        
+        tokens = self._index_tokens
+        subtag_ids = self._index_subtag_ids
+        
+        rows = []
+        
+        i = bisect.bisect_left( tokens, prefix )
+        
+        while i < len( tokens ) and tokens[ i ].startswith( prefix ):
+            
+            rows.append( ( tokens[ i ], subtag_ids[ i ] ) )
+            
+            i += 1
+            
+        
+        return rows
+        
+    
+    def _MaintainSize( self ):
+        
+        while ( self._total_rows > self.MAX_CACHED_ROWS or len( self._prefixes_to_rows ) > self.MAX_CACHED_PREFIXES ) and len( self._prefixes_to_rows ) > 0:
+            
+            prefix = next( iter( self._prefixes_to_rows ) )
+            
+            self._Delete( prefix )
+            
+        
+    
+    def _MergePendingIndexRows( self ):
+        
+        pending_rows = self._index_pending_rows
+        
+        if len( pending_rows ) == 0:
+            
+            return
+            
+        
+        self._index_pending_rows = []
+        
+        if len( pending_rows ) * 32 > len( self._index_tokens ):
+            
+            rows = zip( self._index_tokens, self._index_subtag_ids )
+            
+            rows.extend( pending_rows )
+            
+            self._SetIndexRows( rows )
+            
+        else:
+            
+            for ( token, subtag_id ) in pending_rows:
+                
+                i = bisect.bisect_right( self._index_tokens, token )
+                
+                self._index_tokens.insert( i, token )
+                self._index_subtag_ids.insert( i, subtag_id )
+                
+            
+        
+    
+    def _SetIndexRows( self, rows ):
+        
+        rows.sort()
+        
+        self._index_tokens = [ token for ( token, subtag_id ) in rows ]
+        self._index_subtag_ids = [ subtag_id for ( token, subtag_id ) in rows ]
+        
+    
+    def AddRows( self, generation, prefix, rows ):
+        
+        with self._lock:
+            
+            if generation != self._generation:
+                
+                return
+                
+            
+            self._AddRows( prefix, rows )
+            
+        
+    
+    def AddSubtag( self, subtag_id, searchable_subtag ):
+        
+        tokens = ConvertSearchableSubtagToTokens( searchable_subtag )
+        
+        with self._lock:
+            
+            self._generation += 1
+            
+            for ( prefix, rows ) in self._prefixes_to_rows.items():
+                
+                for token in tokens:
+                    
+                    if token.startswith( prefix ):
+                        
+                        rows.append( ( token, subtag_id ) )
+                        
+                        self._total_rows += 1
+                        
+                    
+                
+            
+            if self._index_tokens is not None or self._index_loading:
+                
+                self._index_pending_rows.extend( ( ( token, subtag_id ) for token in tokens ) )
+                
+            
+            self._MaintainSize()
+            
+        
+    
+    def Clear( self ):
+        
+        with self._lock:
+            
+            self._generation += 1
+            
+            self._prefixes_to_rows = collections.OrderedDict()
+            
+            self._total_rows = 0
+            
+        
+        self.ClearIndex()
+        
+    
+    def ClearIndex( self ):
+        
+        with self._lock:
+            
+            self._index_generation += 1
+            
+            self._index_tokens = None
+            self._index_subtag_ids = None
+            self._index_pending_rows = []
+            self._index_loading = False
+            
+        
+    
+    def GetGeneration( self ):
+        
+        with self._lock:
+            
+            return self._generation
+            
+        
+    
+    def GetSubtagIds( self, prefix ):
+        
+        with self._lock:
+            
+            if prefix in self._prefixes_to_rows:
+                
+                rows = self._prefixes_to_rows.pop( prefix )
+                
+                self._prefixes_to_rows[ prefix ] = rows
+                
+            else:
+                
+                rows = None
+                
+                # the longest cached prefix of our prefix holds every subtag we could match
+                
+                for i in range( len( prefix ) - 1, 0, -1 ):
+                    
+                    shorter_prefix = prefix[ : i ]
+                    
+                    if shorter_prefix in self._prefixes_to_rows:
+                        
+                        rows = [ row for row in self._prefixes_to_rows[ shorter_prefix ] if row[0].startswith( prefix ) ]
+                        
+                        break
+                        
+                    
+                
+                if rows is None and self._index_tokens is not None:
+                    
+                    rows = self._GetIndexRows( prefix )
+                    
+                
+                if rows is None:
+                    
+                    return None
+                    
+                
+                self._AddRows( prefix, rows )
+                
+            
+            return { subtag_id for ( token, subtag_id ) in rows }
+            
+        
+    
+    def IndexIsLoaded( self ):
+        
+        with self._lock:
+            
+            return self._index_tokens is not None
+            
+        
+    
+    def SetIndex( self, index_generation, rows ):
+        
+        with self._lock:
+            
+            if index_generation != self._index_generation:
+                
+                return
+                
+            
+            self._SetIndexRows( rows )
+            
+            self._index_loading = False
+            
+        
+    
+    def StartIndexLoad( self ):
+        
+        # only one reader needs to do the load--the others keep asking the db until it is done
+        
+        with self._lock:
+            
+            if self._index_tokens is not None or self._index_loading:
+                
+                return None
+                
+            
+            self._index_loading = True
+            self._index_pending_rows = []
+            
+            return self._index_generation
+            
+        
+    
+class TagPostingLists( object ):
+    
+    # this is not locked itself. the db only touches it from its writer, or from a read connection holding its read cache lock
+    
+    # a rough allowance for the key and bookkeeping of each list, and for each hash_id waiting to be merged in, so small lists and pending changes still count against the size
+    ENTRY_OVERHEAD = 256
+    PENDING_HASH_ID_OVERHEAD = 64
+    
+    # pending changes are merged when the list is next fetched, or when they get this big compared to the list
+    MIN_PENDING_TO_MERGE = 1024
+    
+    def __init__( self, max_size = 64 * 1048576 ):
+        
+        self._max_size = max_size
+        
+        # keys are ( file_service_id, tag_service_id, tag_id, status ), values are [ posting_list, hash_ids_to_add, hash_ids_to_delete ], oldest first
+        self._keys_to_entries = collections.OrderedDict()
+        
+        self._total_size = 0
+        
+    
+    def __len__( self ):
+        
+        return len( self._keys_to_entries )
+        
+    
+    def _Delete( self, key ):
+        
+        entry = self._keys_to_entries.pop( key )
+        
+        self._total_size -= self._GetEntrySize( entry )
+        
+    
+    def _GetEntrySize( self, entry ):
+        
+        ( posting_list, hash_ids_to_add, hash_ids_to_delete ) = entry
+        
+        return posting_list.nbytes + self.ENTRY_OVERHEAD + ( len( hash_ids_to_add ) + len( hash_ids_to_delete ) ) * self.PENDING_HASH_ID_OVERHEAD
+        
+    
+    def _MaintainSize( self ):
+        
+        while self._total_size > self._max_size and len( self._keys_to_entries ) > 0:
+            
+            key = next( iter( self._keys_to_entries ) )
+            
+            self._Delete( key )
+            
+        
+    
+    def _MergePending( self, key ):
+        
+        entry = self._keys_to_entries[ key ]
+        
+        ( posting_list, hash_ids_to_add, hash_ids_to_delete ) = entry
+        
+        if len( hash_ids_to_add ) == 0 and len( hash_ids_to_delete ) == 0:
+            
+            return
+            
+        
+        self._total_size -= self._GetEntrySize( entry )
+        
+        # the old array may have been handed out, so we make a new one rather than changing it
+        
+        if len( hash_ids_to_delete ) > 0:
+            
+            posting_list = DifferencePostingLists( posting_list, ConvertHashIdsToPostingList( hash_ids_to_delete ) )
+            
+        
+        if len( hash_ids_to_add ) > 0:
+            
+            posting_list = UnionPostingLists( ( posting_list, ConvertHashIdsToPostingList( hash_ids_to_add ) ) )
+            
+        
+        entry = [ posting_list, set(), set() ]
+        
+        self._keys_to_entries[ key ] = entry
+        
+        self._total_size += self._GetEntrySize( entry )
+        
+    
+    def _UpdatePending( self, key, hash_ids, adding ):
+        
+        # lists we have not loaded yet will be read fresh from the db when they are first wanted
+        
+        if key not in self._keys_to_entries:
+            
+            return
+            
+        
+        entry = self._keys_to_entries[ key ]
+        
+        self._total_size -= self._GetEntrySize( entry )
+        
+        ( posting_list, hash_ids_to_add, hash_ids_to_delete ) = entry
+        
+        if adding:
+            
+            hash_ids_to_add.update( hash_ids )
+            hash_ids_to_delete.difference_update( hash_ids )
+            
+        else:
+            
+            hash_ids_to_delete.update( hash_ids )
+            hash_ids_to_add.difference_update( hash_ids )
+            
+        
+        self._total_size += self._GetEntrySize( entry )
+        
+        if len( hash_ids_to_add ) + len( hash_ids_to_delete ) > max( self.MIN_PENDING_TO_MERGE, len( posting_list ) ):
+            
+            self._MergePending( key )
+            
+        
+        self._MaintainSize()
+        
+    
+    def AddHashIds( self, key, hash_ids ):
+        
+        self._UpdatePending( key, hash_ids, True )
+        
+    
+    def Clear( self ):
+        
+        self._keys_to_entries = collections.OrderedDict()
+        
+        self._total_size = 0
+        
+    
+    def ClearServicePair( self, file_service_id, tag_service_id ):
+        
+        keys = [ key for key in self._keys_to_entries if key[:2] == ( file_service_id, tag_service_id ) ]
+        
+        for key in keys:
+            
+            self._Delete( key )
+            
+        
+    
+    def DeleteHashIds( self, key, hash_ids ):
+        
+        self._UpdatePending( key, hash_ids, False )
+        
+    
+    def GetMemoryUsage( self ):
+        
+        return self._total_size
+        
+    
+    def GetPostingList( self, key ):
+        
+        if key not in self._keys_to_entries:
+            
+            return None
+            
+        
+        self._MergePending( key )
+        
+        entry = self._keys_to_entries.pop( key )
+        
+        self._keys_to_entries[ key ] = entry
+        
+        return entry[0]
+        
+    
+    def SetMaxSize( self, max_size ):
+        
+        self._max_size = max_size
+        
+        self._MaintainSize()
+        
+    
+    def SetPostingList( self, key, posting_list ):
+        
+        if key in self._keys_to_entries:
+            
+            self._Delete( key )
+            
+        
+        entry = [ posting_list, set(), set() ]
+        
+        if self._GetEntrySize( entry ) > self._max_size:
+            
+            return
+            
+        
+        self._keys_to_entries[ key ] = entry
+        
+        self._total_size += self._GetEntrySize( entry )
+        
+        self._MaintainSize()
+        
+    
@@ -5,13 +5,14 @@ import ClientNetworkingContexts
 import ClientNetworkingJobs
 import ClientRatings
 import ClientThreading
-import hashlib
 import HydrusConstants as HC
 import HydrusData
 import HydrusExceptions
+import HydrusFileHandling
 import HydrusGlobals as HG
 import HydrusNetwork
 import HydrusNetworking
+import HydrusPaths
 import HydrusSerialisable
 import json
 import os
@@ -869,7 +870,11 @@ class ServiceRestricted( ServiceRemote ):
                     
                 elif isinstance( e, HydrusExceptions.NotFoundException ):
                     
-                    self._DelayFutureRequests( 'got an unexpected 404', HC.UPDATE_DURATION )
+                    # older servers do not have thumbnail bundles, and SyncThumbnails falls back to single thumbnails
+                    if command != 'thumbnails':
+                        
+                        self._DelayFutureRequests( 'got an unexpected 404', HC.UPDATE_DURATION )
+                        
                     
                 elif isinstance( e, HydrusExceptions.BandwidthException ):
                     
@@ -992,6 +997,8 @@ class ServiceRepository( ServiceRestricted ):
         
         self._sync_lock = threading.Lock()
         
+        self._server_supports_thumbnail_bundles = True
+        
     
     def _CanSyncDownload( self ):
         
@@ -1036,6 +1043,31 @@ class ServiceRepository( ServiceRestricted ):
         ServiceRestricted._CheckFunctional( self, including_external_communication = including_external_communication, including_account = including_account )
         
     
+    def _DownloadThumbnailBundle( self, thumbnail_hashes ):
+        
+        client_files_manager = HG.client_controller.client_files_manager
+        
+        requested_hashes = set( thumbnail_hashes )
+        
+        ( os_file_handle, temp_path ) = HydrusPaths.GetTempPath()
+        
+        try:
+            
+            self.Request( HC.POST, 'thumbnails', { 'hashes' : thumbnail_hashes }, temp_path = temp_path )
+            
+            with open( temp_path, 'rb' ) as f:
+                
+                hashes_and_thumbnails = ( ( hash, thumbnail ) for ( hash, thumbnail ) in HydrusNetwork.ReadThumbnailBundle( f ) if hash in requested_hashes )
+                
+                client_files_manager.AddFullSizeThumbnails( hashes_and_thumbnails )
+                
+            
+        finally:
+            
+            HydrusPaths.CleanUpTempPath( os_file_handle, temp_path )
+            
+        
+    
     def _GetSerialisableDictionary( self ):
         
         dictionary = ServiceRestricted._GetSerialisableDictionary( self )
@@ -1191,6 +1223,48 @@ class ServiceRepository( ServiceRestricted ):
         
         if len( update_hashes ) > 0:
             
+            num_simultaneous_downloads = max( 1, HG.client_controller.new_options.GetInteger( 'repository_update_download_concurrency' ) )
+            
+            # several updates download at once on other threads, streaming to temp files and hashing as they go, but they are still imported in order
+            
+            downloads_condition = threading.Condition()
+            
+            indices_to_downloads = {}
+            
+            downloads_abandoned = threading.Event()
+            
+            def download_update( i, update_hash ):
+                
+                ( os_file_handle, temp_path ) = HydrusPaths.GetTempPath()
+                
+                try:
+                    
+                    self.Request( HC.GET, 'update', { 'update_hash' : update_hash }, temp_path = temp_path )
+                    
+                    download = ( os_file_handle, temp_path, HydrusFileHandling.GetHashFromPath( temp_path ), None )
+                    
+                except Exception as e:
+                    
+                    download = ( os_file_handle, temp_path, None, e )
+                    
+                
+                with downloads_condition:
+                    
+                    if not downloads_abandoned.is_set():
+                        
+                        indices_to_downloads[ i ] = download
+                        
+                        downloads_condition.notify_all()
+                        
+                        return
+                        
+                    
+                
+                HydrusPaths.CleanUpTempPath( os_file_handle, temp_path )
+                
+            
+            next_download_index = 0
+            
             job_key = ClientThreading.JobKey( cancellable = True, stop_time = stop_time )
             
             try:
@@ -1227,49 +1301,76 @@ class ServiceRepository( ServiceRestricted ):
                         return
                         
                     
-                    try:
+                    # each request still waits on the service's bandwidth rules in the network engine before it starts
+                    
+                    while next_download_index < min( i + num_simultaneous_downloads, len( update_hashes ) ):
                         
-                        update_network_string = self.Request( HC.GET, 'update', { 'update_hash' : update_hash } )
+                        HG.client_controller.CallToThread( download_update, next_download_index, update_hashes[ next_download_index ] )
                         
-                    except HydrusExceptions.NetworkException as e:
+                        next_download_index += 1
                         
-                        HydrusData.Print( 'Attempting to download an update for ' + name + ' resulted in a network error:' )
+                    
+                    with downloads_condition:
                         
-                        HydrusData.Print( e )
+                        while i not in indices_to_downloads:
+                            
+                            downloads_condition.wait( 1.0 )
+                            
                         
-                        return
+                        ( os_file_handle, temp_path, update_network_string_hash, e ) = indices_to_downloads.pop( i )
                         
                     
-                    update_network_string_hash = hashlib.sha256( update_network_string ).digest()
-                    
-                    if update_network_string_hash != update_hash:
-                        
-                        # this is the weird update problem, seems to be network related
-                        # throwing a whole hullabaloo about it only caused problems, as the real fix was 'unpause it, try again'
+                    try:
                         
-                        with self._lock:
+                        if e is not None:
                             
-                            self._DelayFutureRequests( 'had an unusual update response' )
+                            if isinstance( e, HydrusExceptions.NetworkException ):
+                                
+                                HydrusData.Print( 'Attempting to download an update for ' + name + ' resulted in a network error:' )
+                                
+                                HydrusData.Print( e )
+                                
+                                return
+                                
+                            
+                            raise e
                             
                         
-                        filename = 'should be ' + update_network_string_hash.encode( 'hex' ) + '.wew'
-                        
-                        path = os.path.join( HG.client_controller.db_dir, filename )
-                        
-                        with open( path, 'wb' ) as f:
+                        if update_network_string_hash != update_hash:
+                            
+                            # this is the weird update problem, seems to be network related
+                            # throwing a whole hullabaloo about it only caused problems, as the real fix was 'unpause it, try again'
+                            
+                            with self._lock:
+                                
+                                self._DelayFutureRequests( 'had an unusual update response' )
+                                
+                            
+                            filename = 'should be ' + update_network_string_hash.encode( 'hex' ) + '.wew'
                             
-                            f.write( update_network_string )
+                            path = os.path.join( HG.client_controller.db_dir, filename )
+                            
+                            HydrusPaths.MirrorFile( temp_path, path )
+                            
+                            message = 'Update ' + update_hash.encode( 'hex' ) + ' downloaded from the ' + self._name + ' repository had hash ' + update_network_string_hash.encode( 'hex' ) + '!'
+                            message += os.linesep * 2
+                            message += 'This is an unusual network error that hydrus dev is trying to pin down. The bad file has been written to ' + path + '--please inform hydrus dev of what has happened and send him that file!'
+                            message += os.linesep * 2
+                            message += 'Your repository will try again later, which usually fixes this problem.'
+                            
+                            HydrusData.ShowText( message )
+                            
+                            return
                             
                         
-                        message = 'Update ' + update_hash.encode( 'hex' ) + ' downloaded from the ' + self._name + ' repository had hash ' + update_network_string_hash.encode( 'hex' ) + '!'
-                        message += os.linesep * 2
-                        message += 'This is an unusual network error that hydrus dev is trying to pin down. The bad file has been written to ' + path + '--please inform hydrus dev of what has happened and send him that file!'
-                        message += os.linesep * 2
-                        message += 'Your repository will try again later, which usually fixes this problem.'
+                        with open( temp_path, 'rb' ) as f:
+                            
+                            update_network_string = f.read()
+                            
                         
-                        HydrusData.ShowText( message )
+                    finally:
                         
-                        return
+                        HydrusPaths.CleanUpTempPath( os_file_handle, temp_path )
                         
                     
                     try:
@@ -1350,6 +1451,20 @@ class ServiceRepository( ServiceRestricted ):
                 
             finally:
                 
+                # downloads still in flight will clean up after themselves
+                
+                with downloads_condition:
+                    
+                    downloads_abandoned.set()
+                    
+                    for ( os_file_handle, temp_path, update_network_string_hash, e ) in indices_to_downloads.values():
+                        
+                        HydrusPaths.CleanUpTempPath( os_file_handle, temp_path )
+                        
+                    
+                    indices_to_downloads.clear()
+                    
+                
                 job_key.Finish()
                 job_key.Delete( 5 )
                 
@@ -1482,13 +1597,15 @@ class ServiceRepository( ServiceRestricted ):
                 
                 HG.client_controller.pub( 'message', job_key )
                 
-                for ( i, thumbnail_hash ) in enumerate( thumbnail_hashes ):
+                num_done = 0
+                
+                for chunk_of_thumbnail_hashes in HydrusData.SplitListIntoChunks( thumbnail_hashes, HydrusNetwork.MAX_THUMBNAIL_BUNDLE_HASHES ):
                     
-                    status = 'thumbnail ' + HydrusData.ConvertValueRangeToPrettyString( i + 1, num_to_do )
+                    status = 'thumbnails ' + HydrusData.ConvertValueRangeToPrettyString( num_done, num_to_do )
                     
                     HG.client_controller.pub( 'splash_set_status_text', status, print_to_log = False )
                     job_key.SetVariable( 'popup_text_1', status )
-                    job_key.SetVariable( 'popup_gauge_1', ( i + 1, num_to_do ) )
+                    job_key.SetVariable( 'popup_gauge_1', ( num_done, num_to_do ) )
                     
                     with self._lock:
                         
@@ -1497,6 +1614,8 @@ class ServiceRepository( ServiceRestricted ):
                             break
                             
                         
+                        fetch_bundle = self._server_supports_thumbnail_bundles
+                        
                     
                     ( i_paused, should_quit ) = job_key.WaitIfNeeded()
                     
@@ -1512,7 +1631,34 @@ class ServiceRepository( ServiceRestricted ):
                     
                     try:
                         
-                        thumbnail = self.Request( HC.GET, 'thumbnail', { 'hash' : thumbnail_hash } )
+                        if fetch_bundle:
+                            
+                            try:
+                                
+                                self._DownloadThumbnailBundle( chunk_of_thumbnail_hashes )
+                                
+                            except HydrusExceptions.NotFoundException:
+                                
+                                # older servers have no bundle resource, so fall back to one request per thumbnail
+                                
+                                with self._lock:
+                                    
+                                    self._server_supports_thumbnail_bundles = False
+                                    
+                                
+                                fetch_bundle = False
+                                
+                            
+                        
+                        if not fetch_bundle:
+                            
+                            for thumbnail_hash in chunk_of_thumbnail_hashes:
+                                
+                                thumbnail = self.Request( HC.GET, 'thumbnail', { 'hash' : thumbnail_hash } )
+                                
+                                client_files_manager.AddFullSizeThumbnail( thumbnail_hash, thumbnail )
+                                
+                            
                         
                     except HydrusExceptions.NetworkException as e:
                         
@@ -1523,7 +1669,7 @@ class ServiceRepository( ServiceRestricted ):
                         return
                         
                     
-                    client_files_manager.AddFullSizeThumbnail( thumbnail_hash, thumbnail )
+                    num_done += len( chunk_of_thumbnail_hashes )
                     
                 
                 job_key.SetVariable( 'popup_text_1', 'finished' )
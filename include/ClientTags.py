@@ -544,6 +544,98 @@ class TagFilter( HydrusSerialisable.SerialisableBase ):
     
 HydrusSerialisable.SERIALISABLE_TYPES_TO_OBJECT_TYPES[ HydrusSerialisable.SERIALISABLE_TYPE_TAG_FILTER ] = TagFilter
 
+class TagIdTable( object ):
+    
+    # every tag that gets loaded into a tags manager is stored and split just once here, and the managers hold its id
+    # ids are only good for the life of the process and are unrelated to the ids in the db
+    
+    def __init__( self ):
+        
+        self._lock = threading.Lock()
+        
+        self._tags_to_tag_ids = {}
+        self._namespaces = {}
+        
+        self._tag_ids_to_tags = []
+        self._tag_ids_to_namespaces = []
+        self._tag_ids_to_subtags = []
+        
+        self._tag_ids_to_sortable_subtags = {}
+        
+    
+    def GetExistingTagId( self, tag ):
+        
+        return self._tags_to_tag_ids.get( tag, None )
+        
+    
+    def GetNamespace( self, tag_id ):
+        
+        return self._tag_ids_to_namespaces[ tag_id ]
+        
+    
+    def GetSortableSubtag( self, tag_id ):
+        
+        if tag_id not in self._tag_ids_to_sortable_subtags:
+            
+            self._tag_ids_to_sortable_subtags[ tag_id ] = HydrusTags.ConvertTagToSortable( self._tag_ids_to_subtags[ tag_id ] )
+            
+        
+        return self._tag_ids_to_sortable_subtags[ tag_id ]
+        
+    
+    def GetSubtag( self, tag_id ):
+        
+        return self._tag_ids_to_subtags[ tag_id ]
+        
+    
+    def GetTag( self, tag_id ):
+        
+        return self._tag_ids_to_tags[ tag_id ]
+        
+    
+    def GetTagIds( self, tags ):
+        
+        with self._lock:
+            
+            tag_ids = []
+            
+            for tag in tags:
+                
+                if tag in self._tags_to_tag_ids:
+                    
+                    tag_id = self._tags_to_tag_ids[ tag ]
+                    
+                else:
+                    
+                    tag_id = len( self._tag_ids_to_tags )
+                    
+                    ( namespace, subtag ) = HydrusTags.SplitTag( tag )
+                    
+                    namespace = self._namespaces.setdefault( namespace, namespace )
+                    
+                    self._tags_to_tag_ids[ tag ] = tag_id
+                    
+                    self._tag_ids_to_tags.append( tag )
+                    self._tag_ids_to_namespaces.append( namespace )
+                    self._tag_ids_to_subtags.append( subtag )
+                    
+                
+                tag_ids.append( tag_id )
+                
+            
+            return tag_ids
+            
+        
+    
+    def GetTags( self, tag_ids ):
+        
+        tag_ids_to_tags = self._tag_ids_to_tags
+        
+        return [ tag_ids_to_tags[ tag_id ] for tag_id in tag_ids ]
+        
+    
+tag_id_table = TagIdTable()
+
 class TagSummaryGenerator( HydrusSerialisable.SerialisableBase ):
     
     SERIALISABLE_TYPE = HydrusSerialisable.SERIALISABLE_TYPE_TAG_SUMMARY_GENERATOR
@@ -1,3 +1,4 @@
+import collections
 import cProfile
 import cStringIO
 import distutils.version
@@ -18,6 +19,8 @@ import time
 
 CONNECTION_REFRESH_TIME = 60 * 30
 
+READ_CONNECTION_WRITE_ACTIONS = { sqlite3.SQLITE_ALTER_TABLE, sqlite3.SQLITE_CREATE_INDEX, sqlite3.SQLITE_CREATE_TABLE, sqlite3.SQLITE_DELETE, sqlite3.SQLITE_DROP_INDEX, sqlite3.SQLITE_DROP_TABLE, sqlite3.SQLITE_INSERT, sqlite3.SQLITE_UPDATE }
+
 def CanVacuum( db_path, stop_time = None ):
     
     try:
@@ -61,6 +64,17 @@ def CanVacuum( db_path, stop_time = None ):
         return False
         
     
+def ReadConnectionAuthoriser( action, arg1, arg2, db_name, trigger_name ):
+    
+    # read connections may fill their own temporary tables, but nothing else
+    
+    if action in READ_CONNECTION_WRITE_ACTIONS and db_name not in ( 'mem', 'temp' ):
+        
+        return sqlite3.SQLITE_DENY
+        
+    
+    return sqlite3.SQLITE_OK
+    
 def VacuumDB( db_path ):
     
     db = sqlite3.connect( db_path, isolation_level = None, detect_types = sqlite3.PARSE_DECLTYPES )
@@ -105,6 +119,15 @@ def VacuumDB( db_path ):
 class HydrusDB( object ):
     
     READ_WRITE_ACTIONS = []
+    
+    # pure reads that may be served by the read connection pool in parallel with the writer
+    READ_CONCURRENT_ACTIONS = []
+    NUM_READ_CONNECTIONS = 0
+    
+    # asynchronous writes that can be merged with others of the same action waiting in the queue and done as one job
+    COALESCABLE_WRITE_ACTIONS = []
+    MAX_COALESCED_WRITES = 256
+    
     UPDATE_WAIT = 2
     
     TRANSACTION_COMMIT_TIME = 10
@@ -116,9 +139,13 @@ class HydrusDB( object ):
         self._db_name = db_name
         self._no_wal = no_wal
         
+        self._write_c = None
+        self._read_thread_local = threading.local()
+        
         self._transaction_started = 0
         self._in_transaction = False
         self._transaction_contains_writes = False
+        self._transaction_total_changes = 0
         
         self._connection_timestamp = 0
         
@@ -154,6 +181,17 @@ class HydrusDB( object ):
         self._jobs = Queue.PriorityQueue()
         self._pubsubs = []
         
+        self._read_jobs = Queue.PriorityQueue()
+        self._read_pool_lock = threading.Lock()
+        self._num_read_loops_running = 0
+        self._num_pending_writes = 0
+        
+        # read connections check the writer's state and take their snapshots under this, so they know whether the resident caches match what they see
+        self._read_cache_lock = threading.Lock()
+        self._commit_generation = 0
+        self._writer_job_running = False
+        self._read_pool_wants_commit = False
+        
         self._currently_doing_job = False
         self._current_status = ''
         self._current_job_name = ''
@@ -267,9 +305,31 @@ class HydrusDB( object ):
             self._transaction_started = HydrusData.GetNow()
             self._in_transaction = True
             self._transaction_contains_writes = False
+            self._transaction_total_changes = self._db.total_changes
             
         
     
+    def _CanReadConcurrently( self, action ):
+        
+        if self._num_read_loops_running == 0 or action not in self.READ_CONCURRENT_ACTIONS:
+            
+            return False
+            
+        
+        # a read connection only sees committed data, so if the writer has uncommitted work or is still to do a write queued before this read, the writer has to serve it
+        
+        if self._transaction_contains_writes or self._num_pending_writes > 0:
+            
+            # the writer commits as soon as it is next idle, so later reads can go back to the pool
+            
+            self._read_pool_wants_commit = True
+            
+            return False
+            
+        
+        return True
+        
+    
     def _CleanUpCaches( self ):
         
         pass
@@ -295,13 +355,119 @@ class HydrusDB( object ):
             
         
     
+    def _CoalesceJob( self, priority, job ):
+        
+        def get_coalesce_key( j ):
+            
+            ( action, args, kwargs ) = j.GetCallableTuple()
+            
+            if j.GetType() == 'write' and not j.IsSynchronous() and action in self.COALESCABLE_WRITE_ACTIONS and len( kwargs ) == 0:
+                
+                return self._GetWriteCoalesceKey( action, args )
+                
+            
+            return None
+            
+        
+        coalesce_key = get_coalesce_key( job )
+        
+        if coalesce_key is None:
+            
+            return job
+            
+        
+        ( action, args, kwargs ) = job.GetCallableTuple()
+        
+        coalesced_rows = self._GetWriteCoalesceRows( action, args )
+        
+        if coalesced_rows is None:
+            
+            return job
+            
+        
+        jobs = [ job ]
+        
+        while len( jobs ) < self.MAX_COALESCED_WRITES:
+            
+            try:
+                
+                ( next_priority, next_job ) = self._jobs.get_nowait()
+                
+            except Queue.Empty:
+                
+                break
+                
+            
+            next_rows = None
+            
+            if next_priority == priority and get_coalesce_key( next_job ) == coalesce_key:
+                
+                next_rows = self._GetWriteCoalesceRows( action, next_job.GetCallableTuple()[1] )
+                
+            
+            # a merged job does not keep its parts in order, so a write that touches anything the run already touches has to wait its turn
+            
+            if next_rows is not None and coalesced_rows.isdisjoint( next_rows ):
+                
+                jobs.append( next_job )
+                
+                coalesced_rows.update( next_rows )
+                
+            else:
+                
+                # the queue is ordered, so putting this back puts it right back at the front
+                
+                self._jobs.put( ( next_priority, next_job ) )
+                
+                break
+                
+            
+        
+        if len( jobs ) == 1:
+            
+            return job
+            
+        
+        merged_args = self._CoalesceWriteArgs( action, [ j.GetCallableTuple()[1] for j in jobs ] )
+        
+        with self._read_pool_lock:
+            
+            self._num_pending_writes -= len( jobs ) - 1
+            
+        
+        if HG.db_report_mode:
+            
+            HydrusData.ShowText( 'Coalesced ' + HydrusData.ConvertIntToPrettyString( len( jobs ) ) + ' ' + action + ' writes into one job.' )
+            
+        
+        return HydrusData.JobDatabase( 'write', False, action, *merged_args )
+        
+    
+    def _CoalesceWriteArgs( self, action, list_of_args ):
+        
+        # the base db does not coalesce, so it only ever sees one write's args
+        
+        ( args, ) = list_of_args
+        
+        return args
+        
+    
     def _Commit( self ):
         
         if self._in_transaction:
             
-            self._c.execute( 'COMMIT;' )
-            
-            self._in_transaction = False
+            with self._read_cache_lock:
+                
+                self._c.execute( 'COMMIT;' )
+                
+                self._in_transaction = False
+                self._transaction_contains_writes = False
+                self._read_pool_wants_commit = False
+                
+                # any read connection snapshot taken before this no longer matches the resident caches
+                
+                self._commit_generation += 1
+                
             
         else:
             
@@ -343,6 +509,11 @@ class HydrusDB( object ):
         self._c.execute( statement )
         
     
+    def _DeleteCursor( self ):
+        
+        self._write_c = None
+        
+    
     def _DisplayCatastrophicError( self, text ):
         
         message = 'The db encountered a serious error! This is going to be written to the log as well, but here it is for a screenshot:'
@@ -352,6 +523,25 @@ class HydrusDB( object ):
         HydrusData.DebugPrint( message )
         
     
+    def _GetCursor( self ):
+        
+        # read pool threads have their own cursor, everything else uses the writer's
+        
+        read_c = getattr( self._read_thread_local, 'c', None )
+        
+        if read_c is not None:
+            
+            return read_c
+            
+        
+        return self._write_c
+        
+    
+    def _GetNumReadConnections( self ):
+        
+        return self.NUM_READ_CONNECTIONS
+        
+    
     def _GetRowCount( self ):
         
         row_count = self._c.rowcount
@@ -360,6 +550,20 @@ class HydrusDB( object ):
         else: return row_count
         
     
+    def _GetWriteCoalesceKey( self, action, args ):
+        
+        # a write is only merged with the run of writes queued right after it that give the same key. None means it is done on its own
+        
+        return action
+        
+    
+    def _GetWriteCoalesceRows( self, action, args ):
+        
+        # the set of things a write touches. writes are only merged if their sets do not overlap. None means it is done on its own
+        
+        return None
+        
+    
     def _InitCaches( self ):
         
         pass
@@ -502,6 +706,56 @@ class HydrusDB( object ):
         pass
         
     
+    def _InitReadCursor( self ):
+        
+        db_path = os.path.join( self._db_dir, self._db_filenames[ 'main' ] )
+        
+        # a short timeout, as a read connection should never be waiting on a lock for long--if it does, the writer can do the job instead
+        
+        db = sqlite3.connect( db_path, isolation_level = None, detect_types = sqlite3.PARSE_DECLTYPES, timeout = 1 )
+        
+        # a job that wants to write to the real db is refused as soon as the statement is prepared, rather than waiting out the busy timeout on the writer's lock
+        
+        db.set_authorizer( ReadConnectionAuthoriser )
+        
+        self._read_thread_local.db = db
+        self._read_thread_local.c = db.cursor()
+        
+        self._c.execute( 'PRAGMA temp_store = 2;' )
+        
+        self._c.execute( 'PRAGMA main.cache_size = -10000;' )
+        
+        self._c.execute( 'ATTACH ":memory:" AS mem;' )
+        
+        self._AttachExternalDatabases()
+        
+        db_names = [ name for ( index, name, path ) in self._c.execute( 'PRAGMA database_list;' ) if name not in ( 'mem', 'temp' ) ]
+        
+        for db_name in db_names:
+            
+            self._c.execute( 'PRAGMA ' + db_name + '.cache_size = -10000;' )
+            
+        
+        self._read_thread_local.db_names = db_names
+        self._read_thread_local.generation = None
+        self._read_thread_local.pubsubs = []
+        
+    
+    def _InitReadPool( self ):
+        
+        if self._no_wal:
+            
+            # without WAL, readers and the writer lock each other out
+            
+            return
+            
+        
+        for i in range( self._GetNumReadConnections() ):
+            
+            self._controller.CallToThreadLongRunning( self.ReadLoop )
+            
+        
+    
     def _ManageDBError( self, job, e ):
         
         raise NotImplementedError()
@@ -515,12 +769,20 @@ class HydrusDB( object ):
         
         try:
             
+            with self._read_cache_lock:
+                
+                self._writer_job_running = True
+                
+                if job_type in ( 'read_write', 'write' ):
+                    
+                    self._transaction_contains_writes = True
+                    
+                
+            
             if job_type in ( 'read_write', 'write' ):
                 
                 self._current_status = 'db write locked'
                 
-                self._transaction_contains_writes = True
-                
             else:
                 
                 self._current_status = 'db read locked'
@@ -585,6 +847,26 @@ class HydrusDB( object ):
             
         finally:
             
+            with self._read_cache_lock:
+                
+                # plain reads can make new definitions, so anything uncommitted keeps the read connections off the caches until the next commit
+                
+                if self._in_transaction and self._db is not None and self._db.total_changes != self._transaction_total_changes:
+                    
+                    self._transaction_contains_writes = True
+                    
+                
+                self._writer_job_running = False
+                
+            
+            if job_type == 'write':
+                
+                with self._read_pool_lock:
+                    
+                    self._num_pending_writes -= 1
+                    
+                
+            
             self._pubsubs = []
             
             self._current_status = ''
@@ -593,11 +875,100 @@ class HydrusDB( object ):
             
         
     
+    def _ProcessReadJob( self, priority, job ):
+        
+        ( action, args, kwargs ) = job.GetCallableTuple()
+        
+        try:
+            
+            with self._read_cache_lock:
+                
+                # a write may have been queued or started since this job was dispatched, in which case the writer has to serve it
+                
+                can_read_concurrently = self._CanReadConcurrently( action )
+                
+                if can_read_concurrently:
+                    
+                    # a deferred transaction gives the whole job one consistent snapshot of the db
+                    # reading every db now fixes that snapshot while the writer cannot commit, so it matches the current generation
+                    
+                    self._c.execute( 'BEGIN DEFERRED;' )
+                    
+                    try:
+                        
+                        for db_name in self._read_thread_local.db_names:
+                            
+                            self._c.execute( 'SELECT 1 FROM ' + db_name + '.sqlite_master;' ).fetchone()
+                            
+                        
+                    except:
+                        
+                        self._c.execute( 'ROLLBACK;' )
+                        
+                        raise
+                        
+                    
+                    self._read_thread_local.generation = self._commit_generation
+                    
+                
+            
+            if not can_read_concurrently:
+                
+                self._jobs.put( ( priority + 1, job ) )
+                
+                return
+                
+            
+            self._read_thread_local.pubsubs = []
+            
+            try:
+                
+                result = self._Read( action, *args, **kwargs )
+                
+            finally:
+                
+                self._read_thread_local.generation = None
+                
+                self._c.execute( 'ROLLBACK;' )
+                
+            
+            for ( topic, args, kwargs ) in self._read_thread_local.pubsubs:
+                
+                self._controller.pub( topic, *args, **kwargs )
+                
+            
+            job.PutResult( result )
+            
+        except sqlite3.DatabaseError:
+            
+            # the job wanted to write something, like a new hash definition, or could not get its snapshot, so let the writer do it properly
+            
+            self._jobs.put( ( priority + 1, job ) )
+            
+        except Exception as e:
+            
+            self._ManageDBError( job, e )
+            
+        
+    
     def _Read( self, action, *args, **kwargs ):
         
         raise NotImplementedError()
         
     
+    def _ReadCachesAreCurrent( self ):
+        
+        # call this holding _read_cache_lock, and keep holding it while using what the caches hand out
+        # the writer's caches always match its own view of the db. a read connection can only trust them if the writer is idle, has nothing uncommitted, and has not committed since the read took its snapshot
+        
+        if getattr( self._read_thread_local, 'c', None ) is None:
+            
+            return True
+            
+        
+        return not self._writer_job_running and not self._transaction_contains_writes and self._read_thread_local.generation == self._commit_generation
+        
+    
     def _RepairDB( self ):
         
         pass
@@ -627,6 +998,11 @@ class HydrusDB( object ):
         self._c.execute( 'SAVEPOINT hydrus_savepoint;' )
         
     
+    def _SetCursor( self, c ):
+        
+        self._write_c = c
+        
+    
     def _SelectFromList( self, select_statement, xs ):
         
         # issue here is that doing a simple blah_id = ? is real quick and cacheable but doing a lot of fetchone()s is slow
@@ -703,7 +1079,16 @@ class HydrusDB( object ):
     
     def pub_after_job( self, topic, *args, **kwargs ):
         
-        self._pubsubs.append( ( topic, args, kwargs ) )
+        # a read connection keeps its own list, so it never touches the writer's
+        
+        if getattr( self._read_thread_local, 'c', None ) is not None:
+            
+            self._read_thread_local.pubsubs.append( ( topic, args, kwargs ) )
+            
+        else:
+            
+            self._pubsubs.append( ( topic, args, kwargs ) )
+            
         
     
     def publish_status_update( self ):
@@ -747,7 +1132,7 @@ class HydrusDB( object ):
     
     def LoopIsFinished( self ):
         
-        return self._loop_finished
+        return self._loop_finished and self._num_read_loops_running == 0
         
     
     def JobsQueueEmpty( self ):
@@ -765,6 +1150,8 @@ class HydrusDB( object ):
             
             self._InitCaches()
             
+            self._InitReadPool()
+            
         except:
             
             self._DisplayCatastrophicError( traceback.format_exc() )
@@ -778,12 +1165,17 @@ class HydrusDB( object ):
         
         error_count = 0
         
-        while not ( ( self._local_shutdown or self._controller.ModelIsShutdown() ) and self._jobs.empty() ):
+        # a read connection can hand its job back to us until it has finished, so we keep going until they all have and the queue is clear
+        # a read loop hands its last job back before it counts itself out, so checking the count first means the queue check sees that job
+        
+        while not ( ( self._local_shutdown or self._controller.ModelIsShutdown() ) and self._num_read_loops_running == 0 and self._jobs.empty() ):
             
             try:
                 
                 ( priority, job ) = self._jobs.get( timeout = 1 )
                 
+                job = self._CoalesceJob( priority, job )
+                
                 self._currently_doing_job = True
                 self._current_job_name = job.ToString()
                 
@@ -815,6 +1207,14 @@ class HydrusDB( object ):
                         raise
                         
                     
+                    if job.GetType() == 'write':
+                        
+                        with self._read_pool_lock:
+                            
+                            self._num_pending_writes += 1
+                            
+                        
+                    
                     self._jobs.put( ( priority, job ) ) # couldn't lock db; put job back on queue
                     
                     time.sleep( 5 )
@@ -827,7 +1227,12 @@ class HydrusDB( object ):
                 
             except Queue.Empty:
                 
-                if self._transaction_contains_writes and HydrusData.TimeHasPassed( self._transaction_started + self.TRANSACTION_COMMIT_TIME ):
+                # if reads had to come to us because of uncommitted changes, committing as soon as we are idle lets the read connections take them again
+                # otherwise we wait as usual, so light write traffic does not pay for a commit every second
+                
+                commit_for_read_pool = self._read_pool_wants_commit and self._db.total_changes != self._transaction_total_changes
+                
+                if self._transaction_contains_writes and ( commit_for_read_pool or HydrusData.TimeHasPassed( self._transaction_started + self.TRANSACTION_COMMIT_TIME ) ):
                     
                     self._Commit()
                     
@@ -862,11 +1267,69 @@ class HydrusDB( object ):
             raise HydrusExceptions.ShutdownException( 'Application has shut down!' )
             
         
-        self._jobs.put( ( priority + 1, job ) ) # +1 so all writes of equal priority can clear out first
+        if self._CanReadConcurrently( action ):
+            
+            self._read_jobs.put( ( priority, job ) )
+            
+        else:
+            
+            self._jobs.put( ( priority + 1, job ) ) # +1 so all writes of equal priority can clear out first
+            
         
         return job.GetResult()
         
     
+    def ReadLoop( self ):
+        
+        try:
+            
+            self._InitReadCursor()
+            
+        except Exception as e:
+            
+            HydrusData.Print( 'Could not start a db read connection:' )
+            
+            HydrusData.PrintException( e )
+            
+            return
+            
+        
+        with self._read_pool_lock:
+            
+            self._num_read_loops_running += 1
+            
+        
+        try:
+            
+            while not ( ( self._local_shutdown or self._controller.ModelIsShutdown() ) and self._read_jobs.empty() ):
+                
+                try:
+                    
+                    ( priority, job ) = self._read_jobs.get( timeout = 1 )
+                    
+                except Queue.Empty:
+                    
+                    continue
+                    
+                
+                self._ProcessReadJob( priority, job )
+                
+            
+        finally:
+            
+            with self._read_pool_lock:
+                
+                self._num_read_loops_running -= 1
+                
+            
+            self._read_thread_local.c.close()
+            self._read_thread_local.db.close()
+            
+            self._read_thread_local.c = None
+            self._read_thread_local.db = None
+            
+        
+    
     def ReadyToServeRequests( self ):
         
         return self._ready_to_serve_requests
@@ -903,11 +1366,171 @@ class HydrusDB( object ):
             raise HydrusExceptions.ShutdownException( 'Application has shut down!' )
             
         
+        with self._read_pool_lock:
+            
+            self._num_pending_writes += 1
+            
+        
         self._jobs.put( ( priority, job ) )
         
         if synchronous: return job.GetResult()
         
     
+    _c = property( _GetCursor, _SetCursor, _DeleteCursor )
+    
+class IdCache( object ):
+    
+    # master definitions like hashes and tags never change once they have an id, so recently used pairs can be kept without checking the db
+    # ids made in a transaction that rolls back do not exist any more, so the owner has to clear this on rollback
+    
+    def __init__( self, max_size ):
+        
+        self._max_size = max_size
+        
+        self._lock = threading.Lock()
+        
+        self._keys_to_ids = collections.OrderedDict()
+        self._ids_to_keys = {}
+        
+    
+    def __len__( self ):
+        
+        with self._lock:
+            
+            return len( self._keys_to_ids )
+            
+        
+    
+    def AddIds( self, keys_to_ids ):
+        
+        with self._lock:
+            
+            for ( key, i ) in keys_to_ids.items():
+                
+                if key in self._keys_to_ids:
+                    
+                    del self._keys_to_ids[ key ]
+                    
+                
+                self._keys_to_ids[ key ] = i
+                self._ids_to_keys[ i ] = key
+                
+            
+            while len( self._keys_to_ids ) > self._max_size:
+                
+                ( key, i ) = self._keys_to_ids.popitem( last = False )
+                
+                if self._ids_to_keys.get( i, None ) == key:
+                    
+                    del self._ids_to_keys[ i ]
+                    
+                
+            
+        
+    
+    def Clear( self ):
+        
+        with self._lock:
+            
+            self._keys_to_ids = collections.OrderedDict()
+            self._ids_to_keys = {}
+            
+        
+    
+    def GetId( self, key ):
+        
+        with self._lock:
+            
+            i = self._keys_to_ids.pop( key, None )
+            
+            if i is not None:
+                
+                self._keys_to_ids[ key ] = i
+                
+            
+            return i
+            
+        
+    
+    def GetIds( self, keys ):
+        
+        # returns what we know, and the keys the caller will have to look up themselves
+        
+        keys_to_ids = {}
+        missing_keys = set()
+        
+        with self._lock:
+            
+            for key in keys:
+                
+                i = self._keys_to_ids.pop( key, None )
+                
+                if i is None:
+                    
+                    missing_keys.add( key )
+                    
+                else:
+                    
+                    self._keys_to_ids[ key ] = i
+                    
+                    keys_to_ids[ key ] = i
+                    
+                
+            
+        
+        return ( keys_to_ids, missing_keys )
+        
+    
+    def GetKeys( self, ids ):
+        
+        with self._lock:
+            
+            ids_to_keys = {}
+            missing_ids = set()
+            
+            for i in ids:
+                
+                if i in self._ids_to_keys:
+                    
+                    ids_to_keys[ i ] = self._ids_to_keys[ i ]
+                    
+                else:
+                    
+                    missing_ids.add( i )
+                    
+                
+            
+            return ( ids_to_keys, missing_ids )
+            
+        
+    
+class TemporaryBlobTable( object ):
+    
+    def __init__( self, cursor, blob_iterable, column_name ):
+        
+        self._cursor = cursor
+        self._blob_iterable = blob_iterable
+        self._column_name = column_name
+        
+        self._table_name = 'mem.tempblob' + os.urandom( 32 ).encode( 'hex' )
+        
+    
+    def __enter__( self ):
+        
+        self._cursor.execute( 'CREATE TABLE ' + self._table_name + ' ( ' + self._column_name + ' BLOB_BYTES PRIMARY KEY );' )
+        
+        self._cursor.executemany( 'INSERT OR IGNORE INTO ' + self._table_name + ' ( ' + self._column_name + ' ) VALUES ( ? );', ( ( sqlite3.Binary( b ), ) for b in self._blob_iterable ) )
+        
+        return self._table_name
+        
+    
+    def __exit__( self, exc_type, exc_val, exc_tb ):
+        
+        self._cursor.execute( 'DROP TABLE ' + self._table_name + ';' )
+        
+        return False
+        
+    
 class TemporaryIntegerTable( object ):
     
     def __init__( self, cursor, integer_iterable, column_name ):
@@ -935,3 +1558,30 @@ class TemporaryIntegerTable( object ):
         return False
         
     
+class TemporaryTextTable( object ):
+    
+    def __init__( self, cursor, text_iterable, column_name ):
+        
+        self._cursor = cursor
+        self._text_iterable = text_iterable
+        self._column_name = column_name
+        
+        self._table_name = 'mem.temptext' + os.urandom( 32 ).encode( 'hex' )
+        
+    
+    def __enter__( self ):
+        
+        self._cursor.execute( 'CREATE TABLE ' + self._table_name + ' ( ' + self._column_name + ' TEXT PRIMARY KEY );' )
+        
+        self._cursor.executemany( 'INSERT OR IGNORE INTO ' + self._table_name + ' ( ' + self._column_name + ' ) VALUES ( ? );', ( ( t, ) for t in self._text_iterable ) )
+        
+        return self._table_name
+        
+    
+    def __exit__( self, exc_type, exc_val, exc_tb ):
+        
+        self._cursor.execute( 'DROP TABLE ' + self._table_name + ';' )
+        
+        return False
+        
+    
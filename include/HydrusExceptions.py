@@ -13,6 +13,7 @@ class DBException( Exception ):
 class DBAccessException( Exception ): pass
 class FileMissingException( Exception ): pass
 class NameException( Exception ): pass
+class SerialisationException( Exception ): pass
 class ShutdownException( Exception ): pass
 
 class VetoException( Exception ): pass
@@ -1,3 +1,4 @@
+import array
 import collections
 import HydrusConstants as HC
 import HydrusData
@@ -5,11 +6,37 @@ import HydrusExceptions
 import HydrusGlobals as HG
 import HydrusNetworking
 import HydrusSerialisable
+import json
+import mmap
+import os
+import struct
+import sys
 import threading
 
 INT_PARAMS = { 'expires', 'num', 'since', 'content_type', 'action', 'status' }
 BYTE_PARAMS = { 'access_key', 'account_type_key', 'subject_account_key', 'hash', 'registration_key', 'subject_hash', 'subject_tag', 'share_key', 'update_hash' }
 
+MAX_THUMBNAIL_BUNDLE_HASHES = 256
+
+# a content update sidecar is this header, a json list of the non-mapping content, and then the new and deleted mappings
+# each mappings section is a run of ( service_tag_id, num_service_hash_ids ) headers, each followed by that many uint32 service_hash_ids
+CONTENT_UPDATE_SIDECAR_HEADER_STRUCT = struct.Struct( '<4sIQQQQQQQ' )
+CONTENT_UPDATE_SIDECAR_MAGIC = 'HCUS'
+CONTENT_UPDATE_SIDECAR_VERSION = 1
+CONTENT_UPDATE_SIDECAR_MAPPING_HEADER_STRUCT = struct.Struct( '<II' )
+
+if array.array( 'I' ).itemsize == 4:
+    
+    UINT32_ARRAY_TYPECODE = 'I'
+    
+else:
+    
+    UINT32_ARRAY_TYPECODE = 'L'
+    
+
+# each thumbnail in a bundle is the 32-byte hash, a big-endian unsigned int length, and then the thumbnail bytes
+THUMBNAIL_BUNDLE_HEADER_STRUCT = struct.Struct( '>32sI' )
+
 def GenerateDefaultServiceDictionary( service_type ):
     
     dictionary = HydrusSerialisable.SerialisableDictionary()
@@ -140,6 +167,11 @@ def DumpToBodyString( args ):
         args[ 'account_types' ] = [ account_type.ToSerialisableTuple() for account_type in args[ 'account_types' ] ]
         
     
+    if 'hashes' in args:
+        
+        args[ 'hashes' ] = [ hash.encode( 'hex' ) for hash in args[ 'hashes' ] ]
+        
+    
     if 'registration_keys' in args:
         
         args[ 'registration_keys' ] = [ registration_key.encode( 'hex' ) for registration_key in args[ 'registration_keys' ] ]
@@ -241,6 +273,18 @@ def ParseBodyString( json_string ):
         args[ 'account_types' ] = map( AccountType.GenerateAccountTypeFromSerialisableTuple, account_type_tuples )
         
     
+    if 'hashes' in args:
+        
+        try:
+            
+            args[ 'hashes' ] = [ encoded_hash.decode( 'hex' ) for encoded_hash in args[ 'hashes' ] ]
+            
+        except:
+            
+            raise HydrusExceptions.ForbiddenException( 'I was expecting to parse \'hashes\' as a list of hex-encoded strings, but it failed.' )
+            
+        
+    
     if 'registration_keys' in args:
         
         args[ 'registration_keys' ] = [ encoded_registration_key.decode( 'hex' ) for encoded_registration_key in args[ 'registration_keys' ] ]
@@ -318,6 +362,87 @@ def ParseGETArgs( requests_args ):
     
     return args
     
+def ReadThumbnailBundle( f ):
+    
+    while True:
+        
+        header = f.read( THUMBNAIL_BUNDLE_HEADER_STRUCT.size )
+        
+        if len( header ) == 0:
+            
+            break
+            
+        
+        if len( header ) < THUMBNAIL_BUNDLE_HEADER_STRUCT.size:
+            
+            raise HydrusExceptions.NetworkException( 'The thumbnail bundle was truncated!' )
+            
+        
+        ( hash, num_bytes ) = THUMBNAIL_BUNDLE_HEADER_STRUCT.unpack( header )
+        
+        thumbnail = f.read( num_bytes )
+        
+        if len( thumbnail ) < num_bytes:
+            
+            raise HydrusExceptions.NetworkException( 'The thumbnail bundle was truncated!' )
+            
+        
+        yield ( hash, thumbnail )
+        
+    
+def WriteContentUpdateSidecar( path, content_update ):
+    
+    def pack_mappings( mappings ):
+        
+        blocks = []
+        
+        for ( service_tag_id, service_hash_ids ) in mappings:
+            
+            service_hash_ids = array.array( UINT32_ARRAY_TYPECODE, service_hash_ids )
+            
+            if sys.byteorder == 'big':
+                
+                service_hash_ids.byteswap()
+                
+            
+            blocks.append( CONTENT_UPDATE_SIDECAR_MAPPING_HEADER_STRUCT.pack( service_tag_id, len( service_hash_ids ) ) )
+            blocks.append( service_hash_ids.tostring() )
+            
+        
+        return ''.join( blocks )
+        
+    
+    other_content = [ content_update.GetNewFiles(), content_update.GetDeletedFiles(), content_update.GetNewTagParents(), content_update.GetDeletedTagParents(), content_update.GetNewTagSiblings(), content_update.GetDeletedTagSiblings() ]
+    
+    other_content_bytes = json.dumps( other_content )
+    new_mappings_bytes = pack_mappings( content_update.GetNewMappings() )
+    deleted_mappings_bytes = pack_mappings( content_update.GetDeletedMappings() )
+    
+    other_content_offset = CONTENT_UPDATE_SIDECAR_HEADER_STRUCT.size
+    new_mappings_offset = other_content_offset + len( other_content_bytes )
+    deleted_mappings_offset = new_mappings_offset + len( new_mappings_bytes )
+    
+    header = CONTENT_UPDATE_SIDECAR_HEADER_STRUCT.pack( CONTENT_UPDATE_SIDECAR_MAGIC, CONTENT_UPDATE_SIDECAR_VERSION, content_update.GetNumRows(), other_content_offset, len( other_content_bytes ), new_mappings_offset, len( new_mappings_bytes ), deleted_mappings_offset, len( deleted_mappings_bytes ) )
+    
+    # written under a temp name first so a crash never leaves a truncated sidecar behind
+    
+    temp_path = path + '.temp'
+    
+    with open( temp_path, 'wb' ) as f:
+        
+        f.write( header )
+        f.write( other_content_bytes )
+        f.write( new_mappings_bytes )
+        f.write( deleted_mappings_bytes )
+        
+    
+    if os.path.exists( path ):
+        
+        os.remove( path )
+        
+    
+    os.rename( temp_path, path )
+    
 class Account( object ):
     
     def __init__( self, account_key, account_type, created, expires, banned_info = None, bandwidth_tracker = None ):
@@ -1324,6 +1449,124 @@ class ContentUpdate( HydrusSerialisable.SerialisableBase ):
     
 HydrusSerialisable.SERIALISABLE_TYPES_TO_OBJECT_TYPES[ HydrusSerialisable.SERIALISABLE_TYPE_CONTENT_UPDATE ] = ContentUpdate
 
+class ContentUpdateSidecar( object ):
+    
+    def __init__( self, path ):
+        
+        with open( path, 'rb' ) as f:
+            
+            self._mmap = mmap.mmap( f.fileno(), 0, access = mmap.ACCESS_READ )
+            
+        
+        try:
+            
+            if len( self._mmap ) < CONTENT_UPDATE_SIDECAR_HEADER_STRUCT.size:
+                
+                raise HydrusExceptions.SerialisationException( 'That update sidecar was truncated!' )
+                
+            
+            ( magic, version, self._num_rows, other_content_offset, other_content_length, self._new_mappings_offset, self._new_mappings_length, self._deleted_mappings_offset, self._deleted_mappings_length ) = CONTENT_UPDATE_SIDECAR_HEADER_STRUCT.unpack_from( self._mmap, 0 )
+            
+            if magic != CONTENT_UPDATE_SIDECAR_MAGIC or version != CONTENT_UPDATE_SIDECAR_VERSION:
+                
+                raise HydrusExceptions.SerialisationException( 'Did not recognise that update sidecar!' )
+                
+            
+            if self._deleted_mappings_offset + self._deleted_mappings_length != len( self._mmap ):
+                
+                raise HydrusExceptions.SerialisationException( 'That update sidecar was truncated!' )
+                
+            
+            other_content = json.loads( self._mmap[ other_content_offset : other_content_offset + other_content_length ] )
+            
+            ( self._new_files, self._deleted_files, self._new_tag_parents, self._deleted_tag_parents, self._new_tag_siblings, self._deleted_tag_siblings ) = other_content
+            
+        except:
+            
+            self.Close()
+            
+            raise
+            
+        
+    
+    def _IterateMappings( self, offset, length ):
+        
+        position = offset
+        end = offset + length
+        
+        while position < end:
+            
+            ( service_tag_id, num_service_hash_ids ) = CONTENT_UPDATE_SIDECAR_MAPPING_HEADER_STRUCT.unpack_from( self._mmap, position )
+            
+            position += CONTENT_UPDATE_SIDECAR_MAPPING_HEADER_STRUCT.size
+            
+            next_position = position + num_service_hash_ids * 4
+            
+            service_hash_ids = array.array( UINT32_ARRAY_TYPECODE )
+            
+            service_hash_ids.fromstring( self._mmap[ position : next_position ] )
+            
+            if sys.byteorder == 'big':
+                
+                service_hash_ids.byteswap()
+                
+            
+            position = next_position
+            
+            yield ( service_tag_id, service_hash_ids.tolist() )
+            
+        
+    
+    def Close( self ):
+        
+        self._mmap.close()
+        
+    
+    def GetDeletedFiles( self ):
+        
+        return self._deleted_files
+        
+    
+    def GetDeletedMappings( self ):
+        
+        return self._IterateMappings( self._deleted_mappings_offset, self._deleted_mappings_length )
+        
+    
+    def GetDeletedTagParents( self ):
+        
+        return self._deleted_tag_parents
+        
+    
+    def GetDeletedTagSiblings( self ):
+        
+        return self._deleted_tag_siblings
+        
+    
+    def GetNewFiles( self ):
+        
+        return self._new_files
+        
+    
+    def GetNewMappings( self ):
+        
+        return self._IterateMappings( self._new_mappings_offset, self._new_mappings_length )
+        
+    
+    def GetNewTagParents( self ):
+        
+        return self._new_tag_parents
+        
+    
+    def GetNewTagSiblings( self ):
+        
+        return self._new_tag_siblings
+        
+    
+    def GetNumRows( self ):
+        
+        return self._num_rows
+        
+    
 class Credentials( HydrusSerialisable.SerialisableBase ):
     
     SERIALISABLE_TYPE = HydrusSerialisable.SERIALISABLE_TYPE_CREDENTIALS
@@ -2330,45 +2573,137 @@ class ServerServiceAdmin( ServerServiceRestricted ):
             
         
     
-class UpdateBuilder( object ):
+class ThumbnailBundleStream( object ):
     
-    def __init__( self, update_class, max_rows ):
+    def __init__( self, hashes_and_paths ):
         
-        self._update_class = update_class
-        self._max_rows = max_rows
+        # each file is stat'd once, here, and that size is used for the total length, the file's header and how much of it is sent, so they always agree
+        # files are only opened as they are reached, so a big bundle does not hold a handle for every thumbnail
         
-        self._updates = []
+        self._hashes_paths_and_sizes = [ ( hash, path, os.path.getsize( path ) ) for ( hash, path ) in hashes_and_paths ]
         
-        self._current_update = self._update_class()
-        self._current_num_rows = 0
+        self._length = sum( ( THUMBNAIL_BUNDLE_HEADER_STRUCT.size + num_bytes for ( hash, path, num_bytes ) in self._hashes_paths_and_sizes ) )
+        
+        self._next_index = 0
+        self._current_file = None
+        self._current_path = None
+        self._current_num_bytes_remaining = 0
+        self._buffer = ''
         
     
-    def AddRow( self, row, row_weight = 1 ):
+    def _OpenNextFile( self ):
+        
+        ( hash, path, num_bytes ) = self._hashes_paths_and_sizes[ self._next_index ]
+        
+        self._next_index += 1
         
-        self._current_update.AddRow( row )
-        self._current_num_rows += row_weight
+        self._current_file = open( path, 'rb' )
+        self._current_path = path
+        self._current_num_bytes_remaining = num_bytes
         
-        if self._current_num_rows > self._max_rows:
+        self._buffer = THUMBNAIL_BUNDLE_HEADER_STRUCT.pack( hash, num_bytes )
+        
+    
+    def close( self ):
+        
+        if self._current_file is not None:
             
-            self._updates.append( self._current_update )
+            self._current_file.close()
             
-            self._current_update = self._update_class()
-            self._current_num_rows = 0
+            self._current_file = None
             
         
+        self._next_index = len( self._hashes_paths_and_sizes )
+        self._buffer = ''
+        
+    
+    def GetLength( self ):
+        
+        return self._length
+        
     
-    def Finish( self ):
+    def read( self, num_bytes ):
+        
+        chunks = []
+        num_bytes_remaining = num_bytes
         
-        if self._current_update.GetNumRows() > 0:
+        while num_bytes_remaining > 0:
+            
+            if len( self._buffer ) > 0:
+                
+                chunk = self._buffer[ : num_bytes_remaining ]
+                
+                self._buffer = self._buffer[ num_bytes_remaining : ]
+                
+            elif self._current_file is not None:
+                
+                if self._current_num_bytes_remaining == 0:
+                    
+                    self._current_file.close()
+                    
+                    self._current_file = None
+                    
+                    continue
+                    
+                
+                chunk = self._current_file.read( min( num_bytes_remaining, self._current_num_bytes_remaining ) )
+                
+                if len( chunk ) == 0:
+                    
+                    raise HydrusExceptions.FileMissingException( 'The thumbnail at ' + self._current_path + ' shrank while it was being sent!' )
+                    
+                
+                self._current_num_bytes_remaining -= len( chunk )
+                
+            elif self._next_index < len( self._hashes_paths_and_sizes ):
+                
+                self._OpenNextFile()
+                
+                continue
+                
+            else:
+                
+                break
+                
+            
+            chunks.append( chunk )
             
-            self._updates.append( self._current_update )
+            num_bytes_remaining -= len( chunk )
             
         
-        self._current_update = None
+        return ''.join( chunks )
+        
+    
+class UpdateBuilder( object ):
+    
+    def __init__( self, update_class, max_rows ):
+        
+        self._update_class = update_class
+        self._max_rows = max_rows
         
     
-    def GetUpdates( self ):
+    def IterateUpdates( self, rows_and_weights ):
+        
+        current_update = self._update_class()
+        current_num_rows = 0
+        
+        for ( row, row_weight ) in rows_and_weights:
+            
+            current_update.AddRow( row )
+            current_num_rows += row_weight
+            
+            if current_num_rows > self._max_rows:
+                
+                yield current_update
+                
+                current_update = self._update_class()
+                current_num_rows = 0
+                
+            
         
-        return self._updates
+        if current_update.GetNumRows() > 0:
+            
+            yield current_update
+            
         
     
@@ -12,10 +12,51 @@ from twisted.internet import reactor, defer
 from twisted.internet.threads import deferToThread
 from twisted.web.server import NOT_DONE_YET
 from twisted.web.resource import Resource
-from twisted.web.static import File as FileResource, NoRangeStaticProducer
+from twisted.web.static import File as FileResource, NoRangeStaticProducer, SingleRangeStaticProducer
 import HydrusData
 import HydrusGlobals as HG
 
+def ETagMatches( header_value, etag ):
+    
+    if header_value.strip() == '*':
+        
+        return True
+        
+    
+    # If-None-Match uses the weak comparison, so a W/ prefix is ignored
+    
+    for tag in header_value.split( ',' ):
+        
+        tag = tag.strip()
+        
+        if tag.startswith( 'W/' ):
+            
+            tag = tag[2:]
+            
+        
+        if tag == etag:
+            
+            return True
+            
+        
+    
+    return False
+    
+def GenerateETag( hash, path = None ):
+    
+    etag = hash.encode( 'hex' )
+    
+    if path is not None:
+        
+        # thumbnails can be regenerated under the same hash, so their etags also cover the file's size and modified time
+        
+        stat_result = os.stat( path )
+        
+        etag += '-' + '%x' % stat_result.st_size + '-' + '%x' % int( stat_result.st_mtime )
+        
+    
+    return '"' + etag + '"'
+    
 def GenerateEris( service, domain ):
     
     name = service.GetName()
@@ -259,6 +300,72 @@ def ParseFileArguments( path ):
     
     return args
     
+def ParseRangeHeader( range_header, size ):
+    
+    # returns ( offset, length ), where a length of 0 means the range cannot be satisfied
+    # only single byte ranges are supported, and anything else returns None so the whole file is sent
+    
+    range_header = range_header.strip()
+    
+    if not range_header.startswith( 'bytes=' ):
+        
+        return None
+        
+    
+    byte_range = range_header[ 6 : ].strip()
+    
+    if ',' in byte_range or '-' not in byte_range:
+        
+        return None
+        
+    
+    ( first, last ) = byte_range.split( '-', 1 )
+    
+    try:
+        
+        if first == '':
+            
+            suffix_length = int( last )
+            
+            offset = max( size - suffix_length, 0 )
+            
+            length = size - offset
+            
+        else:
+            
+            offset = int( first )
+            
+            if last == '':
+                
+                last = size - 1
+                
+            else:
+                
+                last = int( last )
+                
+                if last < offset:
+                    
+                    return None
+                    
+                
+                last = min( last, size - 1 )
+                
+            
+            length = max( last - offset + 1, 0 )
+            
+        
+    except ValueError:
+        
+        return None
+        
+    
+    if offset >= size:
+        
+        length = 0
+        
+    
+    return ( offset, length )
+    
 hydrus_favicon = FileResource( os.path.join( HC.STATIC_DIR, 'hydrus.ico' ), defaultType = 'image/x-icon' )
 
 class HydrusDomain( object ):
@@ -460,23 +567,113 @@ class HydrusResource( Resource ):
             
             content_type = HC.mime_string_lookup[ mime ]
             
-            content_length = size
-            
             ( base, filename ) = os.path.split( path )
             
             content_disposition = 'inline; filename="' + filename + '"'
             
-            # can't be unicode!
-            request.setHeader( 'Content-Type', str( content_type ) )
-            request.setHeader( 'Content-Length', str( content_length ) )
-            request.setHeader( 'Content-Disposition', str( content_disposition ) )
+            etag = response_context.GetETag()
+            
+            if etag is not None:
+                
+                request.setHeader( 'ETag', etag )
+                
+            
+            request.setHeader( 'Accept-Ranges', 'bytes' )
             
             request.setHeader( 'Expires', time.strftime( '%a, %d %b %Y %H:%M:%S GMT', time.gmtime( time.time() + 86400 * 365 ) ) )
             request.setHeader( 'Cache-Control', str( 86400 * 365 ) )
             
-            fileObject = open( path, 'rb' )
+            if_none_match = request.getHeader( 'If-None-Match' )
+            
+            if etag is not None and if_none_match is not None and ETagMatches( if_none_match, etag ):
+                
+                request.setResponseCode( 304 )
+                
+                content_length = 0
+                
+            else:
+                
+                byte_range = None
+                
+                range_header = request.getHeader( 'Range' )
+                
+                if range_header is not None:
+                    
+                    if_range = request.getHeader( 'If-Range' )
+                    
+                    # if the client's partial copy is out of date, If-Range will not match and it gets the whole file
+                    
+                    if if_range is None or ( etag is not None and if_range.strip() == etag ):
+                        
+                        byte_range = ParseRangeHeader( range_header, size )
+                        
+                    
+                
+                if byte_range is None:
+                    
+                    content_length = size
+                    
+                    # can't be unicode!
+                    request.setHeader( 'Content-Type', str( content_type ) )
+                    request.setHeader( 'Content-Length', str( content_length ) )
+                    request.setHeader( 'Content-Disposition', str( content_disposition ) )
+                    
+                    fileObject = open( path, 'rb' )
+                    
+                    producer = NoRangeStaticProducer( request, fileObject )
+                    
+                    producer.start()
+                    
+                    do_finish = False
+                    
+                else:
+                    
+                    ( offset, content_length ) = byte_range
+                    
+                    if content_length == 0:
+                        
+                        request.setResponseCode( 416 )
+                        
+                        request.setHeader( 'Content-Range', 'bytes */' + str( size ) )
+                        request.setHeader( 'Content-Length', '0' )
+                        
+                    else:
+                        
+                        request.setResponseCode( 206 )
+                        
+                        request.setHeader( 'Content-Type', str( content_type ) )
+                        request.setHeader( 'Content-Length', str( content_length ) )
+                        request.setHeader( 'Content-Range', 'bytes ' + str( offset ) + '-' + str( offset + content_length - 1 ) + '/' + str( size ) )
+                        request.setHeader( 'Content-Disposition', str( content_disposition ) )
+                        
+                        fileObject = open( path, 'rb' )
+                        
+                        producer = SingleRangeStaticProducer( request, fileObject, offset, content_length )
+                        
+                        producer.start()
+                        
+                        do_finish = False
+                        
+                    
+                
+            
+        elif response_context.HasStream():
             
-            producer = NoRangeStaticProducer( request, fileObject )
+            stream = response_context.GetStream()
+            
+            mime = response_context.GetMime()
+            
+            content_type = HC.mime_string_lookup[ mime ]
+            
+            content_length = stream.GetLength()
+            
+            content_disposition = 'inline'
+            
+            request.setHeader( 'Content-Type', str( content_type ) )
+            request.setHeader( 'Content-Length', str( content_length ) )
+            request.setHeader( 'Content-Disposition', content_disposition )
+            
+            producer = NoRangeStaticProducer( request, stream )
             
             producer.start()
             
@@ -762,7 +959,7 @@ class HydrusResourceWelcome( HydrusResource ):
     
 class ResponseContext( object ):
     
-    def __init__( self, status_code, mime = HC.APPLICATION_JSON, body = None, path = None, cookies = None ):
+    def __init__( self, status_code, mime = HC.APPLICATION_JSON, body = None, path = None, stream = None, etag = None, cookies = None ):
         
         if isinstance( body, HydrusSerialisable.SerialisableBase ):
             
@@ -778,6 +975,8 @@ class ResponseContext( object ):
         self._mime = mime
         self._body = body
         self._path = path
+        self._stream = stream
+        self._etag = etag
         self._cookies = cookies
         
     
@@ -788,6 +987,8 @@ class ResponseContext( object ):
     
     def GetCookies( self ): return self._cookies
     
+    def GetETag( self ): return self._etag
+    
     def GetLength( self ): return len( self._body )
     
     def GetMime( self ): return self._mime
@@ -796,7 +997,11 @@ class ResponseContext( object ):
     
     def GetStatusCode( self ): return self._status_code
     
+    def GetStream( self ): return self._stream
+    
     def HasBody( self ): return self._body is not None
     
     def HasPath( self ): return self._path is not None
     
+    def HasStream( self ): return self._stream is not None
+    
@@ -88,6 +88,8 @@ def GenerateRepositoryUpdateTableName( service_id ):
 class DB( HydrusDB.HydrusDB ):
     
     READ_WRITE_ACTIONS = [ 'access_key', 'immediate_content_update', 'registration_keys' ]
+    READ_CONCURRENT_ACTIONS = [ 'immediate_update', 'ip', 'num_petitions', 'service_has_file', 'service_has_files' ]
+    NUM_READ_CONNECTIONS = 2
     
     TRANSACTION_COMMIT_TIME = 120
     
@@ -1253,6 +1255,7 @@ class DB( HydrusDB.HydrusDB ):
         elif action == 'petition': result = self._RepositoryGetPetition( *args, **kwargs )
         elif action == 'registration_keys': result = self._GenerateRegistrationKeysFromAccount( *args, **kwargs )
         elif action == 'service_has_file': result = self._RepositoryHasFile( *args, **kwargs )
+        elif action == 'service_has_files': result = self._RepositoryHasFiles( *args, **kwargs )
         elif action == 'service_keys': result = self._GetServiceKeys( *args, **kwargs )
         elif action == 'services': result = self._GetServices( *args, **kwargs )
         elif action == 'services_from_account': result = self._GetServicesFromAccount( *args, **kwargs )
@@ -1538,42 +1541,40 @@ class DB( HydrusDB.HydrusDB ):
         
         HydrusData.Print( 'Creating update for ' + repr( name ) + ' from ' + HydrusData.ConvertTimestampToPrettyTime( begin, in_gmt = True ) + ' to ' + HydrusData.ConvertTimestampToPrettyTime( end, in_gmt = True ) )
         
-        updates = self._RepositoryGenerateUpdates( service_id, begin, end )
-        
         update_hashes = []
         
         total_definition_rows = 0
         total_content_rows = 0
         
-        if len( updates ) > 0:
+        for update in self._RepositoryIterateUpdates( service_id, begin, end ):
             
-            for update in updates:
-                
-                num_rows = update.GetNumRows()
-                
-                if isinstance( update, HydrusNetwork.DefinitionsUpdate ):
-                    
-                    total_definition_rows += num_rows
-                    
-                elif isinstance( update, HydrusNetwork.ContentUpdate ):
-                    
-                    total_content_rows += num_rows
-                    
+            num_rows = update.GetNumRows()
+            
+            if isinstance( update, HydrusNetwork.DefinitionsUpdate ):
                 
-                update_bytes = update.DumpToNetworkString()
+                total_definition_rows += num_rows
                 
-                update_hash = hashlib.sha256( update_bytes ).digest()
+            elif isinstance( update, HydrusNetwork.ContentUpdate ):
                 
-                dest_path = ServerFiles.GetExpectedFilePath( update_hash )
+                total_content_rows += num_rows
                 
-                with open( dest_path, 'wb' ) as f:
-                    
-                    f.write( update_bytes )
-                    
+            
+            update_bytes = update.DumpToNetworkString()
+            
+            update_hash = hashlib.sha256( update_bytes ).digest()
+            
+            dest_path = ServerFiles.GetExpectedFilePath( update_hash )
+            
+            with open( dest_path, 'wb' ) as f:
                 
-                update_hashes.append( update_hash )
+                f.write( update_bytes )
                 
             
+            update_hashes.append( update_hash )
+            
+        
+        if len( update_hashes ) > 0:
+            
             ( update_table_name ) = GenerateRepositoryUpdateTableName( service_id )
             
             master_hash_ids = self._GetMasterHashIds( update_hashes )
@@ -1581,7 +1582,7 @@ class DB( HydrusDB.HydrusDB ):
             self._c.executemany( 'INSERT OR IGNORE INTO ' + update_table_name + ' ( master_hash_id ) VALUES ( ? );', ( ( master_hash_id, ) for master_hash_id in master_hash_ids ) )
             
         
-        HydrusData.Print( 'Update OK. ' + HydrusData.ConvertIntToPrettyString( total_definition_rows ) + ' definition rows and ' + HydrusData.ConvertIntToPrettyString( total_content_rows ) + ' content rows in ' + HydrusData.ConvertIntToPrettyString( len( updates ) ) + ' update files.' )
+        HydrusData.Print( 'Update OK. ' + HydrusData.ConvertIntToPrettyString( total_definition_rows ) + ' definition rows and ' + HydrusData.ConvertIntToPrettyString( total_content_rows ) + ' content rows in ' + HydrusData.ConvertIntToPrettyString( len( update_hashes ) ) + ' update files.' )
         
         return update_hashes
         
@@ -1735,132 +1736,7 @@ class DB( HydrusDB.HydrusDB ):
         
         service_id = self._GetServiceId( service_key )
         
-        updates = self._RepositoryGenerateUpdates( service_id, begin, end )
-        
-        return updates
-        
-    
-    def _RepositoryGenerateUpdates( self, service_id, begin, end ):
-        
-        MAX_DEFINITIONS_ROWS = 50000
-        MAX_CONTENT_ROWS = 250000
-        
-        MAX_CONTENT_CHUNK = 25000
-        
-        updates = []
-        
-        definitions_update_builder = HydrusNetwork.UpdateBuilder( HydrusNetwork.DefinitionsUpdate, MAX_DEFINITIONS_ROWS )
-        content_update_builder = HydrusNetwork.UpdateBuilder( HydrusNetwork.ContentUpdate, MAX_CONTENT_ROWS )
-        
-        ( service_hash_ids_table_name, service_tag_ids_table_name ) = GenerateRepositoryMasterMapTableNames( service_id )
-        
-        for ( service_hash_id, hash ) in self._c.execute( 'SELECT service_hash_id, hash FROM ' + service_hash_ids_table_name + ' NATURAL JOIN hashes WHERE hash_id_timestamp BETWEEN ? AND ?;', ( begin, end ) ):
-            
-            row = ( HC.DEFINITIONS_TYPE_HASHES, service_hash_id, hash )
-            
-            definitions_update_builder.AddRow( row )
-            
-        
-        for ( service_tag_id, tag ) in self._c.execute( 'SELECT service_tag_id, tag FROM ' + service_tag_ids_table_name + ' NATURAL JOIN tags WHERE tag_id_timestamp BETWEEN ? AND ?;', ( begin, end ) ):
-            
-            row = ( HC.DEFINITIONS_TYPE_TAGS, service_tag_id, tag )
-            
-            definitions_update_builder.AddRow( row )
-            
-        
-        definitions_update_builder.Finish()
-        
-        updates.extend( definitions_update_builder.GetUpdates() )
-        
-        #
-        
-        ( current_files_table_name, deleted_files_table_name, pending_files_table_name, petitioned_files_table_name, ip_addresses_table_name ) = GenerateRepositoryFilesTableNames( service_id )
-        
-        table_join = self._RepositoryGetFilesInfoFilesTableJoin( service_id, HC.CONTENT_STATUS_CURRENT )
-        
-        for ( service_hash_id, size, mime, timestamp, width, height, duration, num_frames, num_words ) in self._c.execute( 'SELECT service_hash_id, size, mime, file_timestamp, width, height, duration, num_frames, num_words FROM ' + table_join + ' WHERE file_timestamp BETWEEN ? AND ?;', ( begin, end ) ):
-            
-            file_row = ( service_hash_id, size, mime, timestamp, width, height, duration, num_frames, num_words )
-            
-            content_update_builder.AddRow( ( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_ADD, file_row ) )
-            
-        
-        service_hash_ids = [ service_hash_id for ( service_hash_id, ) in self._c.execute( 'SELECT service_hash_id FROM ' + deleted_files_table_name + ' WHERE file_timestamp BETWEEN ? AND ?;', ( begin, end ) ) ]
-        
-        for service_hash_id in service_hash_ids:
-            
-            content_update_builder.AddRow( ( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_DELETE, service_hash_id ) )
-            
-        
-        #
-        
-        ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateRepositoryMappingsTableNames( service_id )
-        
-        service_tag_ids_to_service_hash_ids = HydrusData.BuildKeyToListDict( self._c.execute( 'SELECT service_tag_id, service_hash_id FROM ' + current_mappings_table_name + ' WHERE mapping_timestamp BETWEEN ? AND ?;', ( begin, end ) ) )
-        
-        for ( service_tag_id, service_hash_ids ) in service_tag_ids_to_service_hash_ids.items():
-            
-            for block_of_service_hash_ids in HydrusData.SplitListIntoChunks( service_hash_ids, MAX_CONTENT_CHUNK ):
-                
-                row_weight = len( block_of_service_hash_ids )
-                
-                content_update_builder.AddRow( ( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( service_tag_id, block_of_service_hash_ids ) ), row_weight )
-                
-            
-        
-        service_tag_ids_to_service_hash_ids = HydrusData.BuildKeyToListDict( self._c.execute( 'SELECT service_tag_id, service_hash_id FROM ' + deleted_mappings_table_name + ' WHERE mapping_timestamp BETWEEN ? AND ?;', ( begin, end ) ) )
-        
-        for ( service_tag_id, service_hash_ids ) in service_tag_ids_to_service_hash_ids.items():
-            
-            for block_of_service_hash_ids in HydrusData.SplitListIntoChunks( service_hash_ids, MAX_CONTENT_CHUNK ):
-                
-                row_weight = len( block_of_service_hash_ids )
-                
-                content_update_builder.AddRow( ( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_DELETE, ( service_tag_id, block_of_service_hash_ids ) ), row_weight )
-                
-            
-        
-        #
-        
-        ( current_tag_parents_table_name, deleted_tag_parents_table_name, pending_tag_parents_table_name, petitioned_tag_parents_table_name ) = GenerateRepositoryTagParentsTableNames( service_id )
-        
-        pairs = self._c.execute( 'SELECT child_service_tag_id, parent_service_tag_id FROM ' + current_tag_parents_table_name + ' WHERE parent_timestamp BETWEEN ? AND ?;', ( begin, end ) ).fetchall()
-        
-        for pair in pairs:
-            
-            content_update_builder.AddRow( ( HC.CONTENT_TYPE_TAG_PARENTS, HC.CONTENT_UPDATE_ADD, pair ) )
-            
-        
-        pairs = self._c.execute( 'SELECT child_service_tag_id, parent_service_tag_id FROM ' + deleted_tag_parents_table_name + ' WHERE parent_timestamp BETWEEN ? AND ?;', ( begin, end ) ).fetchall()
-        
-        for pair in pairs:
-            
-            content_update_builder.AddRow( ( HC.CONTENT_TYPE_TAG_PARENTS, HC.CONTENT_UPDATE_DELETE, pair ) )
-            
-        
-        #
-        
-        ( current_tag_siblings_table_name, deleted_tag_siblings_table_name, pending_tag_siblings_table_name, petitioned_tag_siblings_table_name ) = GenerateRepositoryTagSiblingsTableNames( service_id )
-        
-        pairs = self._c.execute( 'SELECT bad_service_tag_id, good_service_tag_id FROM ' + current_tag_siblings_table_name + ' WHERE sibling_timestamp BETWEEN ? AND ?;', ( begin, end ) ).fetchall()
-        
-        for pair in pairs:
-            
-            content_update_builder.AddRow( ( HC.CONTENT_TYPE_TAG_SIBLINGS, HC.CONTENT_UPDATE_ADD, pair ) )
-            
-        
-        pairs = self._c.execute( 'SELECT bad_service_tag_id, good_service_tag_id FROM ' + deleted_tag_siblings_table_name + ' WHERE sibling_timestamp BETWEEN ? AND ?;', ( begin, end ) ).fetchall()
-        
-        for pair in pairs:
-            
-            content_update_builder.AddRow( ( HC.CONTENT_TYPE_TAG_SIBLINGS, HC.CONTENT_UPDATE_DELETE, pair ) )
-            
-        
-        #
-        
-        content_update_builder.Finish()
-        
-        updates.extend( content_update_builder.GetUpdates() )
+        updates = list( self._RepositoryIterateUpdates( service_id, begin, end ) )
         
         return updates
         
@@ -2498,6 +2374,151 @@ class DB( HydrusDB.HydrusDB ):
         return ( True, mime )
         
     
+    def _RepositoryHasFiles( self, service_key, hashes ):
+        
+        service_id = self._GetServiceId( service_key )
+        
+        table_join = self._RepositoryGetFilesInfoFilesTableJoin( service_id, HC.CONTENT_STATUS_CURRENT )
+        
+        hashes_to_mimes = {}
+        
+        for hash in hashes:
+            
+            result = self._c.execute( 'SELECT mime FROM hashes NATURAL JOIN ' + table_join + ' WHERE hash = ?;', ( sqlite3.Binary( hash ), ) ).fetchone()
+            
+            if result is not None:
+                
+                ( mime, ) = result
+                
+                hashes_to_mimes[ hash ] = mime
+                
+            
+        
+        return hashes_to_mimes
+        
+    
+    def _RepositoryIterateContentRows( self, service_id, begin, end, max_rows ):
+        
+        MAX_CONTENT_CHUNK = 25000
+        
+        ( current_files_table_name, deleted_files_table_name, pending_files_table_name, petitioned_files_table_name, ip_addresses_table_name ) = GenerateRepositoryFilesTableNames( service_id )
+        
+        table_join = self._RepositoryGetFilesInfoFilesTableJoin( service_id, HC.CONTENT_STATUS_CURRENT )
+        
+        for ( service_hash_id, size, mime, timestamp, width, height, duration, num_frames, num_words ) in self._c.execute( 'SELECT service_hash_id, size, mime, file_timestamp, width, height, duration, num_frames, num_words FROM ' + table_join + ' WHERE file_timestamp BETWEEN ? AND ?;', ( begin, end ) ):
+            
+            file_row = ( service_hash_id, size, mime, timestamp, width, height, duration, num_frames, num_words )
+            
+            yield ( ( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_ADD, file_row ), 1 )
+            
+        
+        for ( service_hash_id, ) in self._c.execute( 'SELECT service_hash_id FROM ' + deleted_files_table_name + ' WHERE file_timestamp BETWEEN ? AND ?;', ( begin, end ) ):
+            
+            yield ( ( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_DELETE, service_hash_id ), 1 )
+            
+        
+        #
+        
+        ( current_mappings_table_name, deleted_mappings_table_name, pending_mappings_table_name, petitioned_mappings_table_name ) = GenerateRepositoryMappingsTableNames( service_id )
+        
+        for ( mappings_table_name, content_update_action ) in ( ( current_mappings_table_name, HC.CONTENT_UPDATE_ADD ), ( deleted_mappings_table_name, HC.CONTENT_UPDATE_DELETE ) ):
+            
+            # the timestamp index is walked with the cursor and grouped one update's worth of rows at a time, so a huge window never sits in memory all at once
+            
+            cursor = self._c.execute( 'SELECT service_tag_id, service_hash_id FROM ' + mappings_table_name + ' WHERE mapping_timestamp BETWEEN ? AND ?;', ( begin, end ) )
+            
+            while True:
+                
+                mapping_rows = cursor.fetchmany( max_rows )
+                
+                if len( mapping_rows ) == 0:
+                    
+                    break
+                    
+                
+                service_tag_ids_to_service_hash_ids = HydrusData.BuildKeyToListDict( mapping_rows )
+                
+                del mapping_rows
+                
+                for ( service_tag_id, service_hash_ids ) in service_tag_ids_to_service_hash_ids.items():
+                    
+                    for block_of_service_hash_ids in HydrusData.SplitListIntoChunks( service_hash_ids, MAX_CONTENT_CHUNK ):
+                        
+                        row_weight = len( block_of_service_hash_ids )
+                        
+                        yield ( ( HC.CONTENT_TYPE_MAPPINGS, content_update_action, ( service_tag_id, block_of_service_hash_ids ) ), row_weight )
+                        
+                    
+                
+            
+        
+        #
+        
+        ( current_tag_parents_table_name, deleted_tag_parents_table_name, pending_tag_parents_table_name, petitioned_tag_parents_table_name ) = GenerateRepositoryTagParentsTableNames( service_id )
+        
+        for pair in self._c.execute( 'SELECT child_service_tag_id, parent_service_tag_id FROM ' + current_tag_parents_table_name + ' WHERE parent_timestamp BETWEEN ? AND ?;', ( begin, end ) ):
+            
+            yield ( ( HC.CONTENT_TYPE_TAG_PARENTS, HC.CONTENT_UPDATE_ADD, pair ), 1 )
+            
+        
+        for pair in self._c.execute( 'SELECT child_service_tag_id, parent_service_tag_id FROM ' + deleted_tag_parents_table_name + ' WHERE parent_timestamp BETWEEN ? AND ?;', ( begin, end ) ):
+            
+            yield ( ( HC.CONTENT_TYPE_TAG_PARENTS, HC.CONTENT_UPDATE_DELETE, pair ), 1 )
+            
+        
+        #
+        
+        ( current_tag_siblings_table_name, deleted_tag_siblings_table_name, pending_tag_siblings_table_name, petitioned_tag_siblings_table_name ) = GenerateRepositoryTagSiblingsTableNames( service_id )
+        
+        for pair in self._c.execute( 'SELECT bad_service_tag_id, good_service_tag_id FROM ' + current_tag_siblings_table_name + ' WHERE sibling_timestamp BETWEEN ? AND ?;', ( begin, end ) ):
+            
+            yield ( ( HC.CONTENT_TYPE_TAG_SIBLINGS, HC.CONTENT_UPDATE_ADD, pair ), 1 )
+            
+        
+        for pair in self._c.execute( 'SELECT bad_service_tag_id, good_service_tag_id FROM ' + deleted_tag_siblings_table_name + ' WHERE sibling_timestamp BETWEEN ? AND ?;', ( begin, end ) ):
+            
+            yield ( ( HC.CONTENT_TYPE_TAG_SIBLINGS, HC.CONTENT_UPDATE_DELETE, pair ), 1 )
+            
+        
+    
+    def _RepositoryIterateDefinitionsRows( self, service_id, begin, end ):
+        
+        ( service_hash_ids_table_name, service_tag_ids_table_name ) = GenerateRepositoryMasterMapTableNames( service_id )
+        
+        for ( service_hash_id, hash ) in self._c.execute( 'SELECT service_hash_id, hash FROM ' + service_hash_ids_table_name + ' NATURAL JOIN hashes WHERE hash_id_timestamp BETWEEN ? AND ?;', ( begin, end ) ):
+            
+            yield ( ( HC.DEFINITIONS_TYPE_HASHES, service_hash_id, hash ), 1 )
+            
+        
+        for ( service_tag_id, tag ) in self._c.execute( 'SELECT service_tag_id, tag FROM ' + service_tag_ids_table_name + ' NATURAL JOIN tags WHERE tag_id_timestamp BETWEEN ? AND ?;', ( begin, end ) ):
+            
+            yield ( ( HC.DEFINITIONS_TYPE_TAGS, service_tag_id, tag ), 1 )
+            
+        
+    
+    def _RepositoryIterateUpdates( self, service_id, begin, end ):
+        
+        # each update is yielded as soon as it fills, so the caller can write it out before the next one is built
+        # nothing else may use self._c while this is being iterated
+        
+        MAX_DEFINITIONS_ROWS = 50000
+        MAX_CONTENT_ROWS = 250000
+        
+        definitions_update_builder = HydrusNetwork.UpdateBuilder( HydrusNetwork.DefinitionsUpdate, MAX_DEFINITIONS_ROWS )
+        
+        for update in definitions_update_builder.IterateUpdates( self._RepositoryIterateDefinitionsRows( service_id, begin, end ) ):
+            
+            yield update
+            
+        
+        content_update_builder = HydrusNetwork.UpdateBuilder( HydrusNetwork.ContentUpdate, MAX_CONTENT_ROWS )
+        
+        for update in content_update_builder.IterateUpdates( self._RepositoryIterateContentRows( service_id, begin, end, MAX_CONTENT_ROWS ) ):
+            
+            yield update
+            
+        
+    
     def _RepositoryPendTagParent( self, service_id, account_id, child_master_tag_id, parent_master_tag_id, reason_id ):
         
         ( current_tag_parents_table_name, deleted_tag_parents_table_name, pending_tag_parents_table_name, petitioned_tag_parents_table_name ) = GenerateRepositoryTagParentsTableNames( service_id )
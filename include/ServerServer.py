@@ -74,6 +74,7 @@ class HydrusServiceRepositoryFile( HydrusServiceRepository ):
         root.putChild( 'file', ServerServerResources.HydrusResourceRestrictedRepositoryFile( self._service, HydrusServer.REMOTE_DOMAIN ) )
         root.putChild( 'ip', ServerServerResources.HydrusResourceRestrictedIP( self._service, HydrusServer.REMOTE_DOMAIN ) )
         root.putChild( 'thumbnail', ServerServerResources.HydrusResourceRestrictedRepositoryThumbnail( self._service, HydrusServer.REMOTE_DOMAIN ) )
+        root.putChild( 'thumbnails', ServerServerResources.HydrusResourceRestrictedRepositoryThumbnails( self._service, HydrusServer.REMOTE_DOMAIN ) )
         
         return root
         
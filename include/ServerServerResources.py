@@ -366,7 +366,9 @@ class HydrusResourceRestrictedRepositoryFile( HydrusResourceRestricted ):
         
         path = ServerFiles.GetFilePath( hash )
         
-        response_context = HydrusServerResources.ResponseContext( 200, mime = mime, path = path )
+        etag = HydrusServerResources.GenerateETag( hash )
+        
+        response_context = HydrusServerResources.ResponseContext( 200, mime = mime, path = path, etag = etag )
         
         return response_context
         
@@ -411,7 +413,54 @@ class HydrusResourceRestrictedRepositoryThumbnail( HydrusResourceRestricted ):
         
         path = ServerFiles.GetThumbnailPath( hash )
         
-        response_context = HydrusServerResources.ResponseContext( 200, mime = HC.APPLICATION_OCTET_STREAM, path = path )
+        etag = HydrusServerResources.GenerateETag( hash, path )
+        
+        response_context = HydrusServerResources.ResponseContext( 200, mime = HC.APPLICATION_OCTET_STREAM, path = path, etag = etag )
+        
+        return response_context
+        
+    
+class HydrusResourceRestrictedRepositoryThumbnails( HydrusResourceRestricted ):
+    
+    def _threadDoPOSTJob( self, request ):
+        
+        self._checkBandwidth( request )
+        
+        # no permission check as any functional account can get thumbnails
+        
+        hashes = request.hydrus_args[ 'hashes' ]
+        
+        if len( hashes ) > HydrusNetwork.MAX_THUMBNAIL_BUNDLE_HASHES:
+            
+            raise HydrusExceptions.ForbiddenException( 'Please ask for no more than ' + HydrusData.ConvertIntToPrettyString( HydrusNetwork.MAX_THUMBNAIL_BUNDLE_HASHES ) + ' thumbnails at once!' )
+            
+        
+        hashes_to_mimes = HG.server_controller.Read( 'service_has_files', self._service_key, hashes )
+        
+        hashes_and_paths = []
+        
+        for hash in hashes:
+            
+            if hash in hashes_to_mimes and hashes_to_mimes[ hash ] in HC.MIMES_WITH_THUMBNAILS:
+                
+                # missing thumbnails are simply left out of the bundle
+                
+                try:
+                    
+                    path = ServerFiles.GetThumbnailPath( hash )
+                    
+                except HydrusExceptions.NotFoundException:
+                    
+                    continue
+                    
+                
+                hashes_and_paths.append( ( hash, path ) )
+                
+            
+        
+        stream = HydrusNetwork.ThumbnailBundleStream( hashes_and_paths )
+        
+        response_context = HydrusServerResources.ResponseContext( 200, mime = HC.APPLICATION_OCTET_STREAM, stream = stream )
         
         return response_context
         
@@ -476,7 +525,9 @@ class HydrusResourceRestrictedUpdate( HydrusResourceRestricted ):
         
         path = ServerFiles.GetFilePath( update_hash )
         
-        response_context = HydrusServerResources.ResponseContext( 200, mime = HC.APPLICATION_OCTET_STREAM, path = path )
+        etag = HydrusServerResources.GenerateETag( update_hash )
+        
+        response_context = HydrusServerResources.ResponseContext( 200, mime = HC.APPLICATION_OCTET_STREAM, path = path, etag = etag )
         
         return response_context
         
@@ -0,0 +1,81 @@
+import ClientCaches
+import ClientConstants as CC
+import unittest
+import HydrusGlobals as HG
+
+class TestDataCache( unittest.TestCase ):
+    
+    def test_data_cache( self ):
+        
+        class FakeData( object ):
+            
+            def __init__( self, memory_footprint ):
+                
+                self._memory_footprint = memory_footprint
+                
+            
+            def GetEstimatedMemoryFootprint( self ):
+                
+                return self._memory_footprint
+                
+            
+        
+        data_cache = ClientCaches.DataCache( HG.test_controller, 100 )
+        
+        for i in range( 10 ):
+            
+            data_cache.AddData( i, FakeData( 10 ) )
+            
+        
+        self.assertEqual( data_cache.GetStatistics(), ( 10, 100, 100, 0, 0, 0 ) )
+        
+        data_cache.AddData( 10, FakeData( 10 ) )
+        
+        self.assertFalse( data_cache.HasData( 0 ) )
+        self.assertTrue( data_cache.HasData( 10 ) )
+        
+        self.assertEqual( data_cache.GetIfHasData( 0 ), None )
+        self.assertNotEqual( data_cache.GetIfHasData( 1 ), None )
+        
+        data_cache.DeleteData( 5 )
+        
+        self.assertEqual( data_cache.GetStatistics(), ( 9, 90, 100, 1, 1, 1 ) )
+        
+        data_cache.AddData( 11, FakeData( 30 ) )
+        
+        self.assertEqual( data_cache.GetStatistics(), ( 8, 100, 100, 1, 1, 3 ) )
+        
+        #
+        
+        data_cache = ClientCaches.DataCache( HG.test_controller, 100 )
+        
+        for i in range( 10 ):
+            
+            data_cache.AddData( i, FakeData( 10 ) )
+            
+        
+        data_cache.GetData( 0 )
+        
+        data_cache.AddData( 10, FakeData( 10 ) )
+        
+        self.assertTrue( data_cache.HasData( 0 ) )
+        self.assertFalse( data_cache.HasData( 1 ) )
+        
+        #
+        
+        data_cache = ClientCaches.DataCache( HG.test_controller, 100, eviction_policy = CC.CACHE_EVICTION_SIZE_AWARE_LRU )
+        
+        data_cache.AddData( 'small', FakeData( 10 ) )
+        data_cache.AddData( 'big', FakeData( 80 ) )
+        data_cache.AddData( 'new', FakeData( 20 ) )
+        
+        self.assertTrue( data_cache.HasData( 'small' ) )
+        self.assertFalse( data_cache.HasData( 'big' ) )
+        self.assertTrue( data_cache.HasData( 'new' ) )
+        
+        ( num_items, memory_footprint, cache_size, num_hits, num_misses, num_evictions ) = data_cache.GetStatistics()
+        
+        self.assertEqual( memory_footprint, 30 )
+        self.assertEqual( num_evictions, 1 )
+        
+    
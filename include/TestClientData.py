@@ -1,9 +1,14 @@
 import ClientConstants as CC
+import ClientDuplicates
 import ClientImportOptions
 import ClientImportSeeds
+import ClientMedia
+import ClientSearch
 import HydrusConstants as HC
+import HydrusData
 import HydrusExceptions
 import os
+import struct
 import unittest
 
 class TestData( unittest.TestCase ):
@@ -366,3 +371,383 @@ class TestData( unittest.TestCase ):
         self.assertFalse( file_import_options.ShouldPresent( CC.STATUS_SUCCESSFUL_BUT_REDUNDANT, False ) )
         self.assertTrue( file_import_options.ShouldPresent( CC.STATUS_SUCCESSFUL_BUT_REDUNDANT, True ) )
         
+    
+    def test_file_search_results_cache( self ):
+        
+        cache = ClientSearch.FileSearchResultsCache( 1024 * 1024 )
+        
+        car = ClientSearch.Predicate( HC.PREDICATE_TYPE_TAG, 'car' )
+        ford = ClientSearch.Predicate( HC.PREDICATE_TYPE_TAG, 'maker:ford' )
+        limit = ClientSearch.Predicate( HC.PREDICATE_TYPE_SYSTEM_LIMIT, 10 )
+        
+        car_key = ClientSearch.FileSearchContext( file_service_key = CC.LOCAL_FILE_SERVICE_KEY, predicates = [ car ] ).GetCacheKey()
+        car_limit_key = ClientSearch.FileSearchContext( file_service_key = CC.LOCAL_FILE_SERVICE_KEY, predicates = [ limit, car ] ).GetCacheKey()
+        car_ford_key = ClientSearch.FileSearchContext( file_service_key = CC.LOCAL_FILE_SERVICE_KEY, predicates = [ ford, car ] ).GetCacheKey()
+        other_domain_key = ClientSearch.FileSearchContext( file_service_key = CC.TRASH_SERVICE_KEY, predicates = [ car, ford ] ).GetCacheKey()
+        
+        self.assertEqual( car_key, car_limit_key )
+        
+        self.assertEqual( cache.GetResult( car_key ), ( None, False ) )
+        
+        cache.AddResult( cache.GetGeneration(), car_key, { 3, 1, 2 }, [ 'car' ], False, [] )
+        
+        ( posting_list, narrowed ) = cache.GetResult( car_key )
+        
+        self.assertEqual( ( posting_list.tolist(), narrowed ), ( [ 1, 2, 3 ], False ) )
+        
+        # a search with more predicates can start from the smaller one
+        
+        ( posting_list, narrowed ) = cache.GetResult( car_ford_key )
+        
+        self.assertEqual( ( posting_list.tolist(), narrowed ), ( [ 1, 2, 3 ], True ) )
+        
+        self.assertEqual( cache.GetResult( other_domain_key ), ( None, False ) )
+        
+        # a search that ran over a change is not stored
+        
+        generation = cache.GetGeneration()
+        
+        cache.InvalidateTags( CC.LOCAL_TAG_SERVICE_KEY, { 'bus' } )
+        
+        cache.AddResult( generation, car_ford_key, { 1 }, [ 'car', 'ford' ], False, [] )
+        
+        self.assertEqual( len( cache ), 1 )
+        
+        cache.InvalidateTags( CC.LOCAL_TAG_SERVICE_KEY, { 'car' } )
+        
+        self.assertEqual( len( cache ), 0 )
+        
+        cache.AddResult( cache.GetGeneration(), car_ford_key, { 1 }, [ 'car', 'ford' ], False, [ CC.LOCAL_FILE_SERVICE_KEY ] )
+        
+        cache.InvalidateRatings( CC.LOCAL_FILE_SERVICE_KEY )
+        
+        self.assertEqual( len( cache ), 0 )
+        
+        # least recently used results are dropped to stay under the size
+        
+        cache.SetMaxSize( 2 * ClientSearch.FileSearchResultsCache.ENTRY_OVERHEAD + 64 )
+        
+        cache.AddResult( cache.GetGeneration(), car_key, range( 8 ), [ 'car' ], False, [] )
+        cache.AddResult( cache.GetGeneration(), car_ford_key, range( 8 ), [ 'car', 'ford' ], False, [] )
+        
+        cache.GetResult( car_key )
+        
+        cache.AddResult( cache.GetGeneration(), other_domain_key, range( 8 ), [ 'car', 'ford' ], False, [] )
+        
+        self.assertEqual( len( cache ), 2 )
+        self.assertFalse( cache.GetResult( car_key )[0] is None )
+        self.assertEqual( cache.GetResult( car_ford_key ), ( cache.GetResult( car_key )[0], True ) )
+        
+    
+    def test_phash_index( self ):
+        
+        phash_index = ClientDuplicates.PHashIndex()
+        
+        base_phash = '\xb4M\xc7\xb2M\xcb8\x1c'
+        
+        ( base_phash_int, ) = struct.unpack( '!Q', base_phash )
+        
+        rows = [ ( 1, base_phash ) ]
+        
+        for ( i, bit ) in enumerate( ( 0, 5, 17, 33, 60 ) ):
+            
+            rows.append( ( i + 2, struct.pack( '!Q', base_phash_int ^ ( 1 << bit ) ) ) )
+            
+        
+        rows.append( ( 10, struct.pack( '!Q', base_phash_int ^ 0xFFFF ) ) )
+        
+        # a fixed spread of unrelated phashes, so the test sees the same data every run
+        
+        for i in range( 100 ):
+            
+            rows.append( ( 100 + i, struct.pack( '!Q', ( ( i + 1 ) * 0x9E3779B97F4A7C15 ) & 0xFFFFFFFFFFFFFFFF ) ) )
+            
+        
+        phash_index.AddPHashes( rows )
+        
+        for max_hamming_distance in ( 0, 1, 4, 16, 32 ):
+            
+            expected = { phash_id for ( phash_id, phash ) in rows if HydrusData.Get64BitHammingDistance( base_phash, phash ) <= max_hamming_distance }
+            
+            self.assertEqual( phash_index.Search( [ base_phash ], max_hamming_distance ), expected )
+            
+        
+        self.assertEqual( phash_index.Search( [ base_phash ], 1 ), { 1, 2, 3, 4, 5, 6 } )
+        
+        phash_index.RemovePHashIds( [ 2, 3 ] )
+        
+        self.assertEqual( phash_index.Search( [ base_phash ], 1 ), { 1, 4, 5, 6 } )
+        
+        phash_index.AddPHashes( [ ( 2, rows[1][1] ) ] )
+        
+        self.assertEqual( phash_index.Search( [ base_phash ], 1 ), { 1, 2, 4, 5, 6 } )
+        
+    
+    def test_seed_cache( self ):
+        
+        seed_cache = ClientImportSeeds.SeedCache()
+        
+        seeds = [ ClientImportSeeds.Seed( ClientImportSeeds.SEED_TYPE_URL, 'https://wew.lad/' + str( i ) ) for i in range( 5 ) ]
+        
+        seed_cache.AddSeeds( seeds )
+        
+        for seed in ( seeds[1], seeds[3] ):
+            
+            seed.SetStatus( CC.STATUS_SUCCESSFUL_AND_NEW )
+            
+        
+        seed_cache.NotifySeedsUpdated( ( seeds[1], seeds[3] ) )
+        
+        self.assertEqual( seed_cache.GetSeedCount(), 5 )
+        self.assertEqual( seed_cache.GetSeedCount( CC.STATUS_UNKNOWN ), 3 )
+        self.assertEqual( seed_cache.GetSeedCount( CC.STATUS_SUCCESSFUL_AND_NEW ), 2 )
+        self.assertEqual( seed_cache.GetSeeds( CC.STATUS_UNKNOWN ), [ seeds[0], seeds[2], seeds[4] ] )
+        
+        self.assertIs( seed_cache.GetNextSeed( CC.STATUS_UNKNOWN ), seeds[0] )
+        
+        # a status change the cache was not told about should not be handed out again
+        
+        seeds[0].SetStatus( CC.STATUS_ERROR )
+        
+        self.assertEqual( seed_cache.GetSeedCount( CC.STATUS_UNKNOWN ), 2 )
+        self.assertEqual( seed_cache.GetSeedCount( CC.STATUS_ERROR ), 1 )
+        self.assertIs( seed_cache.GetNextSeed( CC.STATUS_UNKNOWN ), seeds[2] )
+        
+        seed_cache.RetryFailures()
+        
+        self.assertIs( seed_cache.GetNextSeed( CC.STATUS_UNKNOWN ), seeds[0] )
+        
+        seed_cache.RemoveSeeds( ( seeds[0], ) )
+        
+        self.assertIs( seed_cache.GetNextSeed( CC.STATUS_UNKNOWN ), seeds[2] )
+        
+        # nor should one moving into a status, or removal by status, miss it
+        
+        seeds[1].SetStatus( CC.STATUS_UNKNOWN )
+        
+        self.assertEqual( seed_cache.GetSeeds( CC.STATUS_UNKNOWN ), [ seeds[1], seeds[2], seeds[4] ] )
+        
+        seeds[1].SetStatus( CC.STATUS_ERROR )
+        seeds[4].SetStatus( CC.STATUS_SUCCESSFUL_AND_NEW )
+        
+        seed_cache.RemoveSeedsByStatus( ( CC.STATUS_ERROR, ) )
+        
+        self.assertEqual( seed_cache.GetSeeds(), [ seeds[2], seeds[3], seeds[4] ] )
+        
+        seeds[2].SetStatus( CC.STATUS_SUCCESSFUL_AND_NEW )
+        
+        self.assertIs( seed_cache.GetNextSeed( CC.STATUS_UNKNOWN ), None )
+        
+        seeds[2].SetStatus( CC.STATUS_UNKNOWN )
+        
+        self.assertIs( seed_cache.GetNextSeed( CC.STATUS_UNKNOWN ), seeds[2] )
+        
+        # a loaded seed cache should report its counts before it creates its seeds
+        
+        dupe_seed_cache = seed_cache.Duplicate()
+        
+        self.assertEqual( len( dupe_seed_cache ), 3 )
+        self.assertEqual( dupe_seed_cache.GetStatusesToCounts(), seed_cache.GetStatusesToCounts() )
+        self.assertEqual( dupe_seed_cache.GetStatus(), seed_cache.GetStatus() )
+        
+        self.assertEqual( dupe_seed_cache.GetNextSeed( CC.STATUS_UNKNOWN ), seeds[2] )
+        self.assertEqual( dupe_seed_cache.GetSeeds(), seed_cache.GetSeeds() )
+        
+        # the dupe's seeds are its own, so changing one only changes the dupe
+        
+        dupe_seed_cache.GetSeeds()[0].SetStatus( CC.STATUS_ERROR )
+        
+        self.assertEqual( dupe_seed_cache.GetSeedCount( CC.STATUS_ERROR ), 1 )
+        self.assertEqual( seed_cache.GetSeedCount( CC.STATUS_ERROR ), 0 )
+        
+    
+    def test_sorted_list( self ):
+        
+        values = { i : i % 7 for i in range( 200 ) }
+        
+        sort_key = lambda i: values[ i ]
+        
+        sorted_list = ClientMedia.SortedList( range( 100 ) )
+        
+        sorted_list.sort( sort_key, reverse = True )
+        
+        expected = sorted( range( 100 ), key = sort_key, reverse = True )
+        
+        self.assertEqual( list( sorted_list ), expected )
+        
+        # a small insert goes in by bisection and should land exactly where a full stable sort would put it
+        
+        sorted_list.insert_items( [ 100, 101, 102 ] )
+        
+        expected = sorted( expected + [ 100, 101, 102 ], key = sort_key, reverse = True )
+        
+        self.assertEqual( list( sorted_list ), expected )
+        
+        for ( index, item ) in enumerate( expected ):
+            
+            self.assertEqual( sorted_list.index( item ), index )
+            
+        
+        removees = [ expected[0], expected[50] ]
+        
+        sorted_list.remove_items( removees )
+        
+        expected = [ item for item in expected if item not in removees ]
+        
+        self.assertEqual( list( sorted_list ), expected )
+        self.assertEqual( sorted_list.index( expected[-1] ), len( expected ) - 1 )
+        
+        for item in removees:
+            
+            self.assertNotIn( item, sorted_list )
+            
+        
+        # a changed item is resorted on the next insert
+        
+        values[ 5 ] = 10
+        
+        sorted_list.invalidate_sort_keys( [ 5 ] )
+        
+        sorted_list.insert_items( [ 103 ] )
+        
+        expected = sorted( expected + [ 103 ], key = sort_key, reverse = True )
+        
+        self.assertEqual( list( sorted_list ), expected )
+        self.assertEqual( sorted_list.index( 5 ), 0 )
+        
+        # a big insert is a resort
+        
+        sorted_list.insert_items( range( 104, 200 ) )
+        
+        expected = sorted( expected + range( 104, 200 ), key = sort_key, reverse = True )
+        
+        self.assertEqual( list( sorted_list ), expected )
+        self.assertEqual( sorted_list.index( 199 ), expected.index( 199 ) )
+        
+    
+    def test_subtag_search_cache( self ):
+        
+        self.assertEqual( ClientSearch.ConvertSearchableSubtagToTokens( u'Samus Aran-2' ), [ u'samus', u'aran', u'2' ] )
+        
+        self.assertEqual( ClientSearch.GetSubtagSearchPrefix( u'Sam*' ), u'sam' )
+        self.assertEqual( ClientSearch.GetSubtagSearchPrefix( u'sam' ), None )
+        self.assertEqual( ClientSearch.GetSubtagSearchPrefix( u'samus ar*' ), None )
+        self.assertEqual( ClientSearch.GetSubtagSearchPrefix( u'*mus*' ), None )
+        
+        cache = ClientSearch.SubtagSearchCache()
+        
+        self.assertEqual( cache.GetSubtagIds( u'sam' ), None )
+        
+        cache.AddRows( cache.GetGeneration(), u'sa', [ ( u'samus', 1 ), ( u'aran', 1 ), ( u'sandwich', 2 ), ( u'samurai', 3 ) ] )
+        
+        # a longer prefix is narrowed from the shorter one, and then cached itself
+        
+        self.assertEqual( cache.GetSubtagIds( u'sam' ), { 1, 3 } )
+        self.assertEqual( len( cache ), 2 )
+        
+        cache.AddSubtag( 4, u'sam fisher' )
+        
+        self.assertEqual( cache.GetSubtagIds( u'sam' ), { 1, 3, 4 } )
+        self.assertEqual( cache.GetSubtagIds( u'samu' ), { 1, 3 } )
+        
+        # a lookup that ran over a new subtag is not stored
+        
+        generation = cache.GetGeneration()
+        
+        cache.AddSubtag( 5, u'fish' )
+        
+        cache.AddRows( generation, u'f', [ ( u'fisher', 4 ) ] )
+        
+        self.assertEqual( cache.GetSubtagIds( u'fi' ), None )
+        
+        # the resident index answers anything once it is loaded, including subtags added while it loaded
+        
+        cache.Clear()
+        
+        index_generation = cache.StartIndexLoad()
+        
+        self.assertEqual( cache.StartIndexLoad(), None )
+        
+        cache.AddSubtag( 5, u'fish' )
+        
+        cache.SetIndex( index_generation, [ ( u'samus', 1 ), ( u'aran', 1 ), ( u'sandwich', 2 ), ( u'samurai', 3 ), ( u'sam', 4 ), ( u'fisher', 4 ) ] )
+        
+        self.assertTrue( cache.IndexIsLoaded() )
+        self.assertEqual( cache.GetSubtagIds( u'fi' ), { 4, 5 } )
+        self.assertEqual( cache.GetSubtagIds( u'sam' ), { 1, 3, 4 } )
+        self.assertEqual( cache.GetSubtagIds( u'z' ), set() )
+        
+    
+    def test_tag_posting_lists( self ):
+        
+        tag_posting_lists = ClientSearch.TagPostingLists()
+        
+        key_1 = ( 1, 2, 1, HC.CONTENT_STATUS_CURRENT )
+        key_2 = ( 1, 2, 2, HC.CONTENT_STATUS_CURRENT )
+        key_3 = ( 1, 2, 2, HC.CONTENT_STATUS_PENDING )
+        other_key = ( 1, 3, 1, HC.CONTENT_STATUS_CURRENT )
+        
+        self.assertIsNone( tag_posting_lists.GetPostingList( key_1 ) )
+        
+        # adds to a list that is not loaded are dropped, as the db will have them when it is loaded
+        
+        tag_posting_lists.AddHashIds( key_1, [ 1, 2 ] )
+        
+        self.assertEqual( len( tag_posting_lists ), 0 )
+        
+        tag_posting_lists.SetPostingList( key_1, ClientSearch.ConvertHashIdsToPostingList( set( range( 0, 100, 2 ) ) ) )
+        tag_posting_lists.SetPostingList( key_2, ClientSearch.ConvertHashIdsToPostingList( set( range( 0, 100, 3 ) ) ) )
+        tag_posting_lists.SetPostingList( key_3, ClientSearch.ConvertHashIdsToPostingList( [ 7, 5, 5 ] ) )
+        tag_posting_lists.SetPostingList( other_key, ClientSearch.ConvertHashIdsToPostingList( [ 1 ] ) )
+        
+        a = tag_posting_lists.GetPostingList( key_1 )
+        b = tag_posting_lists.GetPostingList( key_2 )
+        c = tag_posting_lists.GetPostingList( key_3 )
+        
+        self.assertEqual( c.tolist(), [ 5, 7 ] )
+        
+        self.assertEqual( set( ClientSearch.IntersectPostingLists( ( a, b ) ).tolist() ), set( range( 0, 100, 6 ) ) )
+        self.assertEqual( set( ClientSearch.UnionPostingLists( ( a, b, c ) ).tolist() ), set( range( 0, 100, 2 ) ).union( range( 0, 100, 3 ) ).union( ( 5, 7 ) ) )
+        self.assertEqual( set( ClientSearch.DifferencePostingLists( b, a ).tolist() ), set( range( 0, 100, 3 ) ).difference( range( 0, 100, 2 ) ) )
+        self.assertEqual( ClientSearch.IntersectPostingLists( [] ).tolist(), [] )
+        
+        # changes are held until the list is next fetched, and the last change to a hash_id wins
+        
+        tag_posting_lists.AddHashIds( key_1, [ 1, 3, 4, 5 ] )
+        tag_posting_lists.DeleteHashIds( key_1, [ 0, 2, 5, 1000 ] )
+        tag_posting_lists.AddHashIds( key_1, [ 2 ] )
+        
+        self.assertEqual( tag_posting_lists.GetPostingList( key_1 ).tolist()[:6], [ 1, 2, 3, 4, 6, 8 ] )
+        
+        # a list that has been handed out is never changed underneath whoever has it
+        
+        self.assertEqual( a.tolist()[:3], [ 0, 2, 4 ] )
+        
+        tag_posting_lists.ClearServicePair( 1, 2 )
+        
+        self.assertIsNone( tag_posting_lists.GetPostingList( key_1 ) )
+        self.assertIsNone( tag_posting_lists.GetPostingList( key_3 ) )
+        self.assertEqual( tag_posting_lists.GetPostingList( other_key ).tolist(), [ 1 ] )
+        
+        # when full, the least recently fetched lists go first
+        
+        tag_posting_lists.Clear()
+        
+        posting_list = ClientSearch.ConvertHashIdsToPostingList( range( 1000 ) )
+        
+        tag_posting_lists.SetMaxSize( 3 * ( posting_list.nbytes + ClientSearch.TagPostingLists.ENTRY_OVERHEAD ) )
+        
+        tag_posting_lists.SetPostingList( key_1, posting_list )
+        tag_posting_lists.SetPostingList( key_2, posting_list )
+        tag_posting_lists.SetPostingList( key_3, posting_list )
+        
+        tag_posting_lists.GetPostingList( key_1 )
+        
+        tag_posting_lists.SetPostingList( other_key, posting_list )
+        
+        self.assertEqual( len( tag_posting_lists ), 3 )
+        self.assertIsNone( tag_posting_lists.GetPostingList( key_2 ) )
+        self.assertIsNotNone( tag_posting_lists.GetPostingList( key_1 ) )
+        
+        self.assertLessEqual( tag_posting_lists.GetMemoryUsage(), 3 * ( posting_list.nbytes + ClientSearch.TagPostingLists.ENTRY_OVERHEAD ) )
+        
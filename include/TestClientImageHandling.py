@@ -1,10 +1,51 @@
+import numpy.core.multiarray # important this comes before cv!
+import ClientConstants as CC
 import ClientImageHandling
 import collections
+import cv2
 import HydrusConstants as HC
+import multiprocessing.pool
 import os
 import TestConstants
 import unittest
 
+def GenerateReferenceShapePerceptualHashes( numpy_image ):
+    
+    # the original one-file-at-a-time phash, to check the batched version gives the same bits as the phashes already in the db
+    
+    ( y, x, depth ) = numpy_image.shape
+    
+    if depth == 4:
+        
+        numpy_image = ClientImageHandling.EfficientlyThumbnailNumpyImage( numpy_image, ( 1024, 1024 ) )
+        
+        ( y, x, depth ) = numpy_image.shape
+        
+        numpy_alpha_float = numpy_image[ :, :, 3 ] / 255.0
+        
+        numpy_image_gray_bare = cv2.cvtColor( numpy_image[ :, :, :3 ], cv2.COLOR_RGB2GRAY )
+        
+        white = numpy.ones( ( y, x ) ) * 255.0
+        
+        numpy_image_gray = numpy.uint8( ( numpy_image_gray_bare * numpy_alpha_float ) + ( white * ( numpy.ones( ( y, x ) ) - numpy_alpha_float ) ) )
+        
+    else:
+        
+        numpy_image_gray = cv2.cvtColor( numpy_image, cv2.COLOR_RGB2GRAY )
+        
+    
+    numpy_image_tiny = cv2.resize( numpy_image_gray, ( 32, 32 ), interpolation = cv2.INTER_AREA )
+    
+    dct_88 = cv2.dct( numpy.float32( numpy_image_tiny ) )[ :8, :8 ]
+    
+    median = numpy.median( dct_88.reshape( 64 )[1:] )
+    
+    dct_88_boolean = dct_88 > median
+    
+    phash = str( bytearray( [ reduce( lambda a, b: ( a << 1 ) + int( b ), dct_88_boolean[i], 0 ) for i in range( 8 ) ] ) )
+    
+    return { phash }.difference( ( CC.BLANK_PHASH, ) )
+    
 class TestImageHandling( unittest.TestCase ):
     
     def test_phash( self ):
@@ -13,3 +54,46 @@ class TestImageHandling( unittest.TestCase ):
         
         self.assertEqual( phashes, set( [ '\xb4M\xc7\xb2M\xcb8\x1c' ] ) )
         
+    
+    def test_phash_batch( self ):
+        
+        path = os.path.join( HC.STATIC_DIR, 'hydrus.png' )
+        
+        pool = multiprocessing.pool.ThreadPool( 2 )
+        
+        try:
+            
+            results = ClientImageHandling.GenerateShapePerceptualHashesForPaths( [ ( path, HC.IMAGE_PNG ), ( path + 'x', HC.IMAGE_PNG ), ( path, HC.IMAGE_PNG ) ], pool )
+            
+        finally:
+            
+            pool.close()
+            
+        
+        self.assertEqual( results[0], ( set( [ '\xb4M\xc7\xb2M\xcb8\x1c' ] ), None ) )
+        self.assertEqual( results[1][0], set() )
+        self.assertIsNotNone( results[1][1] )
+        self.assertEqual( results[2], results[0] )
+        
+    
+    def test_phash_matches_reference( self ):
+        
+        ( ys, xs ) = numpy.mgrid[ 0 : 300, 0 : 400 ]
+        
+        numpy_images = []
+        
+        for i in range( 1, 6 ):
+            
+            rgb = numpy.dstack( ( ( xs * i ) % 256, ( ys * 3 + xs ) % 256, ( ( xs ^ ys ) * i ) % 256 ) ).astype( numpy.uint8 )
+            
+            alpha = ( ( xs + ys * i ) % 256 ).astype( numpy.uint8 )
+            
+            numpy_images.append( rgb )
+            numpy_images.append( numpy.dstack( ( rgb, alpha ) ) )
+            
+        
+        expected = [ GenerateReferenceShapePerceptualHashes( numpy_image ) for numpy_image in numpy_images ]
+        
+        self.assertEqual( ClientImageHandling.GenerateShapePerceptualHashesFromNumpyImages( numpy_images ), expected )
+        
+    
@@ -83,6 +83,36 @@ class TestClientDB( unittest.TestCase ):
     def _read( self, action, *args, **kwargs ): return TestClientDB._db.Read( action, HC.HIGH_PRIORITY, *args, **kwargs )
     def _write( self, action, *args, **kwargs ): return TestClientDB._db.Write( action, HC.HIGH_PRIORITY, True, *args, **kwargs )
     
+    def _write_in_db_thread( self, func ):
+        
+        # private db calls need the db's own cursor and thread, so we sneak a write action in to run them as a normal job
+        
+        db = TestClientDB._db
+        
+        original_write = db._Write
+        
+        def test_write( action, *args, **kwargs ):
+            
+            if action == 'test_func':
+                
+                return func( db )
+                
+            
+            return original_write( action, *args, **kwargs )
+            
+        
+        db._Write = test_write
+        
+        try:
+            
+            return self._write( 'test_func' )
+            
+        finally:
+            
+            del db._Write
+            
+        
+    
     def test_autocomplete( self ):
         
         TestClientDB._clear_db()
@@ -236,6 +266,43 @@ class TestClientDB( unittest.TestCase ):
             
         
     
+    def test_content_updates_keep_order( self ):
+        
+        TestClientDB._clear_db()
+        
+        path = os.path.join( HC.STATIC_DIR, 'hydrus.png' )
+        
+        file_import_job = ClientImportSeeds.FileImportJob( path )
+        
+        file_import_job.GenerateHashAndStatus()
+        
+        file_import_job.GenerateInfo()
+        
+        self._write( 'import_file', file_import_job )
+        
+        hash = file_import_job.GetHash()
+        
+        self._write( 'content_updates', { CC.LOCAL_TAG_SERVICE_KEY : [ HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( 'coalesce', ( hash, ) ) ) ] } )
+        
+        # queue these from inside a job, so they are both waiting when the writer next looks and could be merged
+        
+        def queue_delete_then_add( db ):
+            
+            for content_update_action in ( HC.CONTENT_UPDATE_DELETE, HC.CONTENT_UPDATE_ADD ):
+                
+                content_update = HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, content_update_action, ( 'coalesce', ( hash, ) ) )
+                
+                db.Write( 'content_updates', HC.HIGH_PRIORITY, False, { CC.LOCAL_TAG_SERVICE_KEY : [ content_update ] } )
+                
+            
+        
+        self._write_in_db_thread( queue_delete_then_add )
+        
+        ( media_result, ) = self._read( 'media_results', ( hash, ) )
+        
+        self.assertIn( 'coalesce', media_result.GetTagsManager().GetCurrent( CC.LOCAL_TAG_SERVICE_KEY ) )
+        
+    
     def test_export_folders( self ):
         
         file_search_context = ClientSearch.FileSearchContext(file_service_key = HydrusData.GenerateKey(), tag_service_key = HydrusData.GenerateKey(), predicates = [ ClientSearch.Predicate( HC.PREDICATE_TYPE_TAG, 'test' ) ] )
@@ -253,6 +320,18 @@ class TestClientDB( unittest.TestCase ):
         
         TestClientDB._clear_db()
         
+        def run_mixed_predicate_tests( tests ):
+            
+            for ( predicates, result ) in tests:
+                
+                search_context = ClientSearch.FileSearchContext( file_service_key = CC.LOCAL_FILE_SERVICE_KEY, predicates = predicates )
+                
+                file_query_ids = self._read( 'file_query_ids', search_context )
+                
+                self.assertEqual( len( file_query_ids ), result )
+                
+            
+        
         def run_namespace_predicate_tests( tests ):
             
             for ( inclusive, namespace, result ) in tests:
@@ -521,6 +600,28 @@ class TestClientDB( unittest.TestCase ):
         
         #
         
+        car = ClientSearch.Predicate( HC.PREDICATE_TYPE_TAG, 'car' )
+        not_car = ClientSearch.Predicate( HC.PREDICATE_TYPE_TAG, 'car', False )
+        bus = ClientSearch.Predicate( HC.PREDICATE_TYPE_TAG, 'bus' )
+        ford = ClientSearch.Predicate( HC.PREDICATE_TYPE_TAG, 'maker:ford' )
+        series = ClientSearch.Predicate( HC.PREDICATE_TYPE_NAMESPACE, 'series' )
+        wildcard = ClientSearch.Predicate( HC.PREDICATE_TYPE_WILDCARD, 'ser*:c*' )
+        wide = ClientSearch.Predicate( HC.PREDICATE_TYPE_SYSTEM_WIDTH, ( '=', 200 ) )
+        too_wide = ClientSearch.Predicate( HC.PREDICATE_TYPE_SYSTEM_WIDTH, ( '>', 200 ) )
+        
+        tests = []
+        
+        tests.append( ( [ car, ford ], 1 ) )
+        tests.append( ( [ car, bus ], 0 ) )
+        tests.append( ( [ ford, not_car ], 0 ) )
+        tests.append( ( [ car, series, wildcard ], 1 ) )
+        tests.append( ( [ series, wide ], 1 ) )
+        tests.append( ( [ car, too_wide ], 0 ) )
+        
+        run_mixed_predicate_tests( tests )
+        
+        #
+        
         like_rating_service_key = HydrusData.GenerateKey()
         numerical_rating_service_key = HydrusData.GenerateKey()
         
@@ -891,6 +992,131 @@ class TestClientDB( unittest.TestCase ):
             
         
     
+    def test_id_caches_after_rollback( self ):
+        
+        num_ids = ClientDB.BULK_ID_LOOKUP_THRESHOLD * 2
+        
+        rolled_back_hashes = [ HydrusData.GenerateKey() for i in range( num_ids ) ]
+        rolled_back_tags = [ 'rolled back:' + str( i ) for i in range( num_ids ) ]
+        
+        def make_ids_then_fail( db ):
+            
+            db._GetHashesToHashIds( rolled_back_hashes )
+            db._GetHashId( HydrusData.GenerateKey() )
+            db._GetTagsToTagIds( rolled_back_tags )
+            db._GetTagId( 'rolled back:single' )
+            
+            raise Exception( 'this job fails after making new ids' )
+            
+        
+        with self.assertRaises( HydrusExceptions.DBException ):
+            
+            self._write_in_db_thread( make_ids_then_fail )
+            
+        
+        # the rolled back rows are free to be used again, so the new definitions here will probably get the same ids
+        
+        new_hashes = [ HydrusData.GenerateKey() for i in range( num_ids ) ]
+        new_tags = [ 'new:' + str( i ) for i in range( num_ids ) ]
+        
+        def make_ids_again( db ):
+            
+            new_hashes_to_hash_ids = db._GetHashesToHashIds( new_hashes )
+            new_tags_to_tag_ids = db._GetTagsToTagIds( new_tags )
+            
+            rolled_back_hashes_to_hash_ids = db._GetHashesToHashIds( rolled_back_hashes )
+            rolled_back_tags_to_tag_ids = db._GetTagsToTagIds( rolled_back_tags )
+            
+            hash_ids_to_db_hashes = { hash_id : db._GetHash( hash_id ) for hash_id in list( new_hashes_to_hash_ids.values() ) + list( rolled_back_hashes_to_hash_ids.values() ) }
+            tag_ids_to_db_tags = { tag_id : db._GetTag( tag_id ) for tag_id in list( new_tags_to_tag_ids.values() ) + list( rolled_back_tags_to_tag_ids.values() ) }
+            
+            return ( new_hashes_to_hash_ids, rolled_back_hashes_to_hash_ids, hash_ids_to_db_hashes, new_tags_to_tag_ids, rolled_back_tags_to_tag_ids, tag_ids_to_db_tags )
+            
+        
+        ( new_hashes_to_hash_ids, rolled_back_hashes_to_hash_ids, hash_ids_to_db_hashes, new_tags_to_tag_ids, rolled_back_tags_to_tag_ids, tag_ids_to_db_tags ) = self._write_in_db_thread( make_ids_again )
+        
+        self.assertEqual( len( set( new_hashes_to_hash_ids.values() ).union( rolled_back_hashes_to_hash_ids.values() ) ), num_ids * 2 )
+        self.assertEqual( len( set( new_tags_to_tag_ids.values() ).union( rolled_back_tags_to_tag_ids.values() ) ), num_ids * 2 )
+        
+        for hashes_to_hash_ids in ( new_hashes_to_hash_ids, rolled_back_hashes_to_hash_ids ):
+            
+            for ( hash, hash_id ) in hashes_to_hash_ids.items():
+                
+                self.assertEqual( hash_ids_to_db_hashes[ hash_id ], hash )
+                
+            
+        
+        for tags_to_tag_ids in ( new_tags_to_tag_ids, rolled_back_tags_to_tag_ids ):
+            
+            for ( tag, tag_id ) in tags_to_tag_ids.items():
+                
+                self.assertEqual( tag_ids_to_db_tags[ tag_id ], tag )
+                
+            
+        
+    
+    def test_id_lookups( self ):
+        
+        # bulk lookups of some new and some existing definitions should match what the single lookups find
+        
+        num_ids = ClientDB.BULK_ID_LOOKUP_THRESHOLD * 2
+        
+        existing_hashes = [ HydrusData.GenerateKey() for i in range( num_ids ) ]
+        existing_subtags = [ u'existing subtag ' + str( i ) for i in range( num_ids ) ]
+        existing_tags = [ u'existing:' + subtag for subtag in existing_subtags ]
+        
+        new_hashes = [ HydrusData.GenerateKey() for i in range( num_ids ) ]
+        new_subtags = [ u'new subtag ' + str( i ) for i in range( num_ids ) ]
+        new_tags = [ u'new:' + subtag for subtag in new_subtags ] + [ u'existing:' + subtag for subtag in new_subtags ]
+        
+        def make_existing( db ):
+            
+            for hash in existing_hashes:
+                
+                db._GetHashId( hash )
+                
+            
+            for tag in existing_tags:
+                
+                db._GetTagId( tag )
+                
+            
+        
+        self._write_in_db_thread( make_existing )
+        
+        all_hashes = existing_hashes + new_hashes
+        all_subtags = existing_subtags + new_subtags
+        all_tags = existing_tags + new_tags
+        
+        def do_lookups( db ):
+            
+            db._ClearIdCaches()
+            
+            bulk_results = ( db._GetHashesToHashIds( all_hashes ), db._GetSubtagsToSubtagIds( all_subtags ), db._GetTagsToTagIds( all_tags ) )
+            
+            # and again from the cache
+            
+            cached_results = ( db._GetHashesToHashIds( all_hashes ), db._GetSubtagsToSubtagIds( all_subtags ), db._GetTagsToTagIds( all_tags ) )
+            
+            db._ClearIdCaches()
+            
+            single_results = ( { hash : db._GetHashId( hash ) for hash in all_hashes }, { subtag : db._GetSubtagId( subtag ) for subtag in all_subtags }, { tag : db._GetTagId( tag ) for tag in all_tags } )
+            
+            return ( bulk_results, cached_results, single_results )
+            
+        
+        ( bulk_results, cached_results, single_results ) = self._write_in_db_thread( do_lookups )
+        
+        self.assertEqual( bulk_results, single_results )
+        self.assertEqual( cached_results, single_results )
+        
+        ( hashes_to_hash_ids, subtags_to_subtag_ids, tags_to_tag_ids ) = bulk_results
+        
+        self.assertEqual( len( set( hashes_to_hash_ids.values() ) ), len( all_hashes ) )
+        self.assertEqual( len( set( subtags_to_subtag_ids.values() ) ), len( all_subtags ) )
+        self.assertEqual( len( set( tags_to_tag_ids.values() ) ), len( all_tags ) )
+        
+    
     def test_hash_status( self ):
         
         TestClientDB._clear_db()
@@ -999,6 +1225,41 @@ class TestClientDB( unittest.TestCase ):
         self.assertEqual( mr_num_words, None )
         
     
+    def test_orphan_hashes( self ):
+        
+        TestClientDB._clear_db()
+        
+        path = os.path.join( HC.STATIC_DIR, 'hydrus.png' )
+        
+        file_import_job = ClientImportSeeds.FileImportJob( path )
+        
+        file_import_job.GenerateHashAndStatus()
+        
+        file_import_job.GenerateInfo()
+        
+        self._write( 'import_file', file_import_job )
+        
+        hash = file_import_job.GetHash()
+        
+        unknown_hash = HydrusData.GenerateKey()
+        
+        self.assertEqual( self._read( 'orphan_hashes', 'file', ( hash, unknown_hash ) ), { unknown_hash } )
+        self.assertEqual( self._read( 'orphan_hashes', 'thumbnail', ( hash, unknown_hash ) ), { unknown_hash } )
+        
+        # a file in the trash is still a file
+        
+        content_update = HydrusData.ContentUpdate( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_DELETE, ( hash, ) )
+        
+        self._write( 'content_updates', { CC.LOCAL_FILE_SERVICE_KEY : ( content_update, ) } )
+        
+        self.assertEqual( self._read( 'orphan_hashes', 'file', ( hash, ) ), set() )
+        
+        self._write( 'content_updates', { CC.TRASH_SERVICE_KEY : ( content_update, ) } )
+        
+        self.assertEqual( self._read( 'orphan_hashes', 'file', ( hash, unknown_hash ) ), { hash, unknown_hash } )
+        self.assertEqual( self._read( 'orphan_hashes', 'thumbnail', ( hash, ) ), { hash } )
+        
+    
     def test_tag_censorship( self ):
         
         result = self._read( 'tag_censorship' )
@@ -1091,6 +1352,42 @@ class TestClientDB( unittest.TestCase ):
         self.assertTrue( result, ( pixiv_id, password ) )
         
     
+    def test_related_tags( self ):
+        
+        hashes = [ os.urandom( 32 ) for i in range( 4 ) ]
+        
+        content_updates = []
+        
+        content_updates.append( HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( 'related:car', hashes[:3] ) ) )
+        content_updates.append( HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( 'related:red', hashes[:2] ) ) )
+        content_updates.append( HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( 'related:fast', hashes[:1] ) ) )
+        content_updates.append( HydrusData.ContentUpdate( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( 'related:blue', hashes[2:3] ) ) )
+        
+        self._write( 'content_updates', { CC.LOCAL_TAG_SERVICE_KEY : content_updates } )
+        
+        result = self._read( 'related_tags', CC.LOCAL_TAG_SERVICE_KEY, hashes[3], [ 'related:car' ], 100, 0.25 )
+        
+        self.assertEqual( set( result ), { ClientSearch.Predicate( HC.PREDICATE_TYPE_TAG, tag ) for tag in ( 'related:red', 'related:fast', 'related:blue' ) } )
+        
+        tags_to_counts = { predicate.GetValue() : predicate.GetCount( HC.CONTENT_STATUS_CURRENT ) for predicate in result }
+        
+        self.assertEqual( tags_to_counts, { 'related:red' : 2, 'related:fast' : 1, 'related:blue' : 1 } )
+        
+        # the files with both search tags are the best guide
+        
+        result = self._read( 'related_tags', CC.LOCAL_TAG_SERVICE_KEY, hashes[3], [ 'related:car', 'related:red' ], 100, 0.25 )
+        
+        self.assertEqual( set( result ), { ClientSearch.Predicate( HC.PREDICATE_TYPE_TAG, 'related:fast' ) } )
+        
+        result = self._read( 'related_tags', CC.LOCAL_TAG_SERVICE_KEY, hashes[0], [ 'related:fast' ], 100, 0.25 )
+        
+        self.assertEqual( result, [] )
+        
+        result = self._read( 'related_tags', CC.LOCAL_TAG_SERVICE_KEY, hashes[3], [ 'related:does not exist' ], 100, 0.25 )
+        
+        self.assertEqual( result, [] )
+        
+    
     def test_repo_downloads( self ):
         
         result = self._read( 'downloads' )
@@ -13,12 +13,17 @@ import ClientSearch
 import ClientTags
 import HydrusConstants as HC
 import HydrusData
+import HydrusExceptions
 import HydrusNetwork
 import HydrusSerialisable
 import TestConstants as TC
+import json
+import marshal
 import os
+import struct
 import unittest
 import wx
+import zlib
 
 class TestSerialisables( unittest.TestCase ):
     
@@ -60,6 +65,20 @@ class TestSerialisables( unittest.TestCase ):
         
         #
         
+        binary_dump = HydrusSerialisable.DumpSerialisableInfo( serialisable_tuple )
+        
+        self.assertIsInstance( binary_dump, str )
+        
+        self.assertEqual( HydrusSerialisable.LoadSerialisableInfo( binary_dump ), json.loads( json_string ) )
+        
+        dupe_obj = HydrusSerialisable.CreateFromSerialisableInfoDump( serialisable_tuple[:-1], HydrusSerialisable.DumpSerialisableInfo( serialisable_tuple[-1] ) )
+        
+        self.assertIsNot( obj, dupe_obj )
+        
+        test_func( obj, dupe_obj )
+        
+        #
+        
         network_string = obj.DumpToNetworkString()
         
         self.assertIsInstance( network_string, str )
@@ -126,6 +145,94 @@ class TestSerialisables( unittest.TestCase ):
         self._dump_and_load_and_test( db, test )
         
     
+    def test_binary_dumps( self ):
+        
+        info = ( 1, 'abc', ( 2, 3 ), { 4 : None } )
+        
+        binary_dump = HydrusSerialisable.DumpSerialisableInfo( info )
+        
+        # we get back exactly what json would have given, lists, unicode and string keys included
+        
+        loaded_info = HydrusSerialisable.LoadSerialisableInfo( binary_dump )
+        
+        self.assertEqual( loaded_info, [ 1, u'abc', [ 2, 3 ], { u'4' : None } ] )
+        
+        self.assertIsInstance( loaded_info[1], unicode )
+        self.assertIsInstance( loaded_info[2], list )
+        
+        # old json dumps still load
+        
+        self.assertEqual( HydrusSerialisable.LoadSerialisableInfo( json.dumps( info ) ), json.loads( json.dumps( info ) ) )
+        
+        # damage is caught before marshal sees it
+        
+        damaged_dump = binary_dump[:-1] + chr( ( ord( binary_dump[-1] ) + 1 ) % 256 )
+        
+        with self.assertRaises( HydrusExceptions.SerialisationException ):
+            
+            HydrusSerialisable.LoadSerialisableInfo( damaged_dump )
+            
+        
+        with self.assertRaises( HydrusExceptions.SerialisationException ):
+            
+            HydrusSerialisable.LoadSerialisableInfo( binary_dump[:4] )
+            
+        
+        with self.assertRaises( HydrusExceptions.SerialisationException ):
+            
+            HydrusSerialisable.LoadSerialisableInfo( HydrusSerialisable.BINARY_DUMP_PREFIX + chr( 99 ) + binary_dump[2:] )
+            
+        
+        # version 2 dumps stored marshal's own types, so they get what json would have given too
+        
+        payload = marshal.dumps( info, 2 )
+        
+        version_2_dump = HydrusSerialisable.BINARY_DUMP_PREFIX + chr( 2 ) + struct.pack( '>I', zlib.crc32( payload ) & 0xFFFFFFFF ) + payload
+        
+        self.assertEqual( HydrusSerialisable.LoadSerialisableInfo( version_2_dump ), loaded_info )
+        
+    
+    def test_content_update_sidecar( self ):
+        
+        content_update = HydrusNetwork.ContentUpdate()
+        
+        content_update.AddRow( ( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_ADD, ( 1, 5270, HC.IMAGE_PNG, 123456, 200, 200, None, None, None ) ) )
+        content_update.AddRow( ( HC.CONTENT_TYPE_FILES, HC.CONTENT_UPDATE_DELETE, 2 ) )
+        content_update.AddRow( ( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( 3, range( 1000 ) ) ) )
+        content_update.AddRow( ( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_ADD, ( 4, [ 2 ** 32 - 1 ] ) ) )
+        content_update.AddRow( ( HC.CONTENT_TYPE_MAPPINGS, HC.CONTENT_UPDATE_DELETE, ( 5, [ 6, 7 ] ) ) )
+        content_update.AddRow( ( HC.CONTENT_TYPE_TAG_PARENTS, HC.CONTENT_UPDATE_ADD, ( 8, 9 ) ) )
+        content_update.AddRow( ( HC.CONTENT_TYPE_TAG_SIBLINGS, HC.CONTENT_UPDATE_DELETE, ( 10, 11 ) ) )
+        
+        path = os.path.join( TC.DB_DIR, 'test_content_update.sidecar' )
+        
+        HydrusNetwork.WriteContentUpdateSidecar( path, content_update )
+        
+        sidecar = HydrusNetwork.ContentUpdateSidecar( path )
+        
+        try:
+            
+            self.assertEqual( sidecar.GetNumRows(), content_update.GetNumRows() )
+            
+            self.assertEqual( [ tuple( row ) for row in sidecar.GetNewFiles() ], [ tuple( row ) for row in content_update.GetNewFiles() ] )
+            self.assertEqual( sidecar.GetDeletedFiles(), [ 2 ] )
+            
+            self.assertEqual( list( sidecar.GetNewMappings() ), [ ( 3, range( 1000 ) ), ( 4, [ 2 ** 32 - 1 ] ) ] )
+            self.assertEqual( list( sidecar.GetDeletedMappings() ), [ ( 5, [ 6, 7 ] ) ] )
+            
+            self.assertEqual( [ tuple( pair ) for pair in sidecar.GetNewTagParents() ], [ ( 8, 9 ) ] )
+            self.assertEqual( sidecar.GetDeletedTagParents(), [] )
+            self.assertEqual( sidecar.GetNewTagSiblings(), [] )
+            self.assertEqual( [ tuple( pair ) for pair in sidecar.GetDeletedTagSiblings() ], [ ( 10, 11 ) ] )
+            
+        finally:
+            
+            sidecar.Close()
+            
+            os.remove( path )
+            
+        
+    
     def test_SERIALISABLE_TYPE_APPLICATION_COMMAND( self ):
         
         def test( obj, dupe_obj ):
@@ -2,6 +2,7 @@ import ClientLocalServer
 import ClientMedia
 import ClientRatings
 import ClientServices
+import cStringIO
 import hashlib
 import httplib
 import HydrusConstants as HC
@@ -195,6 +196,18 @@ class TestServer( unittest.TestCase ):
         
         self.assertEqual( response, EXAMPLE_THUMBNAIL )
         
+        # thumbnails
+        
+        missing_hash = HydrusData.GenerateKey()
+        
+        HG.test_controller.SetRead( 'service_has_files', { self._file_hash : HC.IMAGE_PNG } )
+        
+        response = service.Request( HC.POST, 'thumbnails', { 'hashes' : [ self._file_hash, missing_hash ] } )
+        
+        hashes_and_thumbnails = list( HydrusNetwork.ReadThumbnailBundle( cStringIO.StringIO( response ) ) )
+        
+        self.assertEqual( hashes_and_thumbnails, [ ( self._file_hash, EXAMPLE_THUMBNAIL ) ] )
+        
         try: os.remove( path )
         except: pass
         
@@ -278,6 +291,56 @@ class TestServer( unittest.TestCase ):
         
         #
         
+        file_request = '/file?share_key=' + share_key.encode( 'hex' ) + '&hash=' + hashes[0].encode( 'hex' )
+        
+        connection.request( 'GET', file_request )
+        
+        response = connection.getresponse()
+        
+        response.read()
+        
+        etag = response.getheader( 'ETag' )
+        
+        self.assertEqual( etag, '"' + hashes[0].encode( 'hex' ) + '"' )
+        
+        connection.request( 'GET', file_request, headers = { 'If-None-Match' : etag } )
+        
+        response = connection.getresponse()
+        
+        data = response.read()
+        
+        self.assertEqual( response.status, 304 )
+        self.assertEqual( data, '' )
+        
+        connection.request( 'GET', file_request, headers = { 'Range' : 'bytes=10-19', 'If-Range' : etag } )
+        
+        response = connection.getresponse()
+        
+        data = response.read()
+        
+        self.assertEqual( response.status, 206 )
+        self.assertEqual( response.getheader( 'Content-Range' ), 'bytes 10-19/' + str( len( EXAMPLE_FILE ) ) )
+        self.assertEqual( data, EXAMPLE_FILE[ 10 : 20 ] )
+        
+        connection.request( 'GET', file_request, headers = { 'Range' : 'bytes=10-19', 'If-Range' : '"stale"' } )
+        
+        response = connection.getresponse()
+        
+        data = response.read()
+        
+        self.assertEqual( response.status, 200 )
+        self.assertEqual( data, EXAMPLE_FILE )
+        
+        connection.request( 'GET', file_request, headers = { 'Range' : 'bytes=' + str( len( EXAMPLE_FILE ) ) + '-' } )
+        
+        response = connection.getresponse()
+        
+        data = response.read()
+        
+        self.assertEqual( response.status, 416 )
+        
+        #
+        
         HG.test_controller.SetRead( 'local_booru_share_keys', [] )
         
         local_booru_manager.RefreshShares()
@@ -138,6 +138,21 @@ class TestTagsManager( unittest.TestCase ):
         self.assertEqual( self._other_tags_manager.GetPetitioned( self._pending_service_key ), set() )
         
     
+    def test_get_comparable_namespace_slice( self ):
+        
+        service_keys_to_statuses_to_tags = collections.defaultdict( HydrusData.default_dict_set )
+        
+        service_keys_to_statuses_to_tags[ self._first_key ][ HC.CONTENT_STATUS_CURRENT ] = { u'series:knights of sidonia', u'volume:10', u'volume:4', u'sortable' }
+        service_keys_to_statuses_to_tags[ self._second_key ][ HC.CONTENT_STATUS_PENDING ] = { u'volume:2a' }
+        
+        tags_manager = ClientMedia.TagsManager( service_keys_to_statuses_to_tags )
+        
+        result = ( ( u'knights of sidonia', ), ( ( 2, u'a' ), ( 4, u'' ), ( 10, u'' ) ), () )
+        
+        self.assertEqual( tags_manager.GetComparableNamespaceSlice( ( 'series', 'volume', 'missing' ) ), result )
+        self.assertEqual( tags_manager.GetComparableNamespaceSlice( ( '', ) ), ( ( u'sortable', ), ) )
+        
+    
     def test_get_current( self ):
         
         self.assertEqual( self._tags_manager.GetCurrent( self._first_key ), { 'current', u'\u2835', 'creator:tsutomu nihei', 'series:blame!', 'title:test title', 'volume:3', 'chapter:2', 'page:1' } )
@@ -146,6 +161,11 @@ class TestTagsManager( unittest.TestCase ):
         
         self.assertEqual( self._tags_manager.GetCurrent(), { 'current', 'deleted', u'\u2835', 'creator:tsutomu nihei', 'series:blame!', 'title:test title', 'volume:3', 'chapter:2', 'page:1', 'petitioned' } )
         
+        # the sets are built once and kept until the tags change
+        
+        self.assertIs( self._tags_manager.GetCurrent( self._first_key ), self._tags_manager.GetCurrent( self._first_key ) )
+        self.assertIs( self._tags_manager.GetCurrent(), self._tags_manager.GetCurrent() )
+        
     
     def test_get_deleted( self ):
         
@@ -21,6 +21,7 @@ from include import HydrusPubSub
 from include import HydrusSessions
 from include import HydrusTags
 from include import HydrusThreading
+from include import TestClientCaches
 from include import TestClientConstants
 from include import TestClientDaemons
 from include import TestClientData
@@ -451,6 +452,7 @@ class Controller( object ):
             
         if run_all or only_run == 'data':
             
+            suites.append( unittest.TestLoader().loadTestsFromModule( TestClientCaches ) )
             suites.append( unittest.TestLoader().loadTestsFromModule( TestClientConstants ) )
             suites.append( unittest.TestLoader().loadTestsFromModule( TestClientData ) )
             suites.append( unittest.TestLoader().loadTestsFromModule( TestFunctions ) )